@@ -130,13 +130,27 @@ from toil_scripts.adam_pipeline.adam_preprocessing import * #static_adam_preproc
 from toil_scripts.bwa_alignment.bwa_alignment import * #download_shared_files
 from toil_scripts.gatk_germline.germline import * #run_gatk_germline_pipeline
 from toil_lib.files import generate_file
+from toil_scripts.downloads import add_shared_download
+
+# Reference files of the BWA alignment and GATK pipelines, which are downloaded once and shared by every sample
+REFERENCE_FILES = ['ref', 'fai', 'amb', 'ann', 'bwt', 'pac', 'sa', 'alt',
+                   'genome_fasta', 'genome_fai', 'genome_dict',
+                   'phase', 'g1k_indel', 'g1k_snp', 'mills', 'dbsnp', 'hapmap', 'omni']
 
 
 def sample_loop(job, uuid_list, inputs):
   """
-  Loops over the sample_ids (uuids) in the manifest, creating child jobs to process each
+  Downloads the reference files, then loops over the sample_ids (uuids) in the manifest, creating follow-on
+  jobs to process each. The sub-pipelines of every sample read the reference files from the download registry.
   """
 
+  inputs.downloads = {}
+  for name in REFERENCE_FILES:
+    url = getattr(inputs, name, None)
+    if url:
+      add_shared_download(job, inputs.downloads, url, getattr(inputs, 'reference_cache', None),
+                          s3_key_path=inputs.ssec)
+
   for uuid_rg in uuid_list:
 
     uuid_items = uuid_rg.split(',')
@@ -145,7 +159,7 @@ def sample_loop(job, uuid_list, inputs):
     if len(uuid_items) > 1:
         rg_line = uuid_items[1]
 
-    job.addChildJobFn(static_dag, uuid, rg_line, inputs)
+    job.addFollowOnJobFn(static_dag, uuid, rg_line, inputs)
 
 
 def static_dag(job, uuid, rg_line, inputs):
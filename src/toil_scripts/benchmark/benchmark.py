@@ -0,0 +1,325 @@
+#!/usr/bin/env python2.7
+"""
+Orchestration benchmark for the toil-scripts pipelines.
+
+Runs a pipeline on synthetic inputs with the single machine batch system, and with a fake docker on
+the PATH in place of the container runtime (see fake_docker). The containers do no work, so the
+measurements show what Toil and the pipeline's job graph cost for 10, 100 or 1000 samples: jobs per
+second, bytes read from and written to the FileStore, and the CPU time of the leader process.
+
+Usage: python -m toil_scripts.benchmark.benchmark germline --samples 10 100 1000
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+import yaml
+
+from toil_scripts.benchmark.synthetic import random_contigs, write_bam, write_fasta, write_fastq_pair, write_vcf
+from toil_scripts.metrics import METRICS_KEY, _format_value
+
+PIPELINES = {'germline': 'toil_scripts.gatk_germline.germline',
+             'exome': 'toil_scripts.exome_variant_pipeline.exome_variant_pipeline',
+             'bwa': 'toil_scripts.bwa_alignment.bwa_alignment'}
+
+# Config values for each pipeline, on top of the values of its generated config
+GERMLINE_CONFIG = {'cores': 1,
+                   'xmx': '1G',
+                   'file_size': '1G',
+                   'sorted': True,
+                   'preprocess': True,
+                   'joint_genotype': True,
+                   'run_vqsr': False,
+                   'run_oncotator': False,
+                   'snp_filter_annotations': ['QualByDepth', 'FisherStrand', 'StrandOddsRatio', 'ReadPosRankSumTest',
+                                              'MappingQualityRankSumTest', 'RMSMappingQuality'],
+                   'indel_filter_annotations': ['QualByDepth', 'FisherStrand', 'StrandOddsRatio',
+                                                'ReadPosRankSumTest', 'MappingQualityRankSumTest'],
+                   'snp_filter_name': 'GERMLINE_SNP_FILTER',
+                   'snp_filter_expression': 'QD < 2.0 || FS > 60.0 || MQ < 40.0 || MQRankSum < -12.5 || '
+                                            'ReadPosRankSum < -8.0',
+                   'indel_filter_name': 'GERMLINE_INDEL_FILTER',
+                   'indel_filter_expression': 'QD < 2.0 || FS > 200.0 || ReadPosRankSum < -20.0',
+                   'suffix': '.benchmark'}
+EXOME_CONFIG = {'ci_test': True}
+BWA_CONFIG = {'file_size': '1G',
+              'amb': None, 'ann': None, 'bwt': None, 'pac': None, 'sa': None, 'fai': None}
+
+KNOWN_SITES = ['dbsnp', 'mills', 'g1k_indel', 'g1k_snp', 'hapmap', 'omni', 'phase', 'cosmic']
+
+
+def generate_config(pipeline):
+    """
+    Returns the generated config of a pipeline, with underscores in its keys
+
+    :param str pipeline: Pipeline name
+    :rtype: dict
+    """
+    if pipeline == 'germline':
+        from toil_scripts.gatk_germline.germline_config_manifest import generate_config
+    else:
+        generate_config = __import__(PIPELINES[pipeline], fromlist=['generate_config']).generate_config
+    return {key.replace('-', '_'): value for key, value in yaml.load(generate_config()).iteritems()}
+
+
+def parse_overrides(overrides):
+    """
+    Parses KEY=VALUE config overrides. Values are parsed as YAML.
+
+    >>> sorted(parse_overrides(['hc-shards=4', 'run_vqsr=true', 'xmx=2G']).items())
+    [('hc_shards', 4), ('run_vqsr', True), ('xmx', '2G')]
+    """
+    result = {}
+    for override in overrides:
+        key, _, value = override.partition('=')
+        result[key.replace('-', '_')] = yaml.load(value) if value else None
+    return result
+
+
+class Inputs(object):
+    """
+    Synthetic reference, known sites and samples, written once and shared by every run of a benchmark
+    """
+
+    def __init__(self, pipeline, path, num_samples, reads_per_sample, genome_length, num_contigs, seed=0):
+        self.pipeline = pipeline
+        self.path = path
+        self.reads_per_sample = reads_per_sample
+        self.seed = seed
+        self.contigs = random_contigs(random.Random(seed), genome_length, num_contigs)
+        self.reference = os.path.join(path, 'genome.fa')
+        write_fasta(self.reference, self.contigs)
+        self.known_sites = os.path.join(path, 'known_sites.vcf')
+        write_vcf(self.known_sites, self.contigs, max(1, genome_length // 1000), seed=seed)
+        self.samples = [self._write_sample(i) for i in xrange(num_samples)]
+
+    def _write_sample(self, i):
+        uuid = 'sample_%d' % i
+        path = os.path.join(self.path, uuid)
+        seed = self.seed + i + 1
+        if self.pipeline == 'germline':
+            write_bam(path + '.bam', self.contigs, self.reads_per_sample, sample=uuid, seed=seed)
+            return [uuid, 'file://' + path + '.bam']
+        if self.pipeline == 'exome':
+            write_bam(path + '.normal.bam', self.contigs, self.reads_per_sample, sample=uuid + '_normal', seed=seed)
+            write_bam(path + '.tumor.bam', self.contigs, self.reads_per_sample, sample=uuid + '_tumor', seed=-seed)
+            return [uuid, 'file://' + path + '.normal.bam', 'file://' + path + '.tumor.bam']
+        write_fastq_pair(path + '_R1.fq.gz', path + '_R2.fq.gz', self.contigs, self.reads_per_sample, seed=seed)
+        return [uuid, 'file://' + path + '_R1.fq.gz', 'file://' + path + '_R2.fq.gz']
+
+    def write_manifest(self, path, num_samples):
+        with open(path, 'w') as f:
+            for sample in self.samples[:num_samples]:
+                f.write('\t'.join(sample) + '\n')
+
+    def write_config(self, path, output_dir, overrides):
+        config = generate_config(self.pipeline)
+        config.update({'germline': GERMLINE_CONFIG, 'exome': EXOME_CONFIG, 'bwa': BWA_CONFIG}[self.pipeline])
+        reference = 'file://' + self.reference
+        for key in ['genome_fasta', 'reference', 'ref']:
+            if key in config:
+                config[key] = reference
+        for key in KNOWN_SITES:
+            if key in config:
+                config[key] = 'file://' + self.known_sites
+        config['output_dir'] = output_dir
+        config.update(overrides)
+        with open(path, 'w') as f:
+            yaml.safe_dump({key.replace('_', '-'): value for key, value in config.iteritems()}, f,
+                           default_flow_style=False)
+
+
+def write_fake_docker(bin_dir):
+    """
+    Writes a docker executable that runs fake_docker with this interpreter
+    """
+    path = os.path.join(bin_dir, 'docker')
+    package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'PYTHONPATH="{}${{PYTHONPATH:+:$PYTHONPATH}}" exec "{}" -m toil_scripts.benchmark.fake_docker "$@"\n'
+                .format(package_dir, sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def run_leader(pipeline, argv, env):
+    """
+    Runs a pipeline's main() in a child process, which becomes the Toil leader
+
+    :param str pipeline: Pipeline name
+    :param list[str] argv: Command line of the pipeline
+    :param dict env: Environment variables of the leader and its workers
+    :return: Wall time and the CPU time of the leader process in seconds
+    :rtype: tuple(float, float)
+    """
+    read_fd, write_fd = os.pipe()
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 1
+        try:
+            os.environ.update(env)
+            sys.argv = argv
+            __import__(PIPELINES[pipeline], fromlist=['main']).main()
+            status = 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+        finally:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            os.write(write_fd, json.dumps(usage.ru_utime + usage.ru_stime))
+            os._exit(status)
+    os.close(write_fd)
+    chunks = []
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_fd)
+    _, status = os.waitpid(pid, 0)
+    wall_time = time.time() - start
+    if status != 0:
+        raise RuntimeError('The %s pipeline failed with status %d' % (pipeline, status))
+    return wall_time, json.loads(''.join(chunks))
+
+
+def read_job_store(job_store):
+    """
+    Counts the jobs of a finished workflow and sums their FileStore traffic. The workflow must have been
+    run with --stats.
+
+    :param str job_store: Job store locator
+    :return: Number of jobs, bytes read from and bytes written to the FileStore
+    :rtype: tuple(int, int, int)
+    """
+    from toil.common import Toil
+    totals = {'jobs': 0, 'filestore_read': 0, 'filestore_written': 0}
+
+    def callback(f):
+        try:
+            stats = json.load(f)
+        except ValueError:
+            return
+        totals['jobs'] += len(stats.get('jobs', []))
+        for record in stats.get(METRICS_KEY, []):
+            totals['filestore_read'] += record.get('filestore_read') or 0
+            totals['filestore_written'] += record.get('filestore_written') or 0
+
+    Toil.resumeJobStore(job_store).readStatsAndLogging(callback, readAll=True)
+    return totals['jobs'], totals['filestore_read'], totals['filestore_written']
+
+
+def benchmark(inputs, num_samples, work_dir, options):
+    """
+    Runs a pipeline once and measures it
+
+    :param Inputs inputs: Synthetic inputs
+    :param int num_samples: Number of samples to run
+    :param str work_dir: Scratch directory of the run
+    :param Namespace options: Parsed command line options
+    :return: Result row
+    :rtype: dict
+    """
+    run_dir = os.path.join(work_dir, '%s-%d' % (inputs.pipeline, num_samples))
+    os.makedirs(os.path.join(run_dir, 'output'))
+    os.makedirs(os.path.join(run_dir, 'tmp'))
+    os.makedirs(os.path.join(run_dir, 'bin'))
+    config, manifest = os.path.join(run_dir, 'config.yaml'), os.path.join(run_dir, 'manifest.tsv')
+    inputs.write_config(config, os.path.join(run_dir, 'output'), parse_overrides(options.set))
+    inputs.write_manifest(manifest, num_samples)
+    write_fake_docker(os.path.join(run_dir, 'bin'))
+    job_store = os.path.join(run_dir, 'jobstore')
+    argv = [inputs.pipeline, 'run', job_store, '--config', config, '--manifest', manifest,
+            '--batchSystem', 'singleMachine', '--stats', '--clean', 'never',
+            '--workDir', os.path.join(run_dir, 'tmp'), '--maxCores', str(options.max_cores)]
+    env = {'PATH': os.path.join(run_dir, 'bin') + os.pathsep + os.environ.get('PATH', ''),
+           'TOIL_SCRIPTS_FAKE_DOCKER_TIME_SCALE': str(options.time_scale),
+           'TOIL_SCRIPTS_FAKE_DOCKER_LOG': os.path.join(run_dir, 'docker.log')}
+    wall_time, leader_cpu = run_leader(inputs.pipeline, argv, env)
+    jobs, filestore_read, filestore_written = read_job_store(job_store)
+    if not options.keep:
+        shutil.rmtree(run_dir)
+    return {'samples': num_samples, 'jobs': jobs, 'wall_time': wall_time, 'leader_cpu': leader_cpu,
+            'filestore_read': filestore_read, 'filestore_written': filestore_written}
+
+
+def format_results(results):
+    """
+    Formats benchmark results as a table
+
+    >>> print(format_results([{'samples': 10, 'jobs': 120, 'wall_time': 60.0, 'leader_cpu': 12.0,
+    ...                        'filestore_read': 2048, 'filestore_written': 4096}]))
+     samples     jobs       wall   jobs/s   FS read  FS written  leader CPU  CPU/job
+          10      120      60.0s      2.0      2.0K        4.0K       12.0s    100ms
+    """
+    lines = ['%8s %8s %10s %8s %9s %11s %11s %8s' % ('samples', 'jobs', 'wall', 'jobs/s', 'FS read',
+                                                    'FS written', 'leader CPU', 'CPU/job')]
+    for r in results:
+        lines.append('%8d %8d %10s %8.1f %9s %11s %11s %6dms' % (
+            r['samples'], r['jobs'], _format_value('wall_time', r['wall_time']),
+            r['jobs'] / r['wall_time'] if r['wall_time'] else 0,
+            _format_value('filestore_read', r['filestore_read']),
+            _format_value('filestore_written', r['filestore_written']),
+            _format_value('leader_time', r['leader_cpu']),
+            1000 * r['leader_cpu'] / r['jobs'] if r['jobs'] else 0))
+    return '\n'.join(lines)
+
+
+def main():
+    """
+    Benchmarks the orchestration overhead of a toil-scripts pipeline on synthetic data
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('pipeline', choices=sorted(PIPELINES), help='Pipeline to benchmark')
+    parser.add_argument('--samples', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Numbers of samples to run the pipeline with. Default: %(default)s')
+    parser.add_argument('--work-dir', default=None,
+                        help='Directory for the inputs, job stores and outputs. Default: a temporary directory')
+    parser.add_argument('--reads-per-sample', type=int, default=1000,
+                        help='Number of reads, or read pairs, in each sample. Default: %(default)s')
+    parser.add_argument('--genome-length', type=int, default=1000000,
+                        help='Length of the synthetic reference genome. Default: %(default)s')
+    parser.add_argument('--contigs', type=int, default=3,
+                        help='Number of contigs in the reference genome. Default: %(default)s')
+    parser.add_argument('--time-scale', type=float, default=0.0,
+                        help='Fraction of the modelled runtime of each tool that the fake containers sleep for. '
+                             'Default: %(default)s')
+    parser.add_argument('--max-cores', type=int, default=os.sysconf('SC_NPROCESSORS_ONLN'),
+                        help='Cores available to the single machine batch system. Default: %(default)s')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='Overrides a config value, e.g. --set hc-shards=4. Can be repeated.')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keeps the inputs, job stores and outputs')
+    options = parser.parse_args()
+
+    work_dir = options.work_dir or tempfile.mkdtemp(prefix='toil-scripts-benchmark-')
+    input_dir = os.path.join(work_dir, 'inputs')
+    os.makedirs(input_dir)
+    try:
+        print('Writing synthetic inputs for {} samples to {}'.format(max(options.samples), input_dir))
+        inputs = Inputs(options.pipeline, input_dir, max(options.samples), options.reads_per_sample,
+                        options.genome_length, options.contigs)
+        results = []
+        for num_samples in sorted(options.samples):
+            print('Running the {} pipeline with {} samples'.format(options.pipeline, num_samples))
+            results.append(benchmark(inputs, num_samples, work_dir, options))
+        print(format_results(results))
+    finally:
+        if not options.keep:
+            shutil.rmtree(input_dir if options.work_dir else work_dir)
+
+
+if __name__ == '__main__':
+    main()
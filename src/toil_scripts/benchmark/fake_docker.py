@@ -0,0 +1,620 @@
+#!/usr/bin/env python2.7
+"""
+Fake container runtime for benchmarks.
+
+The benchmark harness installs this module as docker on the PATH of the workflow, so the pipelines and
+toil-lib run unchanged while no tool is run. For docker run, the container paths in the tool's arguments
+are mapped to the mounted host directories. The fake then sleeps for a simulated runtime and writes the
+files that the tool would write. Output sizes follow the size of the inputs. Sequence indexes,
+dictionaries and VCFs are valid, since the pipelines parse them. VCFs that bgzip compresses are written
+as gzip files, which read like BGZF.
+
+The simulated runtime is TOIL_SCRIPTS_FAKE_DOCKER_TIME_SCALE times a coarse model of the tool's runtime
+for its input size. It defaults to 0, which measures orchestration alone. When
+TOIL_SCRIPTS_FAKE_DOCKER_LOG is set, every call is appended to that file as a JSON line.
+"""
+from __future__ import print_function
+import gzip
+import json
+import os
+import posixpath
+import random
+import re
+import sys
+import time
+import zlib
+from collections import namedtuple
+
+from toil_scripts.benchmark.synthetic import read_fasta_index, write_fasta_index, write_sequence_dictionary
+
+# docker run options that take a value
+VALUE_OPTIONS = {'-v', '--volume', '-e', '--env', '-w', '--workdir', '--name', '--log-driver', '--entrypoint',
+                 '-u', '--user', '--net', '--network', '-m', '--memory', '--cpus', '--cpu-shares', '-c',
+                 '--cidfile', '--env-file', '-h', '--hostname'}
+
+# Tools are recognized by a substring of their image name. bwakit is checked before bwa.
+TOOLS = ['bwakit', 'bwa', 'picard', 'gatk', 'samtools', 'oncotator', 'mutect', 'pindel', 'muse']
+
+# htslib tools that are run from the samtools image with their own entrypoint
+HTSLIB_TOOLS = {'bgzip', 'tabix'}
+
+# Seconds of runtime for each GB of input, on top of a fixed BASE_SECONDS
+SECONDS_PER_GB = {'bwakit': 1200, 'bwa': 1200, 'picard': 120, 'gatk': 600, 'samtools': 60, 'oncotator': 600,
+                  'mutect': 1200, 'pindel': 1200, 'muse': 1200}
+BASE_SECONDS = 5
+
+GATK_OUTPUT_FLAGS = {'-o', '--out', '-recalFile', '--recal_file', '-tranchesFile', '--tranches_file',
+                     '-rscriptFile', '--rscript_file', '-bamout', '--bamOutput'}
+MUTECT_OUTPUT_FLAGS = {'-o', '--out', '--vcf', '--coverage_file'}
+PICARD_OUTPUT_KEYS = {'O', 'OUTPUT', 'M', 'METRICS_FILE'}
+SAMTOOLS_VALUE_OPTIONS = {'-@', '-o', '-O', '-T', '-m', '-R', '-b', '-l', '-q', '-F', '-f', '-L', '-t', '-r'}
+SAMTOOLS_FLAG_OPTIONS = {'merge': {'-f', '-n', '-r', '-u', '-1', '-c', '-p'}, 'sort': {'-n'},
+                         'view': {'-b', '-C', '-h', '-u'}}
+ONCOTATOR_VALUE_OPTIONS = {'-i', '-o', '--db-dir', '-c', '--canonical-tx-file', '--log_name', '-a', '--tx-mode'}
+BWA_INDEX_SUFFIXES = {'.amb': 0.0001, '.ann': 0.0001, '.bwt': 1.0, '.pac': 0.25, '.sa': 0.5}
+PINDEL_SUFFIXES = ['_BP', '_CloseEndMapped', '_D', '_INT', '_INT_final', '_INV', '_LI', '_RP', '_SI', '_TD']
+VCF_INPUT_FLAGS = {'-V', '--variant', '-input', '--input'}
+FASTA_EXTENSIONS = ('.fa', '.fasta', '.fa.gz', '.fasta.gz')
+
+# Output sizes relative to the inputs. A GVCF is about 8% of its BAM, and a somatic VCF much smaller.
+GVCF_FRACTION = 0.08
+SOMATIC_VCF_FRACTION = 0.001
+BYTES_PER_VCF_RECORD = 180
+
+Run = namedtuple('Run', 'image parameters mounts workdir entrypoint')
+Run.__new__.__defaults__ = (None,)
+
+
+class DockerError(Exception):
+    """
+    Error that docker run reports before it starts a container
+    """
+
+
+def parse_run(args):
+    """
+    Parses the arguments of docker run
+
+    >>> run = parse_run(['--rm', '--log-driver=none', '-v', '/tmp/w:/data', '-v', '/ref:/ref:ro', '-e', 'A=1',
+    ...                  'quay.io/ucsc_cgl/samtools:1.3', 'index', '/data/x.bam'])
+    >>> run.image, run.parameters, sorted(run.mounts.items())
+    ('quay.io/ucsc_cgl/samtools:1.3', ['index', '/data/x.bam'], [('/data', '/tmp/w'), ('/ref', '/ref')])
+    >>> parse_run(['-v', '/tmp/w:/data', '--entrypoint', 'MuSE', 'quay.io/ucsc_cgl/muse:1.0', 'call']).entrypoint
+    'MuSE'
+
+    Like Docker, the fake refuses a container path that is mounted twice.
+
+    >>> parse_run(['-v', '/tmp/w:/data', '-v', '/tmp/w:/data', 'quay.io/ucsc_cgl/samtools:1.3', 'index'])
+    Traceback (most recent call last):
+    ...
+    DockerError: Duplicate mount point: /data
+
+    :param list[str] args: Arguments after run
+    :rtype: Run
+    """
+    mounts, workdir, entrypoint = {}, '/data', None
+    i = 0
+    while i < len(args) and args[i].startswith('-'):
+        option, separator, value = args[i].partition('=')
+        if option in VALUE_OPTIONS and not separator:
+            i += 1
+            value = args[i]
+        if option in ('-v', '--volume'):
+            host, container = value.split(':')[:2]
+            container = container.rstrip('/') or '/'
+            if container in mounts:
+                raise DockerError('Duplicate mount point: {}'.format(container))
+            mounts[container] = host
+        elif option in ('-w', '--workdir'):
+            workdir = value
+        elif option == '--entrypoint':
+            # toil-lib passes the entrypoint of its chown runs last, so the last one applies
+            entrypoint = value
+        i += 1
+    return Run(args[i], args[i + 1:], mounts, workdir, entrypoint)
+
+
+def host_path(run, path):
+    """
+    Maps a path in the container to the host
+
+    >>> run = Run('tool', [], {'/data': '/tmp/w', '/ref': '/nodes/ref'}, '/data')
+    >>> host_path(run, 'x.bam'), host_path(run, '/ref/genome.fa'), host_path(run, '/opt/x')
+    ('/tmp/w/x.bam', '/nodes/ref/genome.fa', None)
+
+    :param Run run: Parsed docker run arguments
+    :param str path: Absolute path, or path relative to the container's working directory
+    :return: Host path, or None if the path is not mounted
+    :rtype: str
+    """
+    path = posixpath.normpath(posixpath.join(run.workdir, path))
+    for container in sorted(run.mounts, key=len, reverse=True):
+        if path == container or path.startswith(container.rstrip('/') + '/'):
+            return run.mounts[container] + path[len(container):]
+    return None
+
+
+def tool_name(image):
+    """
+    >>> tool_name('quay.io/ucsc_cgl/gatk:3.5--dba6dae49156168a909c43330350c6161dc7ecc2')
+    'gatk'
+    >>> tool_name('quay.io/ucsc_cgl/picardtools:1.95'), tool_name('quay.io/ucsc_cgl/bwakit:0.7.12')
+    ('picard', 'bwakit')
+    """
+    name = image.split('/')[-1].split(':')[0].lower()
+    return next((tool for tool in TOOLS if tool in name), name)
+
+
+def option_values(parameters, *flags):
+    """
+    Returns the values of options in a tool's parameters, in order
+
+    >>> option_values(['-T', 'CombineGVCFs', '--variant', 'a.g.vcf', '--variant', 'b.g.vcf', '--out=c'],
+    ...               '--variant', '--out')
+    ['a.g.vcf', 'b.g.vcf', 'c']
+    """
+    values = []
+    for i, parameter in enumerate(parameters):
+        option, separator, value = parameter.partition('=')
+        if separator and option in flags and option.startswith('-'):
+            values.append(value)
+        elif parameter in flags and i + 1 < len(parameters):
+            values.append(parameters[i + 1])
+    return values
+
+
+def positionals(parameters, value_options, flag_options=()):
+    """
+    Returns the positional arguments of a tool. Options that are not value options are taken to be flags.
+
+    >>> positionals(['merge', '-@', '4', '-f', 'out.bam', 'a.bam'], {'-@'})
+    ['merge', 'out.bam', 'a.bam']
+    """
+    result = []
+    i = 0
+    while i < len(parameters):
+        parameter = parameters[i]
+        if parameter.startswith('-') and len(parameter) > 1:
+            if parameter in value_options and parameter not in flag_options:
+                i += 1
+        else:
+            result.append(parameter)
+        i += 1
+    return result
+
+
+def tool_outputs(tool, parameters):
+    """
+    Returns the container paths of the files that a tool writes
+
+    >>> tool_outputs('gatk', ['-T', 'PrintReads', '-I', '/data/input.bam', '-o', '/data/bqsr.bam'])
+    ['/data/bqsr.bam', '/data/bqsr.bai']
+    >>> tool_outputs('samtools', ['merge', '-@', '4', '-f', '/data/merged.bam', '/data/chunk.0.bam'])
+    ['/data/merged.bam']
+    >>> tool_outputs('samtools', ['index', '/data/merged.bam'])
+    ['/data/merged.bam.bai']
+    >>> tool_outputs('samtools', ['index', '/data/output.cram', '/data/output.cram.crai'])
+    ['/data/output.cram.crai']
+    >>> tool_outputs('picard', ['CreateSequenceDictionary', 'R=genome.fa', 'O=genome.dict'])
+    ['genome.dict']
+    >>> tool_outputs('picard', ['MarkDuplicates', 'INPUT=sorted.bam', 'OUTPUT=mkdups.bam', 'CREATE_INDEX=true'])
+    ['mkdups.bam', 'mkdups.bai']
+    >>> tool_outputs('oncotator', ['-i', 'VCF', '-o', 'VCF', '--db-dir', '/db', 'in.vcf', 'out.vcf', 'hg19'])
+    ['out.vcf']
+    >>> tool_outputs('bwakit', ['-t', '4', '-o', '/data/aligned', '/data/ref.fa', '/data/r1.fq.gz'])
+    ['/data/aligned.aln.bam']
+    >>> tool_outputs('muse', ['--mode', 'wxs', '--outfile', '/data/muse.vcf', '--cpus', '1'])
+    ['/data/muse.vcf']
+    >>> tool_outputs('tabix', ['-f', '-p', 'vcf', '/data/output.g.vcf.gz'])
+    ['/data/output.g.vcf.gz.tbi']
+    >>> tool_outputs('bgzip', ['-c', '/data/output.g.vcf'])
+    []
+
+    :param str tool: Tool name from tool_name
+    :param list[str] parameters: Parameters of the tool
+    :rtype: list[str]
+    """
+    if tool == 'gatk':
+        outputs = option_values(parameters, *GATK_OUTPUT_FLAGS)
+        if '--disable_bam_indexing' not in parameters:
+            # GATK indexes the BAMs that it writes, like Picard with CREATE_INDEX=true
+            outputs += [os.path.splitext(p)[0] + '.bai' for p in outputs if p.endswith('.bam')]
+        return outputs
+    if tool == 'mutect':
+        return option_values(parameters, *MUTECT_OUTPUT_FLAGS)
+    if tool == 'picard':
+        outputs = [p.split('=', 1)[1] for p in parameters if p.split('=', 1)[0] in PICARD_OUTPUT_KEYS and '=' in p]
+        if 'CREATE_INDEX=true' in parameters:
+            # Picard names the index after the BAM without its extension
+            outputs += [os.path.splitext(p)[0] + '.bai' for p in outputs if p.endswith('.bam')]
+        return outputs
+    if tool == 'samtools':
+        command = parameters[0] if parameters else None
+        outputs = option_values(parameters, '-o')
+        args = positionals(parameters[1:], SAMTOOLS_VALUE_OPTIONS, SAMTOOLS_FLAG_OPTIONS.get(command, ()))
+        if outputs or not args:
+            return outputs
+        if command == 'faidx':
+            return [args[0] + '.fai']
+        if command == 'index':
+            return [args[1] if len(args) > 1 else args[0] + '.bai']
+        if command == 'sort' and len(args) > 1:
+            return [args[1] + '.bam']
+        if command == 'merge':
+            return [args[0]]
+        return []
+    if tool == 'bwa':
+        if parameters and parameters[0] == 'index':
+            prefix = (option_values(parameters, '-p') or positionals(parameters[1:], {'-p', '-a', '-b'})[:1])[0]
+            return [prefix + suffix for suffix in sorted(BWA_INDEX_SUFFIXES)]
+        return []
+    if tool == 'bwakit':
+        return [prefix + '.aln.bam' for prefix in option_values(parameters, '-o')]
+    if tool == 'oncotator':
+        args = positionals(parameters, ONCOTATOR_VALUE_OPTIONS)
+        return args[1:2]
+    if tool == 'pindel':
+        return [prefix + suffix for prefix in option_values(parameters, '-o') for suffix in PINDEL_SUFFIXES]
+    if tool == 'muse':
+        if parameters and parameters[0] == 'call':
+            return [prefix + '.MuSE.txt' for prefix in option_values(parameters, '-O')]
+        # toil-lib's run_muse uses an image that calls and sums up in one run
+        return option_values(parameters, '-O', '--outfile')
+    if tool == 'tabix':
+        return [path + '.tbi' for path in positionals(parameters, {'-p'})[:1]]
+    if tool == 'bgzip':
+        # bgzip -c writes to stdout
+        return []
+    return option_values(parameters, '-o', '-O', '--output')
+
+
+def tool_inputs(run):
+    """
+    Returns the host paths of the existing files named in a tool's parameters
+    """
+    inputs = []
+    for parameter in run.parameters:
+        for value in {parameter, parameter.partition('=')[2]}:
+            if value and not value.startswith('-'):
+                path = host_path(run, value)
+                if path and os.path.isfile(path) and path not in inputs:
+                    inputs.append(path)
+    return inputs
+
+
+def reference_contigs(paths):
+    """
+    Returns the (name, length) contigs of the first FASTA file, index or sequence dictionary among paths
+    """
+    for path in paths:
+        base, ext = os.path.splitext(path)
+        if path.endswith('.fai'):
+            with open(path) as f:
+                return [(line.split('\t')[0], int(line.split('\t')[1])) for line in f if line.strip()]
+        if path.endswith('.dict'):
+            with open(path) as f:
+                return [(re.search(r'SN:(\S+)', line).group(1), int(re.search(r'LN:(\d+)', line).group(1)))
+                        for line in f if line.startswith('@SQ')]
+        if path.endswith(FASTA_EXTENSIONS):
+            for index in [path + '.fai', base + '.dict']:
+                if os.path.exists(index):
+                    return reference_contigs([index])
+            return [entry[:2] for entry in read_fasta_index(path)]
+    return []
+
+
+def parse_intervals(run, values, contigs):
+    """
+    Returns the (contig, start, end) intervals of GATK -L options, or the whole genome
+
+    >>> parse_intervals(Run('gatk', [], {}, '/data'), ['chr1:11-20', 'chr2'], [('chr1', 100), ('chr2', 50)])
+    [('chr1', 11, 20), ('chr2', 1, 50)]
+    """
+    lengths = dict(contigs)
+    lines = []
+    for value in values:
+        path = host_path(run, value)
+        if path and os.path.isfile(path):
+            with open(path) as f:
+                lines.extend(line.strip() for line in f if line.strip() and not line.startswith('@'))
+        else:
+            lines.append(value)
+    intervals = []
+    for line in lines:
+        match = re.match(r'^([^:\s]+)(?::(\d+)-(\d+))?$', line)
+        if match and match.group(1) in lengths:
+            start, end = match.group(2), match.group(3)
+            intervals.append((match.group(1), int(start) if start else 1,
+                              int(end) if end else lengths[match.group(1)]))
+    return intervals if values else [(name, 1, length) for name, length in contigs]
+
+
+class Vcf(object):
+    """
+    VCF header and records. Records are lists of fields.
+    """
+
+    def __init__(self, meta, samples, records):
+        self.meta = meta
+        self.samples = samples
+        self.records = records
+
+    @classmethod
+    def read(cls, path):
+        meta, samples, records = [], [], []
+        with (gzip.open(path) if path.endswith('.gz') else open(path)) as f:
+            for line in f:
+                if line.startswith('##'):
+                    meta.append(line.rstrip('\n'))
+                elif line.startswith('#'):
+                    samples = line.rstrip('\n').split('\t')[9:]
+                elif line.strip():
+                    records.append(line.rstrip('\n').split('\t'))
+        return cls(meta, samples, records)
+
+    def write(self, path):
+        columns = ['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
+        if self.samples:
+            columns += ['FORMAT'] + self.samples
+        with open(path, 'w') as f:
+            for line in self.meta:
+                f.write(line + '\n')
+            f.write('\t'.join(columns) + '\n')
+            for record in self.records:
+                f.write('\t'.join(record) + '\n')
+
+
+def _sort_records(records, contigs):
+    order = {name: i for i, (name, _) in enumerate(contigs)}
+    records.sort(key=lambda r: (order.get(r[0], len(order)), r[0], int(r[1])))
+
+
+def merge_vcfs(vcfs, names, contigs, drop_non_ref=False):
+    """
+    Merges VCFs into one multi-sample VCF. Records at the same position are combined.
+
+    >>> a = Vcf(['##fileformat=VCFv4.2'], ['x'], [['1', '5', '.', 'A', 'C', '50', 'PASS', '.', 'GT', '0/1']])
+    >>> b = Vcf(['##fileformat=VCFv4.2'], ['x'], [['1', '5', '.', 'A', 'C', '50', 'PASS', '.', 'GT', '1/1'],
+    ...                                          ['1', '2', '.', 'G', 'T', '50', 'PASS', '.', 'GT', '0/1']])
+    >>> merged = merge_vcfs([a, b], ['a', 'b'], [('1', 10)])
+    >>> merged.samples, [r[1] + ':' + ','.join(r[9:]) for r in merged.records]
+    (['x', 'b.x'], ['2:./.,0/1', '5:0/1,1/1'])
+    """
+    samples = []
+    columns = []
+    for vcf, name in zip(vcfs, names):
+        column = []
+        for sample in vcf.samples:
+            unique = sample if sample not in samples else '%s.%s' % (name, sample)
+            column.append(len(samples))
+            samples.append(unique)
+        columns.append(column)
+    merged = {}
+    for vcf, column in zip(vcfs, columns):
+        for record in vcf.records:
+            key = (record[0], int(record[1]))
+            if key not in merged:
+                merged[key] = record[:9] + ['./.'] * len(samples)
+                if drop_non_ref:
+                    alts = [alt for alt in record[4].split(',') if alt != '<NON_REF>']
+                    merged[key][4] = ','.join(alts) or '.'
+            for i, genotype in zip(column, record[9:]):
+                merged[key][9 + i] = genotype
+    records = merged.values()
+    _sort_records(records, contigs)
+    meta = vcfs[0].meta if vcfs else ['##fileformat=VCFv4.2']
+    return Vcf(meta, samples if any(columns) else [], [r[:9 + len(samples)] if samples else r[:8] for r in records])
+
+
+def generate_vcf(rng, contigs, intervals, num_records, samples, gvcf=False):
+    """
+    Generates a VCF with random variant calls in the given intervals
+    """
+    meta = ['##fileformat=VCFv4.2']
+    meta += ['##contig=<ID=%s,length=%d>' % contig for contig in contigs]
+    meta += ['##INFO=<ID=%s,Number=1,Type=Float,Description="%s">' % (key, key)
+             for key in ['QD', 'FS', 'SOR', 'MQ', 'MQRankSum', 'ReadPosRankSum', 'DP']]
+    meta += ['##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+             '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">',
+             '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">',
+             '##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype quality">']
+    total = sum(end - start + 1 for _, start, end in intervals)
+    records = []
+    if total:
+        positions = sorted(rng.sample(xrange(total), min(total, num_records)))
+        interval_index, offset = 0, 0
+        for x in positions:
+            while x - offset >= intervals[interval_index][2] - intervals[interval_index][1] + 1:
+                offset += intervals[interval_index][2] - intervals[interval_index][1] + 1
+                interval_index += 1
+            contig, start, _ = intervals[interval_index]
+            ref = rng.choice('ACGT')
+            alt = rng.choice([base for base in 'ACGT' if base != ref])
+            if rng.random() < 0.1:
+                alt = ref + alt
+            if gvcf:
+                alt += ',<NON_REF>'
+            depth = rng.randint(10, 60)
+            info = 'DP=%d;FS=%.3f;MQ=%.2f;MQRankSum=%.3f;QD=%.2f;ReadPosRankSum=%.3f;SOR=%.3f' % (
+                depth, rng.expovariate(0.3), rng.gauss(58, 3), rng.gauss(0, 1), rng.uniform(1, 35),
+                rng.gauss(0, 1), rng.uniform(0.1, 4))
+            genotypes = ['%s:%d,%d:%d:%d' % (rng.choice(['0/1', '1/1']), depth // 2, depth - depth // 2, depth,
+                                              rng.randint(20, 99)) for _ in samples]
+            records.append([contig, str(start + x - offset), '.', ref, alt, '%.2f' % rng.uniform(30, 3000), '.',
+                            info, 'GT:AD:DP:GQ'] + genotypes)
+    return Vcf(meta, samples, records)
+
+
+def write_blob(path, size, rng):
+    """
+    Writes a file of random bytes, such as a BAM file that no pipeline code reads
+    """
+    block = ''.join(chr(rng.getrandbits(8)) for _ in xrange(min(size, 1 << 16)))
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def _stem(path):
+    return os.path.basename(path).split('.')[0]
+
+
+def write_vcf_output(run, tool, path, inputs, contigs, rng):
+    """
+    Writes a VCF output, derived from the tool's input VCFs or generated from its input BAMs
+    """
+    parameters = run.parameters
+    walker = (option_values(parameters, '-T') or [''])[0]
+    if tool == 'oncotator':
+        vcf_inputs = [host_path(run, p) for p in positionals(parameters, ONCOTATOR_VALUE_OPTIONS)[:1]]
+    else:
+        vcf_inputs = [host_path(run, p) for p in option_values(parameters, *VCF_INPUT_FLAGS)]
+    vcf_inputs = [p for p in vcf_inputs if p and os.path.isfile(p)]
+
+    if vcf_inputs:
+        vcf = merge_vcfs([Vcf.read(p) for p in vcf_inputs], [_stem(p) for p in vcf_inputs], contigs,
+                         drop_non_ref=walker == 'GenotypeGVCFs')
+        select_type = option_values(parameters, '-selectType', '--selectTypeToInclude')
+        if select_type:
+            snp = select_type[0] == 'SNP'
+            vcf.records = [r for r in vcf.records
+                           if snp == (len(r[3]) == 1 and all(len(alt) == 1 for alt in r[4].split(',')))]
+        filter_names = option_values(parameters, '--filterName', '-filterName')
+        if filter_names or walker == 'ApplyRecalibration':
+            name = filter_names[0] if filter_names else 'VQSRTrancheSNP99.90to100.00'
+            vcf.meta.append('##FILTER=<ID=%s,Description="Benchmark filter">' % name)
+            for record in vcf.records:
+                record[6] = name if zlib.crc32(record[0] + record[1]) % 10 == 0 else 'PASS'
+        if '-recalFile' in parameters and path == host_path(run, option_values(parameters, '-recalFile')[0]):
+            vcf.samples = []
+            vcf.records = [r[:7] + ['VQSLOD=%.2f' % rng.gauss(2, 3)] for r in vcf.records]
+        if tool == 'oncotator':
+            # Oncotator annotations make the VCF about three times larger
+            for record in vcf.records:
+                record[7] += ';ONCOTATOR=' + 'x' * (2 * len('\t'.join(record)))
+        vcf.write(path)
+        return
+
+    bams = [p for p in inputs if p.endswith('.bam')]
+    bam_size = sum(os.path.getsize(p) for p in bams)
+    intervals = parse_intervals(run, option_values(parameters, '-L', '--intervals'), contigs)
+    genome_length = sum(length for _, length in contigs) or 1
+    fraction = float(sum(end - start + 1 for _, start, end in intervals)) / genome_length
+    if tool == 'gatk':
+        target = GVCF_FRACTION * bam_size * fraction
+        samples = [_stem(p) for p in bams[:1]] or ['sample']
+    else:
+        target = SOMATIC_VCF_FRACTION * bam_size * fraction
+        samples = ['NORMAL', 'TUMOR']
+    vcf = generate_vcf(rng, contigs, intervals, max(1, int(target / BYTES_PER_VCF_RECORD)), samples,
+                       gvcf='--emitRefConfidence' in parameters)
+    vcf.write(path)
+
+
+def write_output(run, tool, path, inputs, rng):
+    """
+    Writes an output file whose format and size follow its extension and the tool's inputs
+    """
+    input_size = sum(os.path.getsize(p) for p in inputs)
+    fasta = next((p for p in inputs if p.endswith(FASTA_EXTENSIONS)), None)
+    if path.endswith('.fai') and fasta:
+        write_fasta_index(fasta, path)
+    elif path.endswith('.dict') and fasta:
+        write_sequence_dictionary(fasta, path)
+    elif path.endswith('.vcf') or path.endswith('.recal'):
+        write_vcf_output(run, tool, path, inputs, reference_contigs(inputs), rng)
+    elif tool == 'bwa' and fasta:
+        write_blob(path, int(os.path.getsize(fasta) * BWA_INDEX_SUFFIXES[os.path.splitext(path)[1]]) + 1, rng)
+    elif path.endswith('.bam'):
+        fastqs = [p for p in inputs if re.search(r'\.(fq|fastq)(\.gz)?$', p)]
+        if fastqs:
+            # Compressed FASTQs are about as large as the aligned BAM, uncompressed ones about three times larger
+            size = sum(os.path.getsize(p) * (1.0 if p.endswith('.gz') else 0.3) for p in fastqs)
+        else:
+            # BAMs decoded from a CRAM are about twice as large
+            size = sum(os.path.getsize(p) * (2 if p.endswith('.cram') else 1)
+                       for p in inputs if p.endswith(('.bam', '.cram')))
+        write_blob(path, int(size), rng)
+    elif path.endswith('.cram'):
+        write_blob(path, max(1024, sum(os.path.getsize(p) for p in inputs if p.endswith('.bam')) // 2), rng)
+    elif path.endswith(('.bai', '.crai')):
+        write_blob(path, max(1024, input_size // 5000), rng)
+    else:
+        write_blob(path, max(1024, input_size // 100000), rng)
+
+
+def simulated_seconds(tool, input_size):
+    """
+    >>> simulated_seconds('gatk', 2 * 1024 ** 3)
+    1205.0
+    """
+    return BASE_SECONDS + SECONDS_PER_GB.get(tool, 60) * input_size / float(1024 ** 3)
+
+
+def run_tool(args):
+    """
+    Emulates docker run
+
+    :param list[str] args: Arguments after run
+    """
+    run = parse_run(args)
+    tool = run.entrypoint if run.entrypoint in HTSLIB_TOOLS else tool_name(run.image)
+    inputs = tool_inputs(run)
+    input_size = sum(os.path.getsize(p) for p in inputs)
+    seconds = simulated_seconds(tool, input_size) * float(os.environ.get('TOIL_SCRIPTS_FAKE_DOCKER_TIME_SCALE', 0))
+    time.sleep(seconds)
+    rng = random.Random(zlib.crc32(' '.join(run.parameters)) + input_size)
+    # toil-lib runs the image with chown as its entrypoint to fix the ownership of the work directory,
+    # which writes nothing
+    chown = run.entrypoint == 'chown'
+    outputs = []
+    for output in [] if chown else tool_outputs(tool, run.parameters):
+        path = host_path(run, output)
+        if path is None:
+            continue
+        write_output(run, tool, path, inputs, rng)
+        outputs.append(path)
+    if not outputs and inputs and not chown:
+        # Tools that write to stdout, such as samtools view
+        if tool == 'bgzip':
+            with open(inputs[0], 'rb') as f_in, gzip.GzipFile(fileobj=sys.stdout, mode='wb') as f_out:
+                for block in iter(lambda: f_in.read(1 << 20), ''):
+                    f_out.write(block)
+        elif '-H' in run.parameters:
+            sys.stdout.write('@HD\tVN:1.5\tSO:coordinate\n')
+        else:
+            block = 'x' * (1 << 16)
+            for _ in xrange(input_size // len(block) + 1):
+                sys.stdout.write(block)
+    log_path = os.environ.get('TOIL_SCRIPTS_FAKE_DOCKER_LOG')
+    if log_path:
+        with open(log_path, 'a') as f:
+            f.write(json.dumps({'image': run.image, 'entrypoint': run.entrypoint, 'parameters': run.parameters,
+                                'inputs': inputs, 'outputs': outputs, 'seconds': seconds}) + '\n')
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    command = args[0] if args else None
+    if command == 'run':
+        try:
+            run_tool(args[1:])
+        except DockerError as e:
+            print('docker: Error response from daemon: {}.'.format(e), file=sys.stderr)
+            sys.exit(125)
+    elif command in ('pull', 'rm', 'kill', 'stop', 'ps', 'images', 'version', 'info', 'wait'):
+        # Containers exit before docker run returns, so there is nothing to manage
+        pass
+    elif command == 'inspect':
+        # No container outlives its docker run, as if it were run with --rm
+        print('Error: No such object: {}'.format(args[-1]), file=sys.stderr)
+        sys.exit(1)
+    else:
+        print('fake docker: unsupported command {}'.format(command), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python2.7
+"""
+Synthetic genomic data for benchmarks.
+
+Writes a random reference genome, and FASTQs, BAMs and VCFs drawn from it. The files are valid, so the
+pipelines can read the ones they parse themselves, and their sizes follow the configured number of reads
+and variants. All generators are seeded, so a benchmark input set is reproducible.
+"""
+import gzip
+import hashlib
+import random
+import struct
+import zlib
+
+BASES = 'ACGT'
+COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N': 'N'}
+FASTA_LINE_LENGTH = 60
+
+# BGZF blocks hold at most 64 KiB of compressed data, so uncompressed blocks are kept below that
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00'
+            '\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+
+def random_contigs(rng, genome_length, num_contigs):
+    """
+    Returns random contig sequences of approximately equal length
+
+    >>> [(name, len(seq)) for name, seq in random_contigs(random.Random(0), 10, 3)]
+    [('chr1', 4), ('chr2', 3), ('chr3', 3)]
+
+    :param random.Random rng: Random number generator
+    :param int genome_length: Total length of the contigs
+    :param int num_contigs: Number of contigs
+    :return: List of (name, sequence) tuples
+    :rtype: list[tuple(str, str)]
+    """
+    contigs = []
+    for i in range(num_contigs):
+        length = genome_length // num_contigs + (1 if i < genome_length % num_contigs else 0)
+        contigs.append(('chr%d' % (i + 1), ''.join(rng.choice(BASES) for _ in xrange(length))))
+    return contigs
+
+
+def write_fasta(path, contigs):
+    """
+    Writes contigs to a FASTA file
+
+    :param str path: Path to the FASTA file
+    :param list[tuple(str, str)] contigs: List of (name, sequence) tuples
+    """
+    with open(path, 'w') as f:
+        for name, seq in contigs:
+            f.write('>%s\n' % name)
+            for i in xrange(0, len(seq), FASTA_LINE_LENGTH):
+                f.write(seq[i:i + FASTA_LINE_LENGTH] + '\n')
+
+
+def read_fasta_index(path):
+    """
+    Scans a FASTA file for the fields of its samtools index
+
+    >>> import os, tempfile
+    >>> path = tempfile.mktemp(suffix='.fa')
+    >>> write_fasta(path, [('chr1', 'A' * 70), ('chr2', 'C' * 5)])
+    >>> [entry[:5] for entry in read_fasta_index(path)]
+    [('chr1', 70, 6, 60, 61), ('chr2', 5, 84, 5, 6)]
+    >>> os.remove(path)
+
+    :param str path: Path to the FASTA file
+    :return: List of (name, length, offset, line bases, line width, MD5) tuples
+    :rtype: list[tuple]
+    """
+    entries = []
+    offset = 0
+    current = None
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith('>'):
+                if current:
+                    entries.append(tuple(current[:5]) + (current[5].hexdigest(),))
+                current = [line[1:].split()[0], 0, offset + len(line), 0, 0, hashlib.md5()]
+            elif current is not None:
+                bases = line.rstrip('\r\n')
+                if not current[3]:
+                    current[3], current[4] = len(bases), len(line)
+                current[1] += len(bases)
+                current[5].update(bases.upper())
+            offset += len(line)
+    if current:
+        entries.append(tuple(current[:5]) + (current[5].hexdigest(),))
+    return entries
+
+
+def write_fasta_index(fasta_path, path):
+    """
+    Writes the samtools index (.fai) of a FASTA file
+    """
+    with open(path, 'w') as f:
+        for entry in read_fasta_index(fasta_path):
+            f.write('%s\t%d\t%d\t%d\t%d\n' % entry[:5])
+
+
+def write_sequence_dictionary(fasta_path, path):
+    """
+    Writes the Picard sequence dictionary (.dict) of a FASTA file
+    """
+    with open(path, 'w') as f:
+        f.write('@HD\tVN:1.5\tSO:unsorted\n')
+        for name, length, _, _, _, md5 in read_fasta_index(fasta_path):
+            f.write('@SQ\tSN:%s\tLN:%d\tM5:%s\tUR:file:%s\n' % (name, length, md5, fasta_path))
+
+
+def reverse_complement(seq):
+    """
+    >>> reverse_complement('AACG')
+    'CGTT'
+    """
+    return ''.join(COMPLEMENT[base] for base in reversed(seq))
+
+
+def sample_reads(rng, contigs, num_reads, read_length, insert_size=None):
+    """
+    Samples reads, or read pairs, from random positions of the contigs. Reads are returned in
+    coordinate order.
+
+    :param random.Random rng: Random number generator
+    :param list[tuple(str, str)] contigs: List of (name, sequence) tuples
+    :param int num_reads: Number of reads or read pairs
+    :param int read_length: Read length
+    :param int insert_size: Fragment length of read pairs, or None for single reads
+    :return: List of (contig index, 0-based position, read, mate or None) tuples
+    :rtype: list[tuple]
+    """
+    fragment = insert_size or read_length
+    candidates = [(i, len(seq) - fragment + 1) for i, (_, seq) in enumerate(contigs) if len(seq) >= fragment]
+    if not candidates:
+        raise ValueError('Contigs are shorter than the fragment length %d' % fragment)
+    total = sum(span for _, span in candidates)
+    reads = []
+    for _ in xrange(num_reads):
+        x = rng.randrange(total)
+        for i, span in candidates:
+            if x < span:
+                break
+            x -= span
+        seq = contigs[i][1]
+        read = seq[x:x + read_length]
+        mate = reverse_complement(seq[x + fragment - read_length:x + fragment]) if insert_size else None
+        reads.append((i, x, read, mate))
+    reads.sort(key=lambda r: (r[0], r[1]))
+    return reads
+
+
+def _quality(rng, length):
+    return ''.join(chr(33 + rng.randint(20, 40)) for _ in xrange(length))
+
+
+def write_fastq_pair(r1_path, r2_path, contigs, num_reads, read_length=100, insert_size=300, seed=0):
+    """
+    Writes a pair of gzipped FASTQ files with read pairs sampled from the contigs
+
+    :param str r1_path: Path to the first FASTQ file
+    :param str r2_path: Path to the paired FASTQ file
+    :param list[tuple(str, str)] contigs: List of (name, sequence) tuples
+    :param int num_reads: Number of read pairs
+    :param int read_length: Read length
+    :param int insert_size: Fragment length
+    :param int seed: Random seed
+    """
+    rng = random.Random(seed)
+    reads = sample_reads(rng, contigs, num_reads, read_length, insert_size)
+    # Aligners expect reads in random order
+    rng.shuffle(reads)
+    with gzip.open(r1_path, 'wb') as r1, gzip.open(r2_path, 'wb') as r2:
+        for n, (_, _, read, mate) in enumerate(reads):
+            r1.write('@read%d/1\n%s\n+\n%s\n' % (n, read, _quality(rng, len(read))))
+            r2.write('@read%d/2\n%s\n+\n%s\n' % (n, mate, _quality(rng, len(mate))))
+
+
+class BgzfWriter(object):
+    """
+    Writes BGZF, the blocked gzip format of BAM files
+
+    >>> import os, tempfile
+    >>> path = tempfile.mktemp()
+    >>> with BgzfWriter(path) as f:
+    ...     f.write('x' * 100000)
+    >>> gzip.open(path).read() == 'x' * 100000
+    True
+    >>> os.remove(path)
+    """
+
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= BGZF_BLOCK_SIZE:
+            data = ''.join(self.buffer)
+            for i in xrange(0, len(data) - BGZF_BLOCK_SIZE + 1, BGZF_BLOCK_SIZE):
+                self._write_block(data[i:i + BGZF_BLOCK_SIZE])
+            rest = data[len(data) - len(data) % BGZF_BLOCK_SIZE:]
+            self.buffer, self.buffered = [rest], len(rest)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25)
+        self.f.write(header + compressed + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data)))
+
+    def close(self):
+        data = ''.join(self.buffer)
+        if data:
+            self._write_block(data)
+        self.f.write(BGZF_EOF)
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def reg2bin(beg, end):
+    """
+    Computes the BAM bin of a 0-based, half-open alignment interval, as in the SAM specification
+
+    >>> reg2bin(0, 100), reg2bin(20000, 20100), reg2bin(16000, 17000)
+    (4681, 4682, 585)
+    """
+    end -= 1
+    if beg >> 14 == end >> 14:
+        return ((1 << 15) - 1) // 7 + (beg >> 14)
+    if beg >> 17 == end >> 17:
+        return ((1 << 12) - 1) // 7 + (beg >> 17)
+    if beg >> 20 == end >> 20:
+        return ((1 << 9) - 1) // 7 + (beg >> 20)
+    if beg >> 23 == end >> 23:
+        return ((1 << 6) - 1) // 7 + (beg >> 23)
+    if beg >> 26 == end >> 26:
+        return ((1 << 3) - 1) // 7 + (beg >> 26)
+    return 0
+
+
+def _encode_alignment(ref_id, pos, name, seq, qual, flag=0, mapq=60):
+    seq_codes = '=ACMGRSVTWYHKDBN'
+    packed = []
+    for i in xrange(0, len(seq), 2):
+        high = seq_codes.index(seq[i]) << 4
+        low = seq_codes.index(seq[i + 1]) if i + 1 < len(seq) else 0
+        packed.append(chr(high | low))
+    cigar = struct.pack('<I', len(seq) << 4)
+    body = (struct.pack('<iiBBHHHiiii', ref_id, pos, len(name) + 1, mapq, reg2bin(pos, pos + len(seq)),
+                        1, flag, len(seq), -1, -1, 0) +
+            name + '\0' + cigar + ''.join(packed) + ''.join(chr(ord(q) - 33) for q in qual))
+    return struct.pack('<i', len(body)) + body
+
+
+def write_bam(path, contigs, num_reads, read_length=100, sample='sample', seed=0):
+    """
+    Writes a coordinate sorted BAM file with single reads sampled from the contigs
+
+    >>> import os, tempfile
+    >>> path = tempfile.mktemp(suffix='.bam')
+    >>> write_bam(path, [('chr1', 'ACGT' * 100)], 10, read_length=50)
+    >>> gzip.open(path).read(4)
+    'BAM\\x01'
+    >>> os.remove(path)
+
+    :param str path: Path to the BAM file
+    :param list[tuple(str, str)] contigs: List of (name, sequence) tuples
+    :param int num_reads: Number of reads
+    :param int read_length: Read length
+    :param str sample: Sample name of the read group
+    :param int seed: Random seed
+    """
+    rng = random.Random(seed)
+    text = '@HD\tVN:1.5\tSO:coordinate\n'
+    text += ''.join('@SQ\tSN:%s\tLN:%d\n' % (name, len(seq)) for name, seq in contigs)
+    text += '@RG\tID:%s\tSM:%s\tPL:ILLUMINA\n' % (sample, sample)
+    with BgzfWriter(path) as f:
+        f.write('BAM\1' + struct.pack('<i', len(text)) + text + struct.pack('<i', len(contigs)))
+        for name, seq in contigs:
+            f.write(struct.pack('<i', len(name) + 1) + name + '\0' + struct.pack('<i', len(seq)))
+        for n, (ref_id, pos, read, _) in enumerate(sample_reads(rng, contigs, num_reads, read_length)):
+            f.write(_encode_alignment(ref_id, pos, 'read%d' % n, read, _quality(rng, len(read))))
+
+
+def write_vcf(path, contigs, num_records, seed=0, indel_fraction=0.1):
+    """
+    Writes a sites-only VCF file with random variants, such as a database of known variants
+
+    >>> import os, tempfile
+    >>> path = tempfile.mktemp(suffix='.vcf')
+    >>> write_vcf(path, [('chr1', 'ACGT' * 100)], 5)
+    >>> records = [line.split('\\t') for line in open(path) if not line.startswith('#')]
+    >>> len(records), sorted(int(r[1]) for r in records) == [int(r[1]) for r in records]
+    (5, True)
+    >>> os.remove(path)
+
+    :param str path: Path to the VCF file
+    :param list[tuple(str, str)] contigs: List of (name, sequence) tuples
+    :param int num_records: Number of variants
+    :param int seed: Random seed
+    :param float indel_fraction: Fraction of variants that are insertions or deletions
+    """
+    rng = random.Random(seed)
+    total = sum(len(seq) - 1 for _, seq in contigs)
+    positions = sorted(rng.sample(xrange(total), min(num_records, total)))
+    with open(path, 'w') as f:
+        f.write('##fileformat=VCFv4.2\n')
+        f.write(''.join('##contig=<ID=%s,length=%d>\n' % (name, len(seq)) for name, seq in contigs))
+        f.write('##INFO=<ID=AF,Number=A,Type=Float,Description="Allele Frequency">\n')
+        f.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        contig_index, offset = 0, 0
+        for n, x in enumerate(positions):
+            while x - offset >= len(contigs[contig_index][1]) - 1:
+                offset += len(contigs[contig_index][1]) - 1
+                contig_index += 1
+            name, seq = contigs[contig_index]
+            pos = x - offset
+            if rng.random() < indel_fraction:
+                ref, alt = (seq[pos:pos + 2], seq[pos]) if rng.random() < 0.5 else (seq[pos], seq[pos] + 'A')
+            else:
+                ref = seq[pos]
+                alt = rng.choice([b for b in BASES if b != ref])
+            f.write('%s\t%d\trs%d\t%s\t%s\t.\tPASS\tAF=%.2f\n' % (name, pos + 1, n + 1, ref, alt, rng.random()))
@@ -0,0 +1,40 @@
+from __future__ import print_function
+
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+# The invocation of the README, on a cohort small enough for a test
+ARGS = ['--samples', '2', '--reads-per-sample', '200', '--genome-length', '20000', '--contigs', '2']
+
+
+class BenchmarkTest(TestCase):
+    """
+    Runs the benchmark of each pipeline on two synthetic samples
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _benchmark(self, pipeline):
+        output = subprocess.check_output([sys.executable, '-m', 'toil_scripts.benchmark.benchmark', pipeline,
+                                          '--work-dir', self.work_dir] + ARGS)
+        lines = output.splitlines()
+        header = next(i for i, line in enumerate(lines) if line.split()[:2] == ['samples', 'jobs'])
+        samples, jobs = lines[header + 1].split()[:2]
+        self.assertEqual(samples, '2')
+        self.assertGreater(int(jobs), 0)
+
+    def test_germline(self):
+        self._benchmark('germline')
+
+    def test_exome(self):
+        self._benchmark('exome')
+
+    def test_bwa(self):
+        self._benchmark('bwa')
@@ -0,0 +1,48 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from toil_scripts.benchmark.benchmark import PIPELINES, Inputs
+
+# Launches a pipeline's main() the way its console script does
+ENTRY_POINT = 'import sys; from {} import main; sys.argv[0] = "toil-pipeline"; main()'
+
+
+class PlanTest(TestCase):
+    """
+    Plans each pipeline on two synthetic samples, launched as a script and through its entry point
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _plan(self, pipeline, tool_stages):
+        inputs = Inputs(pipeline, self.work_dir, 2, 200, 20000, 2)
+        config, manifest = os.path.join(self.work_dir, 'config.yaml'), os.path.join(self.work_dir, 'manifest.tsv')
+        inputs.write_config(config, os.path.join(self.work_dir, 'output'), {})
+        inputs.write_manifest(manifest, 2)
+        args = ['plan', '--config', config, '--manifest', manifest]
+        script = subprocess.check_output([sys.executable, '-m', PIPELINES[pipeline]] + args)
+        entry_point = subprocess.check_output([sys.executable, '-c', ENTRY_POINT.format(PIPELINES[pipeline])] + args)
+        # The job functions of a pipeline that runs as __main__ are planned like those of the imported module
+        self.assertEqual(script, entry_point)
+        lines = script.splitlines()
+        self.assertGreater(int(lines[0].split()[0]), 1)
+        stages = {line.split()[0]: int(line.split()[1]) for line in lines[2:lines.index('')]}
+        for stage in tool_stages:
+            self.assertEqual(stages.get(stage), 2, stage)
+
+    def test_germline(self):
+        self._plan('germline', ['gatk_haplotype_caller'])
+
+    def test_exome(self):
+        self._plan('exome', ['run_mutect', 'run_pindel', 'run_muse'])
+
+    def test_bwa(self):
+        self._plan('bwa', ['run_bwakit'])
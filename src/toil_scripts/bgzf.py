@@ -0,0 +1,111 @@
+#!/usr/bin/env python2.7
+"""
+Compresses and indexes VCFs with htslib's bgzip and tabix, and reads BAM indexes.
+
+BGZF, the blocked gzip format of BAM files and compressed VCFs, is a series of gzip members, so the
+pipelines read compressed VCFs with zlib like any concatenated gzip file. bgzip and tabix are run from
+the samtools image, which is built on htslib.
+"""
+import os
+import struct
+
+from toil_lib.programs import docker_call
+
+from toil_scripts.chunked_alignment import SAMTOOLS_IMAGE
+from toil_scripts.metrics import metered_docker_call
+
+docker_call = metered_docker_call(docker_call)
+
+# Plain text VCFs and GVCFs are about this many times larger than their BGZF compressed copies
+VCF_COMPRESSION_RATIO = 10
+
+# The linear index of a BAM index has one offset per 16 KiB window
+TABIX_WINDOW_SHIFT = 14
+
+# BAM indexes share the binning scheme of tabix, and have a pseudo-bin per reference with read counts
+BAI_MAGIC = 'BAI\1'
+BAI_PSEUDO_BIN = 37450
+
+
+def bgzip_vcf(job, path):
+    """
+    Compresses a plain text VCF with bgzip and indexes it with tabix. The plain text VCF is kept.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str path: Path to the plain text VCF
+    :return: Path to the compressed VCF, which is path followed by .gz. The index is the same path followed by .tbi
+    :rtype: str
+    """
+    work_dir, name = os.path.split(path)
+    with open(path + '.gz', 'w') as f_out:
+        docker_call(job=job, work_dir=work_dir,
+                    parameters=['-c', os.path.join('/data', name)],
+                    tool=SAMTOOLS_IMAGE,
+                    inputs=[name],
+                    outfile=f_out,
+                    docker_parameters=['--entrypoint', 'bgzip'])
+    index_vcf(job, path + '.gz')
+    return path + '.gz'
+
+
+def index_vcf(job, path):
+    """
+    Writes the tabix index of a BGZF compressed VCF
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str path: Path to the compressed VCF
+    :return: Path to the index, which is path followed by .tbi
+    :rtype: str
+    """
+    work_dir, name = os.path.split(path)
+    docker_call(job=job, work_dir=work_dir,
+                parameters=['-f', '-p', 'vcf', os.path.join('/data', name)],
+                tool=SAMTOOLS_IMAGE,
+                inputs=[name],
+                outputs={name + '.tbi': None},
+                docker_parameters=['--entrypoint', 'tabix'])
+    return path + '.tbi'
+
+
+def read_bam_index_windows(f):
+    """
+    Reads the compressed size of the reads in each 16 KiB window of each reference from a BAM index. The sizes
+    are differences of the virtual offsets in the linear index, so they are accurate to a BGZF block.
+
+    >>> from StringIO import StringIO
+    >>> bai = StringIO(BAI_MAGIC + struct.pack('<i', 2) +
+    ...                struct.pack('<iIi2Q', 1, 4681, 1, 5 << 16, 900 << 16) +
+    ...                struct.pack('<i3Q', 3, 5 << 16, 0, 700 << 16) +
+    ...                struct.pack('<ii', 0, 0))
+    >>> read_bam_index_windows(bai)
+    [[0, 695, 200], []]
+
+    :param file f: BAM index file, opened in binary mode
+    :return: Compressed bytes of each 16 KiB window, for each reference in the order of the BAM header
+    :rtype: list[list[int]]
+    """
+    def read(fmt):
+        data = f.read(struct.calcsize(fmt))
+        if len(data) != struct.calcsize(fmt):
+            raise ValueError('The BAM index is truncated')
+        return struct.unpack(fmt, data)
+
+    if f.read(len(BAI_MAGIC)) != BAI_MAGIC:
+        raise ValueError('Not a BAM index')
+    windows = []
+    for _ in range(read('<i')[0]):
+        end = 0
+        for _ in range(read('<i')[0]):
+            bin_, n_chunk = read('<Ii')
+            chunks = read('<{}Q'.format(2 * n_chunk))
+            if bin_ != BAI_PSEUDO_BIN and chunks:
+                end = max(end, max(chunks[1::2]))
+        offsets = list(read('<{}Q'.format(read('<i')[0])))
+        # Windows without reads have no offset. Leading windows take the offset of the first read, and the
+        # others the offset of the previous window.
+        first = next((offset for offset in offsets if offset), end)
+        for i, offset in enumerate(offsets):
+            offsets[i] = offset or (offsets[i - 1] if i else first)
+        blocks = [offset >> 16 for offset in offsets + [end]]
+        windows.append([max(0, b - a) for a, b in zip(blocks, blocks[1:])])
+    return windows
@@ -8,7 +8,7 @@ from urlparse import urlparse
 
 import yaml
 from bd2k.util.files import mkdir_p
-from toil.job import Job
+from toil.job import Job, PromisedRequirement
 from toil_lib import require, required_length
 from toil_lib.files import copy_file_job
 from toil_lib.files import generate_file
@@ -17,7 +17,22 @@ from toil_lib.tools.aligners import run_bwakit
 from toil_lib.tools.indexing import run_samtools_faidx, run_bwa_index
 from toil_lib.urls import download_url_job, s3am_upload_job
 
+from toil_scripts.chunked_alignment import bwakit_inputs, run_chunked_bwakit
+from toil_scripts.downloads import add_shared_download, repeated_urls
+from toil_scripts.metrics import add_report_parser, metered, report
+from toil_scripts.planner import add_plan_parser, plan
+from toil_scripts.urls import download_disk, probe_url_sizes
 
+# Record the resource usage of the toil-lib job functions run by this pipeline
+download_url_job = metered(download_url_job, __name__)
+run_bwakit = metered(run_bwakit, __name__, inputs=bwakit_inputs)
+run_samtools_faidx = metered(run_samtools_faidx, __name__)
+run_bwa_index = metered(run_bwa_index, __name__)
+s3am_upload_job = metered(s3am_upload_job, __name__)
+copy_file_job = metered(copy_file_job, __name__)
+
+
+@metered
 def download_reference_files(job, inputs, samples):
     """
     Downloads shared files that are used by all samples for alignment, or generates them if they were not provided.
@@ -33,31 +48,44 @@ def download_reference_files(job, inputs, samples):
     # Alt file is optional and can only be provided, not generated
     if inputs.alt:
         urls.append(('alt', inputs.alt))
+    # Reference files are read from the persistent reference cache if one is configured
+    cache_dir = getattr(inputs, 'reference_cache', None)
+    # Inputs with the same URL share one download. Pipelines that run this one for every sample pass the
+    # registry of the reference files that they already downloaded.
+    downloads = inputs.downloads = dict(getattr(inputs, 'downloads', None) or {})
     # Download reference
-    download_ref = job.wrapJobFn(download_url_job, inputs.ref, disk='3G')  # Human genomes are typically ~3G
-    job.addChild(download_ref)
-    shared_ids['ref'] = download_ref.rv()
+    download_ref = add_shared_download(job, downloads, inputs.ref, cache_dir, disk='3G')  # Human genomes are ~3G
+    shared_ids['ref'] = downloads[inputs.ref]
+    # Files are generated from a reference that a predecessor downloaded without waiting for a download job
+    ref_job = download_ref or job
     # If FAI is provided, download it. Otherwise, generate it
     if inputs.fai:
-        shared_ids['fai'] = job.addChildJobFn(download_url_job, inputs.fai).rv()
+        add_shared_download(job, downloads, inputs.fai, cache_dir)
+        shared_ids['fai'] = downloads[inputs.fai]
     else:
-        faidx = job.wrapJobFn(run_samtools_faidx, download_ref.rv())
-        shared_ids['fai'] = download_ref.addChild(faidx).rv()
+        faidx = job.wrapJobFn(run_samtools_faidx, shared_ids['ref'])
+        shared_ids['fai'] = ref_job.addChild(faidx).rv()
     # If all BWA index files are provided, download them. Otherwise, generate them
     if all(x[1] for x in urls):
         for name, url in urls:
-            shared_ids[name] = job.addChildJobFn(download_url_job, url).rv()
+            add_shared_download(job, downloads, url, cache_dir)
+            shared_ids[name] = downloads[url]
     else:
         job.fileStore.logToMaster('BWA index files not provided, creating now')
-        bwa_index = job.wrapJobFn(run_bwa_index, download_ref.rv())
-        download_ref.addChild(bwa_index)
+        bwa_index = job.wrapJobFn(run_bwa_index, shared_ids['ref'])
+        ref_job.addChild(bwa_index)
         for x, name in enumerate(['amb', 'ann', 'bwt', 'pac', 'sa']):
             shared_ids[name] = bwa_index.rv(x)
+    # FASTQs that are used by more than one sample are downloaded once for all of them
+    for url in repeated_urls([urls for _, urls in samples]):
+        add_shared_download(job, downloads, url, s3_key_path=inputs.ssec,
+                            disk=download_disk(inputs.url_sizes, url, inputs.file_size))
 
     # Map_job distributes one sample in samples to the downlaod_sample_and_align function
     job.addFollowOnJobFn(map_job, download_sample_and_align, samples, inputs, shared_ids)
 
 
+@metered
 def download_sample_and_align(job, sample, inputs, ids):
     """
     Downloads the sample and runs BWA-kit
@@ -70,12 +98,16 @@ def download_sample_and_align(job, sample, inputs, ids):
     uuid, urls = sample
     r1_url, r2_url = urls if len(urls) == 2 else (urls[0], None)
     job.fileStore.logToMaster('Downloaded sample: {0}. R1 {1}\nR2 {2}\nStarting BWA Run'.format(uuid, r1_url, r2_url))
-    # Read fastq samples from file store
-    ids['r1'] = job.addChildJobFn(download_url_job, r1_url, s3_key_path=inputs.ssec, disk=inputs.file_size).rv()
-    if r2_url:
-        ids['r2'] = job.addChildJobFn(download_url_job, r2_url, s3_key_path=inputs.ssec, disk=inputs.file_size).rv()
-    else:
-        ids['r2'] = None
+    # Read fastq samples from file store. Downloads are sized from the probed sample sizes. FASTQs that are used
+    # by more than one sample were downloaded with the reference files.
+    for name, url in [('r1', r1_url), ('r2', r2_url)]:
+        if not url:
+            ids[name] = None
+        elif url in inputs.downloads:
+            ids[name] = inputs.downloads[url]
+        else:
+            disk = download_disk(inputs.url_sizes, url, inputs.file_size)
+            ids[name] = job.addChildJobFn(download_url_job, url, s3_key_path=inputs.ssec, disk=disk).rv()
     # Create config for bwakit
     inputs.cores = min(inputs.maxCores, multiprocessing.cpu_count())
     inputs.uuid = uuid
@@ -83,17 +115,29 @@ def download_sample_and_align(job, sample, inputs, ids):
     config.update(ids)  # Overwrite attributes with the FileStoreIDs from ids
     config = argparse.Namespace(**config)
     # Define and wire job functions
-    bam_id = job.wrapJobFn(run_bwakit, config, sort=inputs.sort, trim=inputs.trim,
-                           disk=inputs.file_size, cores=inputs.cores)
+    if inputs.chunk_reads:
+        # Split the sample into chunks that are aligned in parallel
+        bam_id = job.wrapJobFn(run_chunked_bwakit, config, inputs.chunk_reads,
+                               sort=inputs.sort, trim=inputs.trim).encapsulate()
+    else:
+        # The bwakit disk requirement depends on the size of the FASTQs and the reference index files
+        index_size = sum(ids[name].size for name in ['ref', 'fai', 'amb', 'ann', 'bwt', 'pac', 'sa', 'alt']
+                         if ids.get(name) is not None)
+        bwakit_disk = PromisedRequirement(lambda r1, r2: int(4 * (r1.size + (r2.size if r2 else 0)) + index_size),
+                                          ids['r1'], ids['r2'])
+        bam_id = job.wrapJobFn(run_bwakit, config, sort=inputs.sort, trim=inputs.trim,
+                               disk=bwakit_disk, cores=inputs.cores)
     job.addFollowOn(bam_id)
     output_name = uuid + '.bam' + str(inputs.suffix) if inputs.suffix else uuid + '.bam'
+    # The output BAM is the only file on disk while it is uploaded
+    output_disk = PromisedRequirement(lambda bam: bam.size, bam_id.rv())
     if urlparse(inputs.output_dir).scheme == 's3':
         bam_id.addChildJobFn(s3am_upload_job, file_id=bam_id.rv(), file_name=output_name, s3_dir=inputs.output_dir,
-                             s3_key_path=inputs.ssec, cores=inputs.cores, disk=inputs.file_size)
+                             s3_key_path=inputs.ssec, cores=inputs.cores, disk=output_disk)
     else:
-        mkdir_p(inputs.ouput_dir)
-        bam_id.addChildJobFn(copy_file_job, name=output_name, file_id=bam_id.rv(), output_dir=inputs.output_dir,
-                                    disk=inputs.file_size)
+        mkdir_p(inputs.output_dir)
+        # Toil takes a name keyword as the unit name of the job, so the arguments are positional
+        bam_id.addChildJobFn(copy_file_job, output_name, bam_id.rv(), inputs.output_dir, disk=output_disk)
 
 
 def generate_config():
@@ -124,7 +168,8 @@ def generate_config():
         # Required: Program Unit for BAM header. Required for use with GATK.
         program_unit: 12345
 
-        # Required: Approximate input file size. Provided as a number followed by (base-10) [TGMK]. E.g. 10M, 150G
+        # Required: Approximate input file size, used when the size of a sample cannot be determined.
+        # Provided as a number followed by (base-10) [TGMK]. E.g. 10M, 150G
         file-size: 50G
 
         # Optional: If true, sorts bam
@@ -163,6 +208,12 @@ def generate_config():
         # Optional: If true, runs the pipeline in mock mode, generating a fake output bam
         mock-mode:
 
+        # Optional: S3 URL or shared local path to a persistent cache of reference files
+        reference-cache:
+
+        # Optional: Number of reads per FASTQ chunk. Chunks are aligned in parallel and then merged
+        chunk-reads:
+
         # Optional: Optional suffix to add to sample output
         suffix:
     """[1:])
@@ -251,16 +302,20 @@ def main():
     subparsers.add_parser('generate-config', help='Generates an editable config in the current working directory.')
     subparsers.add_parser('generate-manifest', help='Generates an editable manifest in the current working directory.')
     subparsers.add_parser('generate', help='Generates a config and manifest in the current working directory.')
-    # Run subparser
-    parser_run = subparsers.add_parser('run', help='Runs the BWA alignment pipeline')
-    group = parser_run.add_mutually_exclusive_group()
-    parser_run.add_argument('--config', default='config-toil-bwa.yaml', type=str,
-                            help='Path to the (filled in) config file, generated with "generate-config".')
+    add_report_parser(subparsers)
+    # Pipeline inputs, shared by the run and plan subparsers
+    parser_inputs = argparse.ArgumentParser(add_help=False)
+    group = parser_inputs.add_mutually_exclusive_group()
+    parser_inputs.add_argument('--config', default='config-toil-bwa.yaml', type=str,
+                               help='Path to the (filled in) config file, generated with "generate-config".')
     group.add_argument('--manifest', default='manifest-toil-bwa.tsv', type=str,
                        help='Path to the (filled in) manifest file, generated with "generate-manifest". '
                             '\nDefault value: "%(default)s".')
     group.add_argument('--sample', nargs='+', action=required_length(2, 3),
                        help='Space delimited sample UUID and fastq files in the format: uuid url1 [url2].')
+    # Run subparser
+    parser_run = subparsers.add_parser('run', parents=[parser_inputs], help='Runs the BWA alignment pipeline')
+    add_plan_parser(subparsers, [parser_inputs])
     # Print docstring help if no arguments provided
     if len(sys.argv) == 1:
         parser.print_help()
@@ -273,8 +328,10 @@ def main():
         generate_file(os.path.join(cwd, 'config-toil-bwa.yaml'), generate_config)
     if args.command == 'generate-manifest' or args.command == 'generate':
         generate_file(os.path.join(cwd, 'manifest-toil-bwa.tsv'), generate_manifest)
+    elif args.command == 'report':
+        report(args.jobStore, args.update_resource_model)
     # Pipeline execution
-    elif args.command == 'run':
+    elif args.command in ('run', 'plan'):
         require(os.path.exists(args.config), '{} not found. Please run generate-config'.format(args.config))
         if not args.sample:
             args.sample = None
@@ -283,11 +340,18 @@ def main():
         # Parse config
         parsed_config = {x.replace('-', '_'): y for x, y in yaml.load(open(args.config).read()).iteritems()}
         config = argparse.Namespace(**parsed_config)
-        config.maxCores = int(args.maxCores) if args.maxCores else sys.maxint
-        samples = [args.sample[0], args.sample[1:]] if args.sample else parse_manifest(args.manifest)
+        config.maxCores = int(args.maxCores) if getattr(args, 'maxCores', None) else sys.maxint
+        samples = [[args.sample[0], args.sample[1:]]] if args.sample else parse_manifest(args.manifest)
         # Sanity checks
         require(config.ref, 'Missing URL for reference file: {}'.format(config.ref))
         require(config.output_dir, 'No output location specified: {}'.format(config.output_dir))
+        # Download jobs are sized from the sample sizes. file-size is used when a size cannot be determined.
+        config.url_sizes = probe_url_sizes([url for _, urls in samples for url in urls])
+        config.chunk_reads = int(getattr(config, 'chunk_reads', None) or 0)
+        require(config.chunk_reads >= 0, 'The chunk-reads parameter must not be negative')
+        if args.command == 'plan':
+            plan(args, download_reference_files, config, samples)
+            return
         # Launch Pipeline
         Job.Runner.startToil(Job.wrapJobFn(download_reference_files, config, samples), args)
 
@@ -0,0 +1,114 @@
+from __future__ import print_function
+
+import gzip
+import json
+import os
+import random
+import shutil
+import tempfile
+from unittest import TestCase
+
+from toil_scripts.benchmark.synthetic import random_contigs, write_fastq_pair
+from toil_scripts.chunked_alignment import merge_bams, split_fastqs
+from toil_scripts.testing import export_file, fake_docker, run_workflow
+
+
+def split(job, r1_path, r2_path, chunk_reads, output_dir):
+    """
+    Splits a pair of FASTQs into chunks and writes the chunks to output_dir
+    """
+    r1 = job.fileStore.writeGlobalFile(r1_path)
+    r2 = job.fileStore.writeGlobalFile(r2_path) if r2_path else None
+    chunks = job.addChildJobFn(split_fastqs, r1, r2, chunk_reads)
+    job.addFollowOnJobFn(write_chunks, chunks.rv(), output_dir)
+
+
+def write_chunks(job, chunk_ids, output_dir):
+    for i, (r1, r2) in enumerate(chunk_ids):
+        export_file(job, r1, os.path.join(output_dir, 'chunk.%d.1.fq.gz' % i))
+        if r2:
+            export_file(job, r2, os.path.join(output_dir, 'chunk.%d.2.fq.gz' % i))
+
+
+def merge(job, bam_paths, sort, index, output_dir):
+    """
+    Merges BAMs and writes the merged BAM, and its index if requested, to output_dir
+    """
+    bam_ids = [job.fileStore.writeGlobalFile(path) for path in bam_paths]
+    merged = job.addChildJobFn(merge_bams, bam_ids, sort=sort, index=index)
+    job.addFollowOnJobFn(write_merged, merged.rv(), output_dir)
+
+
+def write_merged(job, merged, output_dir):
+    bam, bai = merged if isinstance(merged, tuple) else (merged, None)
+    export_file(job, bam, os.path.join(output_dir, 'merged.bam'))
+    if bai:
+        export_file(job, bai, os.path.join(output_dir, 'merged.bam.bai'))
+
+
+def read_names(path):
+    with gzip.open(path) as f:
+        return [line.rstrip('\n') for i, line in enumerate(f) if i % 4 == 0]
+
+
+class ChunkedAlignmentTest(TestCase):
+    """
+    Runs the FASTQ split and the BAM merge of the chunked alignment in a local workflow
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.work_dir, 'output')
+        os.mkdir(self.output_dir)
+        self.contigs = random_contigs(random.Random(0), 10000, 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _split(self, num_reads, chunk_reads, paired=True):
+        r1, r2 = os.path.join(self.work_dir, 'r1.fq.gz'), os.path.join(self.work_dir, 'r2.fq.gz')
+        write_fastq_pair(r1, r2, self.contigs, num_reads)
+        run_workflow(self.work_dir, split, r1, r2 if paired else None, chunk_reads, self.output_dir)
+        chunks = []
+        while os.path.exists(os.path.join(self.output_dir, 'chunk.%d.1.fq.gz' % len(chunks))):
+            prefix = os.path.join(self.output_dir, 'chunk.%d' % len(chunks))
+            chunks.append((read_names(prefix + '.1.fq.gz'),
+                           read_names(prefix + '.2.fq.gz') if paired else None))
+        return read_names(r1), chunks
+
+    def test_pair_at_chunk_boundary(self):
+        names, chunks = self._split(10, 5)
+        # The last pair of the first chunk and the first pair of the second chunk stay together
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([len(r1) for r1, _ in chunks], [5, 5])
+        self.assertEqual(chunks[0][0][-1], names[4])
+        self.assertEqual(chunks[1][0][0], names[5])
+        for r1, r2 in chunks:
+            self.assertEqual([name[:-2] for name in r1], [name[:-2] for name in r2])
+        self.assertEqual([name for r1, _ in chunks for name in r1], names)
+
+    def test_partial_last_chunk(self):
+        names, chunks = self._split(11, 5)
+        self.assertEqual([len(r1) for r1, _ in chunks], [5, 5, 1])
+        self.assertEqual(chunks[2], ([names[10]], [names[10][:-1] + '2']))
+
+    def test_single_ended(self):
+        names, chunks = self._split(7, 3, paired=False)
+        self.assertEqual([len(r1) for r1, _ in chunks], [3, 3, 1])
+        self.assertEqual([name for r1, _ in chunks for name in r1], names)
+
+    def test_merge(self):
+        bams = []
+        for i in range(3):
+            bams.append(os.path.join(self.work_dir, 'chunk%d.bam' % i))
+            with open(bams[-1], 'wb') as f:
+                f.write(os.urandom(1024))
+        with fake_docker(self.work_dir) as log:
+            run_workflow(self.work_dir, merge, bams, True, True, self.output_dir)
+            # toil-lib also runs the image to fix the ownership of the work directory
+            calls = [json.loads(line)['parameters'] for line in open(log)]
+            calls = [call for call in calls if call[:1] != ['-R']]
+        self.assertEqual(calls, [['merge', '-@', '1', '-c', '-p', '-f', '/data/merged.bam',
+                                  '/data/chunk.0.bam', '/data/chunk.1.bam', '/data/chunk.2.bam'],
+                                 ['index', '/data/merged.bam']])
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'merged.bam.bai')))
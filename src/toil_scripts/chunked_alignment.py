@@ -0,0 +1,337 @@
+#!/usr/bin/env python2.7
+"""
+Chunked BWA alignment.
+
+FASTQ files are split into chunks with a fixed number of reads, and each chunk is aligned by its own
+bwakit job, so a large sample is aligned on several nodes at once and a failed job only repeats one
+chunk. The chunk BAMs are then merged into a single BAM. Paired FASTQs are split at the same reads, so
+mates always land in matching chunks.
+"""
+import argparse
+import gzip
+import os
+import zlib
+from itertools import islice
+
+from toil_lib import require
+from toil_lib.programs import docker_call
+from toil_lib.tools.aligners import run_bwakit
+
+from toil_scripts.metrics import metered, metered_docker_call
+
+# Attributes of a bwakit configuration that hold the input files of the alignment
+BWAKIT_INPUTS = ['r1', 'r2', 'bam', 'ref', 'fai', 'amb', 'ann', 'bwt', 'pac', 'sa', 'alt']
+
+
+def bwakit_inputs(config, *args, **kwargs):
+    """
+    Returns the input files of a bwakit job, which are passed in its configuration. The metrics of
+    bwakit jobs are recorded for these files.
+
+    >>> bwakit_inputs(argparse.Namespace(r1='r1', r2=None, ref='ref', sa='sa', rg_line='@RG'), sort=True)
+    ['r1', 'ref', 'sa']
+
+    :param Namespace config: bwakit configuration, see toil_lib.tools.aligners.run_bwakit
+    :return: FileStoreIDs
+    :rtype: list[str]
+    """
+    return [getattr(config, name) for name in BWAKIT_INPUTS if getattr(config, name, None) is not None]
+
+
+# Record the resource usage of the toil-lib job functions run by this module
+run_bwakit = metered(run_bwakit, __name__, inputs=bwakit_inputs)
+docker_call = metered_docker_call(docker_call)
+
+SAMTOOLS_IMAGE = 'quay.io/ucsc_cgl/samtools:1.3--256539928ea162949d8a65ca5c79a72ef557ce7c'
+
+GZIP_MAGIC = '\x1f\x8b'
+
+
+def decompressed_blocks(f, block_size=1 << 20):
+    """
+    Reads a plain or gzip-compressed stream without seeking. Concatenated gzip members, which are
+    common in FASTQ files, are read one after another.
+
+    >>> from StringIO import StringIO
+    >>> def compress(text):
+    ...     buf = StringIO()
+    ...     with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+    ...         f.write(text)
+    ...     return buf.getvalue()
+    >>> ''.join(decompressed_blocks(StringIO(compress('@r1\\n') + compress('@r2\\n')), block_size=7))
+    '@r1\\n@r2\\n'
+    >>> ''.join(decompressed_blocks(StringIO('@r1\\n')))
+    '@r1\\n'
+
+    :param file f: Readable stream
+    :param int block_size: Number of bytes read at a time
+    :return: Decompressed blocks
+    :rtype: iterator[str]
+    """
+    data = f.read(block_size)
+    if not data.startswith(GZIP_MAGIC):
+        while data:
+            yield data
+            data = f.read(block_size)
+        return
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while data:
+        block = decompressor.decompress(data)
+        if block:
+            yield block
+        # The next gzip member starts after the end of the current one
+        if decompressor.unused_data:
+            data = decompressor.unused_data
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            data = f.read(block_size)
+    yield decompressor.flush()
+
+
+def read_lines(f, block_size=1 << 20):
+    """
+    Iterates over the lines of a plain or gzip-compressed stream
+
+    >>> from StringIO import StringIO
+    >>> list(read_lines(StringIO('a\\nbc\\nd'), block_size=3))
+    ['a\\n', 'bc\\n', 'd']
+
+    :param file f: Readable stream
+    :param int block_size: Number of bytes read at a time
+    :return: Lines, including line endings
+    :rtype: iterator[str]
+    """
+    pending = ''
+    for block in decompressed_blocks(f, block_size):
+        lines = (pending + block).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if pending:
+        yield pending
+
+
+def split_fastq(r1_lines, r2_lines, chunk_reads, open_chunk):
+    """
+    Splits FASTQ reads into chunks of at most chunk_reads reads. Each chunk's files are closed before
+    the chunk is yielded.
+
+    >>> from StringIO import StringIO
+    >>> def fastq(n, mate):
+    ...     return ['@r%d/%d\\n' % (i, mate) + 'ACGT\\n+\\nIIII\\n' for i in range(n)]
+    >>> chunks = {}
+    >>> class Chunk(StringIO):
+    ...     def close(self):
+    ...         chunks.setdefault(self.chunk, []).append(self.getvalue())
+    >>> def open_chunk(chunk, mate):
+    ...     f = Chunk()
+    ...     f.chunk = chunk
+    ...     return f
+    >>> r1, r2 = ''.join(fastq(5, 1)), ''.join(fastq(5, 2))
+    >>> list(split_fastq(StringIO(r1), StringIO(r2), 2, open_chunk))
+    [0, 1, 2]
+    >>> [chunk.count('@r') for chunk in chunks[1]]
+    [2, 2]
+    >>> chunks[2][1].split('\\n')[0]
+    '@r4/2'
+    >>> list(split_fastq(StringIO(r1), StringIO(r2 + r2), 2, open_chunk))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    UserError: The paired FASTQ files have different numbers of reads
+
+    :param iterable[str] r1_lines: Lines of the first FASTQ file
+    :param iterable[str]|None r2_lines: Lines of the paired FASTQ file, or None for single-ended samples
+    :param int chunk_reads: Maximum number of reads (or read pairs) per chunk
+    :param function open_chunk: Called with the chunk number and the mate (1 or 2) and returns a writable file
+    :return: Chunk numbers
+    :rtype: iterator[int]
+    """
+    require(chunk_reads > 0, 'The number of reads per chunk must be positive, got {}'.format(chunk_reads))
+    readers = [iter(r1_lines)] + ([iter(r2_lines)] if r2_lines is not None else [])
+    chunk, reads, outputs = 0, 0, []
+    while True:
+        records = [list(islice(reader, 4)) for reader in readers]
+        if not records[0]:
+            require(not any(records), 'The paired FASTQ files have different numbers of reads')
+            break
+        require(all(records), 'The paired FASTQ files have different numbers of reads')
+        require(all(len(record) == 4 for record in records), 'Truncated FASTQ record: {}'.format(records[0][0]))
+        if reads == chunk_reads:
+            for f in outputs:
+                f.close()
+            yield chunk
+            chunk, reads, outputs = chunk + 1, 0, []
+        if not outputs:
+            outputs = [open_chunk(chunk, mate + 1) for mate in range(len(readers))]
+        for f, record in zip(outputs, records):
+            f.writelines(record)
+        reads += 1
+    if outputs:
+        for f in outputs:
+            f.close()
+        yield chunk
+
+
+@metered
+def split_fastqs(job, r1, r2, chunk_reads):
+    """
+    Splits a FASTQ file, or a pair of FASTQ files, into chunks. The FASTQs are streamed from the
+    FileStore and each chunk is written to the FileStore as soon as it is complete.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str r1: FileStoreID for the first FASTQ file
+    :param str|None r2: FileStoreID for the paired FASTQ file, or None for single-ended samples
+    :param int chunk_reads: Maximum number of reads (or read pairs) per chunk
+    :return: Chunk FileStoreIDs [(R1, R2)], where R2 is None for single-ended samples
+    :rtype: list[tuple(str, str|None)]
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+
+    def chunk_path(chunk, mate):
+        return os.path.join(work_dir, 'chunk.{}.{}.fq.gz'.format(chunk, mate))
+
+    def open_chunk(chunk, mate):
+        # Fast compression keeps the chunks small without slowing down the split
+        return gzip.open(chunk_path(chunk, mate), 'wb', compresslevel=1)
+
+    def write_chunks(r1_lines, r2_lines):
+        chunk_ids = []
+        for chunk in split_fastq(r1_lines, r2_lines, chunk_reads, open_chunk):
+            ids = []
+            for mate in [1, 2] if r2 else [1]:
+                ids.append(job.fileStore.writeGlobalFile(chunk_path(chunk, mate)))
+                # The cache tracks the written file, so it is removed through the FileStore
+                job.fileStore.deleteLocalFile(ids[-1])
+            chunk_ids.append((ids[0], ids[1] if r2 else None))
+        return chunk_ids
+
+    with job.fileStore.readGlobalFileStream(r1) as r1_file:
+        if r2:
+            with job.fileStore.readGlobalFileStream(r2) as r2_file:
+                chunk_ids = write_chunks(read_lines(r1_file), read_lines(r2_file))
+        else:
+            chunk_ids = write_chunks(read_lines(r1_file), None)
+    job.fileStore.logToMaster('Split FASTQ into {} chunks of up to {} reads'.format(len(chunk_ids), chunk_reads))
+    return chunk_ids
+
+
+@metered
+def run_chunked_bwakit(job, config, chunk_reads, sort=False, index=False, trim=False):
+    """
+    Splits the sample FASTQs into chunks, aligns each chunk with bwakit in its own job, and merges the
+    chunk BAMs. Wrap this job with encapsulate() so that successors wait for the merged BAM.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param Namespace config: bwakit configuration, see toil_lib.tools.aligners.run_bwakit
+        Requires the following config attributes:
+        config.r1                   FileStoreID for the first FASTQ file
+        config.r2                   FileStoreID for the paired FASTQ file, or None
+        config.ref                  FileStoreID for reference genome fasta file
+        config.fai                  FileStoreID for reference genome fasta index file
+        config.amb                  FileStoreID for BWA index file prefix.amb
+        config.ann                  FileStoreID for BWA index file prefix.ann
+        config.bwt                  FileStoreID for BWA index file prefix.bwt
+        config.pac                  FileStoreID for BWA index file prefix.pac
+        config.sa                   FileStoreID for BWA index file prefix.sa
+        config.alt                  FileStoreID for alternate contigs file or None
+        config.cores                Number of cores for each alignment job
+    :param int chunk_reads: Maximum number of reads (or read pairs) per chunk
+    :param bool sort: If True, returns a coordinate sorted BAM
+    :param bool index: If True, also returns the BAM index. Requires sort.
+    :param bool trim: If True, trim adapters using bwakit
+    :return: Merged BAM FileStoreID, or BAM and BAI FileStoreIDs if index is True
+    :rtype: str|tuple(str, str)
+    """
+    r2 = getattr(config, 'r2', None)
+    fastq_size = config.r1.size + (r2.size if r2 else 0)
+    # The chunks are uploaded as they are written, so the split needs room for the input FASTQs
+    # and a few chunks
+    split = job.addChildJobFn(split_fastqs, config.r1, r2, chunk_reads, disk=2 * fastq_size)
+    return split.addFollowOnJobFn(align_chunks, config, split.rv(), sort=sort, index=index, trim=trim).rv()
+
+
+@metered
+def align_chunks(job, config, chunk_ids, sort=False, index=False, trim=False):
+    """
+    Aligns each FASTQ chunk with bwakit in its own job and merges the chunk BAMs
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param Namespace config: bwakit configuration, see run_chunked_bwakit
+    :param list[tuple(str, str|None)] chunk_ids: Chunk FileStoreIDs from split_fastqs
+    :param bool sort: If True, the chunk BAMs are sorted and merged in coordinate order
+    :param bool index: If True, the merged BAM is indexed
+    :param bool trim: If True, trim adapters using bwakit
+    :return: Merged BAM FileStoreID, or BAM and BAI FileStoreIDs if index is True
+    :rtype: str|tuple(str, str)
+    """
+    reference_size = sum(getattr(config, name).size
+                         for name in ['ref', 'fai', 'amb', 'ann', 'bwt', 'pac', 'sa', 'alt']
+                         if getattr(config, name, None) is not None)
+    bam_ids = []
+    for r1, r2 in chunk_ids:
+        chunk_config = argparse.Namespace(**vars(config))
+        chunk_config.r1 = r1
+        chunk_config.r2 = r2
+        # The bwakit disk requirement depends on the size of the chunk and the index
+        chunk_size = r1.size + (r2.size if r2 else 0)
+        bam_ids.append(job.addChildJobFn(run_bwakit,
+                                         chunk_config,
+                                         sort=sort,
+                                         trim=trim,
+                                         cores=config.cores,
+                                         disk=int(4 * chunk_size + reference_size)).rv())
+    fastq_size = sum(r1.size + (r2.size if r2 else 0) for r1, r2 in chunk_ids)
+    # The merged BAM is about as large as the compressed FASTQs, and the inputs and output of the
+    # merge are on disk at the same time
+    return job.addFollowOnJobFn(merge_bams, bam_ids, sort=sort, index=index, disk=int(3 * fastq_size)).rv()
+
+
+@metered
+def merge_bams(job, bam_ids, sort=False, index=False):
+    """
+    Merges BAM files that were aligned from chunks of one sample. Coordinate sorted BAMs are merged with
+    samtools merge, so the result is sorted. Other BAMs are concatenated with samtools cat, which keeps
+    the header of the first BAM.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param list[str] bam_ids: BAM FileStoreIDs
+    :param bool sort: If True, the BAMs are coordinate sorted
+    :param bool index: If True, the merged BAM is indexed. Requires sort.
+    :return: Merged BAM FileStoreID, or BAM and BAI FileStoreIDs if index is True
+    :rtype: str|tuple(str, str)
+    """
+    require(sort or not index, 'Only coordinate sorted BAM files can be indexed')
+    if len(bam_ids) == 1 and not index:
+        return bam_ids[0]
+
+    job.fileStore.logToMaster('Merging {} BAM files'.format(len(bam_ids)))
+    work_dir = job.fileStore.getLocalTempDir()
+    inputs = []
+    for i, bam_id in enumerate(bam_ids):
+        name = 'chunk.{}.bam'.format(i)
+        job.fileStore.readGlobalFile(bam_id, os.path.join(work_dir, name))
+        inputs.append(name)
+
+    if sort:
+        # The chunks share their @RG and @PG lines. -c and -p keep one copy of each, instead of adding a
+        # suffix to each duplicate ID, which would give the sample a read group per chunk.
+        command = ['merge', '-@', str(job.cores), '-c', '-p', '-f', '/data/merged.bam']
+    else:
+        command = ['cat', '-o', '/data/merged.bam']
+    command.extend(os.path.join('/data', name) for name in inputs)
+    docker_call(job=job, work_dir=work_dir,
+                parameters=command,
+                tool=SAMTOOLS_IMAGE,
+                inputs=inputs,
+                outputs={'merged.bam': None})
+    bam = job.fileStore.writeGlobalFile(os.path.join(work_dir, 'merged.bam'))
+    if not index:
+        return bam
+
+    docker_call(job=job, work_dir=work_dir,
+                parameters=['index', '/data/merged.bam'],
+                tool=SAMTOOLS_IMAGE,
+                inputs=['merged.bam'],
+                outputs={'merged.bam.bai': None})
+    return bam, job.fileStore.writeGlobalFile(os.path.join(work_dir, 'merged.bam.bai'))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python2.7
+"""
+Workflow-wide download registry.
+
+Inputs of a workflow often point to the same URL, i.e. a VCF that is configured as dbSNP and as a set of
+known sites, a BAM that is listed in several manifest rows, or a reference that is used by several
+sub-pipelines. The registry is a dictionary that maps each URL to the FileStoreID promise of the job that
+downloads it, so every input with the same URL shares one download.
+
+Promises can only be read by successors of the job that fulfils them. A job that adds downloads to the
+registry therefore passes it on to its successors, usually in the pipeline config, where the promises
+are resolved to FileStoreIDs. Jobs that are not successors, i.e. the sample jobs started by map_job,
+must not share the downloads they add with each other.
+"""
+from collections import Counter
+
+from toil_scripts.reference_cache import add_reference_download
+
+
+def add_shared_download(job, downloads, url, cache_dir=None, disk=None, **kwargs):
+    """
+    Adds a child job that downloads a file, unless the registry already holds a download of its URL. The
+    FileStoreID of the file is downloads[url] in both cases.
+
+    >>> from toil_scripts.planner import PlanJob
+    >>> job, downloads = PlanJob(), {}
+    >>> add_shared_download(job, downloads, 's3://bucket/dbsnp.vcf') is None
+    False
+    >>> add_shared_download(job, downloads, 's3://bucket/dbsnp.vcf') is None
+    True
+    >>> len(job.children), sorted(downloads)
+    (1, ['s3://bucket/dbsnp.vcf'])
+
+    :param JobFunctionWrappingJob job: Job that the download job is added to
+    :param dict downloads: Download registry {URL: FileStoreID promise}, which is updated with the download
+    :param str url: URL of the file
+    :param str cache_dir: S3 URL or local path to the reference cache, or None to disable the cache
+    :param str|int disk: Disk requirement for downloading the file. The Toil default is used if None.
+    :param kwargs: Keyword arguments for download_url_job, i.e. name and s3_key_path
+    :return: Download job, or None if the URL was already downloaded
+    :rtype: JobFunctionWrappingJob
+    """
+    if url in downloads:
+        return None
+    download = add_reference_download(job, url, cache_dir, disk=disk, **kwargs)
+    downloads[url] = download.rv()
+    return download
+
+
+def repeated_urls(groups):
+    """
+    Returns the URLs that are used by more than one group of inputs, i.e. by more than one sample. These are
+    downloaded before the groups are started, so the groups can share them.
+
+    >>> repeated_urls([['n1', 't1', 't1'], ['n2', 't2'], ['n1', 't3'], ['t2', None]])
+    ['n1', 't2']
+
+    :param list[list[str]] groups: URLs of each group. Empty values are skipped.
+    :return: Repeated URLs in sorted order
+    :rtype: list[str]
+    """
+    counts = Counter(url for urls in groups for url in set(urls) if url)
+    return sorted(url for url, count in counts.iteritems() if count > 1)
@@ -5,6 +5,7 @@ import os
 import sys
 import tarfile
 import textwrap
+from collections import OrderedDict
 from contextlib import closing
 from urlparse import urlparse
 
@@ -18,14 +19,41 @@ from toil_lib.jobs import map_job
 from toil_lib.tools.mutation_callers import run_muse
 from toil_lib.tools.mutation_callers import run_mutect
 from toil_lib.tools.mutation_callers import run_pindel
-from toil_lib.tools.preprocessing import run_gatk_preprocessing
+from toil_lib.tools.preprocessing import apply_bqsr_recalibration
+from toil_lib.tools.preprocessing import picard_mark_duplicates
+from toil_lib.tools.preprocessing import run_base_recalibration
+from toil_lib.tools.preprocessing import run_indel_realignment
 from toil_lib.tools.preprocessing import run_picard_create_sequence_dictionary
+from toil_lib.tools.preprocessing import run_realigner_target_creator
 from toil_lib.tools.preprocessing import run_samtools_faidx
 from toil_lib.tools.preprocessing import run_samtools_index
 from toil_lib.urls import download_url_job, s3am_upload
 
+from toil_scripts.downloads import add_shared_download
+from toil_scripts.exome_variant_pipeline.profiles import resource_profile
+from toil_scripts.exome_variant_pipeline.scatter import scatter_muse, scatter_mutect, scatter_pindel
+from toil_scripts.metrics import add_report_parser, input_size, metered, report
+from toil_scripts.planner import add_plan_parser, plan
+from toil_scripts.resources import ResourceModel
+from toil_scripts.urls import download_disk, probe_url_sizes
+
+# Record the resource usage of the toil-lib job functions run by this pipeline
+download_url_job = metered(download_url_job, __name__)
+run_samtools_faidx = metered(run_samtools_faidx, __name__)
+run_picard_create_sequence_dictionary = metered(run_picard_create_sequence_dictionary, __name__)
+run_samtools_index = metered(run_samtools_index, __name__)
+picard_mark_duplicates = metered(picard_mark_duplicates, __name__)
+run_realigner_target_creator = metered(run_realigner_target_creator, __name__)
+run_indel_realignment = metered(run_indel_realignment, __name__)
+run_base_recalibration = metered(run_base_recalibration, __name__)
+apply_bqsr_recalibration = metered(apply_bqsr_recalibration, __name__)
+run_mutect = metered(run_mutect, __name__)
+run_pindel = metered(run_pindel, __name__)
+run_muse = metered(run_muse, __name__)
+
 
 # Start of Job Functions
+@metered
 def download_shared_files(job, samples, config):
     """
     Downloads files shared by all samples in the pipeline
@@ -37,12 +65,18 @@ def download_shared_files(job, samples, config):
     job.fileStore.logToMaster('Downloaded shared files')
     file_names = ['reference', 'phase', 'mills', 'dbsnp', 'cosmic']
     urls = [config.reference, config.phase, config.mills, config.dbsnp, config.cosmic]
+    # Reference files are read from the persistent reference cache if one is configured
+    cache_dir = getattr(config, 'reference_cache', None)
+    # Inputs with the same URL share one download
+    config.downloads = {}
     for name, url in zip(file_names, urls):
         if url:
-            vars(config)[name] = job.addChildJobFn(download_url_job, url=url).rv()
+            add_shared_download(job, config.downloads, url, cache_dir)
+            vars(config)[name] = config.downloads[url]
     job.addFollowOnJobFn(reference_preprocessing, samples, config)
 
 
+@metered
 def reference_preprocessing(job, samples, config):
     """
     Spawn the jobs that create index and dict file for reference
@@ -54,75 +88,139 @@ def reference_preprocessing(job, samples, config):
     job.fileStore.logToMaster('Processed reference files')
     config.fai = job.addChildJobFn(run_samtools_faidx, config.reference).rv()
     config.dict = job.addChildJobFn(run_picard_create_sequence_dictionary, config.reference).rv()
-    job.addFollowOnJobFn(map_job, download_sample, samples, config)
+    job.addFollowOnJobFn(map_job, download_samples, group_by_bams(samples), config)
 
 
-def download_sample(job, sample, config):
+@metered
+def download_samples(job, samples, config):
     """
-    Download sample and store sample specific attributes
+    Prepares each BAM of a group of pairs once and launches the workflow of every pair in the group
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
-    :param list sample: Contains uuid, normal URL, and tumor URL
+    :param list[list] samples: Samples (uuid, normal URL, tumor URL) that share BAMs, see group_by_bams
     :param Namespace config: Argparse Namespace object containing argument inputs
     """
-    # Create copy of config that is sample specific
+    job.fileStore.logToMaster('Preparing the BAMs of {} sample(s)'.format(len(samples)))
     config = argparse.Namespace(**vars(config))
-    uuid, normal_url, tumor_url = sample
-    job.fileStore.logToMaster('Downloaded sample: ' + uuid)
-    config.uuid = uuid
-    config.normal = normal_url
-    config.tumor = tumor_url
     config.cores = min(config.maxCores, int(multiprocessing.cpu_count()))
-    disk = '1G' if config.ci_test else '20G'
-    # Download sample bams and launch pipeline
-    config.normal_bam = job.addChildJobFn(download_url_job, url=config.normal, s3_key_path=config.ssec,
-                                          cghub_key_path=config.gtkey, disk=disk).rv()
-    config.tumor_bam = job.addChildJobFn(download_url_job, url=config.tumor, s3_key_path=config.ssec,
-                                         cghub_key_path=config.gtkey, disk=disk).rv()
-    job.addFollowOnJobFn(index_bams, config)
+    # A BAM that is listed in several rows, as a normal or as a tumor, is prepared once. The jobs are
+    # encapsulated, so the pairs start once their BAMs are downloaded, indexed and preprocessed.
+    prepared = {}
+    for uuid, normal_url, tumor_url in samples:
+        for url in [normal_url, tumor_url]:
+            if url not in prepared:
+                prepared[url] = job.wrapJobFn(download_sample, url, config).encapsulate()
+                job.addChild(prepared[url])
+        # Create copy of config that is sample specific
+        sample_config = argparse.Namespace(**vars(config))
+        sample_config.uuid = uuid
+        sample_config.normal = normal_url
+        sample_config.tumor = tumor_url
+        normal, tumor = prepared[normal_url], prepared[tumor_url]
+        static_workflow = job.wrapJobFn(static_workflow_declaration, sample_config, normal.rv(0), normal.rv(1),
+                                        tumor.rv(0), tumor.rv(1))
+        normal.addChild(static_workflow)
+        if tumor is not normal:
+            tumor.addChild(static_workflow)
+
+
+@metered
+def download_sample(job, url, config):
+    """
+    Download a sample BAM, then index and optionally preprocess it
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str url: URL of the normal or tumor BAM
+    :param Namespace config: Argparse Namespace object containing argument inputs
+    :return: BAM and BAM index FileStoreIDs
+    :rtype: tuple(str, str)
+    """
+    job.fileStore.logToMaster('Downloaded sample: ' + url)
+    # Downloads are sized from the probed sample sizes
+    bam = job.addChildJobFn(download_url_job, url=url, s3_key_path=config.ssec, cghub_key_path=config.gtkey,
+                            disk=download_disk(config.url_sizes, url, config.resources.default_disk)).rv()
+    return job.addFollowOnJobFn(index_bams, bam, config).rv()
 
 
-def index_bams(job, config):
+@metered
+def index_bams(job, bam, config):
     """
     Convenience job for handling bam indexing to make the workflow declaration cleaner
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str bam: BAM FileStoreID
     :param Namespace config: Argparse Namespace object containing argument inputs
+    :return: BAM and BAM index FileStoreIDs
+    :rtype: tuple(str, str)
     """
-    job.fileStore.logToMaster('Indexed sample BAMS: ' + config.uuid)
-    disk = '1G' if config.ci_test else '20G'
-    config.normal_bai = job.addChildJobFn(run_samtools_index, config.normal_bam, cores=1, disk=disk).rv()
-    config.tumor_bai = job.addChildJobFn(run_samtools_index, config.tumor_bam, cores=1, disk=disk).rv()
-    job.addFollowOnJobFn(preprocessing_declaration, config)
+    # The samtools index disk requirement depends on the input bam and the output bam index
+    index_disk = config.resource_model.disk('run_samtools_index', lambda bam: bam.size, bam)
+    bai = job.addChildJobFn(run_samtools_index, bam, cores=1, disk=index_disk).rv()
+    return job.addFollowOnJobFn(preprocessing_declaration, bam, bai, config).rv()
 
 
-def preprocessing_declaration(job, config):
+@metered
+def preprocessing_declaration(job, bam, bai, config):
     """
-    Declare jobs related to preprocessing
+    Declare jobs related to preprocessing: duplicate marking, indel realignment and base quality score
+    recalibration. The GATK jobs are declared here rather than with toil-lib's run_gatk_preprocessing, so that
+    each one is sized from the BAM that it reads. toil-lib sets the Java heap of each tool to the memory of its job.
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str bam: BAM FileStoreID
+    :param str bai: BAM index FileStoreID
     :param Namespace config: Argparse Namespace object containing argument inputs
+    :return: BAM and BAM index FileStoreIDs, preprocessed if preprocessing is enabled
+    :rtype: tuple(str, str)
     """
-    if config.preprocessing:
-        job.fileStore.logToMaster('Ran preprocessing: ' + config.uuid)
-        disk = '1G' if config.ci_test else '20G'
-        mem = '2G' if config.ci_test else '10G'
-        processed_normal = job.wrapJobFn(run_gatk_preprocessing, config.normal_bam, config.normal_bai,
-                                         config.reference, config.dict, config.fai, config.phase, config.mills,
-                                         config.dbsnp, mem, cores=1, memory=mem, disk=disk)
-        processed_tumor = job.wrapJobFn(run_gatk_preprocessing, config.tumor_bam, config.tumor_bai,
-                                        config.reference, config.dict, config.fai, config.phase, config.mills,
-                                        config.dbsnp, mem, cores=1, memory=mem, disk=disk)
-        static_workflow = job.wrapJobFn(static_workflow_declaration, config, processed_normal.rv(0),
-                                        processed_normal.rv(1), processed_tumor.rv(0), processed_tumor.rv(1))
-        job.addChild(processed_normal)
-        job.addChild(processed_tumor)
-        job.addFollowOn(static_workflow)
-    else:
-        job.addFollowOnJobFn(static_workflow_declaration, config, config.normal_bam, config.normal_bai,
-                             config.tumor_bam, config.tumor_bai)
-
-
+    if not config.preprocessing:
+        return bam, bai
+    resources, model = config.resources, config.resource_model
+    ref_files = [config.reference, config.dict, config.fai]
+    # Each requirement is computed from the promised arguments, which start with the BAM that the job reads
+    memory = lambda bam, *files: resources.memory(bam.size)
+    # Jobs that write a new copy of the BAM need room for both copies. The intervals and the recalibration
+    # table are small enough for the smallest disk of the profile.
+    copy_disk = lambda bam, *files: resources.disk(input_size((bam,) + files) + bam.size)
+    read_disk = lambda *files: resources.disk(input_size(files))
+
+    inputs = [bam, bai]
+    mdups = job.wrapJobFn(picard_mark_duplicates, *inputs, cores=1,
+                          memory=model.memory('picard_mark_duplicates', memory, *inputs),
+                          disk=model.disk('picard_mark_duplicates', copy_disk, *inputs))
+
+    inputs = [mdups.rv(0), mdups.rv(1)] + ref_files + [config.phase, config.mills]
+    realigner_target = job.wrapJobFn(run_realigner_target_creator, *inputs, cores=1,
+                                     memory=model.memory('run_realigner_target_creator', memory, *inputs),
+                                     disk=model.disk('run_realigner_target_creator', read_disk, *inputs))
+
+    inputs = [mdups.rv(0), mdups.rv(1), realigner_target.rv()] + ref_files + [config.phase, config.mills]
+    indel_realign = job.wrapJobFn(run_indel_realignment, realigner_target.rv(), mdups.rv(0), mdups.rv(1),
+                                  *(ref_files + [config.phase, config.mills]), cores=1,
+                                  memory=model.memory('run_indel_realignment', memory, *inputs),
+                                  disk=model.disk('run_indel_realignment', copy_disk, *inputs))
+
+    inputs = [indel_realign.rv(0), indel_realign.rv(1)] + ref_files + [config.dbsnp, config.mills]
+    base_recal = job.wrapJobFn(run_base_recalibration, *inputs, cores=1,
+                               memory=model.memory('run_base_recalibration', memory, *inputs),
+                               disk=model.disk('run_base_recalibration', read_disk, *inputs))
+
+    inputs = [indel_realign.rv(0), indel_realign.rv(1), base_recal.rv()] + ref_files
+    recalibrate_reads = job.wrapJobFn(apply_bqsr_recalibration, base_recal.rv(), indel_realign.rv(0),
+                                      indel_realign.rv(1), *ref_files, cores=1,
+                                      memory=model.memory('apply_bqsr_recalibration', memory, *inputs),
+                                      disk=model.disk('apply_bqsr_recalibration', copy_disk, *inputs))
+
+    # Toil runs the jobs in the order of toil-lib's run_gatk_preprocessing
+    job.addChild(mdups)
+    mdups.addChild(realigner_target)
+    realigner_target.addChild(indel_realign)
+    mdups.addFollowOn(base_recal)
+    base_recal.addChild(recalibrate_reads)
+    return recalibrate_reads.rv(0), recalibrate_reads.rv(1)
+
+
+@metered
 def static_workflow_declaration(job, config, normal_bam, normal_bai, tumor_bam, tumor_bai):
     """
     Statically declare workflow so sections can be modularly repurposed
@@ -134,27 +232,42 @@ def static_workflow_declaration(job, config, normal_bam, normal_bai, tumor_bam,
     :param str tumor_bam: Tumor BAM FileStoreID
     :param str tumor_bai: Tumor BAM Index FileStoreID
     """
-    # Mutation and indel tool wiring
-    memory = '1G' if config.ci_test else '10G'
-    disk = '1G' if config.ci_test else '75G'
+    # Mutation and indel tool wiring. Callers read the pair and the reference files, write outputs up to the
+    # size of the BAMs, and need memory in proportion to the BAMs.
+    resources = config.resources
+    bams = [normal_bam, normal_bai, tumor_bam, tumor_bai]
+    # Both are computed from the promised arguments, which start with the normal BAM, the normal BAI,
+    # the tumor BAM and the tumor BAI
+    caller_disk = lambda *files: resources.disk(input_size(files) + files[0].size + files[2].size)
+    caller_memory = lambda *files: resources.pair_memory(1.0, *files)
     mutect_results, pindel_results, muse_results = None, None, None
-    if config.run_mutect:
-        mutect_results = job.addChildJobFn(run_mutect, normal_bam, normal_bai, tumor_bam, tumor_bai, config.reference,
-                                           config.dict, config.fai, config.cosmic, config.dbsnp,
-                                           cores=1, memory=memory, disk=disk).rv()
-    if config.run_pindel:
-        pindel_results = job.addChildJobFn(run_pindel, normal_bam, normal_bai, tumor_bam, tumor_bai,
-                                           config.reference, config.fai,
-                                           cores=config.cores,  memory=memory, disk=disk).rv()
-    if config.run_muse:
-        muse_results = job.addChildJobFn(run_muse, normal_bam, normal_bai, tumor_bam, tumor_bai,
-                                         config.reference, config.dict, config.fai, config.dbsnp,
-                                         cores=config.cores, memory=memory, disk=disk).rv()
+    if config.run_mutect and config.mutect_shards > 1:
+        mutect_results = job.addChildJobFn(scatter_mutect, config, normal_bam, normal_bai, tumor_bam, tumor_bai).rv()
+    elif config.run_mutect:
+        inputs = bams + [config.reference, config.dict, config.fai, config.cosmic, config.dbsnp]
+        mutect_results = job.addChildJobFn(run_mutect, *inputs, cores=1,
+                                           memory=config.resource_model.memory('run_mutect', caller_memory, *inputs),
+                                           disk=config.resource_model.disk('run_mutect', caller_disk, *inputs)).rv()
+    if config.run_pindel and config.pindel_shards > 1:
+        pindel_results = job.addChildJobFn(scatter_pindel, config, normal_bam, normal_bai, tumor_bam, tumor_bai).rv()
+    elif config.run_pindel:
+        inputs = bams + [config.reference, config.fai]
+        pindel_results = job.addChildJobFn(run_pindel, *inputs, cores=config.cores,
+                                           memory=config.resource_model.memory('run_pindel', caller_memory, *inputs),
+                                           disk=config.resource_model.disk('run_pindel', caller_disk, *inputs)).rv()
+    if config.run_muse and config.muse_shards > 1:
+        muse_results = job.addChildJobFn(scatter_muse, config, normal_bam, normal_bai, tumor_bam, tumor_bai).rv()
+    elif config.run_muse:
+        inputs = bams + [config.reference, config.dict, config.fai, config.dbsnp]
+        muse_results = job.addChildJobFn(run_muse, *inputs, cores=config.cores,
+                                         memory=config.resource_model.memory('run_muse', caller_memory, *inputs),
+                                         disk=config.resource_model.disk('run_muse', caller_disk, *inputs)).rv()
     # Pass tool results (whether None or a promised return value) to consolidation step
     consolidation = job.wrapJobFn(consolidate_output, config, mutect_results, pindel_results, muse_results)
     job.addFollowOn(consolidation)
 
 
+@metered
 def consolidate_output(job, config, mutect, pindel, muse):
     """
     Combine the contents of separate tarball outputs into one via streaming
@@ -220,6 +333,36 @@ def parse_manifest(path_to_manifest):
     return samples
 
 
+def group_by_bams(samples):
+    """
+    Groups samples that share a BAM, as a normal or as a tumor, so each BAM is only prepared once.
+    Samples are in the same group if they are connected by a chain of shared BAMs.
+
+    >>> group_by_bams([['a', 'n1', 't1'], ['b', 'n2', 't2'], ['c', 'n1', 't3'], ['d', 't1', 't4']])
+    [[['a', 'n1', 't1'], ['c', 'n1', 't3'], ['d', 't1', 't4']], [['b', 'n2', 't2']]]
+
+    :param list[list] samples: Samples containing uuid, normal URL, and tumor URL
+    :return: Groups of samples, in manifest order
+    :rtype: list[list[list]]
+    """
+    # Union-find over the BAM URLs
+    parents = {}
+
+    def find(url):
+        parents.setdefault(url, url)
+        while parents[url] != url:
+            parents[url] = parents[parents[url]]
+            url = parents[url]
+        return url
+
+    for _, normal_url, tumor_url in samples:
+        parents[find(tumor_url)] = find(normal_url)
+    groups = OrderedDict()
+    for sample in samples:
+        groups.setdefault(find(sample[1]), []).append(sample)
+    return groups.values()
+
+
 def generate_config():
     return textwrap.dedent("""
     # CGL Exome Pipeline configuration file
@@ -254,12 +397,21 @@ def generate_config():
     # Optional: If true, will run MuTect to do mutation calls
     run-mutect: true
 
+    # Optional: Number of genomic interval shards used to parallelize MuTect for each pair (Default: 1)
+    mutect-shards:
+
     # Optional: If true, will run pindel to analyze indel
     run-pindel: true
 
+    # Optional: Number of contig shards used to parallelize Pindel for each pair (Default: 1)
+    pindel-shards:
+
     # Optional: If true, will run MuSe to do mutation calls
     run-muse: true
 
+    # Optional: Number of genomic interval shards used to parallelize MuSe for each pair (Default: 1)
+    muse-shards:
+
     # Optional: If true, will perform indel realignment and base quality score recalibration
     preprocessing: true
 
@@ -269,7 +421,16 @@ def generate_config():
     # Optional: Provide a full path to a CGHub Key used to access GNOS hosted data
     gtkey:
 
-    # Optional: If true, uses resource requirements appropriate for continuous integration
+    # Optional: S3 URL or shared local path to a persistent cache of reference files
+    reference-cache:
+
+    # Optional: Resource profile that sizes jobs from the BAMs of each pair: ci, standard, or deep (Default: standard)
+    resource-profile:
+
+    # Optional: Local path to a resource model used to estimate disk and memory requirements (Default: None)
+    resource-model:
+
+    # Optional: If true, uses the ci resource profile, which is appropriate for continuous integration
     ci-test: 
     """[1:])
 
@@ -348,6 +509,8 @@ def main():
     15 = Pindel
     16 = MuSe
     17 = Consolidate Output and move/upload results
+
+    A normal BAM that is shared by several samples is downloaded, indexed and preprocessed once for all of them.
     ==================================================
     Dependencies
     Curl:       apt-get install curl
@@ -361,22 +524,26 @@ def main():
     subparsers.add_parser('generate-config', help='Generates an editable config in the current working directory.')
     subparsers.add_parser('generate-manifest', help='Generates an editable manifest in the current working directory.')
     subparsers.add_parser('generate', help='Generates a config and manifest in the current working directory.')
+    add_report_parser(subparsers)
+    # Pipeline inputs, shared by the run and plan subparsers
+    parser_inputs = argparse.ArgumentParser(add_help=False)
+    parser_inputs.add_argument('--config', default='config-toil-exome.yaml', type=str,
+                               help='Path to the (filled in) config file, generated with "generate-config". '
+                                    '\nDefault value: "%(default)s"')
+    parser_inputs.add_argument('--manifest', default='manifest-toil-exome.tsv', type=str,
+                               help='Path to the (filled in) manifest file, generated with "generate-manifest". '
+                                    '\nDefault value: "%(default)s"')
+    parser_inputs.add_argument('--normal', default=None, type=str,
+                               help='URL for the normal BAM. URLs can take the form: http://, ftp://, file://, s3://, '
+                                    'and gnos://. The UUID for the sample must be given with the "--uuid" flag.')
+    parser_inputs.add_argument('--tumor', default=None, type=str,
+                               help='URL for the tumor BAM. URLs can take the form: http://, ftp://, file://, s3://, '
+                                    'and gnos://. The UUID for the sample must be given with the "--uuid" flag.')
+    parser_inputs.add_argument('--uuid', default=None, type=str, help='Provide the UUID of a sample when using the'
+                                                                      '"--tumor" and "--normal" option')
     # Run subparser
-    parser_run = subparsers.add_parser('run', help='Runs the CGL exome pipeline')
-    parser_run.add_argument('--config', default='config-toil-exome.yaml', type=str,
-                            help='Path to the (filled in) config file, generated with "generate-config". '
-                                 '\nDefault value: "%(default)s"')
-    parser_run.add_argument('--manifest', default='manifest-toil-exome.tsv', type=str,
-                            help='Path to the (filled in) manifest file, generated with "generate-manifest". '
-                                 '\nDefault value: "%(default)s"')
-    parser_run.add_argument('--normal', default=None, type=str,
-                            help='URL for the normal BAM. URLs can take the form: http://, ftp://, file://, s3://, '
-                                 'and gnos://. The UUID for the sample must be given with the "--uuid" flag.')
-    parser_run.add_argument('--tumor', default=None, type=str,
-                            help='URL for the tumor BAM. URLs can take the form: http://, ftp://, file://, s3://, '
-                                 'and gnos://. The UUID for the sample must be given with the "--uuid" flag.')
-    parser_run.add_argument('--uuid', default=None, type=str, help='Provide the UUID of a sample when using the'
-                                                                   '"--tumor" and "--normal" option')
+    parser_run = subparsers.add_parser('run', parents=[parser_inputs], help='Runs the CGL exome pipeline')
+    add_plan_parser(subparsers, [parser_inputs])
     # If no arguments provided, print full help menu
     if len(sys.argv) == 1:
         parser.print_help()
@@ -390,8 +557,10 @@ def main():
         generate_file(os.path.join(cwd, 'config-toil-exome.yaml'), generate_config)
     if args.command == 'generate-manifest' or args.command == 'generate':
         generate_file(os.path.join(cwd, 'manifest-toil-exome.tsv'), generate_manifest)
+    elif args.command == 'report':
+        report(args.jobStore, args.update_resource_model)
     # Pipeline execution
-    elif args.command == 'run':
+    elif args.command in ('run', 'plan'):
         require(os.path.exists(args.config), '{} not found. Please run '
                                              '"toil-rnaseq generate-config"'.format(args.config))
         if args.normal or args.tumor or args.uuid:
@@ -402,7 +571,7 @@ def main():
         # Parse config
         parsed_config = {x.replace('-', '_'): y for x, y in yaml.load(open(args.config).read()).iteritems()}
         config = argparse.Namespace(**parsed_config)
-        config.maxCores = int(args.maxCores) if args.maxCores else sys.maxint
+        config.maxCores = int(args.maxCores) if getattr(args, 'maxCores', None) else sys.maxint
         # Exome pipeline sanity checks
         if config.preprocessing:
             require(config.reference and config.phase and config.mills and config.dbsnp,
@@ -410,12 +579,27 @@ def main():
         if config.run_mutect:
             require(config.reference and config.dbsnp and config.cosmic,
                     'Missing inputs for MuTect, check config file.')
+        # Mutation callers are scattered across this many shards of the genome
+        for caller in ['mutect', 'pindel', 'muse']:
+            shards = int(getattr(config, caller + '_shards', None) or 1)
+            require(shards >= 1, 'The {}-shards parameter must be at least 1'.format(caller))
+            vars(config)[caller + '_shards'] = shards
         if config.run_pindel:
             require(config.reference, 'Missing input (reference) for Pindel.')
         if config.run_muse:
             require(config.reference and config.dbsnp,
                     'Missing inputs for MuSe, check config file.')
         require(config.output_dir, 'No output location specified: {}'.format(config.output_dir))
+        # Jobs are sized from the BAMs of each pair with a resource profile. ci-test is an alias for the ci profile.
+        config.resources = resource_profile(getattr(config, 'resource_profile', None), config.ci_test)
+        # Disk and memory requirements are estimated from the metrics of previous runs when a resource model is given
+        config.resource_model = ResourceModel.load(getattr(config, 'resource_model', None))
+        # Download jobs are sized from the sample sizes. The profile's default disk is used when a size cannot be
+        # determined.
+        config.url_sizes = probe_url_sizes([url for _, normal, tumor in samples for url in [normal, tumor]])
+        if args.command == 'plan':
+            plan(args, download_shared_files, samples, config)
+            return
         # Program checks
         for program in ['curl', 'docker']:
             require(next(which(program), None), program + ' must be installed on every node.'.format(program))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python2.7
+"""
+Resource profiles of the exome pipeline.
+
+Jobs request memory and disk in proportion to the BAMs of their pair, so shallow exomes pack densely onto
+nodes and deep exomes get what they need. A profile sets the memory per byte of BAM and its bounds, the
+smallest disk request, and the disk of downloads whose size cannot be probed. The ci profile is selected
+by the ci-test option.
+"""
+from collections import namedtuple
+
+from bd2k.util.humanize import human2bytes
+from toil_lib import require
+
+
+class ResourceProfile(namedtuple('ResourceProfile', ['min_memory', 'max_memory', 'memory_per_bam_byte',
+                                                     'min_disk', 'default_disk'])):
+    """
+    Memory and disk requirements of the exome pipeline's jobs
+
+    >>> profile = RESOURCE_PROFILES['standard']
+    >>> [profile.memory(x * 1024 ** 3) / 1024 ** 3 for x in [1, 12, 100]]
+    [2, 6, 10]
+    >>> profile.disk(1024) == profile.min_disk
+    True
+    >>> from argparse import Namespace
+    >>> bam = Namespace(size=6 * 1024 ** 3)
+    >>> profile.pair_memory(0.5, bam, None, bam, None, Namespace(size=1024 ** 3)) / 1024 ** 3
+    3
+    """
+
+    def memory(self, bam_bytes):
+        """
+        :param int bam_bytes: Size of the BAMs that a job reads
+        :return: Memory requirement in bytes
+        :rtype: int
+        """
+        return int(min(self.max_memory, max(self.min_memory, self.memory_per_bam_byte * bam_bytes)))
+
+    def pair_memory(self, fraction, normal_bam, normal_bai, tumor_bam, tumor_bai, *files):
+        """
+        Memory requirement of a job that reads a pair, computed from the job's arguments. Used as the
+        fallback of ResourceModel.memory.
+
+        :param float fraction: Share of the pair's reads that the job calls
+        :param str normal_bam: Normal BAM FileStoreID
+        :param str normal_bai: Normal BAM index FileStoreID
+        :param str tumor_bam: Tumor BAM FileStoreID
+        :param str tumor_bai: Tumor BAM index FileStoreID
+        :param files: Other input FileStoreIDs, which do not change the memory requirement
+        :return: Memory requirement in bytes
+        :rtype: int
+        """
+        return self.memory(fraction * (normal_bam.size + tumor_bam.size))
+
+    def disk(self, file_bytes):
+        """
+        :param int file_bytes: Size of the files that a job reads and writes
+        :return: Disk requirement in bytes
+        :rtype: int
+        """
+        return int(max(self.min_disk, file_bytes))
+
+
+RESOURCE_PROFILES = {
+    # Small test BAMs of continuous integration
+    'ci': ResourceProfile(min_memory=human2bytes('1G'), max_memory=human2bytes('2G'), memory_per_bam_byte=1.0,
+                          min_disk=human2bytes('1G'), default_disk='1G'),
+    # Exomes of typical depth
+    'standard': ResourceProfile(min_memory=human2bytes('2G'), max_memory=human2bytes('10G'), memory_per_bam_byte=0.5,
+                                min_disk=human2bytes('2G'), default_disk='20G'),
+    # Deep exomes and targeted genomes
+    'deep': ResourceProfile(min_memory=human2bytes('8G'), max_memory=human2bytes('32G'), memory_per_bam_byte=0.5,
+                            min_disk=human2bytes('10G'), default_disk='100G')}
+
+DEFAULT_PROFILE = 'standard'
+
+
+def resource_profile(name=None, ci_test=False):
+    """
+    Looks up a resource profile. The ci-test option is an alias for the ci profile.
+
+    >>> resource_profile(ci_test=True) == RESOURCE_PROFILES['ci']
+    True
+    >>> resource_profile('deep', ci_test=True) == RESOURCE_PROFILES['deep']
+    True
+
+    :param str name: Profile name, or None for the default profile
+    :param bool ci_test: If True and no profile is named, the ci profile is used
+    :return: Resource profile
+    :rtype: ResourceProfile
+    """
+    name = name or ('ci' if ci_test else DEFAULT_PROFILE)
+    require(name in RESOURCE_PROFILES, 'The resource-profile parameter must be one of {}, got {}'
+            .format(', '.join(sorted(RESOURCE_PROFILES)), name))
+    return RESOURCE_PROFILES[name]
@@ -0,0 +1,522 @@
+#!/usr/bin/env python2.7
+"""
+Interval-scattered mutation calling for the exome pipeline.
+
+The genome is split into interval shards from the reference sequence dictionary, balanced by the amount of
+reads that the BAM indexes of the pair place on each contig or 16 KiB window. Each shard is called in its own
+job, and the shard outputs are concatenated in reference order into the tarball that the unscattered caller
+writes, so consolidate_output handles both alike.
+"""
+import logging
+import os
+import tarfile
+from itertools import izip_longest
+
+from toil_lib.programs import docker_call
+from toil_lib.tools import get_mean_insert_size
+from toil_lib.tools.mutation_callers import run_muse, run_mutect, run_pindel
+
+from toil_scripts.bgzf import TABIX_WINDOW_SHIFT, bgzip_vcf, read_bam_index_windows
+from toil_scripts.gatk_germline.intervals import parse_sequence_dictionary, write_interval_list
+from toil_scripts.metrics import metered, metered_docker_call
+
+log = logging.getLogger(__name__)
+
+run_mutect = metered(run_mutect, __name__)
+run_pindel = metered(run_pindel, __name__)
+run_muse = metered(run_muse, __name__)
+docker_call = metered_docker_call(docker_call)
+
+# toil-lib's callers inline their images and parameters and have no option to restrict them to intervals,
+# so the shard runners use these copies and add the intervals. test_scatter checks the copies against the
+# docker calls of toil-lib's run_mutect, run_pindel and run_muse, and checks the MuSE commands below.
+MUTECT_IMAGE = 'quay.io/ucsc_cgl/mutect:1.1.7--e8bf09459cf0aecb9f55ee689c2b2d194754cbd3'
+PINDEL_IMAGE = 'quay.io/ucsc_cgl/pindel:0.2.5b6--4e8d1b31d4028f464b3409c6558fb9dfcad73f88'
+MUSE_IMAGE = 'quay.io/ucsc_cgl/muse:1.0--6add9b0a1662d44fd13bbc1f32eac49326e48562'
+
+# Parameters of toil-lib's run_mutect
+MUTECT_PARAMETERS = ['--analysis_type', 'MuTect',
+                     '--reference_sequence', 'ref.fasta',
+                     '--cosmic', '/data/cosmic.vcf',
+                     '--dbsnp', '/data/dbsnp.vcf',
+                     '--input_file:normal', '/data/normal.bam',
+                     '--input_file:tumor', '/data/tumor.bam',
+                     '--tumor_lod', str(10),
+                     '--initial_tumor_lod', str(4.0),
+                     '--out', 'mutect.out',
+                     '--coverage_file', 'mutect.cov',
+                     '--vcf', 'mutect.vcf']
+
+# The entrypoint of the MuSE image is a wrapper that calls and sums up genome-wide with the options of toil-lib's
+# run_muse. The shard runners run the image's MuSE binary instead: call on a list of chr:start-end regions, and
+# sump with -E for exome data, which run_muse selects with --mode wxs, on a bgzip compressed, tabix indexed dbSNP.
+MUSE_ENTRYPOINT = 'MuSE'
+MUSE_CALL_PARAMETERS = ['call',
+                        '-f', '/data/ref.fasta',
+                        '-l', '/data/shard.intervals',
+                        '-O', '/data/muse',
+                        '/data/tumor.bam',
+                        '/data/normal.bam']
+MUSE_SUMP_PARAMETERS = ['sump',
+                        '-I', '/data/muse.MuSE.txt',
+                        '-E',
+                        '-D', '/data/dbsnp.vcf.gz',
+                        '-O', '/data/muse.vcf']
+
+# MuTect outputs, in the order that run_mutect_shard returns them
+MUTECT_OUTPUTS = ['mutect.vcf', 'mutect.cov', 'mutect.out']
+
+# Pindel outputs, which are named after the -o prefix. Every shard also has the Pindel config.
+PINDEL_SUFFIXES = ['_BP', '_CloseEndMapped', '_D', '_INT', '_INT_final', '_INV', '_LI', '_RP', '_SI', '_TD']
+PINDEL_OUTPUTS = ['pindel-config.txt'] + ['pindel' + suffix for suffix in PINDEL_SUFFIXES]
+
+# Header lines of VCFs, MuTect call stats, MuTect coverage wiggle files, and MuSE call outputs
+HEADER_PREFIXES = ('#', 'contig\t', 'track ')
+
+# Contigs are split at the windows of the BAM index
+WINDOW_SIZE = 1 << TABIX_WINDOW_SHIFT
+
+
+def partition_reads(contigs, windows, num_shards, split_contigs=True):
+    """
+    Splits the genome into at most num_shards shards with about the same amount of reads. Shards and the intervals
+    within each shard are in reference order, so shard outputs are merged in reference order by concatenation.
+
+    >>> contigs, windows = [('1', 40000), ('2', 20000)], [[10, 10, 0], [20, 0]]
+    >>> partition_reads(contigs, windows, 2)
+    [([('1', 1, 32768)], 0.5), ([('1', 32769, 40000), ('2', 1, 20000)], 0.5)]
+    >>> partition_reads(contigs, windows, 2, split_contigs=False)
+    [([('1', 1, 40000)], 0.5), ([('2', 1, 20000)], 0.5)]
+
+    :param list[tuple(str, int)] contigs: List of (contig, length) tuples in reference order
+    :param list[list[int]] windows: Amount of reads in each 16 KiB window of each contig
+    :param int num_shards: Number of shards
+    :param bool split_contigs: If True, shards are balanced sets of regions that may split contigs at window
+                               boundaries. If False, shards are sets of whole contigs.
+    :return: List of (intervals, fraction of the reads) tuples. Intervals are 1-based, closed (contig, start, end).
+    :rtype: list[tuple(list[tuple(str, int, int)], float)]
+    """
+    total = float(sum(sum(contig_windows) for contig_windows in windows))
+    shards = []
+    shard, fill, cumulative = [], 0, 0
+    for (contig, length), contig_windows in zip(contigs, windows):
+        if split_contigs:
+            units = [(i * WINDOW_SIZE + 1, min(length, (i + 1) * WINDOW_SIZE),
+                      contig_windows[i] if i < len(contig_windows) else 0)
+                     for i in range(-(-length // WINDOW_SIZE))]
+        else:
+            units = [(1, length, sum(contig_windows))]
+        for start, end, weight in units:
+            if shard and shard[-1][0] == contig and shard[-1][2] == start - 1:
+                shard[-1] = (contig, shard[-1][1], end)
+            else:
+                shard.append((contig, start, end))
+            fill += weight
+            cumulative += weight
+            if len(shards) < num_shards - 1 and cumulative >= total * (len(shards) + 1) / num_shards:
+                shards.append((shard, fill / total))
+                shard, fill = [], 0
+    if shard:
+        shards.append((shard, fill / total if total else 1.0))
+    return shards
+
+
+def interval_shards(job, ref_dict, bais, num_shards, split_contigs=True):
+    """
+    Splits the genome into interval shards that hold about the same amount of reads in the BAMs. Shards are
+    balanced by length when a BAM index cannot be read or does not match the sequence dictionary.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str ref_dict: Reference dictionary FileStoreID
+    :param list[str] bais: BAM index FileStoreIDs
+    :param int num_shards: Number of shards
+    :param bool split_contigs: If True, contigs may be split across shards
+    :return: List of (intervals, fraction of the reads) tuples
+    :rtype: list[tuple(list[tuple(str, int, int)], float)]
+    """
+    contigs = parse_sequence_dictionary(job.fileStore.readGlobalFile(ref_dict))
+    # Every base counts the same when the reads cannot be counted
+    windows = [[min(WINDOW_SIZE, length - i) for i in range(0, length, WINDOW_SIZE)] for _, length in contigs]
+    try:
+        indexes = []
+        for bai in bais:
+            with open(job.fileStore.readGlobalFile(bai), 'rb') as f:
+                indexes.append(read_bam_index_windows(f))
+        if any(len(index) != len(contigs) for index in indexes):
+            raise ValueError('The BAM header does not match the sequence dictionary')
+        counted = [[sum(window) for window in izip_longest(*contig_windows, fillvalue=0)]
+                   for contig_windows in zip(*indexes)]
+        if any(any(contig_windows) for contig_windows in counted):
+            windows = counted
+    except ValueError as e:
+        log.warning('Balancing shards by length: %s', e)
+    return partition_reads(contigs, windows, num_shards, split_contigs)
+
+
+def shard_disk(file_ids, bams, fraction):
+    """
+    Disk requirement of a shard job: its input files, and outputs up to the shard's share of the BAMs
+
+    >>> from argparse import Namespace
+    >>> shard_disk([Namespace(size=100), Namespace(size=10)], [Namespace(size=100)], 0.25)
+    135
+
+    :param list[str] file_ids: Input FileStoreIDs
+    :param list[str] bams: BAM FileStoreIDs
+    :param float fraction: Shard's fraction of the reads
+    :return: Disk in bytes
+    :rtype: int
+    """
+    return sum(file_id.size for file_id in file_ids) + int(fraction * sum(bam.size for bam in bams))
+
+
+def concatenate_shards(paths, output_path, header_prefixes=HEADER_PREFIXES):
+    """
+    Concatenates text outputs of interval shards in shard order. The leading header lines of the first shard are
+    kept, and the leading header lines of the other shards are dropped.
+
+    >>> import shutil, tempfile
+    >>> tmp = tempfile.mkdtemp()
+    >>> paths = [os.path.join(tmp, name) for name in ['0.out', '1.out']]
+    >>> for path, position in zip(paths, ['10', '20']):
+    ...     with open(path, 'w') as f:
+    ...         f.write('## muTector v1.0\\ncontig\\tposition\\n1\\t' + position + '\\n')
+    >>> concatenate_shards(paths, os.path.join(tmp, 'mutect.out'))
+    >>> open(os.path.join(tmp, 'mutect.out')).read().splitlines()
+    ['## muTector v1.0', 'contig\\tposition', '1\\t10', '1\\t20']
+    >>> shutil.rmtree(tmp)
+
+    :param list[str] paths: Paths to shard outputs, in reference order
+    :param str output_path: Path to concatenated output
+    :param tuple(str) header_prefixes: Prefixes of header lines. Nothing is dropped if empty.
+    """
+    with open(output_path, 'w') as f_out:
+        for i, path in enumerate(paths):
+            with open(path, 'r') as f_in:
+                header = bool(header_prefixes)
+                for line in f_in:
+                    header = header and line.startswith(header_prefixes)
+                    if i == 0 or not header:
+                        f_out.write(line)
+
+
+def write_tarball(job, work_dir, tar_name, names):
+    """
+    Writes files of a job's work directory to a tarball in the FileStore
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str work_dir: Job work directory
+    :param str tar_name: Name of the tarball
+    :param list[str] names: Names of the files in the work directory
+    :return: Tarball FileStoreID
+    :rtype: str
+    """
+    tar_path = os.path.join(work_dir, tar_name)
+    with tarfile.open(tar_path, 'w:gz') as tar:
+        for name in names:
+            tar.add(os.path.join(work_dir, name), arcname=name)
+    return job.fileStore.writeGlobalFile(tar_path)
+
+
+@metered
+def scatter_mutect(job, config, normal_bam, normal_bai, tumor_bam, tumor_bai):
+    """
+    Runs MuTect in one job per interval shard and merges the shard outputs
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param Namespace config: Argparse Namespace object containing argument inputs
+    :param str normal_bam: Normal BAM FileStoreID
+    :param str normal_bai: Normal BAM index FileStoreID
+    :param str tumor_bam: Tumor BAM FileStoreID
+    :param str tumor_bai: Tumor BAM Index FileStoreID
+    :return: MuTect output tarball FileStoreID
+    :rtype: str
+    """
+    # Memory scales with the share of the pair's reads that a job calls
+    resources, model = config.resources, config.resource_model
+    bams = [normal_bam, tumor_bam]
+    shards = interval_shards(job, config.dict, [normal_bai, tumor_bai], config.mutect_shards)
+    inputs = [normal_bam, normal_bai, tumor_bam, tumor_bai, config.reference, config.dict, config.fai,
+              config.cosmic, config.dbsnp]
+    # A single shard covers the genome, so MuTect runs unscattered
+    if len(shards) < 2:
+        return job.addChildJobFn(run_mutect, *inputs, cores=1,
+                                 memory=model.memory('run_mutect', resources.pair_memory, 1.0, *inputs),
+                                 disk=shard_disk(inputs, bams, 1.0)).rv()
+    job.fileStore.logToMaster('Scattering MuTect across %d interval shards' % len(shards))
+    shard_outputs = [job.addChildJobFn(run_mutect_shard, *inputs, intervals=intervals, cores=1,
+                                       memory=model.memory('run_mutect_shard', resources.pair_memory, fraction,
+                                                           *inputs),
+                                       disk=shard_disk(inputs, bams, fraction)).rv()
+                     for intervals, fraction in shards]
+    return job.addFollowOnJobFn(merge_mutect_shards, shard_outputs).rv()
+
+
+@metered
+def run_mutect_shard(job, normal_bam, normal_bai, tumor_bam, tumor_bai, ref, ref_dict, fai, cosmic, dbsnp,
+                     intervals):
+    """
+    Calls MuTect on the intervals of one shard
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str normal_bam: Normal BAM FileStoreID
+    :param str normal_bai: Normal BAM index FileStoreID
+    :param str tumor_bam: Tumor BAM FileStoreID
+    :param str tumor_bai: Tumor BAM Index FileStoreID
+    :param str ref: Reference genome FileStoreID
+    :param str ref_dict: Reference dictionary FileStoreID
+    :param str fai: Reference index FileStoreID
+    :param str cosmic: Cosmic VCF FileStoreID
+    :param str dbsnp: DBSNP VCF FileStoreID
+    :param list[tuple(str, int, int)] intervals: 1-based, closed (contig, start, end) intervals of the shard
+    :return: FileStoreIDs of the MuTect VCF, coverage file, and call stats
+    :rtype: tuple(str, str, str)
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    file_ids = [normal_bam, normal_bai, tumor_bam, tumor_bai, ref, fai, ref_dict, cosmic, dbsnp]
+    file_names = ['normal.bam', 'normal.bai', 'tumor.bam', 'tumor.bai', 'ref.fasta',
+                  'ref.fasta.fai', 'ref.dict', 'cosmic.vcf', 'dbsnp.vcf']
+    for file_store_id, name in zip(file_ids, file_names):
+        job.fileStore.readGlobalFile(file_store_id, os.path.join(work_dir, name))
+    write_interval_list(intervals, work_dir)
+    parameters = MUTECT_PARAMETERS + ['--intervals', '/data/shard.intervals']
+    docker_call(job=job, work_dir=work_dir, parameters=parameters, tool=MUTECT_IMAGE,
+                inputs=file_names + ['shard.intervals'],
+                outputs={name: None for name in MUTECT_OUTPUTS})
+    return tuple(job.fileStore.writeGlobalFile(os.path.join(work_dir, name)) for name in MUTECT_OUTPUTS)
+
+
+@metered
+def merge_mutect_shards(job, shard_outputs):
+    """
+    Concatenates the MuTect outputs of the interval shards into the tarball that run_mutect writes
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param list[tuple(str, str, str)] shard_outputs: Outputs of run_mutect_shard, in reference order
+    :return: MuTect output tarball FileStoreID
+    :rtype: str
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    for i, name in enumerate(MUTECT_OUTPUTS):
+        paths = [job.fileStore.readGlobalFile(outputs[i], os.path.join(work_dir, '{}.{}'.format(shard, name)))
+                 for shard, outputs in enumerate(shard_outputs)]
+        concatenate_shards(paths, os.path.join(work_dir, name))
+    return write_tarball(job, work_dir, 'mutect.tar.gz', MUTECT_OUTPUTS)
+
+
+@metered
+def scatter_pindel(job, config, normal_bam, normal_bai, tumor_bam, tumor_bai):
+    """
+    Runs Pindel in one job per shard of whole contigs and merges the shard outputs. Contigs are not split, so
+    Pindel finds the same structural variants as it does genome-wide.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param Namespace config: Argparse Namespace object containing argument inputs
+    :param str normal_bam: Normal BAM FileStoreID
+    :param str normal_bai: Normal BAM index FileStoreID
+    :param str tumor_bam: Tumor BAM FileStoreID
+    :param str tumor_bai: Tumor BAM Index FileStoreID
+    :return: Pindel output tarball FileStoreID
+    :rtype: str
+    """
+    resources, model = config.resources, config.resource_model
+    bams = [normal_bam, tumor_bam]
+    shards = interval_shards(job, config.dict, [normal_bai, tumor_bai], config.pindel_shards, split_contigs=False)
+    inputs = [normal_bam, normal_bai, tumor_bam, tumor_bai, config.reference, config.fai]
+    if len(shards) < 2:
+        return job.addChildJobFn(run_pindel, *inputs, cores=config.cores,
+                                 memory=model.memory('run_pindel', resources.pair_memory, 1.0, *inputs),
+                                 disk=shard_disk(inputs, bams, 1.0)).rv()
+    job.fileStore.logToMaster('Scattering Pindel across %d contig shards' % len(shards))
+    # Every shard uses the insert sizes of the whole BAMs, which are estimated once
+    insert_sizes = job.addChildJobFn(pindel_insert_sizes, normal_bam, tumor_bam, disk=shard_disk(bams, [], 0))
+    shard_outputs = [insert_sizes.addChildJobFn(run_pindel_shard, *inputs, insert_sizes=insert_sizes.rv(),
+                                                intervals=intervals, cores=1,
+                                                memory=model.memory('run_pindel_shard', resources.pair_memory,
+                                                                    fraction, *inputs),
+                                                disk=shard_disk(inputs, bams, fraction)).rv()
+                     for intervals, fraction in shards]
+    return job.addFollowOnJobFn(merge_pindel_shards, shard_outputs).rv()
+
+
+@metered
+def pindel_insert_sizes(job, normal_bam, tumor_bam):
+    """
+    Estimates the mean insert sizes of the normal and tumor BAMs for the Pindel config
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str normal_bam: Normal BAM FileStoreID
+    :param str tumor_bam: Tumor BAM FileStoreID
+    :return: Mean insert sizes of the normal and tumor BAMs
+    :rtype: tuple(int, int)
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    for file_store_id, name in [(normal_bam, 'normal.bam'), (tumor_bam, 'tumor.bam')]:
+        job.fileStore.readGlobalFile(file_store_id, os.path.join(work_dir, name))
+    return get_mean_insert_size(work_dir, 'normal.bam'), get_mean_insert_size(work_dir, 'tumor.bam')
+
+
+@metered
+def run_pindel_shard(job, normal_bam, normal_bai, tumor_bam, tumor_bai, ref, fai, insert_sizes, intervals):
+    """
+    Runs Pindel on the contigs of one shard
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str normal_bam: Normal BAM FileStoreID
+    :param str normal_bai: Normal BAM index FileStoreID
+    :param str tumor_bam: Tumor BAM FileStoreID
+    :param str tumor_bai: Tumor BAM Index FileStoreID
+    :param str ref: Reference genome FileStoreID
+    :param str fai: Reference index FileStoreID
+    :param tuple(int, int) insert_sizes: Mean insert sizes of the normal and tumor BAMs
+    :param list[tuple(str, int, int)] intervals: 1-based, closed (contig, start, end) intervals of the shard
+    :return: Pindel outputs {name: FileStoreID}
+    :rtype: dict
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    file_ids = [normal_bam, normal_bai, tumor_bam, tumor_bai, ref, fai]
+    file_names = ['normal.bam', 'normal.bam.bai', 'tumor.bam', 'tumor.bam.bai', 'ref.fasta', 'ref.fasta.fai']
+    for file_store_id, name in zip(file_ids, file_names):
+        job.fileStore.readGlobalFile(file_store_id, os.path.join(work_dir, name))
+    with open(os.path.join(work_dir, 'pindel-config.txt'), 'w') as f:
+        for bam, insert_size in zip(['normal', 'tumor'], insert_sizes):
+            f.write('/data/{}.bam {} {}\n'.format(bam, insert_size, bam))
+    # Pindel reads the regions of the shard from a BED file
+    with open(os.path.join(work_dir, 'shard.bed'), 'w') as f:
+        for contig, start, end in intervals:
+            f.write('{}\t{}\t{}\n'.format(contig, start - 1, end))
+    parameters = pindel_parameters(job.cores) + ['-j', '/data/shard.bed']
+    docker_call(job=job, work_dir=work_dir, parameters=parameters, tool=PINDEL_IMAGE,
+                inputs=file_names + ['pindel-config.txt', 'shard.bed'])
+    return {name: job.fileStore.writeGlobalFile(os.path.join(work_dir, name))
+            for name in PINDEL_OUTPUTS if os.path.exists(os.path.join(work_dir, name))}
+
+
+def pindel_parameters(cores):
+    """
+    Returns the parameters of toil-lib's run_pindel
+
+    :param int cores: Number of Pindel threads
+    :rtype: list[str]
+    """
+    return ['-f', '/data/ref.fasta',
+            '-i', '/data/pindel-config.txt',
+            '--number_of_threads', str(cores),
+            '--minimum_support_for_event', '3',
+            '--report_long_insertions', 'true',
+            '--report_breakpoints', 'true',
+            '-o', 'pindel']
+
+
+@metered
+def merge_pindel_shards(job, shard_outputs):
+    """
+    Concatenates the Pindel outputs of the contig shards into the tarball that run_pindel writes
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param list[dict] shard_outputs: Outputs of run_pindel_shard, in reference order
+    :return: Pindel output tarball FileStoreID
+    :rtype: str
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    names = sorted(set(name for outputs in shard_outputs for name in outputs))
+    for name in names:
+        paths = [job.fileStore.readGlobalFile(outputs[name], os.path.join(work_dir, '{}.{}'.format(shard, name)))
+                 for shard, outputs in enumerate(shard_outputs) if name in outputs]
+        # Every shard has the same config. Pindel starts each record with a line of #, so nothing is dropped.
+        concatenate_shards(paths[:1] if name == 'pindel-config.txt' else paths, os.path.join(work_dir, name),
+                           header_prefixes=())
+    return write_tarball(job, work_dir, 'pindel.tar.gz', names)
+
+
+@metered
+def scatter_muse(job, config, normal_bam, normal_bai, tumor_bam, tumor_bai):
+    """
+    Runs MuSE call in one job per interval shard, and MuSE sump on the merged calls. sump fits its error model
+    to the candidates of the whole exome, so it is not scattered.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param Namespace config: Argparse Namespace object containing argument inputs
+    :param str normal_bam: Normal BAM FileStoreID
+    :param str normal_bai: Normal BAM index FileStoreID
+    :param str tumor_bam: Tumor BAM FileStoreID
+    :param str tumor_bai: Tumor BAM Index FileStoreID
+    :return: MuSE output tarball FileStoreID
+    :rtype: str
+    """
+    resources, model = config.resources, config.resource_model
+    bams = [normal_bam, tumor_bam]
+    shards = interval_shards(job, config.dict, [normal_bai, tumor_bai], config.muse_shards)
+    if len(shards) < 2:
+        inputs = [normal_bam, normal_bai, tumor_bam, tumor_bai, config.reference, config.dict, config.fai,
+                  config.dbsnp]
+        return job.addChildJobFn(run_muse, *inputs, cores=config.cores,
+                                 memory=model.memory('run_muse', resources.pair_memory, 1.0, *inputs),
+                                 disk=shard_disk(inputs, bams, 1.0)).rv()
+    job.fileStore.logToMaster('Scattering MuSE across %d interval shards' % len(shards))
+    inputs = [normal_bam, normal_bai, tumor_bam, tumor_bai, config.reference, config.fai]
+    calls = [job.addChildJobFn(run_muse_call, *inputs, intervals=intervals, cores=1,
+                               memory=model.memory('run_muse_call', resources.pair_memory, fraction, *inputs),
+                               disk=shard_disk(inputs, bams, fraction)).rv()
+             for intervals, fraction in shards]
+    # sump needs the plain text and the compressed dbSNP VCF, and the calls, which are much smaller than the BAMs
+    return job.addFollowOnJobFn(run_muse_sump, calls, config.dbsnp, memory=resources.min_memory,
+                                disk=shard_disk([config.dbsnp, config.dbsnp], bams, 0.1)).rv()
+
+
+@metered
+def run_muse_call(job, normal_bam, normal_bai, tumor_bam, tumor_bai, ref, fai, intervals):
+    """
+    Runs MuSE call on the intervals of one shard
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str normal_bam: Normal BAM FileStoreID
+    :param str normal_bai: Normal BAM index FileStoreID
+    :param str tumor_bam: Tumor BAM FileStoreID
+    :param str tumor_bai: Tumor BAM Index FileStoreID
+    :param str ref: Reference genome FileStoreID
+    :param str fai: Reference index FileStoreID
+    :param list[tuple(str, int, int)] intervals: 1-based, closed (contig, start, end) intervals of the shard
+    :return: FileStoreID for the MuSE call output
+    :rtype: str
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    file_ids = [normal_bam, normal_bai, tumor_bam, tumor_bai, ref, fai]
+    file_names = ['normal.bam', 'normal.bam.bai', 'tumor.bam', 'tumor.bam.bai', 'ref.fasta', 'ref.fasta.fai']
+    for file_store_id, name in zip(file_ids, file_names):
+        job.fileStore.readGlobalFile(file_store_id, os.path.join(work_dir, name))
+    write_interval_list(intervals, work_dir)
+    docker_call(job=job, work_dir=work_dir,
+                parameters=MUSE_CALL_PARAMETERS,
+                tool=MUSE_IMAGE,
+                inputs=file_names + ['shard.intervals'],
+                outputs={'muse.MuSE.txt': None},
+                docker_parameters=['--entrypoint', MUSE_ENTRYPOINT])
+    return job.fileStore.writeGlobalFile(os.path.join(work_dir, 'muse.MuSE.txt'))
+
+
+@metered
+def run_muse_sump(job, calls, dbsnp):
+    """
+    Merges the MuSE call outputs of the interval shards and runs MuSE sump on the whole exome
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param list[str] calls: FileStoreIDs for the MuSE call outputs, in reference order
+    :param str dbsnp: DBSNP VCF FileStoreID
+    :return: MuSE output tarball FileStoreID
+    :rtype: str
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    paths = [job.fileStore.readGlobalFile(call, os.path.join(work_dir, '{}.MuSE.txt'.format(shard)))
+             for shard, call in enumerate(calls)]
+    concatenate_shards(paths, os.path.join(work_dir, 'muse.MuSE.txt'))
+    # MuSE sump reads a BGZF compressed, tabix indexed dbSNP VCF
+    bgzip_vcf(job, job.fileStore.readGlobalFile(dbsnp, os.path.join(work_dir, 'dbsnp.vcf')))
+    docker_call(job=job, work_dir=work_dir,
+                parameters=MUSE_SUMP_PARAMETERS,
+                tool=MUSE_IMAGE,
+                inputs=['muse.MuSE.txt', 'dbsnp.vcf.gz', 'dbsnp.vcf.gz.tbi'],
+                outputs={'muse.vcf': None},
+                docker_parameters=['--entrypoint', MUSE_ENTRYPOINT])
+    return write_tarball(job, work_dir, 'muse.tar.gz', ['muse.vcf'])
+
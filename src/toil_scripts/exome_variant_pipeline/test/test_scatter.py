@@ -0,0 +1,96 @@
+from __future__ import print_function
+
+import json
+import os
+import random
+import shutil
+import tempfile
+from unittest import TestCase
+
+from toil_lib.tools.mutation_callers import run_muse, run_mutect, run_pindel
+
+from toil_scripts.benchmark.synthetic import (random_contigs, write_bam, write_fasta, write_fasta_index,
+                                              write_sequence_dictionary, write_vcf)
+from toil_scripts.exome_variant_pipeline.scatter import (MUSE_CALL_PARAMETERS, MUSE_ENTRYPOINT, MUSE_IMAGE,
+                                                         MUSE_SUMP_PARAMETERS, MUTECT_IMAGE, MUTECT_PARAMETERS,
+                                                         PINDEL_IMAGE, PINDEL_OUTPUTS, pindel_parameters,
+                                                         run_muse_call, run_muse_sump, run_mutect_shard,
+                                                         run_pindel_shard)
+from toil_scripts.testing import fake_docker, run_workflow
+
+
+def call(job, paths, intervals, names_path):
+    """
+    Runs toil-lib's callers and the shard runners on the same pair, and writes the names of the Pindel shard
+    outputs to names_path
+    """
+    ids = {name: job.fileStore.writeGlobalFile(path) for name, path in paths.iteritems()}
+    pair = [ids['normal.bam'], ids['normal.bai'], ids['tumor.bam'], ids['tumor.bai']]
+    job.addChildJobFn(run_mutect, *(pair + [ids['ref'], ids['dict'], ids['fai'], ids['vcf'], ids['vcf']]))
+    job.addChildJobFn(run_mutect_shard, *(pair + [ids['ref'], ids['dict'], ids['fai'], ids['vcf'], ids['vcf']]),
+                      intervals=intervals)
+    job.addChildJobFn(run_pindel, *(pair + [ids['ref'], ids['fai']]), cores=1)
+    pindel_shard = job.addChildJobFn(run_pindel_shard, *(pair + [ids['ref'], ids['fai']]), insert_sizes=(300, 300),
+                                     intervals=intervals, cores=1)
+    job.addChildJobFn(run_muse, *(pair + [ids['ref'], ids['dict'], ids['fai'], ids['vcf']]))
+    muse_call = job.addChildJobFn(run_muse_call, *(pair + [ids['ref'], ids['fai']]), intervals=intervals)
+    muse_call.addFollowOnJobFn(run_muse_sump, [muse_call.rv()], ids['vcf'])
+    job.addFollowOnJobFn(write_names, pindel_shard.rv(), names_path)
+
+
+def write_names(job, outputs, names_path):
+    with open(names_path, 'w') as f:
+        json.dump(sorted(outputs), f)
+
+
+class ScatterTest(TestCase):
+    """
+    Checks the images and parameters of the shard runners against the docker calls of toil-lib's callers,
+    which the shard runners copy
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        contigs = random_contigs(random.Random(0), 20000, 2)
+        ref = os.path.join(self.work_dir, 'genome.fa')
+        write_fasta(ref, contigs)
+        write_fasta_index(ref, ref + '.fai')
+        write_sequence_dictionary(ref, os.path.join(self.work_dir, 'genome.dict'))
+        self.paths = {'ref': ref, 'fai': ref + '.fai', 'dict': os.path.join(self.work_dir, 'genome.dict'),
+                      'vcf': os.path.join(self.work_dir, 'known_sites.vcf')}
+        write_vcf(self.paths['vcf'], contigs, 20)
+        for i, name in enumerate(['normal', 'tumor']):
+            bam = os.path.join(self.work_dir, name + '.bam')
+            write_bam(bam, contigs, 100, sample=name, seed=i)
+            self.paths[name + '.bam'] = bam
+            # Only the shard runners read the indexes, and the fake tools do not
+            self.paths[name + '.bai'] = bam
+        self.intervals = [(contigs[0][0], 1, len(contigs[0][1]))]
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_parameters(self):
+        with fake_docker(self.work_dir) as log:
+            names_path = os.path.join(self.work_dir, 'pindel_outputs.json')
+            run_workflow(self.work_dir, call, self.paths, self.intervals, names_path)
+            # toil-lib also runs each image to fix the ownership of the work directory
+            calls = [json.loads(line) for line in open(log)]
+            calls = [c for c in calls if c['entrypoint'] != 'chown']
+        entrypoints = {c['parameters'][0]: c['entrypoint'] for c in calls if c['image'] == MUSE_IMAGE}
+        calls = [(c['image'], c['parameters']) for c in calls]
+        mutect = [parameters for image, parameters in calls if image == MUTECT_IMAGE]
+        self.assertEqual(sorted(mutect), sorted([MUTECT_PARAMETERS,
+                                                 MUTECT_PARAMETERS + ['--intervals', '/data/shard.intervals']]))
+        pindel = [parameters for image, parameters in calls if image == PINDEL_IMAGE]
+        self.assertEqual(sorted(pindel), sorted([pindel_parameters(1),
+                                                 pindel_parameters(1) + ['-j', '/data/shard.bed']]))
+        # toil-lib runs the image's wrapper for exome data, and the shard runners run MuSE call and sump
+        muse = [parameters for image, parameters in calls if image == MUSE_IMAGE]
+        wrapper = [parameters for parameters in muse if parameters[0] == '--mode']
+        self.assertEqual(len(wrapper), 1)
+        self.assertEqual(wrapper[0][:2], ['--mode', 'wxs'])
+        self.assertEqual(sorted(muse), sorted(wrapper + [MUSE_CALL_PARAMETERS, MUSE_SUMP_PARAMETERS]))
+        self.assertEqual(entrypoints, {'--mode': None, 'call': MUSE_ENTRYPOINT, 'sump': MUSE_ENTRYPOINT})
+        with open(names_path) as f:
+            self.assertEqual(json.load(f), sorted(PINDEL_OUTPUTS))
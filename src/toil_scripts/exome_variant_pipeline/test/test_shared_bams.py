@@ -0,0 +1,48 @@
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from toil_scripts.benchmark.benchmark import Inputs
+from toil_scripts.testing import fake_docker
+
+
+class SharedBamsTest(TestCase):
+    """
+    Runs the exome pipeline on synthetic BAMs with the fake docker in place of the tools, for a manifest in
+    which a normal is shared by two tumors and a tumor is the normal of another row
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.inputs = Inputs('exome', self.work_dir, 2, reads_per_sample=200, genome_length=20000, num_contigs=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_shared_bams(self):
+        (_, n1, t1), (_, n2, t2) = self.inputs.samples
+        # t1 is a tumor of the first two rows and the normal of the third
+        samples = [['pair_a', n1, t1], ['pair_b', n1, t2], ['pair_c', t1, n2]]
+        manifest = os.path.join(self.work_dir, 'manifest.tsv')
+        with open(manifest, 'w') as f:
+            f.write(''.join('\t'.join(sample) + '\n' for sample in samples))
+        config = os.path.join(self.work_dir, 'config.yaml')
+        output_dir = os.path.join(self.work_dir, 'output')
+        self.inputs.write_config(config, output_dir, {'preprocessing': False})
+        with fake_docker(self.work_dir) as log:
+            subprocess.check_call([sys.executable, '-m', 'toil_scripts.exome_variant_pipeline.exome_variant_pipeline',
+                                   'run', os.path.join(self.work_dir, 'jobstore'),
+                                   '--config', config, '--manifest', manifest,
+                                   '--batchSystem', 'singleMachine',
+                                   '--workDir', self.work_dir])
+            calls = [json.loads(line) for line in open(log)]
+        # Each of the four BAMs is indexed once
+        indexed = [call for call in calls if 'samtools' in call['image'] and call['parameters'][0] == 'index']
+        self.assertEqual(len(indexed), 4)
+        self.assertEqual(sorted(os.listdir(output_dir)), ['pair_a.tar.gz', 'pair_b.tar.gz', 'pair_c.tar.gz'])
@@ -0,0 +1,168 @@
+#!/usr/bin/env python2.7
+"""
+Exports files from the FileStore without intermediate copies.
+
+Files exported to a local directory are hard linked from the local FileStore cache when both are on the
+same filesystem, and otherwise reflinked or copied. Files exported to S3 are streamed from the FileStore
+in a parallel multipart upload. Each part is checked by S3 against its MD5, and the ETag of the finished
+object is checked against the MD5s computed while streaming.
+"""
+import base64
+import errno
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+import uuid
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+from urlparse import urlparse
+
+from toil_lib import require
+
+from toil_scripts.urls import s3_connection
+
+log = logging.getLogger(__name__)
+
+# S3 requires every part except the last to be at least 5 MB
+DEFAULT_PART_SIZE = 64 * 1024 * 1024
+
+
+def link_or_copy(src, dest):
+    """
+    Places a file at dest with a hard link, a reflink, or a copy, whichever is possible. The file
+    appears at dest atomically, so readers never see a partial file.
+
+    >>> import shutil, tempfile
+    >>> tmp = tempfile.mkdtemp()
+    >>> src = os.path.join(tmp, 'src.vcf')
+    >>> with open(src, 'w') as f:
+    ...     f.write('##fileformat=VCFv4.2\\n')
+    >>> link_or_copy(src, os.path.join(tmp, 'dest.vcf'))
+    >>> os.stat(src).st_ino == os.stat(os.path.join(tmp, 'dest.vcf')).st_ino
+    True
+    >>> shutil.rmtree(tmp)
+
+    :param str src: Path to the source file
+    :param str dest: Path to the destination file
+    """
+    tmp_dest = os.path.join(os.path.dirname(dest), '.{}.{}'.format(os.path.basename(dest), uuid.uuid4().hex))
+    try:
+        os.link(src, tmp_dest)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        # Copy-on-write filesystems share the blocks of a reflink, and cp falls back to a full copy
+        subprocess.check_call(['cp', '--reflink=auto', src, tmp_dest])
+    os.rename(tmp_dest, dest)
+
+
+def multipart_etag(part_digests):
+    """
+    Returns the ETag that S3 assigns to a multipart upload: the MD5 of the concatenated part MD5s,
+    followed by the number of parts
+
+    >>> multipart_etag([hashlib.md5('a').digest(), hashlib.md5('b').digest()])
+    '96e024ba2074fe77e8e965ba43a704be-2'
+
+    :param list[str] part_digests: Binary MD5 digest of each part, in part order
+    :return: ETag without quotes
+    :rtype: str
+    """
+    return '{}-{}'.format(hashlib.md5(''.join(part_digests)).hexdigest(), len(part_digests))
+
+
+def upload_stream_to_s3(f, s3_url, part_size=DEFAULT_PART_SIZE, threads=4, connection=None):
+    """
+    Uploads a stream to S3 in a parallel multipart upload. At most threads parts are held in memory.
+
+    :param file f: Readable stream
+    :param str s3_url: S3 URL of the uploaded object
+    :param int part_size: Size of each part in bytes
+    :param int threads: Number of parts uploaded concurrently
+    :param boto.s3.connection.S3Connection connection: (OPTIONAL) Connection that starts and completes the
+                                                       upload. By default a connection is opened for the upload.
+    :return: Hex MD5 of the uploaded data
+    :rtype: str
+    """
+    parsed_url = urlparse(s3_url)
+    bucket_name, key_name = parsed_url.netloc, parsed_url.path.lstrip('/')
+    s3 = connection or s3_connection()
+    try:
+        bucket = s3.get_bucket(bucket_name, validate=False)
+        upload = bucket.initiate_multipart_upload(key_name)
+        try:
+            md5, part_digests = _upload_parts(f, bucket_name, key_name, upload.id, part_size, threads)
+            etag = upload.complete_upload().etag.strip('"')
+        except:
+            upload.cancel_upload()
+            raise
+    finally:
+        if connection is None:
+            s3.close()
+    require(etag == multipart_etag(part_digests),
+            'The ETag of {} is {}, but the uploaded data has ETag {}'.format(s3_url, etag,
+                                                                           multipart_etag(part_digests)))
+    log.info('Uploaded %s (%d parts, MD5 %s)', s3_url, len(part_digests), md5.hexdigest())
+    return md5.hexdigest()
+
+
+def _upload_parts(f, bucket_name, key_name, upload_id, part_size, threads):
+    """
+    Reads a stream in parts and uploads them concurrently
+
+    :return: MD5 of the whole stream and the binary MD5 digest of each part
+    :rtype: tuple(hashlib.md5, list[str])
+    """
+    local = threading.local()
+    # Connections opened by the pool threads, which are closed once every part is uploaded
+    connections = []
+
+    def upload_part(part_number, data, digest):
+        try:
+            # boto connections are not thread safe, so each thread opens its own
+            if not hasattr(local, 'upload'):
+                from boto.s3.multipart import MultiPartUpload
+                connection = s3_connection()
+                connections.append(connection)
+                local.upload = MultiPartUpload(connection.get_bucket(bucket_name, validate=False))
+                local.upload.key_name = key_name
+                local.upload.id = upload_id
+            # S3 rejects the part if it does not match the Content-MD5 header
+            local.upload.upload_part_from_file(StringIO(data), part_number,
+                                               md5=(digest.encode('hex'), base64.b64encode(digest)))
+        finally:
+            slots.release()
+
+    md5 = hashlib.md5()
+    part_digests = []
+    slots = threading.BoundedSemaphore(threads)
+    pool = ThreadPool(threads)
+    results = []
+    try:
+        part_number = 1
+        data = f.read(part_size)
+        while True:
+            md5.update(data)
+            digest = hashlib.md5(data).digest()
+            part_digests.append(digest)
+            slots.acquire()
+            results.append(pool.apply_async(upload_part, (part_number, data, digest)))
+            # Fail early instead of reading the rest of the stream
+            for result in results:
+                if result.ready() and not result.successful():
+                    result.get()
+            data = f.read(part_size)
+            # An empty stream is uploaded as a single empty part
+            if not data:
+                break
+            part_number += 1
+        for result in results:
+            result.get()
+    finally:
+        pool.close()
+        pool.join()
+        for connection in connections:
+            connection.close()
+    return md5, part_digests
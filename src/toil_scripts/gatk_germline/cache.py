@@ -0,0 +1,311 @@
+#!/usr/bin/env python2.7
+import hashlib
+import json
+import os
+from urlparse import urlparse
+
+from toil_scripts.gatk_germline import stage_index
+from toil_scripts.gatk_germline.common import GATK_IMAGE
+from toil_scripts.urls import url_fingerprint, url_size
+
+# Pipeline stages whose published outputs can be imported instead of recomputed
+RESUMABLE_STAGES = ('bam', 'gvcf', 'genotyped', 'filtered')
+
+
+def cache_key(*parts):
+    """
+    Hashes the inputs and parameters that determine a pipeline result
+
+    >>> cache_key('s3://bucket/sample.bam', ['QD', 'FS']) == cache_key('s3://bucket/sample.bam', ['QD', 'FS'])
+    True
+    >>> cache_key('s3://bucket/sample.bam', ['QD']) == cache_key('s3://bucket/sample.bam', ['FS'])
+    False
+
+    :param parts: JSON serializable values
+    :return: Hexadecimal SHA-1 digest
+    :rtype: str
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+def alignment_options(config):
+    """
+    Returns the options that change the preprocessed alignment of a sample. bwa mem estimates the insert
+    size distribution per batch of reads, and the batches depend on the number of threads and on the
+    FASTQ chunks, so the cores and chunk-reads options change the alignments of a realigned sample.
+
+    >>> from argparse import Namespace
+    >>> config = Namespace(run_bwa=False, trim=False, preprocess=True, cores=8, chunk_reads=1000,
+    ...                    fused_alignment=False, alignment_format='bam')
+    >>> alignment_options(config) == alignment_options(Namespace(**dict(vars(config), cores=4)))
+    True
+    >>> alignment_options(config) == alignment_options(Namespace(**dict(vars(config), run_bwa=True)))
+    False
+
+    :param Namespace config: Pipeline configuration options
+    :return: JSON serializable options
+    :rtype: list
+    """
+    run_bwa = bool(config.run_bwa)
+    return [run_bwa,
+            bool(getattr(config, 'trim', False)),
+            bool(config.preprocess),
+            # Options of the alignment job only matter when the sample is realigned
+            getattr(config, 'cores', None) if run_bwa else None,
+            getattr(config, 'chunk_reads', 0) if run_bwa else 0,
+            # The fused job sorts the bwakit output with a different command, which the @PG header records
+            bool(getattr(config, 'fused_alignment', False)) if run_bwa else False,
+            getattr(config, 'alignment_format', 'bam')]
+
+
+def gvcf_cache_key(sample, config):
+    """
+    Generates the GVCF cache key for a sample. The key covers the sample files, the reference genome,
+    the HaplotypeCaller image, annotations and shards, the alignment and preprocessing options that change
+    the GVCF, the GVCF compression, and the precomputed HaplotypeCaller output if one is given. Must be
+    called before the configuration URLs are replaced with FileStoreIDs.
+
+    >>> from argparse import Namespace
+    >>> sample = Namespace(url='file:///missing/sample.bam', paired_url=None, rg_line=None)
+    >>> config = Namespace(genome_fasta='file:///missing/genome.fa', preprocess=False, annotations=['QD'],
+    ...                    run_bwa=False, hc_shards=1, compress_vcfs=False)
+    >>> key = gvcf_cache_key(sample, config)
+    >>> key == gvcf_cache_key(sample, Namespace(**dict(vars(config), run_bwa=True, chunk_reads=1000)))
+    False
+    >>> key == gvcf_cache_key(sample, Namespace(**dict(vars(config), hc_shards=4)))
+    False
+    >>> key == gvcf_cache_key(sample, Namespace(**dict(vars(config), compress_vcfs=True)))
+    False
+
+    A precomputed GVCF stands in for the sample's GVCF, so it must not be cached under the sample's key
+
+    >>> key == gvcf_cache_key(sample, Namespace(**dict(vars(config), hc_output='file:///missing/hc.g.vcf')))
+    False
+
+    :param GermlineSample sample: Germline sample
+    :param Namespace config: Pipeline configuration options
+    :return: GVCF cache key
+    :rtype: str
+    """
+    sample_files = [url_fingerprint(url) for url in [sample.url, sample.paired_url] if url]
+    reference_files = [url_fingerprint(config.genome_fasta)]
+    if config.preprocess:
+        reference_files.extend(url_fingerprint(getattr(config, name))
+                               for name in ['g1k_indel', 'mills', 'dbsnp'])
+    hc_output = getattr(config, 'hc_output', None)
+    return cache_key(sample_files,
+                     sample.rg_line,
+                     reference_files,
+                     GATK_IMAGE,
+                     sorted(config.annotations),
+                     alignment_options(config),
+                     # Sharded HaplotypeCaller runs start new reference blocks at the shard boundaries
+                     config.hc_shards,
+                     bool(getattr(config, 'compress_vcfs', False)),
+                     url_fingerprint(hc_output) if hc_output else None)
+
+
+def gvcf_cache_filename(key, compressed=False):
+    """
+    Returns the filename of a GVCF in the persistent GVCF cache
+
+    >>> gvcf_cache_filename('0a1b', compressed=True)
+    '0a1b.g.vcf.gz'
+
+    :param str key: GVCF cache key
+    :param bool compressed: If True, the cached GVCF is BGZF compressed
+    :return: Filename
+    :rtype: str
+    """
+    return '{}.g.vcf{}'.format(key, '.gz' if compressed else '')
+
+
+def find_cached_gvcfs(cache_keys, cache_dir, compressed=False):
+    """
+    Looks up GVCFs in the persistent GVCF cache
+
+    :param dict cache_keys: Dictionary of GVCF cache keys {Sample ID: cache key}
+    :param str cache_dir: S3 URL or local path to the GVCF cache
+    :param bool compressed: If True, look up BGZF compressed GVCFs
+    :return: Dictionary of cached GVCFs {Sample ID: (URL, size in bytes)}
+    :rtype: dict
+    """
+    # Local cache directories must be on a filesystem shared by the worker nodes
+    if not urlparse(cache_dir).scheme:
+        cache_dir = 'file://' + os.path.abspath(cache_dir)
+    cached = {}
+    for uuid, key in cache_keys.iteritems():
+        url = os.path.join(cache_dir, gvcf_cache_filename(key, compressed))
+        size = url_size(url)
+        if size is not None:
+            cached[uuid] = (url, size)
+    return cached
+
+
+def stage_keys(samples, config):
+    """
+    Generates the stage keys of the published outputs of a cohort. Each key covers the stage options, the
+    tool image, and the key of the stage output that it consumes, so a changed input invalidates every
+    downstream output. Must be called before the configuration URLs are replaced with FileStoreIDs.
+
+    Options that do not change the content of any stage output are left out of the keys:
+    node_reference only changes where the GATK jobs read the reference from, GATK is run without
+    multithreading so the cores only matter to bwa (see alignment_options), xmx, resource_model, the
+    download sizes and SSE-C key only change how jobs are run, the reference and GVCF caches hold files
+    with the same content as their sources, and suffix is part of the output filename. Oncotator
+    outputs are not resumable.
+
+    >>> from argparse import Namespace
+    >>> samples = [Namespace(uuid='a', url='file:///missing/a.bam', paired_url=None, rg_line=None)]
+    >>> config = Namespace(genome_fasta='file:///missing/genome.fa', preprocess=False, preprocess_only=False,
+    ...                    run_bwa=False, annotations=['QD'], hc_output=None, hc_shards=1, compress_vcfs=False,
+    ...                    run_vqsr=False, joint_genotype=True, unsafe_mode=False, genotype_shards=1,
+    ...                    combine_fan_in=0, hard_filter_engine='gatk', snp_filter_name='SNP',
+    ...                    snp_filter_expression='QD < 2.0', indel_filter_name='INDEL',
+    ...                    indel_filter_expression='QD < 2.0')
+    >>> keys = stage_keys(samples, config)
+    >>> def changed(**options):
+    ...     other = stage_keys(samples, Namespace(**dict(vars(config), **options)))
+    ...     return [stage for stage in RESUMABLE_STAGES if other[stage] != keys[stage]]
+    >>> changed(hc_shards=4)
+    ['gvcf', 'genotyped', 'filtered']
+    >>> changed(genotype_shards=4), changed(combine_fan_in=2)
+    (['genotyped', 'filtered'], ['genotyped', 'filtered'])
+    >>> changed(hard_filter_engine='native'), changed(node_reference=True, cores=32)
+    (['filtered'], [])
+
+    :param list[GermlineSample] samples: List of GermlineSample namedtuples
+    :param Namespace config: Pipeline configuration options
+    :return: Stage keys {stage: {Sample ID or joint_genotyped: stage key}}
+    :rtype: dict
+    """
+    keys = {stage: {} for stage in RESUMABLE_STAGES}
+    reference_files = [url_fingerprint(config.genome_fasta)]
+    if config.preprocess:
+        reference_files.extend(url_fingerprint(getattr(config, name))
+                               for name in ['g1k_indel', 'mills', 'dbsnp'])
+    for sample in samples:
+        sample_files = [url_fingerprint(url) for url in [sample.url, sample.paired_url] if url]
+        keys['bam'][sample.uuid] = cache_key('bam',
+                                             sample_files,
+                                             sample.rg_line,
+                                             reference_files,
+                                             GATK_IMAGE,
+                                             alignment_options(config))
+    if config.preprocess_only:
+        return keys
+
+    hc_output = url_fingerprint(config.hc_output) if config.hc_output else None
+    for uuid, bam_key in keys['bam'].iteritems():
+        keys['gvcf'][uuid] = cache_key('gvcf',
+                                       bam_key,
+                                       GATK_IMAGE,
+                                       sorted(config.annotations),
+                                       hc_output,
+                                       # Sharded HaplotypeCaller runs start new reference blocks at the
+                                       # shard boundaries
+                                       config.hc_shards,
+                                       bool(getattr(config, 'compress_vcfs', False)))
+
+    if config.run_vqsr:
+        filter_options = ['vqsr',
+                          [url_fingerprint(getattr(config, name))
+                           for name in ['g1k_snp', 'mills', 'dbsnp', 'hapmap', 'omni']],
+                          config.snp_filter_annotations,
+                          config.indel_filter_annotations,
+                          bool(config.unsafe_mode)]
+    else:
+        # The native engine keeps the input record order, where GATK writes the CombineVariants order, see
+        # variant_filter.hard_filter_vcf
+        filter_options = ['hard_filter',
+                          config.hard_filter_engine,
+                          config.snp_filter_name,
+                          config.snp_filter_expression,
+                          config.indel_filter_name,
+                          config.indel_filter_expression]
+
+    for name, uuids in genotyping_groups(sorted(keys['gvcf']), config).iteritems():
+        # GenotypeGVCFs shards and CombineGVCFs batches change the records near interval boundaries
+        genotyped_key = cache_key('genotyped',
+                                  [keys['gvcf'][uuid] for uuid in uuids],
+                                  GATK_IMAGE,
+                                  sorted(config.annotations),
+                                  bool(config.unsafe_mode),
+                                  config.genotype_shards,
+                                  config.combine_fan_in)
+        keys['genotyped'][name] = genotyped_key
+        keys['filtered'][name] = cache_key('filtered', genotyped_key, GATK_IMAGE, filter_options)
+    return keys
+
+
+def genotyping_groups(uuids, config):
+    """
+    Groups samples by the genotyped VCF that they are written to
+
+    >>> from argparse import Namespace
+    >>> genotyping_groups(['a', 'b'], Namespace(joint_genotype=True))
+    {'joint_genotyped': ['a', 'b']}
+    >>> sorted(genotyping_groups(['a', 'b'], Namespace(joint_genotype=False)).items())
+    [('a', ['a']), ('b', ['b'])]
+
+    :param list[str] uuids: Sample IDs
+    :param Namespace config: Pipeline configuration options
+    :return: Samples of each genotyped VCF {Sample ID or joint_genotyped: [Sample ID]}
+    :rtype: dict
+    """
+    if config.joint_genotype and len(uuids) > 1:
+        return {'joint_genotyped': list(uuids)}
+    return {uuid: [uuid] for uuid in uuids}
+
+
+def output_filename(stage, name, config):
+    """
+    Returns the filename of a published stage output
+
+    >>> from argparse import Namespace
+    >>> output_filename('gvcf', 'sample', Namespace(suffix='.ci_test'))
+    'sample.ci_test.g.vcf'
+    >>> output_filename('gvcf', 'sample', Namespace(suffix='', compress_vcfs=True))
+    'sample.g.vcf.gz'
+    >>> output_filename('bam', 'sample', Namespace(suffix='', alignment_format='cram'))
+    'sample.preprocessed.cram'
+    >>> output_filename('filtered', 'joint_genotyped', Namespace(suffix='', run_vqsr=True))
+    'joint_genotyped.vqsr.vcf'
+
+    :param str stage: Pipeline stage
+    :param str name: Sample ID, or joint_genotyped for a joint genotyped cohort
+    :param Namespace config: Pipeline configuration options
+    :return: Output filename
+    :rtype: str
+    """
+    if stage == 'filtered':
+        stage = 'vqsr' if config.run_vqsr else 'hard_filter'
+    template = {'bam': '{}.preprocessed{}.bam',
+                'gvcf': '{}{}.g.vcf',
+                'genotyped': '{}.genotyped{}.vcf',
+                'vqsr': '{}.vqsr{}.vcf',
+                'hard_filter': '{}.hard_filter{}.vcf'}[stage]
+    # GVCFs are published in the format that the pipeline passes them between jobs
+    if stage == 'gvcf' and getattr(config, 'compress_vcfs', False):
+        template += '.gz'
+    if stage == 'bam' and getattr(config, 'alignment_format', 'bam') == 'cram':
+        template = '{}.preprocessed{}.cram'
+    return template.format(name, config.suffix)
+
+
+def find_published_outputs(keys, config):
+    """
+    Looks up the stage outputs that were published by a previous run with the same stage keys
+
+    :param dict keys: Stage keys {stage: {Sample ID or joint_genotyped: stage key}}
+    :param Namespace config: Pipeline configuration options
+    :return: Published outputs {stage: {Sample ID or joint_genotyped: (URL, size in bytes)}}
+    :rtype: dict
+    """
+    outputs = {stage: {name: (os.path.join(config.output_dir, name), output_filename(stage, name, config), key)
+                       for name, key in keys[stage].iteritems()}
+               for stage in RESUMABLE_STAGES}
+    # Preprocessed BAMs are only published when the BAMs are preprocessed
+    if not config.preprocess:
+        outputs['bam'] = {}
+    return stage_index.find_published_outputs(outputs)
@@ -1,32 +1,483 @@
 #!/usr/bin/env python2.7
+import fcntl
+import hashlib
 import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 from urlparse import urlparse
 
 from bd2k.util.files import mkdir_p
-from toil_lib.files import copy_files
+from toil.common import Toil
+from toil.job import Job, PromisedRequirement
 from toil_lib.urls import s3am_upload
 
+from toil_scripts.bgzf import VCF_COMPRESSION_RATIO, bgzip_vcf, index_vcf
+from toil_scripts.chunked_alignment import read_lines
+from toil_scripts.export import link_or_copy, upload_stream_to_s3
+from toil_scripts.gatk_germline.stage_index import is_published, remove_stage_records, write_stage_record
+from toil_scripts.gatk_germline.intervals import index_shards, overlapping_shards, vcf_record_interval
+from toil_scripts.metrics import measure_directory, metered
+from toil_scripts.urls import s3_connection
 
-def output_file_job(job, filename, file_id, output_dir, s3_key_path=None):
+
+# Docker image for the GATK tools that are run directly by the germline pipeline
+GATK_IMAGE = 'quay.io/ucsc_cgl/gatk:3.5--dba6dae49156168a909c43330350c6161dc7ecc2'
+
+# Maximum number of samples whose outputs of a cohort-wide stage are uploaded by one output_files_job
+OUTPUT_BATCH_SIZE = 50
+
+
+class IndexedVcf(namedtuple('IndexedVcf', 'vcf_id tbi_id')):
+    """
+    Namedtuple subclass for a BGZF compressed VCF and its tabix index, which jobs pass together so the
+    index is not rebuilt by every job that reads the VCF. Compressed VCFs that were imported without an
+    index, from the GVCF cache or a previous run, are passed as plain FileStoreIDs.
+
+    Attributes
+    vcf_id: FileStoreID of the compressed VCF
+    tbi_id: FileStoreID of the tabix index
+
+    >>> from argparse import Namespace
+    >>> IndexedVcf(Namespace(size=100), Namespace(size=10)).size
+    110
+    """
+    __slots__ = ()
+
+    @property
+    def size(self):
+        """
+        Size of the VCF and its index in bytes, so disk requirements count them like input_size does
+        """
+        return self.vcf_id.size + self.tbi_id.size
+
+
+def vcf_file_id(vcf):
+    """
+    :param str|IndexedVcf vcf: VCF FileStoreID, or IndexedVcf of a compressed VCF
+    :return: VCF FileStoreID
+    :rtype: str
+    """
+    return vcf.vcf_id if isinstance(vcf, IndexedVcf) else vcf
+
+
+def reference_files(config):
+    """
+    Returns the genome reference files that GATK jobs receive. Disk requirements are given these files,
+    so that resource estimates count the reference like the input sizes that the jobs record.
+
+    :param Namespace config: Pipeline configuration options and shared files
+        Requires the following config attributes:
+        config.genome_fasta         FilesStoreID for reference genome fasta file
+        config.genome_fai           FilesStoreID for reference genome fasta index file
+        config.genome_dict          FilesStoreID for reference genome sequence dictionary file
+    :return: Reference FileStoreIDs
+    :rtype: list[str]
+    """
+    return [config.genome_fasta, config.genome_fai, config.genome_dict]
+
+
+def reference_disk(ref_files):
+    """
+    Returns the disk space that a GATK job needs for the genome reference files. A job that uses the
+    node-local reference directory may be the first on its node and fill the directory, so it needs
+    the same space as a job that copies the reference into its work directory. Toil cannot reserve
+    disk once per node, so the node-local reference saves the copies and the disk that is used, but
+    not the disk that is reserved.
+
+    >>> from argparse import Namespace
+    >>> reference_disk([Namespace(size=100), Namespace(size=10), Namespace(size=1)])
+    111
+
+    :param list[str] ref_files: Reference FileStoreIDs, see reference_files
+    :return: Size in bytes
+    :rtype: int
+    """
+    return sum(ref_file.size for ref_file in ref_files)
+
+
+def gvcf_disk(gvcf_ids, compressed=False):
+    """
+    Estimates the disk space that a GenotypeGVCFs or CombineGVCFs job needs for its input GVCFs and its
+    plain text output, which is smaller than the uncompressed inputs
+
+    >>> from argparse import Namespace
+    >>> gvcfs = [Namespace(size=100), Namespace(size=200)]
+    >>> gvcf_disk(gvcfs), gvcf_disk(gvcfs, compressed=True)
+    (600, 3300)
+
+    :param list[str] gvcf_ids: GVCF FileStoreIDs
+    :param bool compressed: If True, the GVCFs are BGZF compressed
+    :return: Size in bytes
+    :rtype: int
+    """
+    size = sum(gvcf_id.size for gvcf_id in gvcf_ids)
+    return size + (VCF_COMPRESSION_RATIO * size if compressed else size)
+
+
+def vcf_output_disk(size, compress=False):
+    """
+    Estimates the disk space for a plain text VCF that a tool writes, and for its compressed copy when the
+    VCF is compressed before it is written to the FileStore
+
+    >>> vcf_output_disk(1000), vcf_output_disk(1000, compress=True)
+    (1000, 1100)
+
+    :param int size: Estimated size of the plain text VCF in bytes
+    :param bool compress: If True, the VCF is compressed
+    :return: Size in bytes
+    :rtype: int
+    """
+    return size + (size // VCF_COMPRESSION_RATIO if compress else 0)
+
+
+def streamed_vcf_disk(vcf_ids, compressed=False):
+    """
+    Estimates the disk space that split_vcf and gather_vcfs need. They stream their input VCFs, and write
+    VCFs of the same total size. Compressed VCFs are written as plain text and then compressed.
+
+    >>> from argparse import Namespace
+    >>> vcfs = [Namespace(size=100), Namespace(size=200)]
+    >>> streamed_vcf_disk(vcfs), streamed_vcf_disk(vcfs, compressed=True)
+    (300, 3300)
+
+    :param list[str] vcf_ids: Input VCF FileStoreIDs
+    :param bool compressed: If True, the VCFs are BGZF compressed
+    :return: Size in bytes
+    :rtype: int
+    """
+    size = sum(vcf_id.size for vcf_id in vcf_ids)
+    return vcf_output_disk(VCF_COMPRESSION_RATIO * size, compress=True) if compressed else size
+
+
+def write_vcf(job, path, compress=False):
+    """
+    Writes a plain text VCF to the FileStore. With compress, the VCF is compressed with bgzip and indexed
+    with tabix, and the compressed copy and its index are written instead, as in write_compressed_vcf.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str path: Path to the plain text VCF
+    :param bool compress: If True, compress and index the VCF
+    :return: VCF FileStoreID, or IndexedVcf if compressed
+    :rtype: str|IndexedVcf
+    """
+    if not compress:
+        return job.fileStore.writeGlobalFile(path)
+    return write_compressed_vcf(job, bgzip_vcf(job, path))
+
+
+def write_compressed_vcf(job, path):
+    """
+    Writes a BGZF compressed VCF and its tabix index to the FileStore
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str path: Path to the compressed VCF. The index is the same path followed by .tbi
+    :return: FileStoreIDs of the VCF and its index
+    :rtype: IndexedVcf
+    """
+    return IndexedVcf(job.fileStore.writeGlobalFile(path), job.fileStore.writeGlobalFile(path + '.tbi'))
+
+
+def read_vcf(job, vcf, path, compressed=False):
+    """
+    Reads a VCF from the FileStore. The tabix index of a compressed VCF is read to the same path followed
+    by .tbi. Compressed VCFs without an IndexedVcf, which were imported from the GVCF cache or a previous
+    run, are indexed with tabix.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str|IndexedVcf vcf: VCF FileStoreID, or IndexedVcf of a compressed VCF
+    :param str path: Local path of the VCF
+    :param bool compressed: If True, the VCF is BGZF compressed
+    :return: path
+    :rtype: str
+    """
+    job.fileStore.readGlobalFile(vcf_file_id(vcf), path)
+    if isinstance(vcf, IndexedVcf):
+        job.fileStore.readGlobalFile(vcf.tbi_id, path + '.tbi')
+    elif compressed:
+        index_vcf(job, path)
+    return path
+
+
+def node_local_dir(job, prefix, file_ids, fill):
+    """
+    Returns a directory that is shared by the jobs of this workflow on the current node. The first job
+    on the node to need the directory fills it, and later jobs reuse it. The directory is named after
+    the FileStoreIDs it is filled from and is removed with the workflow directory. Its size counts towards
+    the peak disk usage of every metered job that uses it.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str prefix: Prefix of the directory name
+    :param list[str] file_ids: FileStoreIDs that determine the contents of the directory
+    :param function fill: Called with the path of an empty directory to fill
+    :return: Path to the filled directory
+    :rtype: str
+    """
+    toil_config = job.fileStore.jobStore.config
+    workflow_dir = Toil.getWorkflowDir(toil_config.workflowID, toil_config.workDir)
+    key = hashlib.sha1('\n'.join(file_ids)).hexdigest()
+    local_dir = os.path.join(workflow_dir, '{}-{}'.format(prefix, key))
+    with open(local_dir + '.lock', 'w') as lock:
+        # Jobs wait here while another job on the node fills the directory
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(local_dir):
+            job.fileStore.logToMaster('Filling node-local directory {}'.format(local_dir))
+            tmp_dir = tempfile.mkdtemp(dir=workflow_dir)
+            try:
+                fill(tmp_dir)
+            except:
+                # A partly filled directory would hold the node's disk until the workflow ends
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+            os.rename(tmp_dir, local_dir)
+    measure_directory(job, local_dir)
+    return local_dir
+
+
+def node_reference_dir(job, ref, fai, ref_dict):
+    """
+    Returns a directory with the genome reference files that is shared by the jobs of this workflow on
+    the current node. Containers mount it read-only, see stage_reference. The job that fills the
+    directory writes the reference outside its work directory, which reference_disk accounts for.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str ref: FileStoreID for reference genome fasta file
+    :param str fai: FileStoreID for reference fasta index file
+    :param str ref_dict: FileStoreID for reference sequence dictionary file
+    :return: Path to directory containing genome.fa, genome.fa.fai and genome.dict
+    :rtype: str
+    """
+    def fill(ref_dir):
+        for name, file_store_id in [('genome.fa', ref), ('genome.fa.fai', fai), ('genome.dict', ref_dict)]:
+            path = os.path.join(ref_dir, name)
+            with job.fileStore.readGlobalFileStream(file_store_id) as f_in, open(path, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+
+    return node_local_dir(job, 'reference', [ref, fai, ref_dict], fill)
+
+
+def stage_reference(job, work_dir, ref, fai, ref_dict, node_reference=False):
+    """
+    Makes the genome reference files available to a GATK container. By default the files are read
+    into the job's work directory. With node_reference, the node-local reference directory is
+    mounted read-only at /ref instead.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str work_dir: Job work directory, which is mounted at /data
+    :param str ref: FileStoreID for reference genome fasta file
+    :param str fai: FileStoreID for reference fasta index file
+    :param str ref_dict: FileStoreID for reference sequence dictionary file
+    :param bool node_reference: If True, use the node-local reference directory
+    :return: Reference fasta path for the GATK -R option, and docker parameters or None
+    :rtype: tuple(str, list[str]|None)
+    """
+    if not node_reference:
+        for name, file_store_id in [('genome.fa', ref), ('genome.fa.fai', fai), ('genome.dict', ref_dict)]:
+            job.fileStore.readGlobalFile(file_store_id, os.path.join(work_dir, name))
+        return 'genome.fa', None
+
+    ref_dir = node_reference_dir(job, ref, fai, ref_dict)
+    # toil-lib's docker_call mounts the work directory and appends these parameters
+    return '/ref/genome.fa', ['-v', '{}:/ref:ro'.format(ref_dir)]
+
+
+@metered
+def output_file_job(job, filename, file_id, output_dir, s3_key_path=None, stage_key=None):
     """
     Uploads a file from the FileStore to an output directory on the local filesystem or S3.
 
+    Local files are hard linked from the FileStore cache when possible. Unencrypted S3 uploads are
+    streamed from the FileStore in a parallel multipart upload that is verified against its MD5.
+
+    Outputs with a stage key replace an existing file unless the stage index of the output directory
+    records that file with the same key, and are recorded in the stage index once they are written.
+
     :param JobFunctionWrappingJob job: passed automatically by Toil
     :param str filename: basename for file
     :param str file_id: FileStoreID
     :param str output_dir: Amazon S3 URL or local path
     :param str s3_key_path: (OPTIONAL) Path to 32-byte key to be used for SSE-C encryption
+    :param str stage_key: (OPTIONAL) Stage key of the inputs and options that produced the file
     :return:
     """
+    _export_file(job, filename, file_id, output_dir, s3_key_path=s3_key_path, stage_key=stage_key)
+
+
+@metered
+def output_files_job(job, outputs, s3_key_path=None, stage_keys=None, threads=4):
+    """
+    Uploads several files from the FileStore to output directories on the local filesystem or S3 in a
+    single job. Collecting the outputs of a sample, or of a batch of samples, in one job saves the
+    scheduling and startup cost of one job per file.
+
+    Files are exported as in output_file_job by a pool of threads. Each thread opens one S3 connection
+    and reuses it for all of its uploads.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param dict outputs: Output files {output path or URL: FileStoreID or IndexedVcf}. Outputs without a
+                         FileStoreID are skipped.
+    :param str s3_key_path: (OPTIONAL) Path to 32-byte key to be used for SSE-C encryption
+    :param dict stage_keys: (OPTIONAL) Stage keys of the inputs and options that produced the files
+                            {output path or URL: stage key}
+    :param int threads: Number of files that are exported concurrently
+    """
+    stage_keys = stage_keys or {}
+    outputs = sorted((path, file_id) for path, file_id in outputs.iteritems() if file_id is not None)
+    job.fileStore.logToMaster('Exporting {} output files'.format(len(outputs)))
+    local = threading.local()
+    connections = []
+
+    def export(output):
+        path, file_id = output
+        output_dir, filename = os.path.split(path)
+        if urlparse(output_dir).scheme == 's3' and not s3_key_path and not hasattr(local, 'connection'):
+            local.connection = s3_connection()
+            connections.append(local.connection)
+        _export_file(job, filename, file_id, output_dir,
+                     s3_key_path=s3_key_path,
+                     stage_key=stage_keys.get(path),
+                     connection=getattr(local, 'connection', None))
+
+    pool = ThreadPool(max(1, min(threads, len(outputs))))
+    try:
+        pool.map(export, outputs)
+    finally:
+        pool.close()
+        pool.join()
+        for connection in connections:
+            connection.close()
+
+
+def output_files(config, outputs, stage_keys=None):
+    """
+    Creates an output_files_job for the outputs. Add it to the workflow after the jobs that write
+    the outputs.
+
+    :param Namespace config: Pipeline configuration options
+        Requires the following config attributes:
+        config.ssec                 Path to key file for SSE-C encryption
+    :param dict outputs: Output files {output path or URL: FileStoreID, IndexedVcf or promise}
+    :param dict stage_keys: (OPTIONAL) Stage keys of the outputs {output path or URL: stage key}
+    :return: Output job
+    :rtype: toil.job.JobFunctionWrappingJob
+    """
+    return Job.wrapJobFn(output_files_job,
+                         outputs,
+                         s3_key_path=config.ssec,
+                         stage_keys=stage_keys,
+                         disk=PromisedRequirement(lambda file_ids: sum(x.size for x in file_ids if x is not None),
+                                                  outputs.values()))
+
+
+def _export_file(job, filename, file_id, output_dir, s3_key_path=None, stage_key=None, connection=None,
+                 replace=False):
+    """
+    Exports a file for output_file_job and output_files_job. Compressed VCFs are exported with their
+    tabix index, which is built if the VCF was passed without an IndexedVcf.
+
+    :param str|IndexedVcf file_id: FileStoreID, or IndexedVcf of a compressed VCF
+    :param boto.s3.connection.S3Connection connection: (OPTIONAL) S3 connection for unencrypted uploads
+    :param bool replace: If True, an existing local file is replaced
+    """
+    if stage_key and is_published(output_dir, filename, stage_key):
+        # A run with the same inputs and options wrote the file, and its index if it is a VCF
+        job.fileStore.logToMaster('Already published: {}'.format(filename))
+        return
     job.fileStore.logToMaster('Writing {} to {}'.format(filename, output_dir))
-    work_dir = job.fileStore.getLocalTempDir()
-    filepath = job.fileStore.readGlobalFile(file_id, os.path.join(work_dir, filename))
+    vcf = file_id
+    file_id = vcf_file_id(vcf)
+    if stage_key:
+        # Stale records must not describe the new file while it is written
+        remove_stage_records(output_dir, filename)
     if urlparse(output_dir).scheme == 's3':
-        s3am_upload(job=job, fpath=os.path.join(work_dir, filepath),
-                    s3_dir=output_dir,
-                    s3_key_path=s3_key_path)
-    elif os.path.exists(os.path.join(output_dir, filename)):
+        if s3_key_path:
+            # s3am derives the SSE-C key of each object from the master key, so encrypted files are
+            # uploaded with s3am to stay readable by download_url_job
+            work_dir = job.fileStore.getLocalTempDir()
+            filepath = job.fileStore.readGlobalFile(file_id, os.path.join(work_dir, filename))
+            s3am_upload(job=job, fpath=filepath,
+                        s3_dir=output_dir,
+                        s3_key_path=s3_key_path)
+        else:
+            with job.fileStore.readGlobalFileStream(file_id) as f:
+                md5 = upload_stream_to_s3(f, os.path.join(output_dir, filename), connection=connection)
+            job.fileStore.logToMaster('Uploaded {} (MD5 {})'.format(filename, md5))
+    elif os.path.exists(os.path.join(output_dir, filename)) and not (stage_key or replace):
         job.fileStore.logToMaster("File already exists: {}".format(filename))
     else:
         mkdir_p(output_dir)
-        copy_files([filepath], output_dir)
+        # The FileStore cache copy is linked into the output directory when they share a filesystem
+        link_or_copy(job.fileStore.readGlobalFile(file_id), os.path.join(output_dir, filename))
+    if filename.endswith('.vcf.gz'):
+        if isinstance(vcf, IndexedVcf):
+            tbi = vcf.tbi_id
+        else:
+            index_path = read_vcf(job, vcf, os.path.join(job.fileStore.getLocalTempDir(), filename), True)
+            tbi = job.fileStore.writeGlobalFile(index_path + '.tbi')
+        # The index is replaced together with the VCF
+        _export_file(job, filename + '.tbi', tbi, output_dir, s3_key_path=s3_key_path, connection=connection,
+                     replace=bool(stage_key or replace))
+    if stage_key:
+        write_stage_record(output_dir, filename, stage_key)
+
+
+@metered
+def gather_vcfs(job, vcf_ids, compressed=False):
+    """
+    Concatenates VCF files that cover consecutive, non-overlapping genomic intervals. The header is
+    taken from the first VCF, so the VCF files must be given in reference order.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param list[str|IndexedVcf] vcf_ids: VCF FileStoreIDs or IndexedVcfs in reference order
+    :param bool compressed: If True, the VCFs are BGZF compressed, and the gathered VCF is compressed and indexed
+    :return: FileStoreID for the gathered VCF file, or IndexedVcf if compressed
+    :rtype: str|IndexedVcf
+    """
+    job.fileStore.logToMaster('Gathering {} VCF shards'.format(len(vcf_ids)))
+    work_dir = job.fileStore.getLocalTempDir()
+    output_path = os.path.join(work_dir, 'gathered.vcf')
+    # Stream the shards from the FileStore so only the gathered VCF is written to local disk. Compressed
+    # shards are decompressed as they are read.
+    with open(output_path, 'w') as f_out:
+        for i, vcf_id in enumerate(vcf_ids):
+            with job.fileStore.readGlobalFileStream(vcf_file_id(vcf_id)) as f_in:
+                for line in read_lines(f_in):
+                    if i > 0 and line.startswith('#'):
+                        continue
+                    f_out.write(line)
+    return write_vcf(job, output_path, compressed)
+
+
+@metered
+def split_vcf(job, vcf_id, shards, compressed=False):
+    """
+    Splits a VCF file into one VCF per genomic interval shard. Every shard VCF has the full header.
+    Records that span a shard boundary, such as GVCF reference blocks, are written to each shard
+    they overlap.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str|IndexedVcf vcf_id: VCF FileStoreID, or IndexedVcf of a compressed VCF
+    :param list[list[tuple(str, int, int)]] shards: Shards of (contig, start, end) intervals
+    :param bool compressed: If True, the VCF is BGZF compressed, and the shard VCFs are compressed and indexed
+    :return: VCF FileStoreIDs in shard order, or IndexedVcfs if compressed
+    :rtype: list[str|IndexedVcf]
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    index = index_shards(shards)
+    paths = [os.path.join(work_dir, 'shard.%d.vcf' % i) for i in range(len(shards))]
+    shard_files = [open(path, 'w') for path in paths]
+    try:
+        with job.fileStore.readGlobalFileStream(vcf_file_id(vcf_id)) as f_in:
+            for line in read_lines(f_in):
+                if line.startswith('#'):
+                    for f_out in shard_files:
+                        f_out.write(line)
+                else:
+                    for i in overlapping_shards(index, *vcf_record_interval(line)):
+                        shard_files[i].write(line)
+    finally:
+        for f_out in shard_files:
+            f_out.close()
+    return [write_vcf(job, path, compressed) for path in paths]
@@ -0,0 +1,176 @@
+#!/usr/bin/env python2.7
+"""
+CRAM alignments for the germline pipeline.
+
+CRAM stores reads as differences from the genome reference, so a CRAM is about half the size of the
+BAM it was converted from. Alignments are converted to CRAM once they are prepared, and are passed
+between jobs and published as CRAMs with .crai indexes. HaplotypeCaller jobs decode their CRAM, or
+only the regions of their interval shard, back into a local BAM.
+"""
+import os
+import posixpath
+
+from toil_lib.programs import docker_call
+
+from toil_scripts.chunked_alignment import SAMTOOLS_IMAGE
+from toil_scripts.gatk_germline.common import stage_reference
+from toil_scripts.gatk_germline.intervals import format_interval
+from toil_scripts.metrics import metered, metered_docker_call
+
+# Record the time spent in the containers run by this module
+docker_call = metered_docker_call(docker_call)
+
+# BAMs are about twice as large as CRAMs of the same reads
+CRAM_COMPRESSION_RATIO = 2
+
+# Reads this far outside an interval shard are decoded, so HaplotypeCaller sees the same reads at the
+# shard boundaries as it does with the whole BAM
+REGION_PADDING = 1000
+
+# Each samtools view decodes at most this many regions, so shards of many small contigs are decoded into
+# several BAMs
+MAX_REGIONS = 100
+
+
+def bam_size(alignment_id, cram=False):
+    """
+    Estimates the size of an alignment file as a BAM
+
+    >>> from argparse import Namespace
+    >>> bam_size(Namespace(size=100)), bam_size(Namespace(size=100), cram=True)
+    (100, 200)
+
+    :param str alignment_id: BAM or CRAM FileStoreID
+    :param bool cram: If True, the alignments are a CRAM
+    :return: Size in bytes
+    :rtype: int
+    """
+    return alignment_id.size * CRAM_COMPRESSION_RATIO if cram else alignment_id.size
+
+
+def padded_regions(intervals, padding=REGION_PADDING):
+    """
+    Pads intervals and merges padded intervals that are closer than the padding, so no read overlaps
+    two regions and is decoded twice
+
+    >>> padded_regions([('1', 1, 100), ('1', 1500, 2000), ('1', 3500, 4000), ('2', 5000, 6000)])
+    ['1:1-5000', '2:4000-7000']
+    >>> padded_regions([('1', 1, 100), ('1', 5000, 6000)])
+    ['1:1-1100', '1:4000-7000']
+
+    :param list[tuple(str, int, int)] intervals: 1-based, closed (contig, start, end) intervals in reference order
+    :param int padding: Number of bases added to each side of an interval
+    :return: Regions for samtools view
+    :rtype: list[str]
+    """
+    merged = []
+    for contig, start, end in intervals:
+        start, end = max(1, start - padding), end + padding
+        if merged and merged[-1][0] == contig and start <= merged[-1][2] + padding:
+            merged[-1] = (contig, merged[-1][1], max(end, merged[-1][2]))
+        else:
+            merged.append((contig, start, end))
+    return [format_interval(interval) for interval in merged]
+
+
+@metered
+def convert_to_cram(job, bam, ref, fai, ref_dict, node_reference=False):
+    """
+    Converts a coordinate sorted BAM to a CRAM that is compressed against the genome reference, and
+    indexes the CRAM
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str bam: FileStoreID for BAM file
+    :param str ref: FileStoreID for reference genome fasta file
+    :param str fai: FileStoreID for reference fasta index file
+    :param str ref_dict: FileStoreID for reference sequence dictionary file
+    :param bool node_reference: If True, reads the genome reference from a read-only node-local directory
+                                instead of copying it to the job's work directory, default is False
+    :return: CRAM and CRAI FileStoreIDs
+    :rtype: tuple(str, str)
+    """
+    job.fileStore.logToMaster('Converting BAM to CRAM')
+    work_dir = job.fileStore.getLocalTempDir()
+    job.fileStore.readGlobalFile(bam, os.path.join(work_dir, 'input.bam'))
+    genome_fasta, docker_parameters = stage_reference(job, work_dir, ref, fai, ref_dict, node_reference)
+    docker_call(job=job, work_dir=work_dir,
+                parameters=['view', '-C',
+                            '-@', str(job.cores),
+                            '-T', posixpath.join('/data', genome_fasta),
+                            '-o', '/data/output.cram',
+                            '/data/input.bam'],
+                tool=SAMTOOLS_IMAGE,
+                inputs=['input.bam'],
+                outputs={'output.cram': None},
+                docker_parameters=docker_parameters)
+    docker_call(job=job, work_dir=work_dir,
+                parameters=['index', '/data/output.cram', '/data/output.cram.crai'],
+                tool=SAMTOOLS_IMAGE,
+                inputs=['output.cram'],
+                outputs={'output.cram.crai': None},
+                docker_parameters=docker_parameters)
+    return (job.fileStore.writeGlobalFile(os.path.join(work_dir, 'output.cram')),
+            job.fileStore.writeGlobalFile(os.path.join(work_dir, 'output.cram.crai')))
+
+
+@metered
+def index_cram(job, cram):
+    """
+    Indexes a CRAM, i.e. a CRAM that was published by a previous run
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str cram: FileStoreID for CRAM file
+    :return: FileStoreID for CRAI file
+    :rtype: str
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    job.fileStore.readGlobalFile(cram, os.path.join(work_dir, 'input.cram'))
+    docker_call(job=job, work_dir=work_dir,
+                parameters=['index', '/data/input.cram', '/data/input.cram.crai'],
+                tool=SAMTOOLS_IMAGE,
+                inputs=['input.cram'],
+                outputs={'input.cram.crai': None})
+    return job.fileStore.writeGlobalFile(os.path.join(work_dir, 'input.cram.crai'))
+
+
+def decode_cram(job, work_dir, cram, crai, genome_fasta, docker_parameters=None, intervals=None):
+    """
+    Reads a CRAM from the FileStore and decodes it into indexed BAMs in a job's work directory. The
+    genome reference must already be staged with stage_reference.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str work_dir: Job work directory, which is mounted at /data
+    :param str cram: FileStoreID for CRAM file
+    :param str crai: FileStoreID for CRAI file
+    :param str genome_fasta: Reference fasta path returned by stage_reference
+    :param list[str]|None docker_parameters: Docker parameters returned by stage_reference
+    :param list[tuple(str, int, int)] intervals: Only decodes reads near these (contig, start, end) intervals,
+                                                 default is None
+    :return: Names of the BAMs in the work directory. Each BAM is indexed.
+    :rtype: list[str]
+    """
+    job.fileStore.readGlobalFile(cram, os.path.join(work_dir, 'input.cram'))
+    job.fileStore.readGlobalFile(crai, os.path.join(work_dir, 'input.cram.crai'))
+    regions = padded_regions(intervals) if intervals else []
+    batches = [regions[i:i + MAX_REGIONS] for i in range(0, len(regions), MAX_REGIONS)] or [[]]
+    bams = []
+    for i, batch in enumerate(batches):
+        name = 'input.{}.bam'.format(i)
+        docker_call(job=job, work_dir=work_dir,
+                    parameters=['view', '-b',
+                                '-@', str(job.cores),
+                                '-T', posixpath.join('/data', genome_fasta),
+                                '-o', posixpath.join('/data', name),
+                                '/data/input.cram'] + batch,
+                    tool=SAMTOOLS_IMAGE,
+                    inputs=['input.cram', 'input.cram.crai'],
+                    outputs={name: None},
+                    docker_parameters=docker_parameters)
+        docker_call(job=job, work_dir=work_dir,
+                    parameters=['index', posixpath.join('/data', name)],
+                    tool=SAMTOOLS_IMAGE,
+                    inputs=[name],
+                    outputs={name + '.bai': None},
+                    docker_parameters=docker_parameters)
+        bams.append(name)
+    return bams
@@ -52,22 +52,50 @@ from urlparse import urlparse
 
 from bd2k.util.humanize import human2bytes
 from bd2k.util.processes import which
-from toil.job import Job, PromisedRequirement
+from toil.job import Job
 from toil_lib import require
 from toil_lib.files import generate_file
 from toil_lib.programs import docker_call
+from toil_lib.tools import aligners, preprocessing
 from toil_lib.tools.aligners import run_bwakit
 from toil_lib.tools.indexing import run_samtools_faidx
 from toil_lib.tools.preprocessing import run_gatk_preprocessing, \
     run_picard_create_sequence_dictionary, run_samtools_index, run_samtools_sort
-from toil_lib.tools.variant_annotation import gatk_genotype_gvcfs, run_oncotator
+from toil_lib.tools.variant_annotation import run_oncotator
 from toil_lib.urls import download_url_job
 import yaml
 
-from toil_scripts.gatk_germline.common import output_file_job
+from toil_scripts.chunked_alignment import bwakit_inputs, run_chunked_bwakit
+from toil_scripts.downloads import add_shared_download
+from toil_scripts.gatk_germline.cache import RESUMABLE_STAGES, find_cached_gvcfs, find_published_outputs, \
+    genotyping_groups, gvcf_cache_filename, gvcf_cache_key, output_filename, stage_keys
+from toil_scripts.gatk_germline.common import GATK_IMAGE, OUTPUT_BATCH_SIZE, gather_vcfs, gvcf_disk, \
+    output_files, read_vcf, reference_disk, reference_files, split_vcf, stage_reference, streamed_vcf_disk, \
+    vcf_output_disk, write_vcf
+from toil_scripts.gatk_germline.cram import CRAM_COMPRESSION_RATIO, bam_size, convert_to_cram, decode_cram, \
+    index_cram
 from toil_scripts.gatk_germline.germline_config_manifest import generate_config, generate_manifest
 from toil_scripts.gatk_germline.hard_filter import hard_filter_pipeline
+from toil_scripts.gatk_germline.oncotator import annotate_vcf_batches, oncotator_db_disk
+from toil_scripts.gatk_germline.intervals import parse_sequence_dictionary, partition_contigs, partition_genome, \
+    write_interval_list
+from toil_scripts.gatk_germline.variant_filter import FilterExpressionError, compile_filter_expression
 from toil_scripts.gatk_germline.vqsr import vqsr_pipeline
+from toil_scripts.metrics import add_report_parser, metered, metered_docker_call, report
+from toil_scripts.planner import add_plan_parser, plan
+from toil_scripts.resources import ResourceModel
+from toil_scripts.urls import download_disk, probe_url_sizes
+
+# Record the resource usage of the toil-lib job functions run by this pipeline
+download_url_job = metered(download_url_job, __name__)
+run_bwakit = metered(run_bwakit, __name__, inputs=bwakit_inputs)
+run_samtools_faidx = metered(run_samtools_faidx, __name__)
+run_gatk_preprocessing = metered(run_gatk_preprocessing, __name__)
+run_picard_create_sequence_dictionary = metered(run_picard_create_sequence_dictionary, __name__)
+run_samtools_index = metered(run_samtools_index, __name__)
+run_samtools_sort = metered(run_samtools_sort, __name__)
+run_oncotator = metered(run_oncotator, __name__)
+docker_call = metered_docker_call(docker_call)
 
 
 logging.basicConfig(level=logging.INFO)
@@ -85,6 +113,7 @@ class GermlineSample(namedtuple('GermlineSample', 'uuid url paired_url rg_line')
     """
 
 
+@metered
 def run_gatk_germline_pipeline(job, samples, config):
     """
     Downloads shared files and calls the GATK best practices germline pipeline for a cohort of samples
@@ -96,6 +125,9 @@ def run_gatk_germline_pipeline(job, samples, config):
         config.preprocess_only      If True, then stops pipeline after preprocessing steps
         config.joint_genotype       If True, then joint genotypes cohort
         config.run_oncotator        If True, then adds Oncotator to pipeline
+        config.gvcf_cache           S3 URL or local path to persistent GVCF cache, or None
+        config.compress_vcfs        If True, then GVCFs are BGZF compressed and tabix indexed
+        config.resume_outputs       If True, then imports outputs published by a previous run with the same inputs
         Additional parameters are needed for downstream steps. Refer to pipeline README for more information.
     """
     # Determine the available disk space on a worker node before any jobs have been run.
@@ -109,18 +141,45 @@ def run_gatk_germline_pipeline(job, samples, config):
         job.fileStore.logToMaster('WARNING: GATK recommends batches of '
                                   '30 to 200 samples for joint genotyping. '
                                   'The current cohort has %d samples.' % num_samples)
+        if num_samples >= 200 and not config.combine_fan_in:
+            job.fileStore.logToMaster('Set the combine-fan-in parameter to combine large cohorts '
+                                      'in a CombineGVCFs merge tree before genotyping.')
+
+    # Look up the samples in the persistent GVCF cache. The cache keys depend on the reference URLs,
+    # so this has to happen before the shared files are downloaded.
+    if config.gvcf_cache and not config.preprocess_only:
+        config.gvcf_cache_keys = {sample.uuid: gvcf_cache_key(sample, config) for sample in samples}
+        config.cached_gvcfs = find_cached_gvcfs(config.gvcf_cache_keys, config.gvcf_cache, config.compress_vcfs)
+        job.fileStore.logToMaster('Found {} of {} samples in the GVCF cache'.format(len(config.cached_gvcfs),
+                                                                                   num_samples))
+
+    # Look up the outputs that a previous run published with the same inputs and options. The stage
+    # keys also depend on the input URLs.
+    if config.resume_outputs:
+        config.stage_keys = stage_keys(samples, config)
+        config.published_outputs = find_published_outputs(config.stage_keys, config)
+        for stage in RESUMABLE_STAGES:
+            job.fileStore.logToMaster('Found {} published {} outputs'.format(len(config.published_outputs[stage]),
+                                                                              stage))
 
     shared_files = Job.wrapJobFn(download_shared_files, config).encapsulate()
     job.addChild(shared_files)
 
     if config.preprocess_only:
         for sample in samples:
-            shared_files.addChildJobFn(prepare_bam,
-                                       sample.uuid,
-                                       sample.url,
-                                       shared_files.rv(),
-                                       paired_url=sample.paired_url,
-                                       rg_line=sample.rg_line)
+            if sample.uuid in config.published_outputs['bam']:
+                continue
+            get_bam = shared_files.addChildJobFn(prepare_bam,
+                                                 sample.uuid,
+                                                 sample.url,
+                                                 shared_files.rv(),
+                                                 paired_url=sample.paired_url,
+                                                 rg_line=sample.rg_line)
+            if config.preprocess:
+                bam_path = os.path.join(config.output_dir, sample.uuid, output_filename('bam', sample.uuid, config))
+                get_bam.addFollowOn(output_files(config,
+                                                 {bam_path: get_bam.rv(0)},
+                                                 {bam_path: config.stage_keys['bam'].get(sample.uuid)}))
     else:
         run_pipeline = Job.wrapJobFn(gatk_germline_pipeline,
                                      samples,
@@ -132,19 +191,18 @@ def run_gatk_germline_pipeline(job, samples, config):
             run_pipeline.addChild(annotate)
 
 
+@metered
 def gatk_germline_pipeline(job, samples, config):
     """
     Runs the GATK best practices pipeline for germline SNP and INDEL discovery.
 
     Steps in Pipeline
     0: Generate and preprocess BAM
-        - Uploads processed BAM to output directory
     1: Call Variants using HaplotypeCaller
-        - Uploads GVCF
+        - Uploads processed BAM and GVCF to output directory
     2: Genotype VCF
-        - Uploads VCF
     3: Filter Variants using either "hard filters" or VQSR
-        - Uploads filtered VCF
+        - Uploads genotyped and filtered VCFs
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
     :param list[GermlineSample] samples: List of GermlineSample namedtuples
@@ -153,63 +211,187 @@ def gatk_germline_pipeline(job, samples, config):
         config.genome_fasta         FilesStoreID for reference genome fasta file
         config.genome_fai           FilesStoreID for reference genome fasta index file
         config.genome_dict          FilesStoreID for reference genome sequence dictionary file
+        config.node_reference       If True, GATK jobs share a node-local copy of the reference
         config.cores                Number of cores for each job
         config.xmx                  Java heap size in bytes
+        config.resource_model       Estimates disk requirements from previous runs
         config.suffix               Suffix added to output filename
         config.output_dir           URL or local path to output directory
         config.ssec                 Path to key file for SSE-C encryption
         config.joint_genotype       If True, then joint genotype and filter cohort
+        config.hc_shards            Number of interval shards for HaplotypeCaller
+        config.compress_vcfs        If True, then GVCFs are BGZF compressed and tabix indexed
+        config.alignment_format     Format of prepared alignments, either bam or cram
+        config.gvcf_cache           S3 URL or local path to persistent GVCF cache, or None
+        config.gvcf_cache_keys      Dictionary of GVCF cache keys {Sample ID: cache key}
+        config.cached_gvcfs         Dictionary of cached GVCFs {Sample ID: (URL, size in bytes)}
+        config.stage_keys           Stage keys of the outputs {stage: {Sample ID: stage key}}
+        config.published_outputs    Published outputs {stage: {Sample ID: (URL, size in bytes)}}
         config.hc_output            URL or local path to HaplotypeCaller output for testing
     :return: Dictionary of filtered VCF FileStoreIDs
     :rtype: dict
     """
     require(len(samples) > 0, 'No samples were provided!')
 
-    # Get total size of genome reference files. This is used for configuring disk size.
-    genome_ref_size = config.genome_fasta.size + config.genome_fai.size + config.genome_dict.size
+    # GVCFs are not needed for genotyped VCFs that were published by a previous run
+    published = config.published_outputs
+    if config.joint_genotype:
+        name = genotyping_groups([sample.uuid for sample in samples], config).keys()[0]
+        if name in published['genotyped'] or name in published['filtered']:
+            return job.addChildJobFn(genotype_and_filter, {sample.uuid: None for sample in samples}, config).rv()
+
+    # The genome reference files are passed to the disk requirements of the GATK jobs
+    ref_files = reference_files(config)
+    cram = config.alignment_format == 'cram'
+
+    # Split the genome into interval shards that are shared by every sample in the cohort.
+    # The HaplotypeCaller test output covers the whole genome, so it is never scattered.
+    shards = None
+    if config.hc_shards > 1 and not config.hc_output:
+        genome_dict = job.fileStore.readGlobalFile(config.genome_dict)
+        shards = partition_genome(parse_sequence_dictionary(genome_dict), config.hc_shards)
+        job.fileStore.logToMaster('Scattering HaplotypeCaller across %d interval shards' % len(shards))
 
     # 0: Generate processed BAM and BAI files for each sample
     # group preprocessing and variant calling steps in empty Job instance
     group_bam_jobs = Job()
     gvcfs = {}
     for sample in samples:
-        # 0: Generate processed BAM and BAI files for each sample
-        get_bam = group_bam_jobs.addChildJobFn(prepare_bam,
-                                               sample.uuid,
-                                               sample.url,
-                                               config,
-                                               paired_url=sample.paired_url,
-                                               rg_line=sample.rg_line)
-
-        # 1: Generate per sample gvcfs {uuid: gvcf_id}
-        # The HaplotypeCaller disk requirement depends on the input bam, bai, the genome reference
-        # files, and the output GVCF file. The output GVCF is smaller than the input BAM file.
-        hc_disk = PromisedRequirement(lambda bam, bai, ref_size:
-                                      2 * bam.size + bai.size + ref_size,
-                                      get_bam.rv(0),
-                                      get_bam.rv(1),
-                                      genome_ref_size)
-
-        get_gvcf = get_bam.addFollowOnJobFn(gatk_haplotype_caller,
-                                            get_bam.rv(0),
-                                            get_bam.rv(1),
-                                            config.genome_fasta, config.genome_fai, config.genome_dict,
-                                            annotations=config.annotations,
-                                            cores=config.cores,
-                                            disk=hc_disk,
-                                            memory=config.xmx,
-                                            hc_output=config.hc_output)
+        if not config.joint_genotype and (sample.uuid in published['genotyped'] or
+                                          sample.uuid in published['filtered']):
+            gvcfs[sample.uuid] = None
+            continue
+
+        # Published GVCFs are imported without writing them to the output directory again
+        if sample.uuid in published['gvcf']:
+            get_gvcf = published_output_job(job, 'gvcf', sample.uuid, config)
+            group_bam_jobs.addChild(get_gvcf)
+            gvcfs[sample.uuid] = get_gvcf.rv()
+            continue
+
+        # The outputs of the sample are exported by one job {output path: FileStoreID}
+        sample_dir = os.path.join(config.output_dir, sample.uuid)
+        outputs = {}
+        output_stage_keys = {}
+
+        # Samples in the GVCF cache skip alignment, preprocessing, and variant calling
+        if sample.uuid in config.cached_gvcfs:
+            cached_url, cached_size = config.cached_gvcfs[sample.uuid]
+            job.fileStore.logToMaster('Using cached GVCF for {}'.format(sample.uuid))
+            get_gvcf = group_bam_jobs.addChildJobFn(download_url_job,
+                                                    cached_url,
+                                                    name='cached.g.vcf',
+                                                    s3_key_path=config.ssec,
+                                                    disk=cached_size)
+
+        else:
+            # 0: Generate processed BAM and BAI files for each sample
+            get_bam = group_bam_jobs.addChildJobFn(prepare_bam,
+                                                   sample.uuid,
+                                                   sample.url,
+                                                   config,
+                                                   paired_url=sample.paired_url,
+                                                   rg_line=sample.rg_line)
+            # Preprocessed BAMs are saved, unless a previous run published the BAM
+            if config.preprocess and sample.uuid not in published['bam']:
+                bam_path = os.path.join(sample_dir, output_filename('bam', sample.uuid, config))
+                outputs[bam_path] = get_bam.rv(0)
+                output_stage_keys[bam_path] = config.stage_keys['bam'].get(sample.uuid)
+
+            # 1: Generate per sample gvcfs {uuid: gvcf_id}
+            if shards:
+                # Run one HaplotypeCaller job per interval shard. Each shard reads the entire BAM,
+                # but only writes the GVCF records within its intervals. A shard only decodes the
+                # reads of its intervals from a CRAM.
+                hc_stage = haplotype_caller_stage(shards=len(shards))
+                hc_disk = config.resource_model.disk(hc_stage,
+                                                     lambda bam, bai, ref, num_shards, compress, cram:
+                                                     bam.size + bai.size + reference_disk(ref) +
+                                                     (bam_size(bam, cram) // num_shards if cram else 0) +
+                                                     vcf_output_disk(bam_size(bam, cram) // num_shards, compress),
+                                                     get_bam.rv(0),
+                                                     get_bam.rv(1),
+                                                     ref_files,
+                                                     len(shards),
+                                                     config.compress_vcfs,
+                                                     cram)
+                hc_memory = config.resource_model.memory(hc_stage, lambda bam, bai, ref, xmx: xmx,
+                                                         get_bam.rv(0), get_bam.rv(1), ref_files, config.xmx)
+                shard_gvcfs = []
+                for intervals in shards:
+                    shard_gvcf = get_bam.addFollowOnJobFn(gatk_haplotype_caller,
+                                                          get_bam.rv(0),
+                                                          get_bam.rv(1),
+                                                          config.genome_fasta,
+                                                          config.genome_fai,
+                                                          config.genome_dict,
+                                                          annotations=config.annotations,
+                                                          intervals=intervals,
+                                                          shards=len(shards),
+                                                          node_reference=config.node_reference,
+                                                          compress=config.compress_vcfs,
+                                                          cram=cram,
+                                                          cores=config.cores,
+                                                          disk=hc_disk,
+                                                          memory=hc_memory)
+                    shard_gvcfs.append(shard_gvcf)
+
+                # Gather the shard GVCFs into a single GVCF. The shard GVCFs are streamed, so the
+                # disk requirement only depends on the size of the gathered GVCF.
+                gather_disk = config.resource_model.disk('gather_vcfs',
+                                                         streamed_vcf_disk,
+                                                         [shard_gvcf.rv() for shard_gvcf in shard_gvcfs],
+                                                         config.compress_vcfs)
+                get_gvcf = Job.wrapJobFn(gather_vcfs,
+                                         [shard_gvcf.rv() for shard_gvcf in shard_gvcfs],
+                                         compressed=config.compress_vcfs,
+                                         disk=gather_disk)
+                for shard_gvcf in shard_gvcfs:
+                    shard_gvcf.addChild(get_gvcf)
+
+            else:
+                # The HaplotypeCaller disk requirement depends on the input bam, bai, the genome reference
+                # files, the BAM decoded from a CRAM, and the output GVCF file. The output GVCF is smaller
+                # than the input BAM file.
+                hc_disk = config.resource_model.disk('gatk_haplotype_caller',
+                                                     lambda bam, bai, ref, compress, cram:
+                                                     bam.size + bai.size + reference_disk(ref) +
+                                                     (bam_size(bam, cram) if cram else 0) +
+                                                     vcf_output_disk(bam_size(bam, cram), compress),
+                                                     get_bam.rv(0),
+                                                     get_bam.rv(1),
+                                                     ref_files,
+                                                     config.compress_vcfs,
+                                                     cram)
+                hc_memory = config.resource_model.memory('gatk_haplotype_caller', lambda bam, bai, ref, xmx: xmx,
+                                                         get_bam.rv(0), get_bam.rv(1), ref_files, config.xmx)
+
+                get_gvcf = get_bam.addFollowOnJobFn(gatk_haplotype_caller,
+                                                    get_bam.rv(0),
+                                                    get_bam.rv(1),
+                                                    config.genome_fasta, config.genome_fai, config.genome_dict,
+                                                    annotations=config.annotations,
+                                                    node_reference=config.node_reference,
+                                                    compress=config.compress_vcfs,
+                                                    cram=cram,
+                                                    cores=config.cores,
+                                                    disk=hc_disk,
+                                                    memory=hc_memory,
+                                                    hc_output=config.hc_output)
+            # Save the new GVCF to the persistent GVCF cache
+            if config.gvcf_cache:
+                outputs[os.path.join(config.gvcf_cache,
+                                     gvcf_cache_filename(config.gvcf_cache_keys[sample.uuid],
+                                                         config.compress_vcfs))] = get_gvcf.rv()
+
         # Store cohort GVCFs in dictionary
         gvcfs[sample.uuid] = get_gvcf.rv()
 
-        # Upload individual sample GVCF before genotyping to a sample specific output directory
-        vqsr_name = '{}{}.g.vcf'.format(sample.uuid, config.suffix)
-        get_gvcf.addChildJobFn(output_file_job,
-                               vqsr_name,
-                               get_gvcf.rv(),
-                               os.path.join(config.output_dir, sample.uuid),
-                               s3_key_path=config.ssec,
-                               disk=PromisedRequirement(lambda x: x.size, get_gvcf.rv()))
+        # Upload the sample's outputs before genotyping to a sample specific output directory
+        gvcf_path = os.path.join(sample_dir, output_filename('gvcf', sample.uuid, config))
+        outputs[gvcf_path] = get_gvcf.rv()
+        output_stage_keys[gvcf_path] = config.stage_keys['gvcf'].get(sample.uuid)
+        get_gvcf.addChild(output_files(config, outputs, output_stage_keys))
 
     # VQSR requires many variants in order to train a decent model. GATK recommends a minimum of
     # 30 exomes or one large WGS sample:
@@ -233,6 +415,7 @@ def gatk_germline_pipeline(job, samples, config):
     return filtered_vcfs
 
 
+@metered
 def joint_genotype_and_filter(job, gvcfs, config):
     """
     Checks for enough disk space for joint genotyping, then calls the genotype and filter pipeline function.
@@ -244,79 +427,111 @@ def joint_genotype_and_filter(job, gvcfs, config):
         config.genome_fasta         FilesStoreID for reference genome fasta file
         config.genome_fai           FilesStoreID for reference genome fasta index file
         config.genome_dict          FilesStoreID for reference genome sequence dictionary file
+        config.node_reference       If True, GATK jobs share a node-local copy of the reference
         config.available_disk       Total available disk space
+        config.genotype_shards      Number of interval shards for GenotypeGVCFs
+        config.combine_fan_in       Maximum number of GVCFs combined by one CombineGVCFs job
+        config.compress_vcfs        If True, then GVCFs are BGZF compressed and tabix indexed
     :returns: FileStoreID for the joint genotyped and filtered VCF file
     :rtype: str
     """
     # Get the total size of genome reference files
     genome_ref_size = config.genome_fasta.size + config.genome_fai.size + config.genome_dict.size
 
-    # Require at least 2.5x the sum of the individual GVCF files
-    cohort_size = sum(gvcf.size for gvcf in gvcfs.values())
-    require(int(2.5 * cohort_size + genome_ref_size) < config.available_disk,
+    # Require 25% more than the GenotypeGVCFs disk estimate, which is 2.5x the sum of the uncompressed
+    # GVCF files. When genotyping is sharded, each worker only needs to hold one shard of the cohort.
+    cohort_disk = gvcf_disk(gvcfs.values(), config.compress_vcfs) / config.genotype_shards
+    require(int(1.25 * cohort_disk + genome_ref_size) < config.available_disk,
             'There is not enough disk space to joint '
             'genotype samples:\n{}'.format('\n'.join(gvcfs.keys())))
 
     job.fileStore.logToMaster('Merging cohort into a single GVCF file')
 
+    # Large cohorts are combined in a merge tree before genotyping. Sharded genotyping runs
+    # a merge tree for each shard instead.
+    if config.genotype_shards == 1 and 0 < config.combine_fan_in < len(gvcfs):
+        combine = Job.wrapJobFn(merge_gvcfs, gvcfs, config).encapsulate()
+        job.addChild(combine)
+        # The combined GVCF is named after the joint genotyped output
+        return combine.addChildJobFn(genotype_and_filter, {'joint_genotyped': combine.rv()}, config).rv()
+
     return job.addChildJobFn(genotype_and_filter, gvcfs, config).rv()
 
 
+@metered
 def genotype_and_filter(job, gvcfs, config):
     """
-    Genotypes one or more GVCF files and runs either the VQSR or hard filtering pipeline. Uploads the genotyped VCF file
-    to the config output directory.
+    Genotypes one or more GVCF files and runs either the VQSR or hard filtering pipeline. Uploads the genotyped and
+    filtered VCF files to the config output directory.
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
-    :param dict gvcfs: Dictionary of GVCFs {Sample ID: FileStoreID}
+    :param dict gvcfs: Dictionary of GVCFs {Sample ID: FileStoreID}. The FileStoreIDs are None if the
+                       genotyped or filtered VCF was published by a previous run.
     :param Namespace config: Input parameters and shared FileStoreIDs
         Requires the following config attributes:
         config.genome_fasta         FilesStoreID for reference genome fasta file
         config.genome_fai           FilesStoreID for reference genome fasta index file
         config.genome_dict          FilesStoreID for reference genome sequence dictionary file
+        config.node_reference       If True, GATK jobs share a node-local copy of the reference
         config.suffix               Suffix added to output filename
         config.output_dir           URL or local path to output directory
         config.ssec                 Path to key file for SSE-C encryption
         config.cores                Number of cores for each job
         config.xmx                  Java heap size in bytes
+        config.resource_model       Estimates disk requirements from previous runs
         config.unsafe_mode          If True, then run GATK tools in UNSAFE mode
+        config.genotype_shards      Number of interval shards for GenotypeGVCFs
+        config.compress_vcfs        If True, then GVCFs are BGZF compressed and tabix indexed
+        config.stage_keys           Stage keys of the outputs {stage: {Sample ID: stage key}}
+        config.published_outputs    Published outputs {stage: {Sample ID: (URL, size in bytes)}}
     :return: FileStoreID for genotyped and filtered VCF file
     :rtype: str
     """
-    # Get the total size of the genome reference
-    genome_ref_size = config.genome_fasta.size + config.genome_fai.size + config.genome_dict.size
-
-    # GenotypeGVCF disk requirement depends on the input GVCF, the genome reference files, and
-    # the output VCF file. The output VCF is smaller than the input GVCF.
-    genotype_gvcf_disk = PromisedRequirement(lambda gvcf_ids, ref_size:
-                                             2 * sum(gvcf_.size for gvcf_ in gvcf_ids) + ref_size,
-                                             gvcfs.values(),
-                                             genome_ref_size)
-
-    genotype_gvcf = job.addChildJobFn(gatk_genotype_gvcfs,
-                                      gvcfs,
-                                      config.genome_fasta,
-                                      config.genome_fai,
-                                      config.genome_dict,
-                                      annotations=config.annotations,
-                                      unsafe_mode=config.unsafe_mode,
-                                      cores=config.cores,
-                                      disk=genotype_gvcf_disk,
-                                      memory=config.xmx)
-
     # Determine if output GVCF has multiple samples
     if len(gvcfs) == 1:
         uuid = gvcfs.keys()[0]
     else:
         uuid = 'joint_genotyped'
 
-    genotyped_filename = '%s.genotyped%s.vcf' % (uuid, config.suffix)
-    genotype_gvcf.addChildJobFn(output_file_job,
-                                genotyped_filename,
-                                genotype_gvcf.rv(),
-                                os.path.join(config.output_dir, uuid),
-                                s3_key_path=config.ssec,
-                                disk=PromisedRequirement(lambda x: x.size, genotype_gvcf.rv()))
+    # Import the filtered or genotyped VCF if a previous run published it
+    if uuid in config.published_outputs['filtered']:
+        filtered_vcf = published_output_job(job, 'filtered', uuid, config)
+        job.addChild(filtered_vcf)
+        return filtered_vcf.rv()
+
+    if uuid in config.published_outputs['genotyped']:
+        genotype_gvcf = published_output_job(job, 'genotyped', uuid, config)
+        job.addChild(genotype_gvcf)
+
+    else:
+        # Get the total size of the genome reference
+        if config.genotype_shards > 1:
+            genotype_gvcf = Job.wrapJobFn(scatter_genotype_gvcfs, gvcfs, config).encapsulate()
+            job.addChild(genotype_gvcf)
+
+        else:
+            # GenotypeGVCF disk requirement depends on the input GVCF, the genome reference files, and
+            # the output VCF file. The output VCF is smaller than the uncompressed input GVCF.
+            genotype_gvcf_disk = config.resource_model.disk('gatk_genotype_gvcfs',
+                                                            lambda gvcf_ids, ref, compressed:
+                                                            gvcf_disk(gvcf_ids, compressed) +
+                                                            reference_disk(ref),
+                                                            gvcfs.values(),
+                                                            reference_files(config),
+                                                            config.compress_vcfs)
+
+            genotype_gvcf = job.addChildJobFn(gatk_genotype_gvcfs,
+                                              gvcfs,
+                                              config.genome_fasta,
+                                              config.genome_fai,
+                                              config.genome_dict,
+                                              annotations=config.annotations,
+                                              unsafe_mode=config.unsafe_mode,
+                                              node_reference=config.node_reference,
+                                              compressed=config.compress_vcfs,
+                                              cores=config.cores,
+                                              disk=genotype_gvcf_disk,
+                                              memory=config.xmx)
 
     if config.run_vqsr:
         if not config.joint_genotype:
@@ -330,47 +545,237 @@ def genotype_and_filter(job, gvcfs, config):
                                                             uuid,
                                                             genotype_gvcf.rv(),
                                                             config)
+
+    # Upload the genotyped and filtered VCFs in one job. A genotyped VCF that was published by a previous
+    # run is not written again.
+    output_dir = os.path.join(config.output_dir, uuid)
+    outputs = {}
+    output_stage_keys = {}
+    for stage, vcf_job in [('genotyped', genotype_gvcf), ('filtered', joint_genotype_vcf)]:
+        if uuid in config.published_outputs[stage]:
+            continue
+        path = os.path.join(output_dir, output_filename(stage, uuid, config))
+        outputs[path] = vcf_job.rv()
+        output_stage_keys[path] = config.stage_keys[stage].get(uuid)
+    joint_genotype_vcf.addFollowOn(output_files(config, outputs, output_stage_keys))
     return joint_genotype_vcf.rv()
 
 
+@metered
+def scatter_genotype_gvcfs(job, gvcfs, config):
+    """
+    Genotypes a cohort of GVCF files in parallel across genomic interval shards. Each GVCF is split
+    into one GVCF per shard, so each GenotypeGVCFs job only reads its region of every sample. The
+    genotyped shards are concatenated in reference order.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param dict gvcfs: Dictionary of GVCFs {Sample ID: FileStoreID}
+    :param Namespace config: Input parameters and shared FileStoreIDs
+        Requires the following config attributes:
+        config.genome_fasta         FilesStoreID for reference genome fasta file
+        config.genome_fai           FilesStoreID for reference genome fasta index file
+        config.genome_dict          FilesStoreID for reference genome sequence dictionary file
+        config.node_reference       If True, GATK jobs share a node-local copy of the reference
+        config.cores                Number of cores for each job
+        config.xmx                  Java heap size in bytes
+        config.resource_model       Estimates disk requirements from previous runs
+        config.unsafe_mode          If True, then run GATK tools in UNSAFE mode
+        config.genotype_shards      Number of interval shards for GenotypeGVCFs
+        config.combine_fan_in       Maximum number of GVCFs combined by one CombineGVCFs job
+        config.compress_vcfs        If True, then GVCFs are BGZF compressed and tabix indexed
+    :return: FileStoreID for genotyped VCF file
+    :rtype: str
+    """
+    genome_dict = job.fileStore.readGlobalFile(config.genome_dict)
+    shards = partition_genome(parse_sequence_dictionary(genome_dict), config.genotype_shards)
+    job.fileStore.logToMaster('Genotyping {} samples across {} interval shards'.format(len(gvcfs), len(shards)))
+
+    # Split each GVCF into shards. The GVCF is streamed, so the disk requirement only depends
+    # on the size of the shard GVCFs.
+    split_gvcfs = {}
+    for uuid, gvcf_id in gvcfs.iteritems():
+        split_gvcfs[uuid] = job.addChildJobFn(split_vcf, gvcf_id, shards,
+                                              compressed=config.compress_vcfs,
+                                              disk=streamed_vcf_disk([gvcf_id], config.compress_vcfs))
+
+    genotyped_shards = []
+    for i, intervals in enumerate(shards):
+        shard_gvcfs = {uuid: split.rv(i) for uuid, split in split_gvcfs.iteritems()}
+        shard_predecessors = split_gvcfs.values()
+
+        # Combine the shard GVCFs in a merge tree, so GenotypeGVCFs reads a single GVCF per shard
+        if 0 < config.combine_fan_in < len(shard_gvcfs):
+            combine = Job.wrapJobFn(merge_gvcfs, shard_gvcfs, config, intervals=intervals).encapsulate()
+            for split in split_gvcfs.values():
+                split.addChild(combine)
+            shard_gvcfs = {'joint_genotyped': combine.rv()}
+            shard_predecessors = [combine]
+
+        # GenotypeGVCF disk requirement depends on the shard GVCFs, the genome reference files,
+        # and the output VCF file. The output VCF is smaller than the uncompressed input GVCFs.
+        genotype_shard_disk = config.resource_model.disk('gatk_genotype_gvcfs',
+                                                         lambda gvcf_ids, ref, compressed:
+                                                         gvcf_disk(gvcf_ids, compressed) +
+                                                         reference_disk(ref),
+                                                         shard_gvcfs.values(),
+                                                         reference_files(config),
+                                                         config.compress_vcfs)
+
+        genotype_shard = Job.wrapJobFn(gatk_genotype_gvcfs,
+                                       shard_gvcfs,
+                                       config.genome_fasta,
+                                       config.genome_fai,
+                                       config.genome_dict,
+                                       annotations=config.annotations,
+                                       unsafe_mode=config.unsafe_mode,
+                                       intervals=intervals,
+                                       node_reference=config.node_reference,
+                                       compressed=config.compress_vcfs,
+                                       cores=config.cores,
+                                       disk=genotype_shard_disk,
+                                       memory=config.xmx)
+        for predecessor in shard_predecessors:
+            predecessor.addChild(genotype_shard)
+        genotyped_shards.append(genotype_shard.rv())
+
+    gather_disk = config.resource_model.disk('gather_vcfs',
+                                             lambda vcfs: sum(vcf.size for vcf in vcfs), genotyped_shards)
+    return job.addFollowOnJobFn(gather_vcfs, genotyped_shards, disk=gather_disk).rv()
+
+
+@metered
+def merge_gvcfs(job, gvcfs, config, intervals=None):
+    """
+    Combines GVCFs in a merge tree. The GVCFs are combined in parallel batches of at most
+    config.combine_fan_in files, and the combined GVCFs are merged recursively until one GVCF is
+    left. This bounds the memory and disk of each CombineGVCFs job regardless of the cohort size.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param dict gvcfs: Dictionary of GVCFs {Sample ID: FileStoreID}
+    :param Namespace config: Input parameters and shared FileStoreIDs
+        Requires the following config attributes:
+        config.genome_fasta         FilesStoreID for reference genome fasta file
+        config.genome_fai           FilesStoreID for reference genome fasta index file
+        config.genome_dict          FilesStoreID for reference genome sequence dictionary file
+        config.node_reference       If True, GATK jobs share a node-local copy of the reference
+        config.annotations          List of GATK variant annotations
+        config.combine_fan_in       Maximum number of GVCFs combined by one CombineGVCFs job
+        config.xmx                  Java heap size in bytes
+        config.resource_model       Estimates disk requirements from previous runs
+        config.unsafe_mode          If True, then run GATK tools in UNSAFE mode
+        config.compress_vcfs        If True, then GVCFs are BGZF compressed and tabix indexed
+    :param list[tuple(str, int, int)] intervals: Restricts the merge to these (contig, start, end) intervals,
+                                                 default is None
+    :return: FileStoreID for the combined GVCF
+    :rtype: str
+    """
+    if len(gvcfs) == 1:
+        return gvcfs.values()[0]
+
+    uuids = sorted(gvcfs)
+    batches = [uuids[i:i + config.combine_fan_in] for i in range(0, len(uuids), config.combine_fan_in)]
+    job.fileStore.logToMaster('Combining {} GVCFs in {} batches'.format(len(uuids), len(batches)))
+
+    combined = {}
+    for i, batch in enumerate(batches):
+        batch_gvcfs = {uuid: gvcfs[uuid] for uuid in batch}
+        # A batch with a single GVCF moves up to the next level of the tree unchanged
+        if len(batch_gvcfs) == 1:
+            combined['combined.%d' % i] = batch_gvcfs.values()[0]
+            continue
+
+        # The CombineGVCFs disk requirement depends on the input GVCFs, the genome reference files,
+        # and the combined GVCF. The combined GVCF is smaller than the sum of the uncompressed input
+        # GVCFs, and a compressed GVCF also needs room for its compressed copy.
+        combine_disk = config.resource_model.disk('gatk_combine_gvcfs',
+                                                  lambda gvcf_ids, ref, compressed:
+                                                  gvcf_disk(gvcf_ids, compressed) + reference_disk(ref) +
+                                                  (sum(gvcf_.size for gvcf_ in gvcf_ids) if compressed else 0),
+                                                  batch_gvcfs.values(),
+                                                  reference_files(config),
+                                                  config.compress_vcfs)
+        combined['combined.%d' % i] = job.addChildJobFn(gatk_combine_gvcfs,
+                                                        batch_gvcfs,
+                                                        config.genome_fasta,
+                                                        config.genome_fai,
+                                                        config.genome_dict,
+                                                        annotations=config.annotations,
+                                                        unsafe_mode=config.unsafe_mode,
+                                                        intervals=intervals,
+                                                        node_reference=config.node_reference,
+                                                        compressed=config.compress_vcfs,
+                                                        disk=combine_disk,
+                                                        memory=config.xmx).rv()
+
+    return job.addFollowOnJobFn(merge_gvcfs, combined, config, intervals=intervals).rv()
+
+
+@metered
 def annotate_vcfs(job, vcfs, config):
     """
-    Runs Oncotator for a group of VCF files. Each sample is annotated individually.
+    Runs Oncotator for a group of VCF files. By default each sample is annotated individually. In batched
+    mode, several VCFs are annotated by each job, the Oncotator database is unpacked once per node, and
+    large VCFs are split into contig shards that are annotated in parallel.
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
     :param dict vcfs: Dictionary of VCF FileStoreIDs {Sample identifier: FileStoreID}
     :param Namespace config: Input parameters and shared FileStoreIDs
         Requires the following config attributes:
         config.oncotator_db         FileStoreID to Oncotator database
+        config.genome_dict          FilesStoreID for reference genome sequence dictionary file
+        config.oncotator_batch_size Number of VCF files annotated by each Oncotator job, or 0 for one job per sample
+        config.oncotator_shard_size VCF files larger than this many bytes are split by contig in batched mode
         config.suffix               Suffix added to output filename
         config.output_dir           URL or local path to output directory
         config.ssec                 Path to key file for SSE-C encryption
         config.cores                Number of cores for each job
         config.xmx                  Java heap size in bytes
+        config.resource_model       Estimates disk requirements from previous runs
     """
     job.fileStore.logToMaster('Running Oncotator on the following samples:\n%s' % '\n'.join(vcfs.keys()))
-    for uuid, vcf_id in vcfs.iteritems():
-        # The Oncotator disk requirement depends on the input VCF, the Oncotator database
-        # and the output VCF. The annotated VCF will be significantly larger than the input VCF.
-        onco_disk = PromisedRequirement(lambda vcf, db: 3 * vcf.size + db.size,
-                                        vcf_id,
-                                        config.oncotator_db)
-
-        annotated_vcf = job.addChildJobFn(run_oncotator,
-                                          vcf_id,
-                                          config.oncotator_db,
-                                          disk=onco_disk,
-                                          cores=config.cores,
-                                          memory=config.xmx)
-
-        output_dir = os.path.join(config.output_dir, uuid)
-        filename = '{}.oncotator{}.vcf'.format(uuid, config.suffix)
-        annotated_vcf.addChildJobFn(output_file_job,
-                                    filename,
-                                    annotated_vcf.rv(),
-                                    output_dir,
-                                    s3_key_path=config.ssec,
-                                    disk=PromisedRequirement(lambda x: x.size, annotated_vcf.rv()))
+    if config.oncotator_batch_size:
+        contigs = None
+        vcf_shards = {}
+        for uuid, vcf_id in vcfs.iteritems():
+            if not config.oncotator_shard_size or vcf_id.size <= config.oncotator_shard_size:
+                vcf_shards[uuid] = [vcf_id]
+                continue
+            if contigs is None:
+                contigs = parse_sequence_dictionary(job.fileStore.readGlobalFile(config.genome_dict))
+            # Whole contigs are kept together, so no record is annotated twice
+            num_shards = -(-vcf_id.size // config.oncotator_shard_size)
+            vcf_shards[uuid] = job.addChildJobFn(split_vcf,
+                                                 vcf_id,
+                                                 partition_contigs(contigs, num_shards),
+                                                 disk=2 * vcf_id.size).rv()
+        job.addFollowOnJobFn(annotate_vcf_batches, vcf_shards, config)
+        return
+
+    # The annotated VCFs of each batch of samples are uploaded by one job
+    uuids = sorted(vcfs)
+    for i in range(0, len(uuids), OUTPUT_BATCH_SIZE):
+        annotate_batch = Job()
+        job.addChild(annotate_batch)
+        outputs = {}
+        for uuid in uuids[i:i + OUTPUT_BATCH_SIZE]:
+            # The Oncotator disk requirement depends on the input VCF, the Oncotator database tarball,
+            # which toil-lib unpacks in the work directory, and the output VCF. The annotated VCF will be
+            # significantly larger than the input VCF.
+            onco_disk = config.resource_model.disk('run_oncotator',
+                                                   lambda vcf, db: 3 * vcf.size + db.size + oncotator_db_disk(db),
+                                                   vcfs[uuid],
+                                                   config.oncotator_db)
+
+            annotated_vcf = annotate_batch.addChildJobFn(run_oncotator,
+                                                         vcfs[uuid],
+                                                         config.oncotator_db,
+                                                         disk=onco_disk,
+                                                         cores=config.cores,
+                                                         memory=config.xmx)
+
+            filename = '{}.oncotator{}.vcf'.format(uuid, config.suffix)
+            outputs[os.path.join(config.output_dir, uuid, filename)] = annotated_vcf.rv()
+        annotate_batch.addFollowOn(output_files(config, outputs))
 
 
 # Pipeline convenience functions
@@ -416,16 +821,24 @@ def parse_manifest(path_to_manifest):
     return samples
 
 
+@metered
 def download_shared_files(job, config):
     """
     Downloads shared reference files for Toil Germline pipeline
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
     :param Namespace config: Pipeline configuration options
+        Requires the following config attributes:
+        config.ssec                 Path to key file for SSE-C encryption
+        config.reference_cache      S3 URL or shared local path to the reference cache, or None
+        config.downloads            (OPTIONAL) Download registry {URL: FileStoreID} of files that a predecessor
+                                    already downloaded
     :return: Updated config with shared fileStoreIDS
     :rtype: Namespace
     """
     job.fileStore.logToMaster('Downloading shared reference files')
+    # Inputs with the same URL, i.e. a VCF that is used for preprocessing and VQSR, share one download
+    config.downloads = dict(getattr(config, 'downloads', None) or {})
     shared_files = {'genome_fasta', 'genome_fai', 'genome_dict'}
     nonessential_files = {'genome_fai', 'genome_dict'}
 
@@ -444,18 +857,21 @@ def download_shared_files(job, config):
             url = getattr(config, name, None)
             if url is None:
                 continue
-            setattr(config, name, job.addChildJobFn(download_url_job,
-                                                    url,
-                                                    name=name,
-                                                    s3_key_path=config.ssec,
-                                                    disk='15G'   # Estimated reference file size
-                                                    ).rv())
+            add_shared_download(job,
+                                config.downloads,
+                                url,
+                                config.reference_cache,
+                                name=name,
+                                s3_key_path=config.ssec,
+                                disk='15G')   # Estimated reference file size
+            setattr(config, name, config.downloads[url])
         finally:
             if getattr(config, name, None) is None and name not in nonessential_files:
                 raise ValueError("Necessary configuration parameter is missing:\n{}".format(name))
     return job.addFollowOnJobFn(reference_preprocessing, config).rv()
 
 
+@metered
 def reference_preprocessing(job, config):
     """
     Creates a genome fasta index and sequence dictionary file if not already present in the pipeline config.
@@ -480,6 +896,30 @@ def reference_preprocessing(job, config):
     return config
 
 
+def published_output_job(job, stage, name, config):
+    """
+    Creates a job that imports an output that was published by a previous run
+
+    :param JobFunctionWrappingJob job: Running job that adds the returned job to the workflow
+    :param str stage: Pipeline stage that produced the output
+    :param str name: Sample ID, or joint_genotyped for a joint genotyped cohort
+    :param Namespace config: Pipeline configuration options
+        Requires the following config attributes:
+        config.ssec                 Path to key file for SSE-C encryption
+        config.published_outputs    Published outputs {stage: {Sample ID: (URL, size in bytes)}}
+    :return: Download job that returns the output FileStoreID
+    :rtype: toil.job.JobFunctionWrappingJob
+    """
+    url, size = config.published_outputs[stage][name]
+    job.fileStore.logToMaster('Using published {} output for {}: {}'.format(stage, name, url))
+    return job.wrapJobFn(download_url_job,
+                         url,
+                         name=output_filename(stage, name, config),
+                         s3_key_path=config.ssec,
+                         disk=size)
+
+
+@metered
 def prepare_bam(job, uuid, url, config, paired_url=None, rg_line=None):
     """
     Prepares BAM file for Toil germline pipeline.
@@ -488,8 +928,11 @@ def prepare_bam(job, uuid, url, config, paired_url=None, rg_line=None):
     0: Download and align BAM or FASTQ sample
     1: Sort BAM
     2: Index BAM
+    Steps 0-2 run in a single job when BWA alignment is fused
     3: Run GATK preprocessing pipeline (Optional)
-        - Uploads preprocessed BAM to output directory
+    4: Convert BAM to CRAM (Optional)
+
+    The caller uploads the preprocessed BAM or CRAM to the output directory.
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
     :param str uuid: Unique identifier for the sample
@@ -503,17 +946,52 @@ def prepare_bam(job, uuid, url, config, paired_url=None, rg_line=None):
         config.mills                FileStoreID for Mills resource file
         config.dbsnp                FileStoreID for dbSNP resource file
         config.suffix               Suffix added to output filename
-        config.output_dir           URL or local path to output directory
         config.ssec                 Path to key file for SSE-C encryption
         config.cores                Number of cores for each job
         config.xmx                  Java heap size in bytes
+        config.file_size            Approximate input file size, used when a sample size is unknown
+        config.url_sizes            Sample sizes in bytes {URL: size}
+        config.run_bwa              If True, align FASTQs or realign the BAM with bwakit
+        config.fused_alignment      If True, sort and index the bwakit output in the alignment job
+        config.resource_model       Estimates disk requirements from previous runs
+        config.published_outputs    Published outputs {stage: {Sample ID: (URL, size in bytes)}}
+        config.alignment_format     Format of prepared alignments, either bam or cram
+        config.node_reference       If True, reads the genome reference from a node-local directory
     :param str|None paired_url: URL or local path to paired FASTQ file, default is None
     :param str|None rg_line: RG line for BWA alignment (i.e. @RG\tID:foo\tSM:bar), default is None
-    :return: BAM and BAI FileStoreIDs
+    :return: BAM and BAI FileStoreIDs, or CRAM and CRAI FileStoreIDs
     :rtype: tuple
     """
+    cram = config.alignment_format == 'cram'
+
+    # Import the preprocessed BAM or CRAM if a previous run published it. Only the alignments are
+    # published, so they are indexed again.
+    if uuid in config.published_outputs['bam']:
+        get_bam = published_output_job(job, 'bam', uuid, config)
+        job.addChild(get_bam)
+        index_bam = get_bam.addChildJobFn(index_cram if cram else run_samtools_index,
+                                          get_bam.rv(),
+                                          disk=config.published_outputs['bam'][uuid][1])
+        return get_bam.rv(), index_bam.rv()
+
+    # 0-2: Align, sort, and index in a single job, so the unsorted BAM never leaves the worker
+    fused = config.run_bwa and config.fused_alignment
+    if fused:
+        get_bam = job.wrapJobFn(setup_and_run_bwakit,
+                                uuid,
+                                url,
+                                rg_line,
+                                config,
+                                paired_url=paired_url,
+                                fused=True).encapsulate()
+        job.addChild(get_bam)
+        sorted_bam = get_bam
+        index_bam = None
+        bam_promise = get_bam.rv(0)
+        bai_promise = get_bam.rv(1)
+
     # 0: Align FASTQ or realign BAM
-    if config.run_bwa:
+    elif config.run_bwa:
         get_bam = job.wrapJobFn(setup_and_run_bwakit,
                                 uuid,
                                 url,
@@ -528,38 +1006,42 @@ def prepare_bam(job, uuid, url, config, paired_url=None, rg_line=None):
                                 url,
                                 name='toil.bam',
                                 s3_key_path=config.ssec,
-                                disk=config.file_size).encapsulate()
+                                disk=download_disk(config.url_sizes, url, config.file_size)).encapsulate()
     else:
         raise ValueError('Could not generate BAM file for %s\n'
                          'Provide a FASTQ URL and set run-bwa or '
                          'provide a BAM URL that includes .bam extension.' % uuid)
 
-    # 1: Sort BAM file if necessary
-    # Realigning BAM file shuffles read order
-    if config.sorted and not config.run_bwa:
-        sorted_bam = get_bam
+    if not fused:
+        # 1: Sort BAM file if necessary
+        # Realigning BAM file shuffles read order
+        if config.sorted and not config.run_bwa:
+            sorted_bam = get_bam
+
+        else:
+            # The samtools sort disk requirement depends on the input bam, the tmp files, and the
+            # sorted output bam.
+            sorted_bam_disk = config.resource_model.disk('run_samtools_sort',
+                                                         lambda bam: 3 * bam.size, get_bam.rv())
+            sorted_bam = get_bam.addChildJobFn(run_samtools_sort,
+                                               get_bam.rv(),
+                                               cores=config.cores,
+                                               disk=sorted_bam_disk)
 
-    else:
-        # The samtools sort disk requirement depends on the input bam, the tmp files, and the
-        # sorted output bam.
-        sorted_bam_disk = PromisedRequirement(lambda bam: 3 * bam.size, get_bam.rv())
-        sorted_bam = get_bam.addChildJobFn(run_samtools_sort,
-                                           get_bam.rv(),
-                                           cores=config.cores,
-                                           disk=sorted_bam_disk)
-
-    # 2: Index BAM
-    # The samtools index disk requirement depends on the input bam and the output bam index
-    index_bam_disk = PromisedRequirement(lambda bam: bam.size, sorted_bam.rv())
-    index_bam = job.wrapJobFn(run_samtools_index, sorted_bam.rv(), disk=index_bam_disk)
-
-    job.addChild(get_bam)
-    sorted_bam.addChild(index_bam)
+        # 2: Index BAM
+        # The samtools index disk requirement depends on the input bam and the output bam index
+        index_bam_disk = config.resource_model.disk('run_samtools_index', lambda bam: bam.size, sorted_bam.rv())
+        index_bam = job.wrapJobFn(run_samtools_index, sorted_bam.rv(), disk=index_bam_disk)
+
+        job.addChild(get_bam)
+        sorted_bam.addChild(index_bam)
+        bam_promise = sorted_bam.rv()
+        bai_promise = index_bam.rv()
 
     if config.preprocess:
         preprocess = job.wrapJobFn(run_gatk_preprocessing,
-                                   sorted_bam.rv(),
-                                   index_bam.rv(),
+                                   bam_promise,
+                                   bai_promise,
                                    config.genome_fasta,
                                    config.genome_dict,
                                    config.genome_fai,
@@ -569,32 +1051,45 @@ def prepare_bam(job, uuid, url, config, paired_url=None, rg_line=None):
                                    memory=config.xmx,
                                    cores=config.cores).encapsulate()
         sorted_bam.addChild(preprocess)
-        index_bam.addChild(preprocess)
+        if index_bam is not None:
+            index_bam.addChild(preprocess)
 
         # Update output BAM promises
         output_bam_promise = preprocess.rv(0)
         output_bai_promise = preprocess.rv(1)
 
-        # Save processed BAM
-        output_dir = os.path.join(config.output_dir, uuid)
-        filename = '{}.preprocessed{}.bam'.format(uuid, config.suffix)
-        output_bam = job.wrapJobFn(output_file_job,
-                                   filename,
-                                   preprocess.rv(0),
-                                   output_dir,
-                                   s3_key_path=config.ssec)
-        preprocess.addChild(output_bam)
-
     else:
-        output_bam_promise = sorted_bam.rv()
-        output_bai_promise = index_bam.rv()
+        output_bam_promise = bam_promise
+        output_bai_promise = bai_promise
+
+    # 4: Convert the prepared BAM to a CRAM, which is compressed against the genome reference
+    if cram:
+        # The conversion disk requirement depends on the input bam, the output cram, and the genome reference
+        cram_disk = config.resource_model.disk('convert_to_cram',
+                                               lambda bam, ref: bam.size + bam.size // CRAM_COMPRESSION_RATIO
+                                                                + reference_disk(ref),
+                                               output_bam_promise,
+                                               reference_files(config))
+        convert = job.wrapJobFn(convert_to_cram,
+                                output_bam_promise,
+                                config.genome_fasta,
+                                config.genome_fai,
+                                config.genome_dict,
+                                node_reference=config.node_reference,
+                                cores=config.cores,
+                                disk=cram_disk)
+        (preprocess if config.preprocess else sorted_bam).addChild(convert)
+        output_bam_promise = convert.rv(0)
+        output_bai_promise = convert.rv(1)
 
     return output_bam_promise, output_bai_promise
 
 
-def setup_and_run_bwakit(job, uuid, url, rg_line, config, paired_url=None):
+@metered
+def setup_and_run_bwakit(job, uuid, url, rg_line, config, paired_url=None, fused=False):
     """
-    Downloads and runs bwakit for BAM or FASTQ files
+    Downloads and runs bwakit for BAM or FASTQ files. In fused mode, bwakit pipes the alignments into
+    a coordinate sort and the sorted BAM is indexed in the same job.
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
     :param str uuid: Unique sample identifier
@@ -605,16 +1100,21 @@ def setup_and_run_bwakit(job, uuid, url, rg_line, config, paired_url=None):
         config.genome_fai           FilesStoreID for reference genome fasta index file
         config.cores                Number of cores for each job
         config.trim                 If True, trim adapters using bwakit
+        config.file_size            Approximate input file size, used when a sample size is unknown
+        config.url_sizes            Sample sizes in bytes {URL: size}
         config.amb                  FileStoreID for BWA index file prefix.amb
         config.ann                  FileStoreID for BWA index file prefix.ann
         config.bwt                  FileStoreID for BWA index file prefix.bwt
         config.pac                  FileStoreID for BWA index file prefix.pac
         config.sa                   FileStoreID for BWA index file prefix.sa
         config.alt                  FileStoreID for alternate contigs file or None
+        config.chunk_reads          Number of reads per FASTQ alignment chunk, or 0 to align the whole sample
+        config.resource_model       Estimates disk requirements from previous runs
     :param str|None paired_url: URL to paired FASTQ
     :param str|None rg_line: Read group line (i.e. @RG\tID:foo\tSM:bar)
-    :return: BAM FileStoreID
-    :rtype: str
+    :param bool fused: If True, returns a sorted BAM and its index, default is False
+    :return: BAM FileStoreID, or sorted BAM and BAI FileStoreIDs if fused
+    :rtype: str|tuple(str, str)
     """
     bwa_config = deepcopy(config)
     bwa_config.uuid = uuid
@@ -641,7 +1141,7 @@ def setup_and_run_bwakit(job, uuid, url, rg_line, config, paired_url=None):
                                url,
                                name='file1',
                                s3_key_path=config.ssec,
-                               disk=config.file_size)
+                               disk=download_disk(config.url_sizes, url, config.file_size))
 
     samples.append(input1.rv())
 
@@ -657,20 +1157,43 @@ def setup_and_run_bwakit(job, uuid, url, rg_line, config, paired_url=None):
                                    paired_url,
                                    name='file2',
                                    s3_key_path=config.ssec,
-                                   disk=config.file_size)
+                                   disk=download_disk(config.url_sizes, paired_url, config.file_size))
         samples.append(input2.rv())
         bwa_config.r2 = input2.rv()
 
     # The bwakit disk requirement depends on the size of the input files and the index
     # Take the sum of the input files and scale it by a factor of 4
-    bwa_index_size = sum([getattr(config, index_file).size
-                          for index_file in ['amb', 'ann', 'bwt', 'pac', 'sa', 'alt']
-                          if getattr(config, index_file, None) is not None])
-
-    bwakit_disk = PromisedRequirement(lambda lst, index_size:
-                                      int(4 * sum(x.size for x in lst) + index_size),
-                                      samples,
-                                      bwa_index_size)
+    bwa_index = [getattr(bwa_config, index_file)
+                 for index_file in ['ref', 'fai', 'amb', 'ann', 'bwt', 'pac', 'sa', 'alt']
+                 if getattr(bwa_config, index_file, None) is not None]
+
+    bwakit_disk = config.resource_model.disk('run_bwakit',
+                                             lambda lst, index:
+                                             int(4 * sum(x.size for x in lst) + sum(x.size for x in index)),
+                                             samples,
+                                             bwa_index)
+
+    # Large FASTQ samples are split into chunks that are aligned in parallel
+    if config.chunk_reads and ext != '.bam':
+        return job.addFollowOnJobFn(run_chunked_bwakit,
+                                    bwa_config,
+                                    config.chunk_reads,
+                                    sort=fused,
+                                    index=fused,
+                                    trim=config.trim).rv()
+
+    if fused:
+        # The fused job needs room for the sort's temporary files and the BAM index as well
+        fused_disk = config.resource_model.disk('run_bwakit_sort_index',
+                                                lambda lst, index:
+                                                int(5 * sum(x.size for x in lst) + sum(x.size for x in index)),
+                                                samples,
+                                                bwa_index)
+        return job.addFollowOnJobFn(run_bwakit_sort_index,
+                                    bwa_config,
+                                    trim=config.trim,
+                                    cores=config.cores,
+                                    disk=fused_disk).rv()
 
     return job.addFollowOnJobFn(run_bwakit,
                                 bwa_config,
@@ -680,19 +1203,59 @@ def setup_and_run_bwakit(job, uuid, url, rg_line, config, paired_url=None):
                                 disk=bwakit_disk).rv()
 
 
+@metered(inputs=bwakit_inputs)
+def run_bwakit_sort_index(job, config, trim=False):
+    """
+    Runs bwakit with coordinate sorting and indexes the sorted BAM in the same job. bwakit pipes the
+    alignments straight into samtools sort, so the unsorted BAM is never written to the FileStore, and
+    the sorted BAM is indexed from the local FileStore cache.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param Namespace config: bwakit configuration, see toil_lib.tools.aligners.run_bwakit
+    :param bool trim: If True, trim adapters using bwakit
+    :return: Sorted BAM and BAI FileStoreIDs
+    :rtype: tuple(str, str)
+    """
+    # Call the unwrapped toil-lib functions, since this job records its own metrics
+    bam = aligners.run_bwakit(job, config, sort=True, trim=trim)
+    bai = preprocessing.run_samtools_index(job, bam)
+    return bam, bai
+
+
+def haplotype_caller_stage(shards=1, **kwargs):
+    """
+    Returns the stage that a HaplotypeCaller job records its metrics under. A shard only writes its share
+    of the GVCF, so the jobs of each shard count are fitted separately.
+
+    >>> haplotype_caller_stage(), haplotype_caller_stage(shards=4)
+    ('gatk_haplotype_caller', 'gatk_haplotype_caller.4_shards')
+
+    :param int shards: Number of shards that the sample is called in
+    :return: Stage name
+    :rtype: str
+    """
+    return 'gatk_haplotype_caller' if shards == 1 else 'gatk_haplotype_caller.{}_shards'.format(shards)
+
+
+@metered(stage=haplotype_caller_stage)
 def gatk_haplotype_caller(job,
                           bam, bai,
                           ref, fai, ref_dict,
                           annotations=None,
                           emit_threshold=10.0, call_threshold=30.0,
                           unsafe_mode=False,
+                          intervals=None,
+                          shards=1,
+                          node_reference=False,
+                          compress=False,
+                          cram=False,
                           hc_output=None):
     """
     Uses GATK HaplotypeCaller to identify SNPs and INDELs. Outputs variants in a Genomic VCF file.
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
-    :param str bam: FileStoreID for BAM file
-    :param str bai: FileStoreID for BAM index file
+    :param str bam: FileStoreID for BAM or CRAM file
+    :param str bai: FileStoreID for BAM or CRAM index file
     :param str ref: FileStoreID for reference genome fasta file
     :param str ref_dict: FileStoreID for reference sequence dictionary file
     :param str fai: FileStoreID for reference fasta index file
@@ -700,28 +1263,37 @@ def gatk_haplotype_caller(job,
     :param float emit_threshold: Minimum phred-scale confidence threshold for a variant to be emitted, default is 10.0
     :param float call_threshold: Minimum phred-scale confidence threshold for a variant to be called, default is 30.0
     :param bool unsafe_mode: If True, runs gatk UNSAFE mode: "-U ALLOW_SEQ_DICT_INCOMPATIBILITY"
+    :param list[tuple(str, int, int)] intervals: Restricts calling to these (contig, start, end) intervals,
+                                                 default is None
+    :param int shards: Number of interval shards that the sample is called in, which names the stage that
+                       the job's metrics are recorded under, default is 1
+    :param bool node_reference: If True, reads the genome reference from a read-only node-local directory
+                                instead of copying it to the job's work directory, default is False
+    :param bool compress: If True, writes a BGZF compressed GVCF with a tabix index, default is False
+    :param bool cram: If True, the alignments are a CRAM and its CRAI index, default is False
     :param str hc_output: URL or local path to pre-cooked VCF file, default is None
-    :return: FileStoreID for GVCF file
-    :rtype: str
+    :return: FileStoreID for GVCF file, or IndexedVcf if compressed
+    :rtype: str|IndexedVcf
     """
     job.fileStore.logToMaster('Running GATK HaplotypeCaller')
 
-    inputs = {'genome.fa': ref,
-              'genome.fa.fai': fai,
-              'genome.dict': ref_dict,
-              'input.bam': bam,
-              'input.bam.bai': bai}
-
     work_dir = job.fileStore.getLocalTempDir()
-    for name, file_store_id in inputs.iteritems():
-        job.fileStore.readGlobalFile(file_store_id, os.path.join(work_dir, name))
+    genome_fasta, docker_parameters = stage_reference(job, work_dir, ref, fai, ref_dict, node_reference)
+
+    # GATK 3 does not read CRAMs, so the reads of the interval shard are decoded into local BAMs
+    if cram:
+        bams = decode_cram(job, work_dir, bam, bai, genome_fasta, docker_parameters, intervals)
+    else:
+        bams = ['input.bam']
+        job.fileStore.readGlobalFile(bam, os.path.join(work_dir, 'input.bam'))
+        job.fileStore.readGlobalFile(bai, os.path.join(work_dir, 'input.bam.bai'))
+    inputs = bams + [name + '.bai' for name in bams]
 
     # Call GATK -- HaplotypeCaller with parameters to produce a genomic VCF file:
     # https://software.broadinstitute.org/gatk/documentation/article?id=2803
     command = ['-T', 'HaplotypeCaller',
                '-nct', str(job.cores),
-               '-R', 'genome.fa',
-               '-I', 'input.bam',
+               '-R', genome_fasta,
                '-o', 'output.g.vcf',
                '-stand_call_conf', str(call_threshold),
                '-stand_emit_conf', str(emit_threshold),
@@ -730,6 +1302,9 @@ def gatk_haplotype_caller(job,
                '--genotyping_mode', 'Discovery',
                '--emitRefConfidence', 'GVCF']
 
+    for name in bams:
+        command.extend(['-I', name])
+
     if unsafe_mode:
         command = ['-U', 'ALLOW_SEQ_DICT_INCOMPATIBILITY'] + command
 
@@ -737,16 +1312,171 @@ def gatk_haplotype_caller(job,
         for annotation in annotations:
             command.extend(['-A', annotation])
 
+    if intervals:
+        write_interval_list(intervals, work_dir)
+        command.extend(['-L', 'shard.intervals'])
+
     # Uses docker_call mock mode to replace output with hc_output file
     outputs = {'output.g.vcf': hc_output}
     docker_call(job=job, work_dir=work_dir,
                 env={'JAVA_OPTS': '-Djava.io.tmpdir=/data/ -Xmx{}'.format(job.memory)},
                 parameters=command,
-                tool='quay.io/ucsc_cgl/gatk:3.5--dba6dae49156168a909c43330350c6161dc7ecc2',
-                inputs=inputs.keys(),
+                tool=GATK_IMAGE,
+                inputs=inputs,
                 outputs=outputs,
+                docker_parameters=docker_parameters,
                 mock=True if outputs['output.g.vcf'] else False)
-    return job.fileStore.writeGlobalFile(os.path.join(work_dir, 'output.g.vcf'))
+    return write_vcf(job, os.path.join(work_dir, 'output.g.vcf'), compress)
+
+
+@metered
+def gatk_genotype_gvcfs(job,
+                        gvcfs,
+                        ref, fai, ref_dict,
+                        annotations=None,
+                        emit_threshold=10.0, call_threshold=30.0,
+                        unsafe_mode=False,
+                        intervals=None,
+                        node_reference=False,
+                        compressed=False):
+    """
+    Runs GenotypeGVCFs on one or more GVCFs. GVCFs from multiple samples are jointly genotyped.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param dict gvcfs: Dictionary of GVCFs {Sample ID: FileStoreID or IndexedVcf}
+    :param str ref: FileStoreID for reference genome fasta file
+    :param str fai: FileStoreID for reference fasta index file
+    :param str ref_dict: FileStoreID for reference sequence dictionary file
+    :param list[str] annotations: List of GATK variant annotations, default is None
+    :param float emit_threshold: Minimum phred-scale confidence threshold for a variant to be emitted, default is 10.0
+    :param float call_threshold: Minimum phred-scale confidence threshold for a variant to be called, default is 30.0
+    :param bool unsafe_mode: If True, runs gatk UNSAFE mode: "-U ALLOW_SEQ_DICT_INCOMPATIBILITY"
+    :param list[tuple(str, int, int)] intervals: Restricts genotyping to these (contig, start, end) intervals,
+                                                 default is None
+    :param bool node_reference: If True, reads the genome reference from a read-only node-local directory
+                                instead of copying it to the job's work directory, default is False
+    :param bool compressed: If True, the GVCFs are BGZF compressed, default is False
+    :return: FileStoreID for genotyped VCF file
+    :rtype: str
+    """
+    job.fileStore.logToMaster('Running GATK GenotypeGVCFs\n'
+                              'Emit threshold: {emit_threshold}\n'
+                              'Call threshold: {call_threshold}\n\n'
+                              'Annotations:\n{annotations}\n\n'
+                              'Samples:\n{samples}\n'.format(emit_threshold=emit_threshold,
+                                                                call_threshold=call_threshold,
+                                                                annotations='\n'.join(annotations) if annotations else '',
+                                                                samples='\n'.join(gvcfs.keys())))
+
+    # GATK reads compressed GVCFs with their tabix index
+    extension = '.g.vcf.gz' if compressed else '.g.vcf'
+    inputs = {}
+    for uuid, gvcf_id in gvcfs.iteritems():
+        inputs[uuid + extension] = gvcf_id
+
+    work_dir = job.fileStore.getLocalTempDir()
+    for name, file_store_id in inputs.iteritems():
+        read_vcf(job, file_store_id, os.path.join(work_dir, name), compressed)
+    genome_fasta, docker_parameters = stage_reference(job, work_dir, ref, fai, ref_dict, node_reference)
+
+    command = ['-T', 'GenotypeGVCFs',
+               '-nt', str(job.cores),
+               '-R', genome_fasta,
+               '-o', 'genotyped.vcf',
+               '-stand_emit_conf', str(emit_threshold),
+               '-stand_call_conf', str(call_threshold)]
+
+    if unsafe_mode:
+        command = ['-U', 'ALLOW_SEQ_DICT_INCOMPATIBILITY'] + command
+
+    if annotations:
+        for annotation in annotations:
+            command.extend(['-A', annotation])
+
+    for uuid in sorted(gvcfs):
+        command.extend(['--variant', uuid + extension])
+
+    if intervals:
+        write_interval_list(intervals, work_dir)
+        command.extend(['-L', 'shard.intervals'])
+
+    docker_call(job=job, work_dir=work_dir,
+                env={'JAVA_OPTS': '-Djava.io.tmpdir=/data/ -Xmx{}'.format(job.memory)},
+                parameters=command,
+                tool=GATK_IMAGE,
+                inputs=inputs.keys(),
+                outputs={'genotyped.vcf': None},
+                docker_parameters=docker_parameters)
+    return job.fileStore.writeGlobalFile(os.path.join(work_dir, 'genotyped.vcf'))
+
+
+@metered
+def gatk_combine_gvcfs(job,
+                       gvcfs,
+                       ref, fai, ref_dict,
+                       annotations=None,
+                       unsafe_mode=False,
+                       intervals=None,
+                       node_reference=False,
+                       compressed=False):
+    """
+    Merges GVCFs into a single multi-sample GVCF using GATK CombineGVCFs.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param dict gvcfs: Dictionary of GVCFs {Sample ID: FileStoreID or IndexedVcf}
+    :param str ref: FileStoreID for reference genome fasta file
+    :param str fai: FileStoreID for reference fasta index file
+    :param str ref_dict: FileStoreID for reference sequence dictionary file
+    :param list[str] annotations: List of GATK variant annotations, default is None
+    :param bool unsafe_mode: If True, runs gatk UNSAFE mode: "-U ALLOW_SEQ_DICT_INCOMPATIBILITY"
+    :param list[tuple(str, int, int)] intervals: Restricts the merge to these (contig, start, end) intervals,
+                                                 default is None
+    :param bool node_reference: If True, reads the genome reference from a read-only node-local directory
+                                instead of copying it to the job's work directory, default is False
+    :param bool compressed: If True, the GVCFs are BGZF compressed, and the combined GVCF is compressed and
+                            indexed, default is False
+    :return: FileStoreID for combined GVCF file, or IndexedVcf if compressed
+    :rtype: str|IndexedVcf
+    """
+    job.fileStore.logToMaster('Running GATK CombineGVCFs on {} GVCFs'.format(len(gvcfs)))
+
+    # GATK reads compressed GVCFs with their tabix index
+    extension = '.g.vcf.gz' if compressed else '.g.vcf'
+    inputs = {}
+    for uuid, gvcf_id in gvcfs.iteritems():
+        inputs[uuid + extension] = gvcf_id
+
+    work_dir = job.fileStore.getLocalTempDir()
+    for name, file_store_id in inputs.iteritems():
+        read_vcf(job, file_store_id, os.path.join(work_dir, name), compressed)
+    genome_fasta, docker_parameters = stage_reference(job, work_dir, ref, fai, ref_dict, node_reference)
+
+    command = ['-T', 'CombineGVCFs',
+               '-R', genome_fasta,
+               '-o', 'combined.g.vcf']
+
+    if unsafe_mode:
+        command = ['-U', 'ALLOW_SEQ_DICT_INCOMPATIBILITY'] + command
+
+    if annotations:
+        for annotation in annotations:
+            command.extend(['-A', annotation])
+
+    for uuid in sorted(gvcfs):
+        command.extend(['--variant', uuid + extension])
+
+    if intervals:
+        write_interval_list(intervals, work_dir)
+        command.extend(['-L', 'shard.intervals'])
+
+    docker_call(job=job, work_dir=work_dir,
+                env={'JAVA_OPTS': '-Djava.io.tmpdir=/data/ -Xmx{}'.format(job.memory)},
+                parameters=command,
+                tool=GATK_IMAGE,
+                inputs=inputs.keys(),
+                outputs={'combined.g.vcf': None},
+                docker_parameters=docker_parameters)
+    return write_vcf(job, os.path.join(work_dir, 'combined.g.vcf'), compressed)
 
 
 def main():
@@ -764,32 +1494,37 @@ def main():
                           help='Generates an editable manifest in the current working directory.')
     subparsers.add_parser('generate',
                           help='Generates a config and manifest in the current working directory.')
+    add_report_parser(subparsers)
+
+    # Pipeline inputs, shared by the run and plan subparsers
+    parser_inputs = argparse.ArgumentParser(add_help=False)
+    parser_inputs.add_argument('--config',
+                               required=True,
+                               type=str,
+                               help='Path to the (filled in) config file, generated with '
+                                    '"generate-config".')
+    parser_inputs.add_argument('--manifest',
+                               type=str,
+                               help='Path to the (filled in) manifest file, generated with '
+                                    '"generate-manifest".\nDefault value: "%(default)s".')
+    parser_inputs.add_argument('--sample',
+                               default=None,
+                               nargs=2,
+                               type=str,
+                               help='Input sample identifier and BAM file URL or local path')
+    parser_inputs.add_argument('--output-dir',
+                               default=None,
+                               help='Path/URL to output directory')
+    parser_inputs.add_argument('-s', '--suffix',
+                               default=None,
+                               help='Additional suffix to add to the names of the output files')
+    parser_inputs.add_argument('--preprocess-only',
+                               action='store_true',
+                               help='Only runs preprocessing steps')
 
     # Run subparser
-    parser_run = subparsers.add_parser('run', help='Runs the GATK germline pipeline')
-    parser_run.add_argument('--config',
-                            required=True,
-                            type=str,
-                            help='Path to the (filled in) config file, generated with '
-                                 '"generate-config".')
-    parser_run.add_argument('--manifest',
-                            type=str,
-                            help='Path to the (filled in) manifest file, generated with '
-                                 '"generate-manifest".\nDefault value: "%(default)s".')
-    parser_run.add_argument('--sample',
-                            default=None,
-                            nargs=2,
-                            type=str,
-                            help='Input sample identifier and BAM file URL or local path')
-    parser_run.add_argument('--output-dir',
-                            default=None,
-                            help='Path/URL to output directory')
-    parser_run.add_argument('-s', '--suffix',
-                            default=None,
-                            help='Additional suffix to add to the names of the output files')
-    parser_run.add_argument('--preprocess-only',
-                            action='store_true',
-                            help='Only runs preprocessing steps')
+    parser_run = subparsers.add_parser('run', parents=[parser_inputs], help='Runs the GATK germline pipeline')
+    add_plan_parser(subparsers, [parser_inputs])
 
     Job.Runner.addToilOptions(parser_run)
     options = parser.parse_args()
@@ -799,11 +1534,14 @@ def main():
         generate_file(os.path.join(cwd, 'config-toil-germline.yaml'), generate_config)
     if options.command == 'generate-manifest' or options.command == 'generate':
         generate_file(os.path.join(cwd, 'manifest-toil-germline.tsv'), generate_manifest)
-    elif options.command == 'run':
+    elif options.command == 'report':
+        report(options.jobStore, options.update_resource_model)
+    elif options.command in ('run', 'plan'):
         # Program checks
-        for program in ['curl', 'docker']:
-            require(next(which(program)),
-                    program + ' must be installed on every node.'.format(program))
+        if options.command == 'run':
+            for program in ['curl', 'docker']:
+                require(next(which(program)),
+                        program + ' must be installed on every node.'.format(program))
 
         require(os.path.exists(options.config), '{} not found. Please run "generate-config"'.format(options.config))
 
@@ -877,6 +1615,14 @@ def main():
                 require(inputs[hard_filter_field], 'Missing %s value for hard filtering, '
                                                    'got %s.' % (hard_filter_field, inputs[hard_filter_field]))
 
+            # The native engine supports a subset of JEXL, so check the expressions before starting
+            if inputs.get('hard_filter_engine') == 'native':
+                for expression_field in ['snp_filter_expression', 'indel_filter_expression']:
+                    try:
+                        compile_filter_expression(inputs[expression_field])
+                    except FilterExpressionError as e:
+                        require(False, 'Invalid %s for the native hard filter engine: %s' % (expression_field, e))
+
         # Set resource parameters
         inputs['xmx'] = human2bytes(inputs['xmx'])
         inputs['file_size'] = human2bytes(inputs['file_size'])
@@ -884,14 +1630,74 @@ def main():
 
         inputs['annotations'] = set(inputs['snp_filter_annotations'] + inputs['indel_filter_annotations'])
 
+        # Number of interval shards for HaplotypeCaller and GenotypeGVCFs
+        inputs['hc_shards'] = int(inputs.get('hc_shards') or 1)
+        inputs['genotype_shards'] = int(inputs.get('genotype_shards') or 1)
+
+        # Maximum number of GVCFs combined by one CombineGVCFs job. Zero disables the merge tree.
+        inputs['combine_fan_in'] = int(inputs.get('combine_fan_in') or 0)
+        require(inputs['combine_fan_in'] != 1, 'The combine-fan-in parameter must be at least 2')
+
+        # Batched Oncotator annotation. Zero runs one Oncotator job per sample.
+        inputs['oncotator_batch_size'] = int(inputs.get('oncotator_batch_size') or 0)
+        shard_size = inputs.get('oncotator_shard_size')
+        inputs['oncotator_shard_size'] = human2bytes(str(shard_size)) if shard_size else None
+
+        # Persistent reference file cache shared with the other pipelines
+        inputs['reference_cache'] = inputs.get('reference_cache', None)
+
+        # Sort and index the bwakit output in the alignment job
+        inputs['fused_alignment'] = bool(inputs.get('fused_alignment', False))
+
+        # Number of reads per FASTQ alignment chunk. Zero aligns each sample in a single job.
+        inputs['chunk_reads'] = int(inputs.get('chunk_reads') or 0)
+        require(inputs['chunk_reads'] >= 0, 'The chunk-reads parameter must not be negative')
+
+        # GATK jobs on the same node share a read-only copy of the genome reference
+        inputs['node_reference'] = bool(inputs.get('node_reference', False))
+
+        # GVCFs are passed between jobs and published as BGZF compressed files with tabix indexes
+        inputs['compress_vcfs'] = bool(inputs.get('compress_vcfs', False))
+
+        # Prepared alignments are passed between jobs and published as BAMs or reference compressed CRAMs
+        inputs['alignment_format'] = inputs.get('alignment_format') or 'bam'
+        require(inputs['alignment_format'] in ('bam', 'cram'),
+                'The alignment-format parameter must be bam or cram, got %s' % inputs['alignment_format'])
+
+        # Persistent GVCF cache. Cache lookups happen when the workflow starts.
+        inputs['gvcf_cache'] = inputs.get('gvcf_cache', None)
+        inputs['gvcf_cache_keys'] = {}
+        inputs['cached_gvcfs'] = {}
+
+        # Import outputs that a previous run published with the same inputs. Stage keys are generated and
+        # published outputs are looked up when the workflow starts.
+        inputs['resume_outputs'] = bool(inputs.get('resume_outputs', False))
+        inputs['stage_keys'] = {stage: {} for stage in RESUMABLE_STAGES}
+        inputs['published_outputs'] = {stage: {} for stage in RESUMABLE_STAGES}
+
+        # Disk requirements are estimated from the metrics of previous runs when a resource model is given
+        inputs['resource_model'] = ResourceModel.load(inputs.get('resource_model'))
+
+        # Hard filter implementation: gatk runs the GATK tools, native filters the VCF in a single pass
+        inputs['hard_filter_engine'] = inputs.get('hard_filter_engine') or 'gatk'
+        require(inputs['hard_filter_engine'] in ('gatk', 'native'),
+                'The hard-filter-engine parameter must be gatk or native, got %s' % inputs['hard_filter_engine'])
+
         # HaplotypeCaller test data for testing
         inputs['hc_output'] = inputs.get('hc_output', None)
 
+        # Download jobs are sized from the sample sizes. file-size is used when a size cannot be determined.
+        inputs['url_sizes'] = probe_url_sizes([sample.url for sample in samples] +
+                                              [sample.paired_url for sample in samples])
+
         # It is a toil-scripts convention to store input parameters in a Namespace object
         config = argparse.Namespace(**inputs)
 
-        root = Job.wrapJobFn(run_gatk_germline_pipeline, samples, config)
-        Job.Runner.startToil(root, options)
+        if options.command == 'plan':
+            plan(options, run_gatk_germline_pipeline, samples, config)
+        else:
+            root = Job.wrapJobFn(run_gatk_germline_pipeline, samples, config)
+            Job.Runner.startToil(root, options)
 
 
 if __name__ == '__main__':
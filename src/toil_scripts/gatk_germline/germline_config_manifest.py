@@ -19,7 +19,7 @@ def generate_config():
         # Required: Java heap size (human readable bytes format i.e. 10G)
         xmx:
 
-        # Required: Approximate input file size (human readable bytes format)
+        # Required: Approximate input file size, used when the size of a sample cannot be determined (human readable bytes format)
         file-size:
 
         # Required: S3 URL or local path to output directory
@@ -61,6 +61,12 @@ def generate_config():
         # Optional. Trim adapters (Default: False)
         trim:
 
+        # Optional: Sort and index the aligned BAM in the BWA alignment job (Default: False)
+        fused-alignment:
+
+        # Optional: Number of reads per FASTQ chunk for parallel BWA alignment (Default: None)
+        chunk-reads:
+
         # Required for BWA alignment: URL or local path to BWA index file prefix.amb (Default: None)
         amb:
 
@@ -103,18 +109,57 @@ def generate_config():
         # Required for hard filtering: INDEL JEXL filter expression
         indel_filter_expression:
 
+        # Optional: Hard filter implementation, gatk or native (Default: gatk)
+        hard-filter-engine:
+
         # Optional: Run GATK VQSR (Default: False)
         run-vqsr:
 
+        # Optional: Number of genomic interval shards used to parallelize HaplotypeCaller for each sample (Default: 1)
+        hc-shards:
+
         # Optional: Merges all samples into a single GVCF for genotyping and filtering (Default: False)
         joint-genotype:
 
+        # Optional: Number of genomic interval shards used to parallelize GenotypeGVCFs (Default: 1)
+        genotype-shards:
+
+        # Optional: Maximum number of GVCFs merged by each CombineGVCFs job before joint genotyping (Default: None)
+        combine-fan-in:
+
+        # Optional: S3 URL or shared local path to a persistent cache of per-sample GVCFs (Default: None)
+        gvcf-cache:
+
+        # Optional: If True, imports outputs published by a previous run with the same inputs (Default: False)
+        resume-outputs:
+
+        # Optional: S3 URL or shared local path to a persistent cache of reference files (Default: None)
+        reference-cache:
+
+        # Optional: If true, GATK jobs share a read-only copy of the genome reference on each node (Default: False)
+        node-reference:
+
+        # Optional: If true, GVCFs are BGZF compressed and tabix indexed (Default: False)
+        compress-vcfs:
+
+        # Optional: Format of preprocessed alignments, bam or cram (Default: bam)
+        alignment-format:
+
+        # Optional: Local path to a resource model used to estimate disk and memory requirements (Default: None)
+        resource-model:
+
         # Optional: Run Oncotator (Default: False)
         run-oncotator:
 
         # Required for Oncotator: URL or local path to Oncotator database (Default: None)
         oncotator-db:
 
+        # Optional: Number of VCFs annotated by each Oncotator job. The database is unpacked once per node (Default: None)
+        oncotator-batch-size:
+
+        # Optional: In batched mode, VCFs larger than this are split by contig (human readable bytes format) (Default: None)
+        oncotator-shard-size:
+
         # Optional: Suffix added to output filename (i.e. .toil)
         suffix:
 
@@ -1,24 +1,33 @@
 #!/usr/bin/env python2.7
 import os
 
-from toil.job import PromisedRequirement
 from toil_lib.tools.variant_manipulation import gatk_select_variants, \
     gatk_variant_filtration, gatk_combine_variants
 
-from toil_scripts.gatk_germline.common import output_file_job
+from toil_scripts.gatk_germline.common import reference_disk, reference_files
+from toil_scripts.gatk_germline.variant_filter import hard_filter_vcf
+from toil_scripts.metrics import metered
 
+# Record the resource usage of the toil-lib job functions run by this pipeline
+gatk_select_variants = metered(gatk_select_variants, __name__)
+gatk_variant_filtration = metered(gatk_variant_filtration, __name__)
+gatk_combine_variants = metered(gatk_combine_variants, __name__)
 
+
+@metered
 def hard_filter_pipeline(job, uuid, vcf_id, config):
     """
-    Runs GATK Hard Filtering on a Genomic VCF file and uploads the results.
+    Runs GATK Hard Filtering on a Genomic VCF file. The caller uploads the filtered VCF.
 
-    0: Start                0 --> 1 --> 3 --> 5 --> 6
+    0: Start                0 --> 1 --> 3 --> 5
     1: Select SNPs                |           |
     2: Select INDELs              +-> 2 --> 4 +
     3: Apply SNP Filter
     4: Apply INDEL Filter
     5: Merge SNP and INDEL VCFs
-    6: Write filtered VCF to output directory
+
+    If config.hard_filter_engine is 'native', steps 1-5 are replaced by a single job that streams the VCF
+    and evaluates both filter expressions without downloading the genome reference.
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
     :param str uuid: Unique sample identifier
@@ -33,23 +42,37 @@ def hard_filter_pipeline(job, uuid, vcf_id, config):
         config.indel_filter_name        Name of INDEL filter for VCF header
         config.indel_filter_expression  INDEL JEXL filter expression
         config.xmx                      Java heap size in bytes
-        config.suffix                   Suffix added to output filename
-        config.output_dir               URL or local path to output directory
-        config.ssec                     Path to key file for SSE-C encryption
+        config.resource_model           Estimates disk requirements from previous runs
+        config.hard_filter_engine       Hard filter implementation: gatk or native
     :return: SNP and INDEL FileStoreIDs
     :rtype: tuple
     """
     job.fileStore.logToMaster('Running Hard Filter on {}'.format(uuid))
 
-    # Get the total size of the genome reference
-    genome_ref_size = config.genome_fasta.size + config.genome_fai.size + config.genome_dict.size
+    if config.hard_filter_engine == 'native':
+        # The filtered VCF is the same size as the input VCF
+        filtered_vcf = job.wrapJobFn(native_hard_filter,
+                                     vcf_id,
+                                     config.snp_filter_name,
+                                     config.snp_filter_expression,
+                                     config.indel_filter_name,
+                                     config.indel_filter_expression,
+                                     disk=config.resource_model.disk('native_hard_filter',
+                                                                     lambda vcf: 2 * vcf.size,
+                                                                     vcf_id))
+        job.addChild(filtered_vcf)
+        return filtered_vcf.rv()
+
+    # The genome reference files are passed to the disk requirements of the GATK jobs
+    ref_files = reference_files(config)
 
     # The SelectVariants disk requirement depends on the input VCF, the genome reference files,
     # and the output VCF. The output VCF is smaller than the input VCF. The disk requirement
     # is identical for SNPs and INDELs.
-    select_variants_disk = PromisedRequirement(lambda vcf, ref_size: 2 * vcf.size + ref_size,
-                                               vcf_id,
-                                               genome_ref_size)
+    select_variants_disk = config.resource_model.disk('gatk_select_variants',
+                                                      lambda vcf, ref: 2 * vcf.size + reference_disk(ref),
+                                                      vcf_id,
+                                                      ref_files)
     select_snps = job.wrapJobFn(gatk_select_variants,
                                 'SNP',
                                 vcf_id,
@@ -61,9 +84,10 @@ def hard_filter_pipeline(job, uuid, vcf_id, config):
 
     # The VariantFiltration disk requirement depends on the input VCF, the genome reference files,
     # and the output VCF. The filtered VCF is smaller than the input VCF.
-    snp_filter_disk = PromisedRequirement(lambda vcf, ref_size: 2 * vcf.size + ref_size,
-                                          select_snps.rv(),
-                                          genome_ref_size)
+    snp_filter_disk = config.resource_model.disk('gatk_variant_filtration',
+                                                 lambda vcf, ref: 2 * vcf.size + reference_disk(ref),
+                                                 select_snps.rv(),
+                                                 ref_files)
 
     snp_filter = job.wrapJobFn(gatk_variant_filtration,
                                select_snps.rv(),
@@ -84,9 +108,10 @@ def hard_filter_pipeline(job, uuid, vcf_id, config):
                                   memory=config.xmx,
                                   disk=select_variants_disk)
 
-    indel_filter_disk = PromisedRequirement(lambda vcf, ref_size: 2 * vcf.size + ref_size,
-                                            select_indels.rv(),
-                                            genome_ref_size)
+    indel_filter_disk = config.resource_model.disk('gatk_variant_filtration',
+                                                   lambda vcf, ref: 2 * vcf.size + reference_disk(ref),
+                                                   select_indels.rv(),
+                                                   ref_files)
 
     indel_filter = job.wrapJobFn(gatk_variant_filtration,
                                  select_indels.rv(),
@@ -100,11 +125,12 @@ def hard_filter_pipeline(job, uuid, vcf_id, config):
 
     # The CombineVariants disk requirement depends on the SNP and INDEL input VCFs and the
     # genome reference files. The combined VCF is approximately the same size as the input files.
-    combine_vcfs_disk = PromisedRequirement(lambda vcf1, vcf2, ref_size:
-                                            2 * (vcf1.size + vcf2.size) + ref_size,
-                                            indel_filter.rv(),
-                                            snp_filter.rv(),
-                                            genome_ref_size)
+    combine_vcfs_disk = config.resource_model.disk('gatk_combine_variants',
+                                                   lambda vcf1, vcf2, ref:
+                                                   2 * (vcf1.size + vcf2.size) + reference_disk(ref),
+                                                   indel_filter.rv(),
+                                                   snp_filter.rv(),
+                                                   ref_files)
 
     combine_vcfs = job.wrapJobFn(gatk_combine_variants,
                                  {'SNPs': snp_filter.rv(), 'INDELs': indel_filter.rv()},
@@ -124,14 +150,32 @@ def hard_filter_pipeline(job, uuid, vcf_id, config):
     select_indels.addChild(indel_filter)
     indel_filter.addChild(combine_vcfs)
 
-    # Output the hard filtered VCF
-    output_dir = os.path.join(config.output_dir, uuid)
-    output_filename = '%s.hard_filter%s.vcf' % (uuid, config.suffix)
-    output_vcf = job.wrapJobFn(output_file_job,
-                               output_filename,
-                               combine_vcfs.rv(),
-                               output_dir,
-                               s3_key_path=config.ssec,
-                               disk=PromisedRequirement(lambda x: x.size, combine_vcfs.rv()))
-    combine_vcfs.addChild(output_vcf)
     return combine_vcfs.rv()
+
+
+@metered
+def native_hard_filter(job, vcf_id, snp_filter_name, snp_filter_expression,
+                       indel_filter_name, indel_filter_expression):
+    """
+    Applies SNP and INDEL hard filters in a single pass over a VCF file. Produces the same records as
+    selecting SNPs and INDELs, filtering each with GATK VariantFiltration, and combining the results.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str vcf_id: VCF FileStoreID
+    :param str snp_filter_name: Name of SNP filter for VCF header
+    :param str snp_filter_expression: SNP JEXL filter expression
+    :param str indel_filter_name: Name of INDEL filter for VCF header
+    :param str indel_filter_expression: INDEL JEXL filter expression
+    :return: Hard filtered VCF FileStoreID
+    :rtype: str
+    """
+    work_dir = job.fileStore.getLocalTempDir()
+    output_path = os.path.join(work_dir, 'filtered.vcf')
+    filters = {'SNP': (snp_filter_name, snp_filter_expression),
+               'INDEL': (indel_filter_name, indel_filter_expression)}
+    with job.fileStore.readGlobalFileStream(vcf_id) as f_in, open(output_path, 'w') as f_out:
+        counts = hard_filter_vcf(f_in, f_out, filters)
+    for var_type in sorted(counts):
+        job.fileStore.logToMaster('Hard filter {}s: {PASS} passed, {FILTERED} filtered'.format(var_type,
+                                                                                                **counts[var_type]))
+    return job.fileStore.writeGlobalFile(output_path)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python2.7
+import os
+
+
+def parse_sequence_dictionary(path):
+    """
+    Reads the contig names and lengths from a Picard sequence dictionary file
+
+    :param str path: Path to sequence dictionary file
+    :return: List of (contig, length) tuples in reference order
+    :rtype: list[tuple(str, int)]
+    """
+    contigs = []
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.startswith('@SQ'):
+                continue
+            tags = dict(field.split(':', 1) for field in line.rstrip('\n').split('\t')[1:])
+            contigs.append((tags['SN'], int(tags['LN'])))
+    return contigs
+
+
+def partition_genome(contigs, num_shards):
+    """
+    Splits the genome into at most num_shards shards of approximately equal length. Contigs longer
+    than the target shard length are split across several shards. Shards and the intervals within
+    each shard are in reference order.
+
+    >>> partition_genome([('1', 100), ('2', 50), ('3', 50)], 2)
+    [[('1', 1, 100)], [('2', 1, 50), ('3', 1, 50)]]
+    >>> partition_genome([('1', 100)], 3)
+    [[('1', 1, 34)], [('1', 35, 68)], [('1', 69, 100)]]
+
+    :param list[tuple(str, int)] contigs: List of (contig, length) tuples in reference order
+    :param int num_shards: Number of shards
+    :return: List of shards. Each shard is a list of 1-based, closed (contig, start, end) intervals.
+    :rtype: list[list[tuple(str, int, int)]]
+    """
+    total_length = sum(length for _, length in contigs)
+    # Round up so that the last shard is never a sliver of the genome
+    shard_length = max(1, -(-total_length // max(1, num_shards)))
+    shards = []
+    shard, shard_fill = [], 0
+    for contig, length in contigs:
+        start = 1
+        while start <= length:
+            end = min(length, start + shard_length - shard_fill - 1)
+            shard.append((contig, start, end))
+            shard_fill += end - start + 1
+            start = end + 1
+            if shard_fill >= shard_length:
+                shards.append(shard)
+                shard, shard_fill = [], 0
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def partition_contigs(contigs, num_shards):
+    """
+    Groups whole contigs into at most num_shards shards of approximately equal length. Unlike
+    partition_genome, no contig is split, so no VCF record can span two shards.
+
+    >>> partition_contigs([('1', 100), ('2', 50), ('3', 30), ('4', 20)], 2)
+    [[('1', 1, 100)], [('2', 1, 50), ('3', 1, 30), ('4', 1, 20)]]
+    >>> partition_contigs([('1', 100), ('2', 50)], 5)
+    [[('1', 1, 100)], [('2', 1, 50)]]
+
+    :param list[tuple(str, int)] contigs: List of (contig, length) tuples in reference order
+    :param int num_shards: Number of shards
+    :return: List of shards. Each shard is a list of 1-based, closed (contig, start, end) intervals.
+    :rtype: list[list[tuple(str, int, int)]]
+    """
+    total_length = sum(length for _, length in contigs)
+    shard_length = max(1, -(-total_length // max(1, num_shards)))
+    shards = []
+    shard, shard_fill = [], 0
+    for contig, length in contigs:
+        shard.append((contig, 1, length))
+        shard_fill += length
+        if shard_fill >= shard_length:
+            shards.append(shard)
+            shard, shard_fill = [], 0
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def format_interval(interval):
+    """
+    Formats an interval for the GATK -L option
+
+    >>> format_interval(('chr1', 1, 1000))
+    'chr1:1-1000'
+
+    :param tuple(str, int, int) interval: 1-based, closed (contig, start, end) interval
+    :return: GATK interval string
+    :rtype: str
+    """
+    return '{}:{}-{}'.format(*interval)
+
+
+def write_interval_list(intervals, work_dir, name='shard.intervals'):
+    """
+    Writes intervals to a GATK interval list file. GATK recognizes the .intervals extension.
+
+    :param list[tuple(str, int, int)] intervals: 1-based, closed (contig, start, end) intervals
+    :param str work_dir: Directory for the interval list
+    :param str name: Name of the interval list file
+    :return: Path to interval list file
+    :rtype: str
+    """
+    path = os.path.join(work_dir, name)
+    with open(path, 'w') as f:
+        for interval in intervals:
+            f.write(format_interval(interval) + '\n')
+    return path
+
+
+def index_shards(shards):
+    """
+    Builds a lookup table from contig to the shard intervals on that contig
+
+    >>> index_shards([[('1', 1, 50)], [('1', 51, 100), ('2', 1, 10)]])['1']
+    [(1, 50, 0), (51, 100, 1)]
+
+    :param list[list[tuple(str, int, int)]] shards: Shards from partition_genome
+    :return: Dictionary of contig to list of (start, end, shard index) tuples
+    :rtype: dict
+    """
+    index = {}
+    for i, shard in enumerate(shards):
+        for contig, start, end in shard:
+            index.setdefault(contig, []).append((start, end, i))
+    return index
+
+
+def overlapping_shards(index, contig, start, end):
+    """
+    Finds the shards that overlap a genomic interval
+
+    >>> index = index_shards([[('1', 1, 50)], [('1', 51, 100), ('2', 1, 10)]])
+    >>> overlapping_shards(index, '1', 45, 60)
+    [0, 1]
+    >>> overlapping_shards(index, '3', 1, 10)
+    []
+
+    :param dict index: Lookup table from index_shards
+    :param str contig: Contig name
+    :param int start: 1-based start position
+    :param int end: 1-based, closed end position
+    :return: Sorted shard indices
+    :rtype: list[int]
+    """
+    return sorted(set(i for shard_start, shard_end, i in index.get(contig, [])
+                      if shard_start <= end and start <= shard_end))
+
+
+def vcf_record_interval(line):
+    """
+    Returns the genomic interval spanned by a VCF record. GVCF reference blocks end at the INFO END position.
+
+    >>> vcf_record_interval('1\\t100\\t.\\tA\\t<NON_REF>\\t.\\t.\\tEND=250\\tGT\\t0/0\\n')
+    ('1', 100, 250)
+    >>> vcf_record_interval('1\\t100\\t.\\tACG\\tA\\t50\\tPASS\\tQD=2.0\\n')
+    ('1', 100, 102)
+
+    :param str line: VCF record
+    :return: 1-based, closed (contig, start, end) interval
+    :rtype: tuple(str, int, int)
+    """
+    fields = line.split('\t', 8)
+    contig, start, ref = fields[0], int(fields[1]), fields[3]
+    end = start + len(ref) - 1
+    if len(fields) > 7:
+        for info in fields[7].rstrip('\n').split(';'):
+            if info.startswith('END='):
+                end = max(end, int(info[4:]))
+    return contig, start, end
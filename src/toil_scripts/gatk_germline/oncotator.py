@@ -0,0 +1,236 @@
+#!/usr/bin/env python2.7
+import os
+import tarfile
+
+from toil_lib import require
+from toil_lib.programs import docker_call
+
+from toil_scripts.gatk_germline.common import OUTPUT_BATCH_SIZE, gather_vcfs, node_local_dir, output_files
+from toil_scripts.metrics import metered, metered_docker_call
+
+# Record the time spent in the containers run by this module
+docker_call = metered_docker_call(docker_call)
+
+# Docker image used by toil_lib.tools.variant_annotation.run_oncotator
+ONCOTATOR_IMAGE = 'jpfeil/oncotator:1.9--8fffc356981862d50cfacd711b753700b886b605'
+
+# Oncotator database tarballs are gzip compressed. The unpacked database is assumed to be at most this
+# many times the size of the tarball. Resource models learn the actual size from the node-local
+# database directory, which counts towards the peak disk usage of the jobs that use it.
+ONCOTATOR_DB_EXPANSION_RATIO = 3
+
+
+def oncotator_db_disk(oncotator_db):
+    """
+    Returns the disk space for the unpacked Oncotator database. Any Oncotator job may be the first on
+    its node and unpack the database, so every job reserves it, see reference_disk.
+
+    >>> from argparse import Namespace
+    >>> oncotator_db_disk(Namespace(size=100))
+    300
+
+    :param str oncotator_db: FileStoreID for Oncotator database tarball
+    :return: Size in bytes
+    :rtype: int
+    """
+    return ONCOTATOR_DB_EXPANSION_RATIO * oncotator_db.size
+
+
+def checked_members(tar, path):
+    """
+    Yields the members of a tar archive that is extracted to path. Fails on members that would be written
+    outside of path, such as absolute paths, paths with .. and links to files outside of path, and on
+    device files.
+
+    >>> import shutil, tempfile
+    >>> from StringIO import StringIO
+    >>> def archive(*members):
+    ...     f = StringIO()
+    ...     with tarfile.open(fileobj=f, mode='w') as tar:
+    ...         for member in members:
+    ...             tar.addfile(member, StringIO('x' * member.size))
+    ...     f.seek(0)
+    ...     return tarfile.open(fileobj=f, mode='r|')
+    >>> def link(name, target):
+    ...     member = tarfile.TarInfo(name)
+    ...     member.type, member.linkname = tarfile.SYMTYPE, target
+    ...     return member
+    >>> db_dir = tempfile.mkdtemp()
+    >>> [m.name for m in checked_members(archive(tarfile.TarInfo('db/a'), link('db/b', 'a')), db_dir)]
+    ['db/a', 'db/b']
+    >>> list(checked_members(archive(tarfile.TarInfo('../a')), db_dir))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    UserError: The Oncotator database contains a file outside of its directory: ../a
+    >>> list(checked_members(archive(link('db/b', '/etc/passwd')), db_dir))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    UserError: The Oncotator database contains a file outside of its directory: db/b
+    >>> shutil.rmtree(db_dir)
+
+    :param tarfile.TarFile tar: Archive opened for reading
+    :param str path: Directory that the archive is extracted to
+    :return: Members of the archive
+    :rtype: iterator[tarfile.TarInfo]
+    """
+    root = os.path.realpath(path)
+
+    def inside(target):
+        target = os.path.realpath(target)
+        return target == root or target.startswith(root + os.sep)
+
+    for member in tar:
+        target = os.path.join(root, member.name)
+        message = 'The Oncotator database contains a file outside of its directory: {}'.format(member.name)
+        require(inside(target), message)
+        if member.issym():
+            require(inside(os.path.join(os.path.dirname(target), member.linkname)), message)
+        elif member.islnk():
+            require(inside(os.path.join(root, member.linkname)), message)
+        require(not member.isdev(), 'The Oncotator database contains a device file: {}'.format(member.name))
+        yield member
+
+
+def node_oncotator_db(job, oncotator_db):
+    """
+    Returns the Oncotator database directory that is shared by the jobs of this workflow on the current
+    node. The first job on the node to need the database unpacks the tarball from the FileStore.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str oncotator_db: FileStoreID for Oncotator database tarball
+    :return: Path to the Oncotator database directory
+    :rtype: str
+    """
+    def fill(db_dir):
+        # Stream the tarball so that only the unpacked database is written to local disk
+        with job.fileStore.readGlobalFileStream(oncotator_db) as f_in:
+            try:
+                with tarfile.open(fileobj=f_in, mode='r|*') as tar:
+                    tar.extractall(db_dir, members=checked_members(tar, db_dir))
+            except tarfile.ReadError:
+                require(False, 'The Oncotator database must be a tar archive')
+
+    db_dir = node_local_dir(job, 'oncotator-db', [oncotator_db], fill)
+    # Database tarballs usually contain a single top level directory
+    entries = os.listdir(db_dir)
+    if len(entries) == 1 and os.path.isdir(os.path.join(db_dir, entries[0])):
+        return os.path.join(db_dir, entries[0])
+    return db_dir
+
+
+@metered
+def run_oncotator_batch(job, vcfs, oncotator_db):
+    """
+    Annotates a batch of VCF files with Oncotator. The Oncotator database is unpacked once per node
+    and mounted read-only into each Oncotator container.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param dict vcfs: Dictionary of VCF FileStoreIDs {name: FileStoreID}
+    :param str oncotator_db: FileStoreID for Oncotator database tarball
+    :return: Dictionary of annotated VCF FileStoreIDs {name: FileStoreID}
+    :rtype: dict
+    """
+    job.fileStore.logToMaster('Running Oncotator on a batch of {} VCFs'.format(len(vcfs)))
+    db_dir = node_oncotator_db(job, oncotator_db)
+    work_dir = job.fileStore.getLocalTempDir()
+    # toil-lib's docker_call mounts the work directory and appends these parameters
+    docker_parameters = ['-v', '{}:/oncotator_db:ro'.format(db_dir)]
+    annotated = {}
+    for i, name in enumerate(sorted(vcfs)):
+        input_vcf = 'input.{}.vcf'.format(i)
+        output_vcf = 'annotated.{}.vcf'.format(i)
+        job.fileStore.readGlobalFile(vcfs[name], os.path.join(work_dir, input_vcf))
+        command = ['-i', 'VCF',
+                   '-o', 'VCF',
+                   '--db-dir', '/oncotator_db',
+                   input_vcf,
+                   output_vcf,
+                   'hg19']
+        docker_call(job=job, work_dir=work_dir,
+                    env={'_JAVA_OPTIONS': '-Djava.io.tmpdir=/data/ -Xmx{}'.format(job.memory)},
+                    parameters=command,
+                    tool=ONCOTATOR_IMAGE,
+                    inputs=[input_vcf],
+                    outputs={output_vcf: None},
+                    docker_parameters=docker_parameters)
+        annotated[name] = job.fileStore.writeGlobalFile(os.path.join(work_dir, output_vcf))
+    return annotated
+
+
+@metered
+def annotate_vcf_batches(job, vcf_shards, config):
+    """
+    Groups VCF files, or contig shards of VCF files, into batches and annotates each batch with Oncotator
+    in a single job. The annotated shards of each sample are then gathered and saved to the output directory.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param dict vcf_shards: Dictionary of VCF shards in reference order {Sample identifier: [FileStoreID]}
+    :param Namespace config: Input parameters and shared FileStoreIDs
+        Requires the following config attributes:
+        config.oncotator_db         FileStoreID to Oncotator database
+        config.oncotator_batch_size Number of VCF files annotated by each Oncotator job
+        config.cores                Number of cores for each job
+        config.xmx                  Java heap size in bytes
+        config.resource_model       Estimates disk requirements from previous runs
+        Additional parameters are needed for output_annotated_vcfs.
+    """
+    shards = [('{}.{}'.format(uuid, i), vcf_id)
+              for uuid in sorted(vcf_shards)
+              for i, vcf_id in enumerate(vcf_shards[uuid])]
+    batches = [dict(shards[i:i + config.oncotator_batch_size])
+               for i in range(0, len(shards), config.oncotator_batch_size)]
+    job.fileStore.logToMaster('Annotating {} VCFs in {} Oncotator batches'.format(len(shards), len(batches)))
+
+    annotated = {}
+    for batch in batches:
+        # The Oncotator disk requirement depends on the input VCFs, the annotated VCFs, which are
+        # significantly larger than the input VCFs, and the database, which is unpacked outside of the
+        # job's work directory.
+        onco_disk = config.resource_model.disk('run_oncotator_batch',
+                                               lambda vcf_ids, db: 3 * sum(vcf.size for vcf in vcf_ids) +
+                                               oncotator_db_disk(db),
+                                               batch.values(),
+                                               config.oncotator_db)
+        annotate = job.addChildJobFn(run_oncotator_batch,
+                                     batch,
+                                     config.oncotator_db,
+                                     disk=onco_disk,
+                                     cores=config.cores,
+                                     memory=config.xmx)
+        for name in batch:
+            annotated[name] = annotate.rv(name)
+
+    annotated_shards = {uuid: [annotated['{}.{}'.format(uuid, i)] for i in range(len(vcf_shards[uuid]))]
+                        for uuid in vcf_shards}
+    job.addFollowOnJobFn(output_annotated_vcfs, annotated_shards, config)
+
+
+@metered
+def output_annotated_vcfs(job, annotated_shards, config):
+    """
+    Gathers the annotated shards of each sample and saves the annotated VCFs to the output directory
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param dict annotated_shards: Dictionary of annotated VCF shards {Sample identifier: [FileStoreID]}
+    :param Namespace config: Input parameters and shared FileStoreIDs
+        Requires the following config attributes:
+        config.suffix               Suffix added to output filename
+        config.output_dir           URL or local path to output directory
+        config.ssec                 Path to key file for SSE-C encryption
+    """
+    # Shards are gathered first, then the annotated VCFs are uploaded in batches of samples
+    annotated_vcfs = {}
+    for uuid, vcf_ids in annotated_shards.iteritems():
+        filename = '{}.oncotator{}.vcf'.format(uuid, config.suffix)
+        path = os.path.join(config.output_dir, uuid, filename)
+        if len(vcf_ids) == 1:
+            annotated_vcfs[path] = vcf_ids[0]
+            continue
+
+        # The shards are streamed, so the gather disk requirement only depends on the gathered VCF
+        annotated_vcfs[path] = job.addChildJobFn(gather_vcfs, vcf_ids, disk=sum(vcf.size for vcf in vcf_ids)).rv()
+
+    paths = sorted(annotated_vcfs)
+    for i in range(0, len(paths), OUTPUT_BATCH_SIZE):
+        batch = {path: annotated_vcfs[path] for path in paths[i:i + OUTPUT_BATCH_SIZE]}
+        job.addFollowOn(output_files(config, batch))
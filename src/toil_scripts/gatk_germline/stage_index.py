@@ -0,0 +1,161 @@
+#!/usr/bin/env python2.7
+"""
+Stage result index for published pipeline outputs.
+
+Each published output is recorded in a hidden index directory next to it. The record is named after the
+output and the stage key, a hash of the inputs, options and tool image that produced the output. A
+record is only written after its output is complete, so an output with a matching record can be
+imported by a later run instead of being recomputed.
+"""
+import json
+import os
+import re
+from urlparse import urlparse
+
+from bd2k.util.files import mkdir_p
+
+from toil_scripts.urls import probe_url_sizes, s3_connection, url_size
+
+# Directory within each output directory that holds the stage records
+STAGE_INDEX_DIR = '.stage_index'
+
+
+def stage_record_url(output_dir, filename, stage_key):
+    """
+    Returns the URL of the stage record for a published output
+
+    >>> stage_record_url('s3://bucket/outputs/sample', 'sample.g.vcf', 'a' * 40)
+    's3://bucket/outputs/sample/.stage_index/sample.g.vcf.aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'
+
+    :param str output_dir: S3 URL or local path to the output directory
+    :param str filename: Output filename
+    :param str stage_key: Stage key of the output
+    :return: URL or local path to the stage record
+    :rtype: str
+    """
+    return os.path.join(output_dir, STAGE_INDEX_DIR, '{}.{}'.format(filename, stage_key))
+
+
+def write_stage_record(output_dir, filename, stage_key):
+    """
+    Records that a published output was produced by the stage with the given key. Write the record after
+    the output is complete.
+
+    >>> import shutil, tempfile
+    >>> tmp = tempfile.mkdtemp()
+    >>> write_stage_record(tmp, 'sample.g.vcf', 'a' * 40)
+    >>> write_stage_record(tmp, 'sample.genotyped.vcf', 'a' * 40)
+    >>> remove_stage_records(tmp, 'sample.g.vcf')
+    >>> os.listdir(os.path.join(tmp, STAGE_INDEX_DIR)) == ['sample.genotyped.vcf.' + 'a' * 40]
+    True
+    >>> shutil.rmtree(tmp)
+
+    :param str output_dir: S3 URL or local path to the output directory
+    :param str filename: Output filename
+    :param str stage_key: Stage key of the output
+    """
+    record = json.dumps({'filename': filename, 'stage_key': stage_key})
+    record_url = stage_record_url(output_dir, filename, stage_key)
+    parsed_url = urlparse(record_url)
+    if parsed_url.scheme == 's3':
+        # Stage records only contain hashes, so they are not encrypted with the SSE-C key of the outputs
+        s3 = s3_connection()
+        try:
+            bucket = s3.get_bucket(parsed_url.netloc, validate=False)
+            bucket.new_key(parsed_url.path.lstrip('/')).set_contents_from_string(record)
+        finally:
+            s3.close()
+    else:
+        mkdir_p(os.path.dirname(parsed_url.path))
+        with open(parsed_url.path, 'w') as f:
+            f.write(record)
+
+
+def remove_stage_records(output_dir, filename):
+    """
+    Removes the stage records of an output. Called before an output is replaced, so that its records
+    never describe a different version of the output.
+
+    :param str output_dir: S3 URL or local path to the output directory
+    :param str filename: Output filename
+    """
+    record_pattern = re.compile(re.escape(filename) + r'\.[0-9a-f]{40}$')
+    index_url = urlparse(os.path.join(output_dir, STAGE_INDEX_DIR))
+    if index_url.scheme == 's3':
+        s3 = s3_connection()
+        try:
+            bucket = s3.get_bucket(index_url.netloc, validate=False)
+            prefix = index_url.path.lstrip('/') + '/'
+            for key in bucket.list(prefix=prefix + filename + '.'):
+                if record_pattern.match(key.name[len(prefix):]):
+                    key.delete()
+        finally:
+            s3.close()
+    elif os.path.isdir(index_url.path):
+        for name in os.listdir(index_url.path):
+            if record_pattern.match(name):
+                os.remove(os.path.join(index_url.path, name))
+
+
+def is_published(output_dir, filename, stage_key):
+    """
+    Checks whether an output exists with a stage record of the given key, in which case exporting it
+    again would write the same file
+
+    >>> import shutil, tempfile
+    >>> tmp = tempfile.mkdtemp()
+    >>> with open(os.path.join(tmp, 'sample.g.vcf'), 'w') as f:
+    ...     f.write('##fileformat=VCFv4.2\\n')
+    >>> is_published(tmp, 'sample.g.vcf', 'a' * 40)
+    False
+    >>> write_stage_record(tmp, 'sample.g.vcf', 'a' * 40)
+    >>> is_published(tmp, 'sample.g.vcf', 'a' * 40), is_published(tmp, 'sample.g.vcf', 'b' * 40)
+    (True, False)
+    >>> shutil.rmtree(tmp)
+
+    :param str output_dir: S3 URL or local path to the output directory
+    :param str filename: Output filename
+    :param str stage_key: Stage key of the output
+    :rtype: bool
+    """
+    return (url_size(stage_record_url(output_dir, filename, stage_key)) is not None and
+            url_size(os.path.join(output_dir, filename)) is not None)
+
+
+def find_published_outputs(outputs):
+    """
+    Looks up outputs that were published with a matching stage record
+
+    >>> import shutil, tempfile
+    >>> tmp = tempfile.mkdtemp()
+    >>> with open(os.path.join(tmp, 'sample.g.vcf'), 'w') as f:
+    ...     f.write('##fileformat=VCFv4.2\\n')
+    >>> write_stage_record(tmp, 'sample.g.vcf', 'a' * 40)
+    >>> published = find_published_outputs({'gvcf': {'sample': (tmp, 'sample.g.vcf', 'a' * 40)},
+    ...                                      'genotyped': {'sample': (tmp, 'sample.genotyped.vcf', 'a' * 40)}})
+    >>> published['gvcf']['sample'] == ('file://' + os.path.join(tmp, 'sample.g.vcf'), 21)
+    True
+    >>> published['genotyped']
+    {}
+    >>> find_published_outputs({'gvcf': {'sample': (tmp, 'sample.g.vcf', 'b' * 40)}})['gvcf']
+    {}
+    >>> shutil.rmtree(tmp)
+
+    :param dict outputs: Expected outputs {stage: {name: (output directory, filename, stage key)}}
+    :return: Published outputs {stage: {name: (URL, size in bytes)}}
+    :rtype: dict
+    """
+    def as_url(output_dir):
+        # Local output directories must be on a filesystem shared by the worker nodes
+        return output_dir if urlparse(output_dir).scheme else 'file://' + os.path.abspath(output_dir)
+
+    expected = [(stage, name, os.path.join(as_url(output_dir), filename),
+                 stage_record_url(as_url(output_dir), filename, stage_key))
+                for stage, stage_outputs in outputs.iteritems()
+                for name, (output_dir, filename, stage_key) in stage_outputs.iteritems()]
+    sizes = probe_url_sizes([url for _, _, output_url, record_url in expected for url in (output_url, record_url)])
+    published = {stage: {} for stage in outputs}
+    for stage, name, output_url, record_url in expected:
+        if sizes[output_url] is not None and sizes[record_url] is not None:
+            published[stage][name] = (output_url, sizes[output_url])
+    return published
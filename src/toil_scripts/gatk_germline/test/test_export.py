@@ -0,0 +1,143 @@
+from __future__ import print_function
+
+import hashlib
+import logging
+import os
+import random
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase, skipUnless
+from uuid import uuid4
+
+from toil_scripts.benchmark.synthetic import random_contigs, write_vcf
+from toil_scripts.export import multipart_etag, upload_stream_to_s3
+from toil_scripts.gatk_germline.common import output_files_job, write_compressed_vcf
+from toil_scripts.gatk_germline.stage_index import STAGE_INDEX_DIR, stage_record_url
+from toil_scripts.testing import gzip_file, run_workflow
+from toil_scripts.urls import s3_connection
+
+
+log = logging.getLogger(__name__)
+
+
+@skipUnless(os.environ.get('TOIL_SCRIPTS_S3_ENDPOINT') and os.environ.get('TOIL_SCRIPTS_TEST_BUCKET'),
+            'Requires an S3-compatible service')
+class ExportTest(TestCase):
+    """
+    These tests upload to an S3-compatible service, i.e. a local MinIO server, and are skipped unless the
+    following environment variables are set:
+
+    TOIL_SCRIPTS_S3_ENDPOINT - URL of the S3-compatible service, i.e. http://localhost:9000
+
+    TOIL_SCRIPTS_TEST_BUCKET - name of an existing bucket that the tests can write to
+    """
+
+    def setUp(self):
+        self.bucket = os.environ['TOIL_SCRIPTS_TEST_BUCKET']
+        self.key = 'test/export/%s.vcf' % uuid4()
+        self.s3 = s3_connection()
+
+    def tearDown(self):
+        self.s3.get_bucket(self.bucket, validate=False).delete_key(self.key)
+        self.s3.close()
+
+    def _upload(self, data, part_size):
+        md5 = upload_stream_to_s3(StringIO(data), 's3://%s/%s' % (self.bucket, self.key), part_size=part_size)
+        key = self.s3.get_bucket(self.bucket, validate=False).get_key(self.key)
+        return md5, key
+
+    def test_multipart_upload(self):
+        part_size = 5 * 1024 * 1024
+        data = os.urandom(part_size) * 2 + 'tail'
+        md5, key = self._upload(data, part_size)
+        self.assertEqual(md5, hashlib.md5(data).hexdigest())
+        self.assertEqual(key.size, len(data))
+        part_digests = [hashlib.md5(data[i:i + part_size]).digest() for i in range(0, len(data), part_size)]
+        self.assertEqual(key.etag.strip('"'), multipart_etag(part_digests))
+        self.assertEqual(key.get_contents_as_string(), data)
+
+    def test_empty_upload(self):
+        md5, key = self._upload('', 1024)
+        self.assertEqual(md5, hashlib.md5('').hexdigest())
+        self.assertEqual(key.size, 0)
+
+
+def export(job, paths, stage_keys):
+    """
+    Exports local files with output_files_job. Paths ending in .vcf.gz are exported as compressed VCFs
+    with their tabix index.
+
+    :param dict paths: Local files to export {output path: local path}
+    :param dict stage_keys: Stage keys of the outputs {output path: stage key}
+    """
+    outputs = {output_path: write_compressed_vcf(job, path) if path.endswith('.vcf.gz')
+               else job.fileStore.writeGlobalFile(path)
+               for output_path, path in paths.iteritems()}
+    job.addChildJobFn(output_files_job, outputs, stage_keys=stage_keys)
+
+
+class LocalExportTest(TestCase):
+    """
+    Exports outputs to a local directory with and without stage keys
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.work_dir, 'output')
+        self.output = os.path.join(self.output_dir, 'sample.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _export(self, contents, stage_key=None):
+        path = os.path.join(self.work_dir, 'input.txt')
+        with open(path, 'w') as f:
+            f.write(contents)
+        run_workflow(self.work_dir, export, {self.output: path}, {self.output: stage_key} if stage_key else {})
+
+    def _read(self):
+        with open(self.output) as f:
+            return f.read()
+
+    def _records(self):
+        index_dir = os.path.join(self.output_dir, STAGE_INDEX_DIR)
+        return sorted(os.listdir(index_dir)) if os.path.isdir(index_dir) else []
+
+    def test_existing_file_without_stage_key(self):
+        self._export('first')
+        self._export('second')
+        self.assertEqual(self._read(), 'first')
+        self.assertEqual(self._records(), [])
+
+    def test_same_stage_key(self):
+        self._export('first', 'a' * 40)
+        self.assertEqual(self._records(), ['sample.txt.' + 'a' * 40])
+        # A run with the same stage key would write the same file, so it is not exported again
+        self._export('second', 'a' * 40)
+        self.assertEqual(self._read(), 'first')
+        self.assertEqual(self._records(), ['sample.txt.' + 'a' * 40])
+
+    def test_different_stage_key(self):
+        self._export('first', 'a' * 40)
+        self._export('second', 'b' * 40)
+        self.assertEqual(self._read(), 'second')
+        self.assertEqual(self._records(), ['sample.txt.' + 'b' * 40])
+
+    def test_unrecorded_file_is_replaced(self):
+        self._export('first')
+        self._export('second', 'a' * 40)
+        self.assertEqual(self._read(), 'second')
+        self.assertTrue(os.path.exists(stage_record_url(self.output_dir, 'sample.txt', 'a' * 40)))
+
+    def test_compressed_vcf(self):
+        vcf = os.path.join(self.work_dir, 'input.vcf')
+        write_vcf(vcf, random_contigs(random.Random(0), 10000, 2), 20)
+        self.output = os.path.join(self.output_dir, 'sample.vcf.gz')
+        # The index is exported as it was written to the FileStore with the VCF
+        with open(vcf + '.gz.tbi', 'wb') as f:
+            f.write('TBI\1')
+        run_workflow(self.work_dir, export, {self.output: gzip_file(vcf)}, {self.output: 'a' * 40})
+        with open(vcf + '.gz.tbi', 'rb') as f_in, open(self.output + '.tbi', 'rb') as f_out:
+            self.assertEqual(f_out.read(), f_in.read())
+        self.assertEqual(self._records(), ['sample.vcf.gz.' + 'a' * 40])
@@ -0,0 +1,111 @@
+from __future__ import print_function
+
+import json
+import os
+import random
+import shutil
+import tempfile
+from argparse import Namespace
+from unittest import TestCase
+
+from toil_scripts.benchmark.fake_docker import Vcf, generate_vcf
+from toil_scripts.benchmark.synthetic import (random_contigs, write_fasta, write_fasta_index,
+                                              write_sequence_dictionary)
+from toil_scripts.gatk_germline.common import vcf_file_id
+from toil_scripts.gatk_germline.germline import merge_gvcfs
+from toil_scripts.resources import ResourceModel
+from toil_scripts.testing import export_file, fake_docker, gzip_file, run_workflow
+
+
+def merge(job, reference, gvcf_paths, fan_in, compressed, output_path):
+    """
+    Merges GVCFs in a merge tree and writes the merged GVCF to output_path
+    """
+    config = Namespace(genome_fasta=job.fileStore.writeGlobalFile(reference),
+                       genome_fai=job.fileStore.writeGlobalFile(reference + '.fai'),
+                       genome_dict=job.fileStore.writeGlobalFile(os.path.splitext(reference)[0] + '.dict'),
+                       node_reference=False,
+                       annotations=['QualByDepth'],
+                       combine_fan_in=fan_in,
+                       xmx='1G',
+                       resource_model=ResourceModel(),
+                       unsafe_mode=False,
+                       compress_vcfs=compressed)
+    gvcfs = {uuid: job.fileStore.writeGlobalFile(path) for uuid, path in gvcf_paths.iteritems()}
+    merged = job.addChildJobFn(merge_gvcfs, gvcfs, config)
+    # Follow-ons of the root job run after the whole merge tree
+    job.addFollowOnJobFn(write_output, merged.rv(), compressed, output_path)
+
+
+def write_output(job, gvcf, compressed, output_path):
+    export_file(job, vcf_file_id(gvcf), output_path)
+    if compressed:
+        export_file(job, gvcf.tbi_id, output_path + '.tbi')
+
+
+class MergeGvcfsTest(TestCase):
+    """
+    Runs the CombineGVCFs merge tree in a local workflow, with the fake docker in place of GATK
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.contigs = random_contigs(random.Random(0), 10000, 2)
+        self.reference = os.path.join(self.work_dir, 'genome.fa')
+        write_fasta(self.reference, self.contigs)
+        write_fasta_index(self.reference, self.reference + '.fai')
+        write_sequence_dictionary(self.reference, os.path.join(self.work_dir, 'genome.dict'))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _merge(self, num_samples, fan_in, compressed=False):
+        """
+        :return: Samples of the merged GVCF, and the number of GVCFs combined by each CombineGVCFs job
+        :rtype: tuple(list[str], list[int])
+        """
+        lengths = [(name, len(seq)) for name, seq in self.contigs]
+        intervals = [(name, 1, length) for name, length in lengths]
+        gvcf_paths = {}
+        for i in range(num_samples):
+            uuid = 'sample%d' % i
+            gvcf_paths[uuid] = os.path.join(self.work_dir, uuid + '.g.vcf')
+            generate_vcf(random.Random(i), lengths, intervals, 20, [uuid], gvcf=True).write(gvcf_paths[uuid])
+            if compressed:
+                gvcf_paths[uuid] = gzip_file(gvcf_paths[uuid])
+        output_path = os.path.join(self.work_dir, 'merged.g.vcf' + ('.gz' if compressed else ''))
+        with fake_docker(self.work_dir) as log:
+            run_workflow(self.work_dir, merge, self.reference, gvcf_paths, fan_in, compressed, output_path)
+            calls = [json.loads(line) for line in open(log)] if os.path.exists(log) else []
+        batch_sizes = [call['parameters'].count('--variant') for call in calls
+                       if 'CombineGVCFs' in call['parameters']]
+        return Vcf.read(output_path).samples, batch_sizes
+
+    def test_fan_in_2(self):
+        samples, batch_sizes = self._merge(5, 2)
+        # 5 GVCFs -> 3 -> 2 -> 1
+        self.assertEqual(sorted(batch_sizes), [2, 2, 2, 2])
+        self.assertEqual(sorted(samples), ['sample%d' % i for i in range(5)])
+
+    def test_fan_in_3(self):
+        samples, batch_sizes = self._merge(7, 3)
+        # 7 GVCFs -> 3 -> 1
+        self.assertEqual(sorted(batch_sizes), [3, 3, 3])
+        self.assertEqual(sorted(samples), ['sample%d' % i for i in range(7)])
+
+    def test_fewer_gvcfs_than_fan_in(self):
+        samples, batch_sizes = self._merge(2, 3)
+        self.assertEqual(batch_sizes, [2])
+        self.assertEqual(sorted(samples), ['sample0', 'sample1'])
+
+    def test_single_gvcf(self):
+        samples, batch_sizes = self._merge(1, 3)
+        self.assertEqual(batch_sizes, [])
+        self.assertEqual(samples, ['sample0'])
+
+    def test_compressed(self):
+        samples, batch_sizes = self._merge(4, 3, compressed=True)
+        # 4 GVCFs -> 2 -> 1
+        self.assertEqual(sorted(batch_sizes), [2, 3])
+        self.assertEqual(sorted(samples), ['sample%d' % i for i in range(4)])
+        self.assertTrue(os.path.exists(os.path.join(self.work_dir, 'merged.g.vcf.gz.tbi')))
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+from argparse import Namespace
+from unittest import TestCase
+
+from toil.common import Toil
+
+from toil_scripts.gatk_germline.common import node_local_dir
+
+
+class NodeLocalDirTest(TestCase):
+    """
+    Fills node-local directories with a stand-in for a running job
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        config = Namespace(workflowID='node-local-dir-test', workDir=self.work_dir)
+        self.job = Namespace(fileStore=Namespace(jobStore=Namespace(config=config),
+                                                 logToMaster=lambda message: None))
+        self.workflow_dir = Toil.getWorkflowDir(config.workflowID, config.workDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_reuse(self):
+        calls = []
+
+        def fill(path):
+            calls.append(path)
+            with open(os.path.join(path, 'genome.fa'), 'w') as f:
+                f.write('>chr1\nACGT\n')
+
+        first = node_local_dir(self.job, 'reference', ['fa', 'fai'], fill)
+        second = node_local_dir(self.job, 'reference', ['fa', 'fai'], fill)
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(os.path.exists(os.path.join(first, 'genome.fa')))
+
+    def test_failed_fill(self):
+        def fill(path):
+            with open(os.path.join(path, 'genome.fa'), 'w') as f:
+                f.write('>chr1\n')
+            raise IOError('Download interrupted')
+
+        self.assertRaises(IOError, node_local_dir, self.job, 'reference', ['fa', 'fai'], fill)
+        # Only the lock file is left, and the next job fills the directory again
+        self.assertEqual([name for name in os.listdir(self.workflow_dir) if not name.endswith('.lock')], [])
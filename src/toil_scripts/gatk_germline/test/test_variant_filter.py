@@ -0,0 +1,79 @@
+from __future__ import print_function
+
+import textwrap
+from StringIO import StringIO
+from unittest import TestCase
+
+from toil_scripts.gatk_germline.variant_filter import hard_filter_vcf
+
+SNP_FILTER = ('GERMLINE_SNP_FILTER', 'QD < 2.0 || FS > 60.0 || MQ < 40.0')
+INDEL_FILTER = ('GERMLINE_INDEL_FILTER', 'QD < 2.0 || FS > 200.0')
+
+HEADER = textwrap.dedent("""\
+    ##fileformat=VCFv4.2
+    ##FILTER=<ID=LowQual,Description="Low quality">
+    ##FILTER=<ID=GERMLINE_SNP_FILTER,Description="Filter of a previous run">
+    ##INFO=<ID=QD,Number=1,Type=Float,Description="Variant Confidence/Quality by Depth">
+    #CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+    """)
+
+# Records of the fixture, and the FILTER column that GATK 3.5 writes for them with SelectVariants,
+# VariantFiltration and CombineVariants, or None if SelectVariants drops the record
+RECORDS = [
+    # SNP that passes, and a SNP filtered by QD
+    ('1\t100\t.\tA\tG\t50\t.\tQD=10.0;FS=1.0;MQ=60.0', 'PASS'),
+    ('1\t200\t.\tA\tG\t50\t.\tQD=1.0;FS=1.0;MQ=60.0', 'GERMLINE_SNP_FILTER'),
+    # Multi-allelic SNP
+    ('1\t300\t.\tC\tA,T\t50\t.\tQD=1.5;FS=1.0;MQ=60.0', 'GERMLINE_SNP_FILTER'),
+    # A spanning deletion allele does not change the type of a SNP or an INDEL site
+    ('1\t400\t.\tG\tC,*\t50\t.\tQD=1.5;FS=1.0;MQ=60.0', 'GERMLINE_SNP_FILTER'),
+    ('1\t500\t.\tGT\tG,*\t50\t.\tQD=9.0;FS=1.0', 'PASS'),
+    # An insertion and a spanning deletion are a MIXED site, and an MNP is neither SNP nor INDEL
+    ('1\t600\t.\tG\tGA,*\t50\t.\tQD=1.0', None),
+    ('1\t700\t.\tAC\tGT\t50\t.\tQD=1.0', None),
+    # The first term reaches a missing annotation, so the expression is False
+    ('1\t800\t.\tA\tT\t50\t.\tFS=100.0;MQ=60.0', 'PASS'),
+    # The first term is True, so the missing annotations of the other terms are not reached
+    ('1\t900\t.\tA\tT\t50\t.\tQD=1.0', 'GERMLINE_SNP_FILTER'),
+    # Existing filters are kept, and the names are sorted
+    ('1\t1000\t.\tA\tT\t50\tLowQual\tQD=1.0;FS=1.0;MQ=60.0', 'GERMLINE_SNP_FILTER;LowQual'),
+    ('1\t1100\t.\tA\tT\t50\tLowQual\tQD=10.0;FS=1.0;MQ=60.0', 'LowQual'),
+    ('1\t1200\t.\tA\tT\t50\tPASS\tQD=1.0;FS=1.0;MQ=60.0', 'GERMLINE_SNP_FILTER'),
+    ('1\t1300\t.\tA\tT\t50\tGERMLINE_SNP_FILTER\tQD=1.0;FS=1.0;MQ=60.0', 'GERMLINE_SNP_FILTER'),
+    # INDELs with their own thresholds
+    ('1\t1400\t.\tA\tAT\t50\t.\tQD=5.0;FS=100.0', 'PASS'),
+    ('1\t1500\t.\tAT\tA\t50\t.\tQD=5.0;FS=250.0', 'GERMLINE_INDEL_FILTER'),
+    # Multi-valued annotations are not numbers, so comparisons with them are False
+    ('1\t1600\t.\tA\tG,T\t50\t.\tQD=1.0,1.0;FS=1.0;MQ=60.0', 'PASS')]
+
+
+class HardFilterTest(TestCase):
+    """
+    Compares the native hard filter engine with the output of the GATK hard filter steps on a fixture VCF
+    """
+
+    def setUp(self):
+        f_in = StringIO(HEADER + ''.join(record + '\n' for record, _ in RECORDS))
+        f_out = StringIO()
+        self.counts = hard_filter_vcf(f_in, f_out, {'SNP': SNP_FILTER, 'INDEL': INDEL_FILTER})
+        self.lines = f_out.getvalue().splitlines()
+
+    def test_records(self):
+        records = [line.split('\t') for line in self.lines if not line.startswith('#')]
+        expected = [record.split('\t')[:6] + [filters] + record.split('\t')[7:]
+                    for record, filters in RECORDS if filters is not None]
+        self.assertEqual(records, expected)
+
+    def test_header(self):
+        filters = [line for line in self.lines if line.startswith('##FILTER')]
+        self.assertEqual(filters, ['##FILTER=<ID=LowQual,Description="Low quality">',
+                                   '##FILTER=<ID=GERMLINE_INDEL_FILTER,Description="QD < 2.0 || FS > 200.0">',
+                                   '##FILTER=<ID=GERMLINE_SNP_FILTER,'
+                                   'Description="QD < 2.0 || FS > 60.0 || MQ < 40.0">'])
+        header = [line for line in self.lines if line.startswith('#')]
+        self.assertEqual(self.lines[:len(header)], header)
+        self.assertTrue(header[-1].startswith('#CHROM'))
+
+    def test_counts(self):
+        self.assertEqual(self.counts, {'SNP': {'PASS': 4, 'FILTERED': 7},
+                                       'INDEL': {'PASS': 2, 'FILTERED': 1}})
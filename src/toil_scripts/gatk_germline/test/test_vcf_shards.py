@@ -0,0 +1,103 @@
+from __future__ import print_function
+
+import gzip
+import os
+import random
+import shutil
+import tempfile
+from unittest import TestCase
+
+from toil_scripts.benchmark.synthetic import random_contigs, write_vcf
+from toil_scripts.gatk_germline.common import gather_vcfs, split_vcf, vcf_file_id
+from toil_scripts.gatk_germline.intervals import partition_genome
+from toil_scripts.testing import export_file, fake_docker, gzip_file, run_workflow
+
+
+def split_and_gather(job, path, shards, compressed, output_dir):
+    """
+    Splits a VCF into shards and gathers them again. The shard VCFs and the gathered VCF are written to
+    output_dir, with their tabix indexes if compressed.
+    """
+    vcf_id = job.fileStore.writeGlobalFile(path)
+    split = job.addChildJobFn(split_vcf, vcf_id, shards, compressed=compressed)
+    gather = split.addFollowOnJobFn(gather_vcfs, split.rv(), compressed=compressed)
+    gather.addFollowOnJobFn(write_outputs, split.rv(), gather.rv(), compressed, output_dir)
+
+
+def write_outputs(job, shard_ids, gathered_id, compressed, output_dir):
+    suffix = '.vcf.gz' if compressed else '.vcf'
+    for name, vcf in [('shard.%d' % i, shard_id) for i, shard_id in enumerate(shard_ids)] + \
+            [('gathered', gathered_id)]:
+        path = os.path.join(output_dir, name + suffix)
+        export_file(job, vcf_file_id(vcf), path)
+        # Compressed VCFs carry the tabix index that was built when they were written
+        if compressed:
+            export_file(job, vcf.tbi_id, path + '.tbi')
+
+
+class VcfShardsTest(TestCase):
+    """
+    Runs split_vcf and gather_vcfs in a local workflow on a synthetic VCF
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.work_dir, 'output')
+        os.mkdir(self.output_dir)
+        self.contigs = random_contigs(random.Random(0), 30000, 3)
+        self.vcf = os.path.join(self.work_dir, 'input.vcf')
+        # Without indels no record spans a shard boundary, so gathering restores the input
+        write_vcf(self.vcf, self.contigs, 300, indel_fraction=0)
+        self.shards = partition_genome([(name, len(seq)) for name, seq in self.contigs], 4)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _run(self, path, compressed):
+        # Compressed VCFs are compressed and indexed in containers
+        with fake_docker(self.work_dir):
+            run_workflow(self.work_dir, split_and_gather, path, self.shards, compressed, self.output_dir)
+
+    def _lines(self, path):
+        with (gzip.open(path) if path.endswith('.gz') else open(path)) as f:
+            return list(f)
+
+    def _assert_shards(self, suffix):
+        records = [line for line in self._lines(self.vcf) if not line.startswith('#')]
+        header = [line for line in self._lines(self.vcf) if line.startswith('#')]
+        shard_records = []
+        for i, shard in enumerate(self.shards):
+            lines = self._lines(os.path.join(self.output_dir, 'shard.%d%s' % (i, suffix)))
+            self.assertEqual([line for line in lines if line.startswith('#')], header)
+            for line in lines:
+                if not line.startswith('#'):
+                    contig, pos = line.split('\t')[0], int(line.split('\t')[1])
+                    self.assertTrue(any(c == contig and start <= pos <= end for c, start, end in shard))
+                    shard_records.append(line)
+        self.assertEqual(shard_records, records)
+
+    def test_plain_round_trip(self):
+        self._run(self.vcf, compressed=False)
+        self._assert_shards('.vcf')
+        with open(self.vcf) as f_in, open(os.path.join(self.output_dir, 'gathered.vcf')) as f_out:
+            self.assertEqual(f_out.read(), f_in.read())
+
+    def test_bgzf_round_trip(self):
+        self._run(gzip_file(self.vcf), compressed=True)
+        self._assert_shards('.vcf.gz')
+        gathered = os.path.join(self.output_dir, 'gathered.vcf.gz')
+        self.assertEqual(self._lines(gathered), self._lines(self.vcf))
+        for i in range(len(self.shards)):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'shard.%d.vcf.gz.tbi' % i)))
+        self.assertTrue(os.path.exists(gathered + '.tbi'))
+
+    def test_record_spanning_boundary(self):
+        contig, _, end = self.shards[0][-1]
+        block = '%s\t%d\t.\tA\t<NON_REF>\t.\t.\tEND=%d\tGT\t0/0\n' % (contig, end - 10, end + 10)
+        path = os.path.join(self.work_dir, 'block.vcf')
+        with open(path, 'w') as f:
+            f.write('##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample\n' + block)
+        self._run(path, compressed=False)
+        shard_records = [[line for line in self._lines(os.path.join(self.output_dir, 'shard.%d.vcf' % i))
+                          if not line.startswith('#')] for i in range(len(self.shards))]
+        self.assertEqual(shard_records[:2], [[block], [block]])
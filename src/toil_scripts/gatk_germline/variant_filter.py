@@ -0,0 +1,293 @@
+#!/usr/bin/env python2.7
+"""
+Single-pass hard filtering of VCF files.
+
+Supports the subset of the GATK JEXL expression language used for hard filters: comparisons between
+variant annotations and numbers (<, <=, >, >=, ==, !=) combined with ||, &&, ! and parentheses.
+Annotations are read from the INFO column. QUAL, CHROM, POS, ID, REF, ALT, FILTER and TYPE refer
+to the corresponding record fields. As in GATK, an expression that reaches a missing annotation
+evaluates to False, so the record is not filtered.
+"""
+import re
+
+
+class FilterExpressionError(ValueError):
+    """
+    Raised for hard filter expressions that are outside of the supported JEXL subset
+    """
+
+
+class _MissingAnnotation(Exception):
+    """
+    Raised during evaluation when an expression references an annotation the record does not have
+    """
+
+
+_TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<op>\|\||&&|<=|>=|==|!=|<|>|!|\(|\))|
+    (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|
+    (?P<name>[A-Za-z_][A-Za-z0-9_.]*)|
+    '(?P<squote>[^']*)'|
+    "(?P<dquote>[^"]*)")""", re.VERBOSE)
+
+_COMPARISONS = {'<': lambda x, y: x < y,
+                '<=': lambda x, y: x <= y,
+                '>': lambda x, y: x > y,
+                '>=': lambda x, y: x >= y,
+                '==': lambda x, y: x == y,
+                '!=': lambda x, y: x != y}
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN_RE.match(expression, position)
+        if match is None or match.end() == position:
+            raise FilterExpressionError('Unsupported syntax at position %d of filter expression: %s'
+                                        % (position, expression))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            tokens.append(('value', float(value)))
+        elif kind in ('squote', 'dquote'):
+            tokens.append(('value', value))
+        else:
+            tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+    """
+    Recursive descent parser that compiles an expression into nested closures
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def parse(self):
+        if not self.tokens:
+            raise FilterExpressionError('Empty filter expression')
+        node = self._or()
+        if self.position != len(self.tokens):
+            raise FilterExpressionError('Unexpected "%s" in filter expression: %s'
+                                        % (self.tokens[self.position][1], self.expression))
+        return node
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise FilterExpressionError('Unexpected end of filter expression: %s' % self.expression)
+        self.position += 1
+        return token
+
+    def _or(self):
+        nodes = [self._and()]
+        while self._peek() == ('op', '||'):
+            self._next()
+            nodes.append(self._and())
+        if len(nodes) == 1:
+            return nodes[0]
+        return lambda record: any(node(record) for node in nodes)
+
+    def _and(self):
+        nodes = [self._unary()]
+        while self._peek() == ('op', '&&'):
+            self._next()
+            nodes.append(self._unary())
+        if len(nodes) == 1:
+            return nodes[0]
+        return lambda record: all(node(record) for node in nodes)
+
+    def _unary(self):
+        if self._peek() == ('op', '!'):
+            self._next()
+            node = self._unary()
+            return lambda record: not node(record)
+        if self._peek() == ('op', '('):
+            self._next()
+            node = self._or()
+            if self._next() != ('op', ')'):
+                raise FilterExpressionError('Missing ")" in filter expression: %s' % self.expression)
+            return node
+        return self._comparison()
+
+    def _comparison(self):
+        left = self._operand()
+        kind, op = self._peek()
+        if kind != 'op' or op not in _COMPARISONS:
+            raise FilterExpressionError('Expected a comparison in filter expression: %s' % self.expression)
+        self._next()
+        right = self._operand()
+        compare = _COMPARISONS[op]
+        return lambda record: _compare(compare, op, left(record), right(record))
+
+    def _operand(self):
+        kind, value = self._next()
+        if kind == 'value':
+            return lambda record: value
+        if kind == 'name':
+            return lambda record: record.get(value)
+        raise FilterExpressionError('Unexpected "%s" in filter expression: %s' % (value, self.expression))
+
+
+def _compare(compare, op, left, right):
+    if left is None or right is None:
+        raise _MissingAnnotation()
+    try:
+        return compare(float(left), float(right))
+    except (TypeError, ValueError):
+        # Non-numeric values, such as multi-allelic annotations, can only be tested for equality
+        if op in ('==', '!='):
+            return compare(str(left), str(right))
+        raise _MissingAnnotation()
+
+
+def compile_filter_expression(expression):
+    """
+    Compiles a JEXL hard filter expression
+
+    >>> f = compile_filter_expression('QD < 2.0 || FS > 60.0')
+    >>> f({'QD': '1.5', 'FS': '3.0'}), f({'QD': '10.0', 'FS': '3.0'})
+    (True, False)
+    >>> f({'FS': '3.0'})
+    False
+    >>> f({'QD': '1.0'})
+    True
+
+    :param str expression: JEXL expression, optionally wrapped in quotes
+    :return: Function of a dictionary of record attributes that returns True if the record is filtered
+    :rtype: function
+    """
+    expression = expression.strip()
+    if len(expression) > 1 and expression[0] == expression[-1] and expression[0] in '"\'':
+        expression = expression[1:-1]
+    node = _Parser(expression).parse()
+
+    def evaluate(record):
+        try:
+            return bool(node(record))
+        except _MissingAnnotation:
+            return False
+    return evaluate
+
+
+def variant_type(ref, alt):
+    """
+    Classifies a VCF record the same way as GATK SelectVariants -selectType. As in htsjdk, the spanning
+    deletion allele * is typed by its length of one base, so it does not change the type of a SNP site.
+
+    >>> variant_type('A', 'G'), variant_type('A', 'G,T'), variant_type('A', 'AT')
+    ('SNP', 'SNP', 'INDEL')
+    >>> variant_type('A', 'G,AT'), variant_type('AC', 'GT'), variant_type('A', '.')
+    ('MIXED', 'MNP', 'NO_VARIATION')
+    >>> variant_type('A', 'G,*'), variant_type('AT', 'A,*'), variant_type('A', 'AT,*')
+    ('SNP', 'INDEL', 'MIXED')
+
+    :param str ref: REF allele
+    :param str alt: ALT column
+    :return: SNP, MNP, INDEL, SYMBOLIC, MIXED or NO_VARIATION
+    :rtype: str
+    """
+    if alt == '.':
+        return 'NO_VARIATION'
+    types = set()
+    for allele in alt.split(','):
+        if allele.startswith('<') or '[' in allele or ']' in allele or allele == '.':
+            types.add('SYMBOLIC')
+        elif len(allele) != len(ref):
+            types.add('INDEL')
+        elif len(allele) == 1:
+            types.add('SNP')
+        else:
+            types.add('MNP')
+    return types.pop() if len(types) == 1 else 'MIXED'
+
+
+def record_attributes(fields):
+    """
+    Builds the dictionary of attributes that filter expressions are evaluated against
+
+    >>> record_attributes(['1', '100', '.', 'A', 'G', '50', '.', 'QD=2.5;DB'])['QD']
+    '2.5'
+
+    :param list[str] fields: VCF record fields
+    :return: Dictionary of INFO annotations and record fields
+    :rtype: dict
+    """
+    attributes = {}
+    if len(fields) > 7 and fields[7] != '.':
+        for info in fields[7].split(';'):
+            key, _, value = info.partition('=')
+            attributes[key] = value if _ else True
+    for i, name in enumerate(['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER']):
+        if fields[i] != '.':
+            attributes[name] = fields[i]
+    attributes['TYPE'] = variant_type(fields[3], fields[4])
+    return attributes
+
+
+def hard_filter_vcf(f_in, f_out, filters):
+    """
+    Applies hard filters to a VCF file in a single pass. Records are classified as SNPs or INDELs and
+    tested against the filter expression for their type. Records of other types are dropped, which
+    matches selecting SNPs and INDELs with GATK SelectVariants before filtering.
+
+    As in GATK VariantFiltration, a filtered record keeps its existing filters and the filter names are
+    written in sorted order, a record that is not filtered keeps its FILTER column or is marked PASS if it
+    had none, and the header describes both filters. Unlike the GATK engine, which merges the SNP and INDEL
+    VCFs with CombineVariants, the records keep their input order and the header is otherwise unchanged.
+
+    >>> from StringIO import StringIO
+    >>> f_in = StringIO('#CHROM\\n1\\t10\\t.\\tA\\tG\\t50\\t.\\tQD=1.0\\n1\\t20\\t.\\tA\\tAT\\t50\\t.\\tQD=9.0\\n'
+    ...                 '1\\t30\\t.\\tAC\\tGT\\t50\\t.\\tQD=1.0\\n')
+    >>> f_out = StringIO()
+    >>> counts = hard_filter_vcf(f_in, f_out, {'SNP': ('SNP_FILTER', 'QD < 2.0'), 'INDEL': ('INDEL_FILTER', 'QD < 2.0')})
+    >>> counts['SNP']['FILTERED'], counts['INDEL']['PASS']
+    (1, 1)
+    >>> [line.split('\\t')[6] for line in f_out.getvalue().splitlines() if not line.startswith('#')]
+    ['SNP_FILTER', 'PASS']
+
+    :param file f_in: Input VCF file object
+    :param file f_out: Output VCF file object
+    :param dict filters: Dictionary of variant type to (filter name, JEXL expression), i.e. {'SNP': (name, expr)}
+    :return: Dictionary with the number of records that passed and were filtered for each variant type
+    :rtype: dict
+    """
+    compiled = {var_type: (name, compile_filter_expression(expression))
+                for var_type, (name, expression) in filters.items()}
+    counts = {var_type: {'PASS': 0, 'FILTERED': 0} for var_type in filters}
+    filter_ids = set('##FILTER=<ID={},'.format(name) for name, _ in filters.itervalues())
+    for line in f_in:
+        if line.startswith('##'):
+            # The descriptions of the new filters replace those of filters with the same name
+            if not any(line.startswith(filter_id) for filter_id in filter_ids):
+                f_out.write(line)
+            continue
+        if line.startswith('#'):
+            # Describe the new filters in the header, like GATK VariantFiltration
+            for var_type in sorted(filters):
+                name, expression = filters[var_type]
+                f_out.write('##FILTER=<ID={},Description="{}">\n'.format(name, expression.replace('"', '\\"')))
+            f_out.write(line)
+            continue
+        fields = line.rstrip('\n').split('\t')
+        var_type = variant_type(fields[3], fields[4])
+        if var_type not in compiled:
+            continue
+        name, is_filtered = compiled[var_type]
+        if is_filtered(record_attributes(fields)):
+            fields[6] = ';'.join(sorted(set(fields[6].split(';')) - {'.', 'PASS'} | {name}))
+            counts[var_type]['FILTERED'] += 1
+        else:
+            fields[6] = 'PASS' if fields[6] == '.' else fields[6]
+            counts[var_type]['PASS'] += 1
+        f_out.write('\t'.join(fields) + '\n')
+    return counts
@@ -1,24 +1,27 @@
 #!/usr/bin/env python2.7
 from __future__ import print_function
-import os
 
-from toil.job import PromisedRequirement
 from toil_lib.tools.variant_manipulation import gatk_variant_recalibrator, \
     gatk_apply_variant_recalibration
 
-from toil_scripts.gatk_germline.common import output_file_job
+from toil_scripts.gatk_germline.common import reference_disk, reference_files
+from toil_scripts.metrics import metered
 
+# Record the resource usage of the toil-lib job functions run by this pipeline
+gatk_variant_recalibrator = metered(gatk_variant_recalibrator, __name__)
+gatk_apply_variant_recalibration = metered(gatk_apply_variant_recalibration, __name__)
 
+
+@metered
 def vqsr_pipeline(job, uuid, vcf_id, config):
     """
-    Runs GATK Variant Quality Score Recalibration.
+    Runs GATK Variant Quality Score Recalibration. The caller uploads the recalibrated VCF.
 
-    0: Start                        0 --> 1 --> 3 --> 4 --> 5
+    0: Start                        0 --> 1 --> 3 --> 4
     1: Recalibrate SNPs                   |      |
     2: Recalibrate INDELS                 +-> 2 -+
     3: Apply SNP Recalibration
     4: Apply INDEL Recalibration
-    5: Write VCF to output directory
 
     :param JobFunctionWrappingJob job: passed automatically by Toil
     :param str uuid: unique sample identifier
@@ -30,9 +33,7 @@ def vqsr_pipeline(job, uuid, vcf_id, config):
         config.genome_dict              FilesStoreID for reference genome sequence dictionary file
         config.cores                    Number of cores for each job
         config.xmx                      Java heap size in bytes
-        config.suffix                   Suffix for output filename
-        config.output_dir               URL or local path to output directory
-        config.ssec                     Path to key file for SSE-C encryption
+        config.resource_model           Estimates disk requirements from previous runs
 
         SNP VQSR attributes:
         config.snp_filter_annotations   List of GATK variant annotations
@@ -49,19 +50,19 @@ def vqsr_pipeline(job, uuid, vcf_id, config):
     :return: SNP and INDEL VQSR VCF FileStoreID
     :rtype: str
     """
-    # Get the total size of the genome reference
-    genome_ref_size = config.genome_fasta.size + config.genome_fai.size + config.genome_dict.size
+    # The genome reference files are passed to the disk requirements of the GATK jobs
+    ref_files = reference_files(config)
 
     # The VariantRecalibator disk requirement depends on the input VCF, the resource files,
     # the genome reference files, and the output recalibration table, tranche file, and plots.
     # The sum of these output files are less than the input VCF.
-    snp_resources = ['hapmap', 'omni', 'dbsnp', 'g1k_snp']
-    snp_resource_size = sum(getattr(config, resource).size for resource in snp_resources)
-    snp_recal_disk = PromisedRequirement(lambda in_vcf, ref_size, resource_size:
-                                         2 * in_vcf.size + ref_size + resource_size,
-                                         vcf_id,
-                                         genome_ref_size,
-                                         snp_resource_size)
+    snp_recal_disk = config.resource_model.disk('gatk_variant_recalibrator',
+                                                lambda in_vcf, ref, resources:
+                                                2 * in_vcf.size + reference_disk(ref) +
+                                                sum(resource.size for resource in resources),
+                                                vcf_id,
+                                                ref_files,
+                                                [config.hapmap, config.omni, config.dbsnp, config.g1k_snp])
 
     snp_recal = job.wrapJobFn(gatk_variant_recalibrator,
                               'SNP',
@@ -79,12 +80,13 @@ def vqsr_pipeline(job, uuid, vcf_id, config):
                               cores=config.cores,
                               memory=config.xmx)
 
-    indel_resource_size = config.mills.size + config.dbsnp.size
-    indel_recal_disk = PromisedRequirement(lambda in_vcf, ref_size, resource_size:
-                                           2 * in_vcf.size + ref_size + resource_size,
-                                           vcf_id,
-                                           genome_ref_size,
-                                           indel_resource_size)
+    indel_recal_disk = config.resource_model.disk('gatk_variant_recalibrator',
+                                                  lambda in_vcf, ref, resources:
+                                                  2 * in_vcf.size + reference_disk(ref) +
+                                                  sum(resource.size for resource in resources),
+                                                  vcf_id,
+                                                  ref_files,
+                                                  [config.dbsnp, config.mills])
 
     indel_recal = job.wrapJobFn(gatk_variant_recalibrator,
                                 'INDEL',
@@ -104,12 +106,14 @@ def vqsr_pipeline(job, uuid, vcf_id, config):
     # recalibration table, the tranche file, the genome reference file, and the output VCF.
     # This step labels variants as filtered, so the output VCF file should be slightly larger
     # than the input file. Estimate a 10% increase in the VCF file size.
-    apply_snp_recal_disk = PromisedRequirement(lambda in_vcf, recal, tranche, ref_size:
-                                               int(2.1 * in_vcf.size + recal.size + tranche.size + ref_size),
-                                               vcf_id,
-                                               snp_recal.rv(0),
-                                               snp_recal.rv(1),
-                                               genome_ref_size)
+    apply_snp_recal_disk = config.resource_model.disk('gatk_apply_variant_recalibration',
+                                                      lambda in_vcf, recal, tranche, ref:
+                                                      int(2.1 * in_vcf.size + recal.size + tranche.size +
+                                                          reference_disk(ref)),
+                                                      vcf_id,
+                                                      snp_recal.rv(0),
+                                                      snp_recal.rv(1),
+                                                      ref_files)
 
     apply_snp_recal = job.wrapJobFn(gatk_apply_variant_recalibration,
                                     'SNP',
@@ -123,12 +127,14 @@ def vqsr_pipeline(job, uuid, vcf_id, config):
                                     cores=config.cores,
                                     memory=config.xmx)
 
-    apply_indel_recal_disk = PromisedRequirement(lambda in_vcf, recal, tranche, ref_size:
-                                                 int(2.1 * in_vcf.size + recal.size + tranche.size + ref_size),
-                                                 vcf_id,
-                                                 indel_recal.rv(0),
-                                                 indel_recal.rv(1),
-                                                 genome_ref_size)
+    apply_indel_recal_disk = config.resource_model.disk('gatk_apply_variant_recalibration',
+                                                        lambda in_vcf, recal, tranche, ref:
+                                                        int(2.1 * in_vcf.size + recal.size + tranche.size +
+                                                            reference_disk(ref)),
+                                                        apply_snp_recal.rv(),
+                                                        indel_recal.rv(0),
+                                                        indel_recal.rv(1),
+                                                        ref_files)
 
     apply_indel_recal = job.wrapJobFn(gatk_apply_variant_recalibration,
                                       'INDEL',
@@ -147,18 +153,6 @@ def vqsr_pipeline(job, uuid, vcf_id, config):
     snp_recal.addChild(apply_snp_recal)
     indel_recal.addChild(apply_indel_recal)
     apply_snp_recal.addChild(apply_indel_recal)
-
-    # Output recalibrated VCF
-    output_dir = config.output_dir
-    output_dir = os.path.join(output_dir, uuid)
-    vqsr_name = '%s.vqsr%s.vcf' % (uuid, config.suffix)
-    output_vqsr = job.wrapJobFn(output_file_job,
-                                vqsr_name,
-                                apply_indel_recal.rv(),
-                                output_dir,
-                                s3_key_path=config.ssec,
-                                disk=PromisedRequirement(lambda x: x.size, apply_indel_recal.rv()))
-    apply_indel_recal.addChild(output_vqsr)
     return apply_indel_recal.rv()
 
 
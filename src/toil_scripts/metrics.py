@@ -0,0 +1,595 @@
+#!/usr/bin/env python2.7
+"""
+Resource telemetry for Toil job functions.
+
+Job functions wrapped with metered() record their wall time, peak work directory usage, bytes read
+from and written to the FileStore, time spent in Docker containers, peak memory of their containers,
+peak RSS of the worker, and the size of their FileStoreID arguments. Each record is written to the job
+store's stats and logging channel, which Toil retains when the workflow is run with --stats. The report
+subcommands read the records back and print per-stage distributions.
+
+Container time and memory are recorded for containers that are run through a docker_call wrapped with
+metered_docker_call. A metered job wraps the docker_call of toil-lib's tool modules, so the containers
+that toil-lib job functions run are measured as well. Container memory is read from the container's
+memory cgroup while it runs, and is missing where the cgroup cannot be read, i.e. when Docker runs on
+another host. The peak RSS is that of the worker process, which includes earlier jobs that the worker
+ran in the same process.
+
+Jobs that toil-lib job functions add to the workflow themselves, such as the GATK jobs of
+run_gatk_preprocessing, are not metered. Their parent records only the time spent declaring them.
+"""
+from __future__ import print_function
+import base64
+import functools
+import importlib
+import inspect
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+
+METRICS_KEY = 'toil_scripts_metrics'
+
+# Sizes are reported in bytes and times in seconds
+METRICS = ['input_bytes', 'wall_time', 'container_time', 'peak_disk', 'peak_memory', 'peak_rss',
+           'disk_requested', 'memory_requested', 'filestore_read', 'filestore_written']
+
+# Attribute of a running job that holds the JobMeter of its metered job function
+_METER_ATTRIBUTE = '_toil_scripts_meter'
+
+# toil-lib modules that bind docker_call at module level
+TOIL_LIB_TOOL_MODULES = ['toil_lib.tools', 'toil_lib.tools.QC', 'toil_lib.tools.aligners',
+                         'toil_lib.tools.indexing', 'toil_lib.tools.mutation_callers',
+                         'toil_lib.tools.preprocessing', 'toil_lib.tools.quantifiers',
+                         'toil_lib.tools.variant_annotation', 'toil_lib.tools.variant_manipulation']
+
+# Files that hold the peak memory usage of a container, relative to the cgroup mount point. The paths
+# cover the cgroupfs and systemd cgroup drivers of cgroup v1 and v2.
+CGROUP_PEAK_MEMORY_FILES = ['memory/docker/{}/memory.max_usage_in_bytes',
+                            'memory/system.slice/docker-{}.scope/memory.max_usage_in_bytes',
+                            'docker/{}/memory.peak',
+                            'system.slice/docker-{}.scope/memory.peak']
+
+
+def metered(func=None, module=None, inputs=None, stage=None):
+    """
+    Wraps a Toil job function so that each invocation records its resource usage.
+
+    Toil locates job functions by module and name, so a wrapped function must be bound to its name
+    in the module given by __module__. Pass the calling module's __name__ when wrapping a function
+    that is imported from another package, i.e. run_bwakit = metered(run_bwakit, __name__).
+
+    The input size of a job is the size of the FileStoreIDs among its arguments. Resource estimates
+    are computed from the same files, so the disk requirement of a job must be given the files that
+    the job receives. Job functions that receive their files inside a Namespace name them with inputs,
+    i.e. @metered(inputs=bwakit_inputs).
+
+    A job records its metrics under the name of the job function, unless stage gives another name. Jobs
+    whose resource usage depends on an argument that is not an input file, i.e. a shard count, name
+    their stage after it so that they are fitted separately.
+
+    :param function func: Job function that takes the job as its first argument
+    :param str module: Module that the wrapped function is bound in
+    :param function inputs: Function of the job function's arguments, without the job, that returns
+        the job's input files. By default the arguments themselves are used.
+    :param function stage: Function that is given the job function's arguments, without the job, as
+        keyword arguments and returns the stage name
+    :return: Wrapped job function
+    :rtype: function
+    """
+    if func is None:
+        return functools.partial(metered, module=module, inputs=inputs, stage=stage)
+
+    def call(job, *args, **kwargs):
+        with JobMeter(job, job_stage(wrapper, args, kwargs), input_size(job_inputs(wrapper, args, kwargs))):
+            return func(job, *args, **kwargs)
+    wrapper = _copy_signature(func, call)
+    functools.update_wrapper(wrapper, func)
+    # The planner calls the wrapped function directly
+    wrapper.__wrapped__ = func
+    wrapper.inputs = inputs
+    wrapper.stage = stage
+    # Functions from other packages run tools, so the planner estimates them rather than calling them
+    wrapper.imported = module is not None
+    if module is not None:
+        wrapper.__module__ = module
+    return wrapper
+
+
+def metered_docker_call(docker_call):
+    """
+    Wraps toil-lib's docker_call so that the time spent in each container and the container's peak memory
+    are added to the metrics record of the metered job function that runs it. The job must be passed as
+    the job keyword argument.
+
+    >>> from argparse import Namespace
+    >>> job = Namespace()
+    >>> timed_call = metered_docker_call(lambda job=None, parameters=None, container_name=None: len(parameters))
+    >>> meter = JobMeter.__new__(JobMeter)
+    >>> meter.record, meter._lock = {'container_time': None, 'peak_memory': None}, threading.Lock()
+    >>> setattr(job, _METER_ATTRIBUTE, meter)
+    >>> timed_call(job=job, parameters=['index', 'sample.bam'], container_name='c'), meter.record['container_time'] >= 0
+    (2, True)
+    >>> timed_call.metered
+    True
+
+    :param function docker_call: toil_lib.programs.docker_call
+    :return: Wrapped function
+    :rtype: function
+    """
+    @functools.wraps(docker_call)
+    def timed(*args, **kwargs):
+        job = kwargs.get('job')
+        meter = getattr(job, _METER_ATTRIBUTE, None)
+        if meter is None:
+            return docker_call(*args, **kwargs)
+        done, sampler = threading.Event(), None
+        if not args:
+            # The container is named here so that its cgroup can be found while it runs
+            if not kwargs.get('container_name'):
+                kwargs['container_name'] = container_name(job)
+            sampler = threading.Thread(target=_sample_container_memory,
+                                       args=(meter, kwargs['container_name'], done))
+            sampler.daemon = True
+            sampler.start()
+        start = time.time()
+        try:
+            return docker_call(*args, **kwargs)
+        finally:
+            meter.add('container_time', time.time() - start)
+            done.set()
+            if sampler is not None:
+                sampler.join()
+    timed.metered = True
+    return timed
+
+
+def meter_toil_lib():
+    """
+    Wraps the docker_call of toil-lib's tool modules with metered_docker_call, so that the containers run
+    by toil-lib job functions are measured. Modules that are already wrapped are left as they are.
+    """
+    for name in TOIL_LIB_TOOL_MODULES:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        call = getattr(module, 'docker_call', None)
+        if call is not None and not getattr(call, 'metered', False):
+            module.docker_call = metered_docker_call(call)
+
+
+def container_name(job):
+    """
+    Returns a unique name for a container run by a job, in the format that toil-lib uses
+
+    :param JobFunctionWrappingJob job: Running job
+    :return: Container name
+    :rtype: str
+    """
+    return '--'.join([job.fileStore.jobStore.config.workflowID, job.fileStore.jobID,
+                      base64.urlsafe_b64encode(os.urandom(9))])
+
+
+def container_peak_memory(container_id, cgroup_root='/sys/fs/cgroup'):
+    """
+    Reads the peak memory usage of a running container from its memory cgroup
+
+    >>> import shutil, tempfile
+    >>> root = tempfile.mkdtemp()
+    >>> os.makedirs(os.path.join(root, 'memory', 'docker', 'abc'))
+    >>> with open(os.path.join(root, 'memory', 'docker', 'abc', 'memory.max_usage_in_bytes'), 'w') as f:
+    ...     f.write('1048576\\n')
+    >>> container_peak_memory('abc', root), container_peak_memory('def', root)
+    (1048576, None)
+    >>> shutil.rmtree(root)
+
+    :param str container_id: Full ID of the container
+    :param str cgroup_root: Mount point of the cgroup file system
+    :return: Peak memory in bytes, or None if the cgroup cannot be read
+    :rtype: int
+    """
+    for path in CGROUP_PEAK_MEMORY_FILES:
+        try:
+            with open(os.path.join(cgroup_root, path.format(container_id))) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            continue
+    return None
+
+
+def _container_id(name):
+    with open(os.devnull, 'w') as devnull:
+        try:
+            return subprocess.check_output(['docker', 'inspect', '--format', '{{.Id}}', name],
+                                           stderr=devnull).strip() or None
+        except (subprocess.CalledProcessError, OSError):
+            return None
+
+
+def _sample_container_memory(meter, name, done, interval=1):
+    # The cgroup of a container is removed when the container exits, so it is read while the container
+    # runs. The peak usage of containers that run for less than a second is not measured.
+    container_id = None
+    while not done.wait(interval):
+        if container_id is None:
+            container_id = _container_id(name)
+        if container_id is not None:
+            peak = container_peak_memory(container_id)
+            if peak is not None:
+                meter.maximum('peak_memory', peak)
+
+
+def _copy_signature(func, call):
+    """
+    Creates a function with the same signature as func that forwards its arguments to call. Toil reads
+    the default cores, memory and disk requirements of a job from the job function's signature.
+
+    >>> def f(job, a, b=2, *args, **kwargs):
+    ...     pass
+    >>> g = _copy_signature(f, lambda *args, **kwargs: (args, kwargs))
+    >>> inspect.getargspec(g) == inspect.getargspec(f)
+    True
+    >>> g('job', 1, c=3)
+    (('job', 1, 2), {'c': 3})
+
+    :param function func: Function whose signature is copied
+    :param function call: Function that is called with the arguments
+    :return: Function with the signature of func
+    :rtype: function
+    """
+    args, varargs, keywords, defaults = inspect.getargspec(func)
+    parameters = inspect.formatargspec(args, varargs, keywords)
+    namespace = {'_call': call}
+    exec('def {}{}:\n    return _call{}\n'.format(func.__name__, parameters, parameters), namespace)
+    wrapper = namespace[func.__name__]
+    wrapper.__defaults__ = defaults
+    return wrapper
+
+
+def job_inputs(func, args, kwargs):
+    """
+    Returns the values that the input size of a metered job is measured on
+
+    :param function func: Job function, wrapped with metered
+    :param tuple args: Positional arguments, without the job
+    :param dict kwargs: Keyword arguments
+    :return: Input files and other argument values
+    :rtype: list
+    """
+    inputs = getattr(func, 'inputs', None)
+    if inputs is not None:
+        return inputs(*args, **kwargs)
+    return list(args) + [kwargs[key] for key in sorted(kwargs)]
+
+
+def job_stage(func, args, kwargs):
+    """
+    Returns the stage name that a metered job records its metrics under
+
+    >>> @metered(stage=lambda shards, **kwargs: 'call.%d_shards' % shards)
+    ... def call(job, bam, shards=1):
+    ...     pass
+    >>> job_stage(call, ('bam',), {'shards': 4}), job_stage(metered(input_size), ([],), {})
+    ('call.4_shards', 'input_size')
+
+    :param function func: Job function, wrapped with metered
+    :param tuple args: Positional arguments, without the job
+    :param dict kwargs: Keyword arguments
+    :return: Stage name
+    :rtype: str
+    """
+    stage = getattr(func, 'stage', None)
+    func = getattr(func, '__wrapped__', func)
+    if stage is None:
+        return func.__name__
+    arguments = inspect.getcallargs(func, None, *args, **kwargs)
+    del arguments[inspect.getargspec(func).args[0]]
+    return stage(**arguments)
+
+
+def measure_directory(job, path):
+    """
+    Adds a directory outside the work directory, i.e. a node-local reference that the job uses, to the
+    peak disk usage that the running metered job records. Jobs that are not metered are unaffected.
+
+    :param JobFunctionWrappingJob job: Running job
+    :param str path: Directory path
+    """
+    meter = getattr(job, _METER_ATTRIBUTE, None)
+    if meter is not None:
+        meter.measure(path)
+
+
+def input_size(values):
+    """
+    Sums the sizes of the FileStoreIDs in a list of values. Lists, tuples and dictionary values are
+    searched. Other values, i.e. integers and Namespaces, do not count towards the input size.
+
+    >>> class FileID(str):
+    ...     size = 10
+    >>> input_size([FileID('a'), [FileID('b')], 'c', 5, {'d': FileID('d')}])
+    30
+
+    :param list values: Job arguments
+    :return: Total size in bytes
+    :rtype: int
+    """
+    total = 0
+    pending = list(values)
+    while pending:
+        value = pending.pop()
+        if isinstance(value, (list, tuple)):
+            pending.extend(value)
+        elif isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(getattr(value, 'size', None), (int, long)):
+            total += value.size
+    return total
+
+
+def directory_size(path):
+    """
+    Returns the total size of the files under a directory
+
+    :param str path: Directory path
+    :return: Size in bytes
+    :rtype: int
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                # Files can be removed while the directory is walked
+                pass
+    return total
+
+
+class JobMeter(object):
+    """
+    Context manager that measures the resource usage of a running job and writes a metrics record
+    to the job store when the job succeeds. Peak disk usage is sampled from the work directory and the
+    directories added with measure_directory. The FileStore methods of the job are wrapped while the
+    job function runs. The counters are updated under a lock, since jobs may use the FileStore from
+    several threads.
+    """
+
+    def __init__(self, job, stage, input_bytes, interval=5):
+        """
+        :param JobFunctionWrappingJob job: Running job
+        :param str stage: Stage name used to group records
+        :param int input_bytes: Size of the job's FileStoreID arguments
+        :param float interval: Seconds between disk usage samples
+        """
+        self.job = job
+        self.stage = stage
+        self.interval = interval
+        # Container time and memory are None unless a container is run through metered_docker_call
+        self.record = {'stage': stage, 'input_bytes': input_bytes,
+                       'disk_requested': getattr(job, 'disk', None),
+                       'memory_requested': getattr(job, 'memory', None),
+                       'cores_requested': getattr(job, 'cores', None),
+                       'container_time': None, 'peak_memory': None,
+                       'filestore_read': 0, 'filestore_written': 0, 'peak_disk': 0}
+        work_dir = getattr(job.fileStore, 'localTempDir', None)
+        self.directories = [work_dir] if work_dir else []
+        self._patched = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._start = None
+        self._outer_meter = None
+
+    def __enter__(self):
+        self._start = time.time()
+        meter_toil_lib()
+        self._patch(self.job.fileStore, 'readGlobalFile', self._read_global_file)
+        self._patch(self.job.fileStore, 'readGlobalFileStream', self._read_global_file_stream)
+        self._patch(self.job.fileStore, 'writeGlobalFile', self._write_global_file)
+        self._outer_meter = getattr(self.job, _METER_ATTRIBUTE, None)
+        setattr(self.job, _METER_ATTRIBUTE, self)
+        self._sampler = threading.Thread(target=self._sample_disk)
+        self._sampler.daemon = True
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._sampler.join()
+        setattr(self.job, _METER_ATTRIBUTE, self._outer_meter)
+        for obj, name, original in reversed(self._patched):
+            setattr(obj, name, original)
+        if exc_type is None:
+            self.record['wall_time'] = time.time() - self._start
+            # ru_maxrss is in kilobytes on Linux
+            self.record['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            self.job.fileStore.jobStore.writeStatsAndLogging(json.dumps({METRICS_KEY: [self.record]}))
+        return False
+
+    def add(self, metric, amount):
+        """
+        Adds to a counter of the metrics record
+
+        :param str metric: Name of the counter
+        :param int|float amount: Amount added to the counter
+        """
+        with self._lock:
+            self.record[metric] = (self.record[metric] or 0) + amount
+
+    def maximum(self, metric, value):
+        """
+        Raises a peak of the metrics record to value if it is larger
+
+        :param str metric: Name of the peak
+        :param int|float value: Measured value
+        """
+        with self._lock:
+            self.record[metric] = max(self.record[metric], value)
+
+    def measure(self, path):
+        """
+        Adds a directory to the peak disk usage
+
+        :param str path: Directory path
+        """
+        with self._lock:
+            if path not in self.directories:
+                self.directories.append(path)
+
+    def _patch(self, obj, name, replacement):
+        self._patched.append((obj, name, getattr(obj, name)))
+        setattr(obj, name, replacement)
+
+    def _original(self, obj, name):
+        for patched_obj, patched_name, original in self._patched:
+            if patched_obj is obj and patched_name == name:
+                return original
+
+    def _read_global_file(self, fileStoreID, *args, **kwargs):
+        path = self._original(self.job.fileStore, 'readGlobalFile')(fileStoreID, *args, **kwargs)
+        size = getattr(fileStoreID, 'size', None)
+        self.add('filestore_read', size if size is not None else os.path.getsize(path))
+        return path
+
+    def _read_global_file_stream(self, fileStoreID, *args, **kwargs):
+        self.add('filestore_read', getattr(fileStoreID, 'size', None) or 0)
+        return self._original(self.job.fileStore, 'readGlobalFileStream')(fileStoreID, *args, **kwargs)
+
+    def _write_global_file(self, localFileName, *args, **kwargs):
+        self.add('filestore_written', os.path.getsize(localFileName))
+        return self._original(self.job.fileStore, 'writeGlobalFile')(localFileName, *args, **kwargs)
+
+    def _sample_disk(self):
+        # The directories are sampled once more after the job function returns
+        while True:
+            with self._lock:
+                directories = list(self.directories)
+            self.maximum('peak_disk', sum(directory_size(path) for path in directories))
+            if self._stop.is_set():
+                return
+            self._stop.wait(self.interval)
+
+
+def read_metrics(job_store_locator):
+    """
+    Reads the metrics records from a job store. The workflow must have been run with --stats,
+    otherwise Toil deletes the records as the workflow runs.
+
+    :param str job_store_locator: Job store locator, i.e. aws:us-west-2:my-jobstore or a local path
+    :return: Metrics records
+    :rtype: list[dict]
+    """
+    from toil.common import Toil
+    job_store = Toil.resumeJobStore(job_store_locator)
+    records = []
+
+    def callback(f):
+        try:
+            stats = json.load(f)
+        except ValueError:
+            return
+        records.extend(stats.get(METRICS_KEY, []))
+
+    job_store.readStatsAndLogging(callback, readAll=True)
+    return records
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile of a list of values using linear interpolation
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    >>> percentile([5], 90)
+    5.0
+
+    :param list values: Numeric values
+    :param float q: Percentile between 0 and 100
+    :return: Percentile
+    :rtype: float
+    """
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def _format_value(metric, value):
+    if metric.endswith('time'):
+        return '%.1fs' % value
+    for unit in ['B', 'K', 'M', 'G']:
+        if abs(value) < 1024:
+            return '%.1f%s' % (value, unit)
+        value /= 1024.0
+    return '%.1fT' % value
+
+
+def format_report(records):
+    """
+    Formats the distribution of each metric for each stage
+
+    >>> print(format_report([{'stage': 'sort', 'wall_time': 10.0, 'peak_disk': 2048},
+    ...                      {'stage': 'sort', 'wall_time': 20.0, 'peak_disk': 4096}]))
+    sort (2 jobs)
+      metric                  min     median        p90        max
+      wall_time             10.0s      15.0s      19.0s      20.0s
+      peak_disk              2.0K       3.0K       3.8K       4.0K
+
+    :param list[dict] records: Metrics records from read_metrics
+    :return: Report
+    :rtype: str
+    """
+    stages = {}
+    for record in records:
+        stages.setdefault(record['stage'], []).append(record)
+    lines = []
+    for stage in sorted(stages):
+        lines.append('%s (%d jobs)' % (stage, len(stages[stage])))
+        lines.append('  %-16s %10s %10s %10s %10s' % ('metric', 'min', 'median', 'p90', 'max'))
+        for metric in METRICS:
+            values = [r[metric] for r in stages[stage] if r.get(metric) is not None]
+            if not values:
+                continue
+            stats = [min(values), percentile(values, 50), percentile(values, 90), max(values)]
+            lines.append('  %-16s %10s %10s %10s %10s' % tuple([metric] + [_format_value(metric, x) for x in stats]))
+    return '\n'.join(lines)
+
+
+def add_report_parser(subparsers):
+    """
+    Adds the report subcommand to a pipeline's argument parser
+
+    :param subparsers: Object returned by ArgumentParser.add_subparsers
+    """
+    parser_report = subparsers.add_parser('report', help='Prints the resource usage of each stage of a workflow. '
+                                                         'The workflow must be run with --stats.')
+    parser_report.add_argument('jobStore', help='Job store of the workflow')
+    parser_report.add_argument('--update-resource-model', default=None, metavar='PATH',
+                               help='Adds the metrics to the resource model at PATH, which is created if it '
+                                    'does not exist. Pass the model to the pipeline with the resource-model '
+                                    'config option to size jobs from these measurements.')
+
+
+def report(job_store_locator, resource_model_path=None):
+    """
+    Prints the resource usage report for a workflow
+
+    :param str job_store_locator: Job store locator
+    :param str resource_model_path: Path to a resource model that is updated with the metrics
+    """
+    records = read_metrics(job_store_locator)
+    if not records:
+        print('No metrics found in {}. Run the workflow with --stats to keep them.'.format(job_store_locator))
+        return
+    print(format_report(records))
+    if resource_model_path:
+        from toil_scripts.resources import ResourceModel
+        model = ResourceModel.load(resource_model_path)
+        model.update(records)
+        model.save(resource_model_path)
+        print('\nUpdated resource model {}:\n{}'.format(resource_model_path, model.summary()))
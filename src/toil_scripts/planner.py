@@ -0,0 +1,876 @@
+#!/usr/bin/env python2.7
+"""
+Offline planning of pipeline workflows.
+
+The plan subcommands build the job graph of a workflow without running any tools. Toil's Job and
+PromisedRequirement are replaced with recording versions while the pipeline's job functions run. Job functions
+that only add jobs to the graph are called as they would be by Toil. Job functions that run tools are not called:
+their runtime and outputs are estimated from the size of their inputs with a per-tool model, or with the runtime
+fits of a resource model written by the report subcommand. The graph is then scheduled the way Toil runs it, with
+children after their parent and follow-ons after their parent's children, to report job counts, the critical path,
+peak concurrent resource usage, and node-hours.
+"""
+from __future__ import print_function
+import argparse
+import heapq
+import inspect
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import urllib2
+from collections import namedtuple
+from contextlib import contextmanager
+from urlparse import urlparse
+
+from bd2k.util.humanize import human2bytes
+
+from toil_scripts.bgzf import VCF_COMPRESSION_RATIO
+from toil_scripts.metrics import input_size, job_inputs, job_stage
+from toil_scripts.resources import ResourceModel
+
+log = logging.getLogger(__name__)
+
+# Toil's default job requirements
+DEFAULT_REQUIREMENTS = {'cores': 1, 'memory': 2 * 1024 ** 3, 'disk': 2 * 1024 ** 3}
+
+# Runtime of a job function that only adds jobs to the graph
+ORCHESTRATION_SECONDS = 5
+
+# Files up to this size are fetched when a job function reads them while the graph is built
+MAX_FETCH_SIZE = 64 * 1024 ** 2
+
+# Tools that write a genomic interval shard scale their output by the shard's share of the human genome
+GENOME_LENGTH = 3.1e9
+
+# Job functions from other packages that only add jobs to the graph
+ORCHESTRATION_FUNCTIONS = {'map_job'}
+
+GB = float(1024 ** 3)
+
+
+class PlanningError(Exception):
+    pass
+
+
+class PlanFile(str):
+    """
+    Stands in for a FileStoreID while a workflow is planned
+    """
+    _ids = itertools.count()
+
+    def __new__(cls, size, url=None):
+        self = super(PlanFile, cls).__new__(cls, 'plan-file-{}'.format(next(cls._ids)))
+        self.size = int(size)
+        self.url = url
+        return self
+
+
+"""
+Runtime and output model of a tool. The runtime in seconds is seconds + seconds_per_gb * input GB, where the input
+is the total size of the job's FileStoreID arguments. output is a function of the job's arguments that returns the
+job's return value.
+"""
+Tool = namedtuple('Tool', 'seconds seconds_per_gb output')
+
+
+def _files(args):
+    """
+    Returns the FileStoreIDs in a job's arguments. Namespaces are not searched, since pipeline configurations
+    hold the shared reference files.
+
+    >>> a, b = PlanFile(10), PlanFile(20)
+    >>> [f.size for f in _files([a, {'x': [b]}, argparse.Namespace(c=PlanFile(30))])]
+    [10, 20]
+    """
+    files = []
+    for arg in args:
+        if isinstance(arg, PlanFile):
+            files.append(arg)
+        elif isinstance(arg, (list, tuple)):
+            files.extend(_files(arg))
+        elif isinstance(arg, dict):
+            files.extend(_files([arg[key] for key in sorted(arg)]))
+    return files
+
+
+def _size(args, kwargs):
+    return sum(f.size for f in _files(list(args) + [kwargs[key] for key in sorted(kwargs)]))
+
+
+def _scaled(factor, minimum=1024):
+    """
+    Returns an output function for tools that write one file whose size is proportional to their inputs
+    """
+    return lambda job, args, kwargs: PlanFile(max(minimum, factor * _size(args, kwargs)))
+
+
+def _fixed(size):
+    """
+    Returns an output function for tools that write one file of a fixed size
+    """
+    return lambda job, args, kwargs: PlanFile(size)
+
+
+def _nothing(job, args, kwargs):
+    return None
+
+
+def _sample_size(config):
+    return sum(getattr(config, name).size for name in ['r1', 'r2', 'bam'] if getattr(config, name, None))
+
+
+def _bam_and_index(bam_size):
+    return PlanFile(bam_size), PlanFile(max(1024, bam_size // 10000))
+
+
+def _download(job, args, kwargs):
+    # Download jobs are sized from the probed size of the file
+    url = kwargs.get('url', args[0] if args else None)
+    return PlanFile(job.requirements['disk'], url=url)
+
+
+def _bwakit(job, args, kwargs):
+    config = kwargs.get('config', args[0] if args else None)
+    return PlanFile(_sample_size(config))
+
+
+def _bwakit_sort_index(job, args, kwargs):
+    config = kwargs.get('config', args[0] if args else None)
+    return _bam_and_index(_sample_size(config))
+
+
+def _preprocessing(job, args, kwargs):
+    return _bam_and_index(args[0].size)
+
+
+def _convert_to_cram(job, args, kwargs):
+    # CRAMs are about half the size of the BAM they encode
+    cram_size = args[0].size // 2
+    return PlanFile(cram_size), PlanFile(max(1024, cram_size // 10000))
+
+
+def _haplotype_caller(job, args, kwargs):
+    size = 0.08 * args[0].size * (2 if kwargs.get('cram') else 1)
+    intervals = kwargs.get('intervals')
+    if intervals:
+        size *= min(1.0, sum(end - start + 1 for _, start, end in intervals) / GENOME_LENGTH)
+    if kwargs.get('compress'):
+        size /= VCF_COMPRESSION_RATIO
+    return PlanFile(max(1024, size))
+
+
+def _shard_output_size(args, kwargs):
+    # Shard outputs cover the shard's share of the genome
+    fraction = min(1.0, sum(end - start + 1 for _, start, end in kwargs['intervals']) / GENOME_LENGTH)
+    return max(1024, 0.01 * _size(args[:4], {}) * fraction)
+
+
+def _mutect_shard(job, args, kwargs):
+    size = _shard_output_size(args, kwargs)
+    return PlanFile(size), PlanFile(size), PlanFile(size)
+
+
+def _pindel_shard(job, args, kwargs):
+    size = _shard_output_size(args, kwargs)
+    return {'pindel' + suffix: PlanFile(size) for suffix in ['-config.txt', '_D', '_SI', '_LI', '_INV', '_TD']}
+
+
+def _genotype_gvcfs(job, args, kwargs):
+    # The genotyped VCF is plain text, so it is larger relative to compressed GVCFs
+    factor = 0.2 * (VCF_COMPRESSION_RATIO if kwargs.get('compressed') else 1)
+    return _scaled(factor)(job, args, kwargs)
+
+
+def _split_vcf(job, args, kwargs):
+    vcf, shards = args[0], kwargs.get('shards', args[1] if len(args) > 1 else [])
+    return [PlanFile(vcf.size // max(1, len(shards))) for _ in shards]
+
+
+def _split_fastqs(job, args, kwargs):
+    r1, r2, chunk_reads = args[0], args[1], args[2]
+    # Compressed FASTQs hold about 60 bytes per read, and uncompressed FASTQs about 250 bytes
+    bytes_per_read = 60 if (r1.url or '').endswith('.gz') else 250
+    num_chunks = max(1, int(math.ceil(r1.size / float(bytes_per_read * chunk_reads))))
+    return [(PlanFile(r1.size // num_chunks), PlanFile(r2.size // num_chunks) if r2 else None)
+            for _ in range(num_chunks)]
+
+
+def _merge_bams(job, args, kwargs):
+    size = _size(args[:1], {})
+    return _bam_and_index(size) if kwargs.get('index') else PlanFile(size)
+
+
+def _oncotator_batch(job, args, kwargs):
+    return {name: PlanFile(3 * vcf.size) for name, vcf in args[0].iteritems()}
+
+
+def _variant_recalibrator(job, args, kwargs):
+    return PlanFile(max(1024, 0.1 * _size(args[:2], {}))), PlanFile(1024 ** 2), PlanFile(1024 ** 2)
+
+
+def _bwa_index(job, args, kwargs):
+    ref = args[0].size
+    return PlanFile(1024 ** 2), PlanFile(1024 ** 2), PlanFile(ref), PlanFile(ref // 4), PlanFile(ref // 2)
+
+
+# Coarse defaults, measured on whole genome samples with 32 cores. A resource model from the report subcommand
+# replaces them with fits to measured runtimes.
+TOOLS = {
+    'download_url_job': Tool(10, 30, _download),
+    'save_reference_job': Tool(10, 30, _nothing),
+    'import_reference_job': Tool(10, 10, lambda job, args, kwargs: PlanFile(args[1], url=args[0])),
+    'output_file_job': Tool(10, 30, _nothing),
+    'output_files_job': Tool(10, 30, _nothing),
+    'copy_file_job': Tool(10, 30, _nothing),
+    's3am_upload_job': Tool(10, 30, _nothing),
+    'run_samtools_faidx': Tool(60, 20, _fixed(1024 ** 2)),
+    'run_picard_create_sequence_dictionary': Tool(60, 20, _fixed(1024 ** 2)),
+    'run_bwa_index': Tool(600, 1200, _bwa_index),
+    'run_bwakit': Tool(300, 1200, _bwakit),
+    'run_bwakit_sort_index': Tool(300, 1400, _bwakit_sort_index),
+    'split_fastqs': Tool(30, 30, _split_fastqs),
+    'merge_bams': Tool(60, 60, _merge_bams),
+    'run_samtools_sort': Tool(60, 120, _scaled(1.0)),
+    'run_samtools_index': Tool(30, 30, lambda job, args, kwargs: PlanFile(max(1024, args[0].size // 10000))),
+    'run_gatk_preprocessing': Tool(600, 1500, _preprocessing),
+    'picard_mark_duplicates': Tool(120, 300, _preprocessing),
+    'run_realigner_target_creator': Tool(120, 200, _fixed(1024 ** 2)),
+    'run_indel_realignment': Tool(120, 300, lambda job, args, kwargs: _bam_and_index(args[1].size)),
+    'run_base_recalibration': Tool(120, 300, _fixed(1024 ** 2)),
+    'apply_bqsr_recalibration': Tool(120, 400, lambda job, args, kwargs: _bam_and_index(args[1].size)),
+    'convert_to_cram': Tool(60, 240, _convert_to_cram),
+    'index_cram': Tool(30, 30, lambda job, args, kwargs: PlanFile(max(1024, args[0].size // 10000))),
+    'gatk_haplotype_caller': Tool(300, 900, _haplotype_caller),
+    'gatk_genotype_gvcfs': Tool(120, 300, _genotype_gvcfs),
+    'gatk_combine_gvcfs': Tool(60, 200, _scaled(1.0)),
+    'gather_vcfs': Tool(10, 20, _scaled(1.0)),
+    'split_vcf': Tool(10, 20, _split_vcf),
+    'native_hard_filter': Tool(10, 60, _scaled(1.0)),
+    'gatk_select_variants': Tool(60, 60, _scaled(0.5)),
+    'gatk_variant_filtration': Tool(60, 60, _scaled(1.0)),
+    'gatk_combine_variants': Tool(60, 60, _scaled(1.0)),
+    'gatk_variant_recalibrator': Tool(300, 300, _variant_recalibrator),
+    'gatk_apply_variant_recalibration': Tool(60, 120, lambda job, args, kwargs: PlanFile(args[1].size)),
+    'run_oncotator': Tool(300, 600, _scaled(3.0)),
+    'run_oncotator_batch': Tool(300, 600, _oncotator_batch),
+    'run_mutect': Tool(600, 1200, _scaled(0.01)),
+    'run_mutect_shard': Tool(600, 1200, _mutect_shard),
+    'merge_mutect_shards': Tool(10, 20, _scaled(1.0)),
+    'pindel_insert_sizes': Tool(60, 30, lambda job, args, kwargs: (300, 300)),
+    'run_pindel_shard': Tool(600, 1200, _pindel_shard),
+    'merge_pindel_shards': Tool(10, 20, _scaled(1.0)),
+    'run_muse_call': Tool(600, 1200, lambda job, args, kwargs: PlanFile(_shard_output_size(args, kwargs))),
+    'run_muse_sump': Tool(60, 60, _scaled(0.1)),
+    'run_pindel': Tool(600, 1200, _scaled(0.01)),
+    'run_muse': Tool(600, 1200, _scaled(0.01)),
+    'consolidate_output': Tool(30, 30, _nothing)}
+
+# Tools that are not in TOOLS
+DEFAULT_TOOL = Tool(60, 60, _scaled(1.0))
+
+
+class PlanPromise(object):
+    """
+    Stands in for a Toil Promise. Resolved when the job that returns the value has been planned.
+    """
+
+    def __init__(self, job, path):
+        self.job = job
+        self.path = path
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class PlanRequirement(object):
+    """
+    Stands in for Toil's PromisedRequirement
+    """
+
+    def __init__(self, value_or_callable, *args):
+        if callable(value_or_callable):
+            self.func, self.args = value_or_callable, list(args)
+        else:
+            self.func, self.args = (lambda x: x), [value_or_callable]
+
+
+class PlanJob(object):
+    """
+    Records a job of the planned graph. Implements the part of Toil's Job API that the pipelines use.
+    """
+
+    def __init__(self, memory=None, cores=None, disk=None, preemptable=None, unitName=None, checkpoint=False):
+        self.func = None
+        self.pass_job = True
+        self.args = ()
+        self.kwargs = {}
+        self.requirements = {'memory': memory, 'cores': cores, 'disk': disk}
+        self.children = []
+        self.follow_ons = []
+        self.predecessors = []
+        self.fileStore = None
+        self.result = None
+        self.planned = False
+        # Scheduling state
+        self.pending = None
+        self.ready = 0.0
+        self.released_by = None
+        self.start = None
+        self.finish = None
+        self.runtime = 0.0
+        self.children_pending = 0
+        self.follow_ons_pending = 0
+        self.last_done = None
+
+    @staticmethod
+    def wrapJobFn(fn, *args, **kwargs):
+        return PlanJob._wrap(fn, True, args, kwargs)
+
+    @staticmethod
+    def wrapFn(fn, *args, **kwargs):
+        return PlanJob._wrap(fn, False, args, kwargs)
+
+    @staticmethod
+    def _wrap(fn, pass_job, args, kwargs):
+        # Toil takes the requirements from the keyword arguments, or from the defaults of the job function
+        spec = inspect.getargspec(fn)
+        defaults = dict(zip(spec.args[-len(spec.defaults):], spec.defaults)) if spec.defaults else {}
+        kwargs = dict(kwargs)
+        requirements = {key: kwargs.pop(key, defaults.get(key)) for key in DEFAULT_REQUIREMENTS}
+        for key in ['preemptable', 'unitName', 'checkpoint']:
+            kwargs.pop(key, None)
+        job = PlanJob(**requirements)
+        job.func, job.pass_job, job.args, job.kwargs = fn, pass_job, args, kwargs
+        return job
+
+    @property
+    def cores(self):
+        return self.requirements['cores']
+
+    @property
+    def memory(self):
+        return self.requirements['memory']
+
+    @property
+    def disk(self):
+        return self.requirements['disk']
+
+    @property
+    def stage(self):
+        return _unwrapped(self.func).__name__ if self.func else None
+
+    def addChild(self, child):
+        self.children.append(child)
+        child.predecessors.append((self, 'child'))
+        return child
+
+    def addFollowOn(self, follow_on):
+        self.follow_ons.append(follow_on)
+        follow_on.predecessors.append((self, 'follow_on'))
+        return follow_on
+
+    def addChildJobFn(self, fn, *args, **kwargs):
+        return self.addChild(PlanJob.wrapJobFn(fn, *args, **kwargs))
+
+    def addFollowOnJobFn(self, fn, *args, **kwargs):
+        return self.addFollowOn(PlanJob.wrapJobFn(fn, *args, **kwargs))
+
+    def addChildFn(self, fn, *args, **kwargs):
+        return self.addChild(PlanJob.wrapFn(fn, *args, **kwargs))
+
+    def addFollowOnFn(self, fn, *args, **kwargs):
+        return self.addFollowOn(PlanJob.wrapFn(fn, *args, **kwargs))
+
+    def encapsulate(self):
+        return PlanEncapsulatedJob(self)
+
+    def rv(self, *path):
+        return PlanPromise(self, path)
+
+
+class PlanEncapsulatedJob(PlanJob):
+    """
+    Stands in for Toil's EncapsulatedJob. Successors run after the encapsulated job and all of its successors.
+    """
+
+    def __init__(self, job):
+        super(PlanEncapsulatedJob, self).__init__()
+        self.encapsulated_job = job
+        PlanJob.addChild(self, job)
+        self.encapsulated_follow_on = PlanJob()
+        PlanJob.addFollowOn(self, self.encapsulated_follow_on)
+
+    def addChild(self, child):
+        return PlanJob.addChild(self.encapsulated_follow_on, child)
+
+    def addFollowOn(self, follow_on):
+        return PlanJob.addFollowOn(self.encapsulated_follow_on, follow_on)
+
+    def rv(self, *path):
+        return self.encapsulated_job.rv(*path)
+
+
+class PlanFileStore(object):
+    """
+    Stands in for the FileStore of a job function that is called while the graph is built. Small input files are
+    fetched from their URL, so job functions can read i.e. sequence dictionaries.
+    """
+
+    def __init__(self, planner):
+        self.planner = planner
+
+    def logToMaster(self, text, level=logging.INFO):
+        log.debug(text)
+
+    def getLocalTempDir(self):
+        return tempfile.mkdtemp(dir=self.planner.work_dir)
+
+    def readGlobalFile(self, fileStoreID, userPath=None, cache=True, mutable=None):
+        path = userPath or os.path.join(self.getLocalTempDir(), 'file')
+        self.planner.fetch(fileStoreID, path)
+        return path
+
+    @contextmanager
+    def readGlobalFileStream(self, fileStoreID):
+        with open(self.readGlobalFile(fileStoreID), 'r') as f:
+            yield f
+
+    def writeGlobalFile(self, localFileName, cleanup=False):
+        return PlanFile(os.path.getsize(localFileName))
+
+    def deleteGlobalFile(self, fileStoreID):
+        pass
+
+
+def _unwrapped(fn):
+    # Job functions wrapped with metered() are planned under the name of the wrapped function
+    return getattr(fn, '__wrapped__', fn)
+
+
+def _requirement(value, default):
+    if value is None:
+        return default
+    if isinstance(value, basestring):
+        return human2bytes(value)
+    return value
+
+
+class Planner(object):
+    """
+    Builds and schedules the job graph of a workflow
+    """
+
+    def __init__(self, tools=None, resource_model=None):
+        """
+        :param dict tools: Tool models by job function name. Defaults to TOOLS.
+        :param ResourceModel resource_model: Resource model whose runtime fits replace the tool models
+        """
+        self.tools = TOOLS if tools is None else tools
+        self.resource_model = resource_model
+        self.jobs = []
+        self.unreadable = set()
+        self.work_dir = None
+        self._events = []
+        self._sequence = itertools.count()
+
+    def run(self, root):
+        """
+        Plans a workflow
+
+        :param PlanJob root: Root job of the workflow
+        :return: Planned jobs that run a job function, in the order that they start
+        :rtype: list[PlanJob]
+        """
+        self.work_dir = tempfile.mkdtemp()
+        try:
+            self._schedule(root, 0.0)
+            while self._events:
+                t, _, event, job = heapq.heappop(self._events)
+                if event == 'start':
+                    self._start(job, t)
+                else:
+                    self._finish(job, t)
+        finally:
+            shutil.rmtree(self.work_dir)
+        return self.jobs
+
+    def is_tool(self, job):
+        """
+        Jobs that run tools are estimated rather than called. These are the job functions with a tool model, and
+        the job functions from other packages that the pipelines wrap with metered(func, __name__), unless they only
+        add jobs. The pipelines' own job functions are called, whichever module they were loaded as.
+
+        :param PlanJob job: Job
+        :rtype: bool
+        """
+        func = _unwrapped(job.func)
+        if func.__name__ in self.tools:
+            return True
+        if func.__name__ in ORCHESTRATION_FUNCTIONS:
+            return False
+        return getattr(job.func, 'imported', False)
+
+    def resolve(self, value):
+        """
+        Replaces promises with the values that they refer to. Containers are copied, since every Toil job works on
+        its own copy of its arguments.
+        """
+        if isinstance(value, PlanPromise):
+            if not value.job.planned:
+                raise PlanningError('A job reads the return value of a {} job that has not run'
+                                    .format(value.job.stage))
+            result = value.job.result
+            for key in value.path:
+                # Tools without an output model return a single file for every path
+                result = self.resolve(result)
+                if not isinstance(result, PlanFile):
+                    result = result[key]
+            return self.resolve(result)
+        if isinstance(value, PlanRequirement):
+            return value.func(*self.resolve(value.args))
+        if isinstance(value, argparse.Namespace):
+            return argparse.Namespace(**self.resolve(vars(value)))
+        if isinstance(value, dict):
+            return type(value)((key, self.resolve(item)) for key, item in value.iteritems())
+        if isinstance(value, tuple) and hasattr(value, '_fields'):
+            return type(value)(*self.resolve(list(value)))
+        if isinstance(value, (list, tuple, set)):
+            return type(value)(self.resolve(item) for item in value)
+        return value
+
+    def fetch(self, file_id, path):
+        """
+        Writes the content of a file to a local path. Files that are too large or not available offline are
+        written empty, and are reported with the plan.
+
+        :param PlanFile file_id: File
+        :param str path: Local path
+        """
+        url = getattr(file_id, 'url', None)
+        if url and file_id.size <= MAX_FETCH_SIZE:
+            try:
+                _fetch_url(url, path)
+                return
+            except Exception as e:
+                log.warning('Could not fetch %s: %s', url, e)
+        self.unreadable.add(url or 'an intermediate file')
+        open(path, 'w').close()
+
+    def _schedule(self, job, t):
+        heapq.heappush(self._events, (t, next(self._sequence), 'start', job))
+
+    def _release(self, job, t, binding_job):
+        # A job starts once every predecessor has released it. The last release determines its start time.
+        if job.pending is None:
+            job.pending = len(job.predecessors)
+        job.pending -= 1
+        if t >= job.ready:
+            job.ready, job.released_by = t, binding_job
+        if job.pending == 0:
+            self._schedule(job, job.ready)
+
+    def _start(self, job, t):
+        job.start = t
+        if job.func is not None:
+            args, kwargs = self.resolve(list(job.args)), self.resolve(job.kwargs)
+            job.requirements = {key: _requirement(self.resolve(job.requirements[key]), default)
+                                for key, default in DEFAULT_REQUIREMENTS.iteritems()}
+            if self.is_tool(job):
+                tool = self.tools.get(job.stage, DEFAULT_TOOL)
+                runtime = None
+                if self.resource_model is not None:
+                    # Resource models are fit to the input sizes recorded by metered job functions
+                    runtime = self.resource_model.estimate(job_stage(job.func, args, kwargs), 'runtime',
+                                                             input_size(job_inputs(job.func, args, kwargs)))
+                if runtime is None:
+                    runtime = tool.seconds + tool.seconds_per_gb * _size(args, kwargs) / GB
+                job.runtime = runtime
+                job.result = tool.output(job, args, kwargs)
+            else:
+                job.fileStore = PlanFileStore(self)
+                func = _unwrapped(job.func)
+                job.result = func(job, *args, **kwargs) if job.pass_job else func(*args, **kwargs)
+                job.runtime = ORCHESTRATION_SECONDS
+            self.jobs.append(job)
+        job.planned = True
+        heapq.heappush(self._events, (t + job.runtime, next(self._sequence), 'finish', job))
+
+    def _finish(self, job, t):
+        job.finish = t
+        job.children_pending = len(job.children)
+        job.follow_ons_pending = len(job.follow_ons)
+        if job.children:
+            for child in job.children:
+                self._release(child, t, job)
+        else:
+            self._children_done(job, t, job)
+
+    def _children_done(self, job, t, last_done):
+        if job.follow_ons:
+            for follow_on in job.follow_ons:
+                self._release(follow_on, t, last_done)
+        else:
+            self._done(job, t, last_done)
+
+    def _done(self, job, t, last_done):
+        # A job is done when it, its children and its follow-ons have finished
+        job.last_done = last_done
+        for predecessor, relation in job.predecessors:
+            if relation == 'child':
+                predecessor.children_pending -= 1
+                if predecessor.children_pending == 0:
+                    self._children_done(predecessor, t, last_done)
+            else:
+                predecessor.follow_ons_pending -= 1
+                if predecessor.follow_ons_pending == 0:
+                    self._done(predecessor, t, last_done)
+
+
+def _fetch_url(url, path):
+    """
+    Downloads a file from a URL (file://, s3://, http://, https://) or local path
+    """
+    parsed_url = urlparse(url)
+    if parsed_url.scheme in ('', 'file'):
+        shutil.copyfile(parsed_url.path, path)
+    elif parsed_url.scheme == 's3':
+        from toil_scripts.urls import s3_connection
+        s3 = s3_connection()
+        try:
+            bucket = s3.get_bucket(parsed_url.netloc, validate=False)
+            bucket.get_key(parsed_url.path.lstrip('/'), validate=False).get_contents_to_filename(path)
+        finally:
+            s3.close()
+    elif parsed_url.scheme in ('http', 'https'):
+        response = urllib2.urlopen(url)
+        try:
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(response, f)
+        finally:
+            response.close()
+    else:
+        raise PlanningError('Cannot fetch {}'.format(url))
+
+
+@contextmanager
+def planning(node_cores=None):
+    """
+    Replaces Toil's Job and PromisedRequirement with PlanJob and PlanRequirement in the modules of this package and
+    toil-lib, and in the __main__ module of a pipeline that is run as a script, and stops tools from being run while
+    the graph is built
+
+    :param int node_cores: (OPTIONAL) Number of cores that job functions see on the worker node
+    """
+    from toil.job import Job, PromisedRequirement
+    replacements = [(Job, PlanJob), (PromisedRequirement, PlanRequirement)]
+    patched = []
+    for module in sys.modules.values():
+        if module is None or not (module.__name__ == '__main__' or
+                                  module.__name__.startswith(('toil_scripts', 'toil_lib'))):
+            continue
+        for name, value in vars(module).items():
+            for original, replacement in replacements:
+                if value is original:
+                    patched.append((module, name, value))
+                    setattr(module, name, replacement)
+
+    def popen(*args, **kwargs):
+        raise PlanningError('A job function tried to run {} while the workflow was planned. Add a tool model for '
+                            'the job function to toil_scripts.planner.TOOLS.'.format(args[0] if args else args))
+
+    patched.append((subprocess, 'Popen', subprocess.Popen))
+    subprocess.Popen = popen
+    if node_cores:
+        # Job functions size their jobs from the cores of the node that they run on
+        patched.append((multiprocessing, 'cpu_count', multiprocessing.cpu_count))
+        multiprocessing.cpu_count = lambda: node_cores
+    try:
+        yield
+    finally:
+        for module, name, value in reversed(patched):
+            setattr(module, name, value)
+
+
+def plan_workflow(job_function, *args, **kwargs):
+    """
+    Plans the workflow that Toil would run for Job.wrapJobFn(job_function, *args, **kwargs)
+
+    :param function job_function: Root job function of the workflow
+    :param Planner planner: (OPTIONAL) Planner with the tool models, given as the keyword argument planner
+    :param int node_cores: (OPTIONAL) Number of cores of the worker nodes, given as the keyword argument node_cores
+    :return: The planner, the planned jobs that run a job function, and the root job
+    :rtype: tuple(Planner, list[PlanJob], PlanJob)
+    """
+    planner = kwargs.pop('planner', None) or Planner()
+    with planning(kwargs.pop('node_cores', None)):
+        root = PlanJob.wrapJobFn(job_function, *args, **kwargs)
+        jobs = planner.run(root)
+    return planner, jobs, root
+
+
+def critical_path(jobs):
+    """
+    Returns the chain of jobs that determines the length of the workflow
+
+    :param list[PlanJob] jobs: Planned jobs
+    :return: Jobs on the critical path that run a job function, in the order that they run
+    :rtype: list[PlanJob]
+    """
+    if not jobs:
+        return []
+    job = max(jobs, key=lambda j: j.finish)
+    path = []
+    while job is not None:
+        if job.func is not None:
+            path.append(job)
+        job = job.released_by
+    return path[::-1]
+
+
+def peak_usage(jobs):
+    """
+    Returns the peak total cores, memory and disk of the jobs that run at the same time when every job starts as
+    soon as its predecessors are done
+
+    >>> a, b, c = PlanJob(cores=2, memory=10, disk=5), PlanJob(cores=4, memory=20, disk=5), PlanJob(cores=1)
+    >>> a.start, a.finish, b.start, b.finish, c.start, c.finish = 0, 10, 5, 15, 10, 20
+    >>> a.requirements['disk'] = c.requirements['disk'] = c.requirements['memory'] = 1
+    >>> peak_usage([a, b, c])
+    {'cores': 6, 'disk': 6, 'memory': 30}
+
+    :param list[PlanJob] jobs: Planned jobs
+    :return: Peak usage {requirement: peak}
+    :rtype: dict
+    """
+    peaks = {}
+    for key in DEFAULT_REQUIREMENTS:
+        # Jobs that finish at the same time as others start release their resources first
+        events = sorted([(j.start, 1, j.requirements[key]) for j in jobs if j.finish > j.start] +
+                        [(j.finish, 0, -j.requirements[key]) for j in jobs if j.finish > j.start])
+        usage = peak = 0
+        for _, _, change in events:
+            usage += change
+            peak = max(peak, usage)
+        peaks[key] = peak
+    return peaks
+
+
+def node_fraction(job, node):
+    """
+    Returns the fraction of a node that a job occupies
+
+    >>> job = PlanJob(cores=8, memory=16, disk=10)
+    >>> node_fraction(job, {'cores': 32, 'memory': 32, 'disk': 100})
+    0.5
+
+    :param PlanJob job: Planned job
+    :param dict node: Node resources {requirement: amount}
+    :rtype: float
+    """
+    return max(job.requirements[key] / float(node[key]) for key in DEFAULT_REQUIREMENTS)
+
+
+def _format_bytes(value):
+    for unit in ['B', 'K', 'M', 'G', 'T']:
+        if abs(value) < 1024 or unit == 'T':
+            return '%.1f%s' % (value, unit)
+        value /= 1024.0
+
+
+def _format_hours(seconds):
+    return '%.2fh' % (seconds / 3600.0)
+
+
+def format_plan(planner, jobs, node):
+    """
+    Formats the job counts, critical path, peak usage and node-hours of a planned workflow
+
+    :param Planner planner: Planner that planned the workflow
+    :param list[PlanJob] jobs: Planned jobs
+    :param dict node: Node resources {requirement: amount}
+    :return: Plan
+    :rtype: str
+    """
+    lines = ['%d jobs' % len(jobs),
+             '  %-40s %6s %10s %8s %10s %10s' % ('stage', 'jobs', 'runtime', 'cores', 'memory', 'disk')]
+    stages = {}
+    for job in jobs:
+        stages.setdefault(job.stage, []).append(job)
+    for stage in sorted(stages):
+        stage_jobs = stages[stage]
+        lines.append('  %-40s %6d %10s %8s %10s %10s' % (stage, len(stage_jobs),
+                                                         _format_hours(sum(j.runtime for j in stage_jobs)),
+                                                         max(j.cores for j in stage_jobs),
+                                                         _format_bytes(max(j.memory for j in stage_jobs)),
+                                                         _format_bytes(max(j.disk for j in stage_jobs))))
+
+    path = critical_path(jobs)
+    lines.append('')
+    lines.append('Critical path: %s' % _format_hours(max(j.finish for j in jobs) if jobs else 0))
+    for job in path:
+        if job.runtime > ORCHESTRATION_SECONDS:
+            lines.append('  %-40s %10s' % (job.stage, _format_hours(job.runtime)))
+
+    peaks = peak_usage(jobs)
+    lines.append('')
+    lines.append('Peak concurrent usage: %s cores, %s memory, %s disk' % (peaks['cores'],
+                                                                       _format_bytes(peaks['memory']),
+                                                                       _format_bytes(peaks['disk'])))
+    node_seconds = sum(node_fraction(j, node) * j.runtime for j in jobs)
+    lines.append('Node-hours: %.1f on nodes with %s cores, %s memory, %s disk' % (node_seconds / 3600.0,
+                                                                                 node['cores'],
+                                                                                 _format_bytes(node['memory']),
+                                                                                 _format_bytes(node['disk'])))
+    oversized = sorted(set(j.stage for j in jobs if node_fraction(j, node) > 1))
+    if oversized:
+        lines.append('Jobs that do not fit on the node: %s' % ', '.join(oversized))
+    if planner.unreadable:
+        lines.append('')
+        lines.append('The following files were not available while the workflow was planned, so jobs that read them '
+                     'were planned as if they were empty:')
+        lines.extend('  %s' % url for url in sorted(planner.unreadable))
+    return '\n'.join(lines)
+
+
+def add_plan_parser(subparsers, parents=()):
+    """
+    Adds the plan subcommand to a pipeline's argument parser
+
+    :param subparsers: Object returned by ArgumentParser.add_subparsers
+    :param list[ArgumentParser] parents: Parsers of the pipeline inputs shared with the run subcommand
+    """
+    parser_plan = subparsers.add_parser('plan', parents=parents,
+                                        help='Builds the job graph of a workflow without running any tools and '
+                                             'estimates its runtime and cost.')
+    parser_plan.add_argument('--node-cores', type=int, default=32,
+                             help='Cores of each worker node. Default value: "%(default)s"')
+    parser_plan.add_argument('--node-memory', default='244G',
+                             help='Memory of each worker node. Default value: "%(default)s"')
+    parser_plan.add_argument('--node-disk', default='1T',
+                             help='Disk space of each worker node. Default value: "%(default)s"')
+    parser_plan.add_argument('--resource-model', default=None, metavar='PATH',
+                             help='Resource model written by "report --update-resource-model". Jobs are planned '
+                                  'with the runtimes measured by previous runs.')
+
+
+def plan(options, job_function, *args):
+    """
+    Prints the plan of the workflow that Toil would run for Job.wrapJobFn(job_function, *args)
+
+    :param Namespace options: Parsed arguments of the plan subcommand
+    :param function job_function: Root job function of the workflow
+    :param args: Arguments of the root job function
+    """
+    resource_model = ResourceModel.load(options.resource_model) if options.resource_model else None
+    planner, jobs, _ = plan_workflow(job_function, *args, planner=Planner(resource_model=resource_model),
+                                     node_cores=options.node_cores)
+    node = {'cores': options.node_cores,
+            'memory': human2bytes(options.node_memory),
+            'disk': human2bytes(options.node_disk)}
+    print(format_plan(planner, jobs, node))
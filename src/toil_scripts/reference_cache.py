@@ -0,0 +1,135 @@
+#!/usr/bin/env python2.7
+"""
+Persistent reference file cache shared by the pipelines.
+
+Reference files are stored under <cache>/<key>/<filename>, where the key is a hash of the source URL and
+its ETag or size and modification time. A new version of a reference file therefore gets a new key, and
+workflows that use the same reference bundle read it from the cache instead of the original location.
+The cache can be an S3 URL or a local directory on a filesystem that is shared by the worker nodes.
+
+Cached files are imported into the job store by the job store itself. An AWS job store copies a file from
+an S3 cache within S3, and a file job store copies it from a cache on the same filesystem, so a cache hit
+transfers nothing through the worker. A cache that is not next to the job store, or an S3 cache encrypted
+with SSE-C, still only saves the transfer from the original location.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+from urlparse import urlparse
+
+from bd2k.util.files import mkdir_p
+from toil.fileStore import FileID
+from toil.job import PromisedRequirement
+from toil_lib.urls import download_url_job, s3am_upload
+
+from toil_scripts.metrics import metered
+from toil_scripts.urls import url_fingerprint, url_size
+
+download_url_job = metered(download_url_job, __name__)
+
+
+def cache_location(cache_dir, fingerprint, url):
+    """
+    Returns the location of a reference file in the cache. The file keeps its original name, because
+    tools recognize file types by their extensions.
+
+    >>> cache_location('s3://bucket/refs', 's3://data/hg19.fa#3000:abc', 's3://data/hg19.fa')
+    's3://bucket/refs/d6a6343acddad267817a2ec640825334c2da8347/hg19.fa'
+
+    :param str cache_dir: S3 URL or local path to the reference cache
+    :param str fingerprint: Fingerprint of the reference file from url_fingerprint
+    :param str url: URL of the reference file
+    :return: URL of the cached reference file
+    :rtype: str
+    """
+    # Local cache directories must be on a filesystem shared by the worker nodes
+    if not urlparse(cache_dir).scheme:
+        cache_dir = 'file://' + os.path.abspath(cache_dir)
+    key = hashlib.sha1(fingerprint).hexdigest()
+    return os.path.join(cache_dir, key, os.path.basename(urlparse(url).path))
+
+
+def add_reference_download(job, url, cache_dir=None, disk=None, **kwargs):
+    """
+    Adds a child job that downloads a reference file. If a cache is given, the file is imported from the
+    cache when it is present, and is otherwise downloaded and then saved to the cache. Files without
+    an ETag or modification time cannot be versioned, so they are always downloaded.
+
+    :param JobFunctionWrappingJob job: Job that the download job is added to
+    :param str url: URL of the reference file
+    :param str cache_dir: S3 URL or local path to the reference cache, or None to disable the cache
+    :param str|int disk: Disk requirement for downloading the reference file from its original location.
+        The Toil default is used if None.
+    :param kwargs: Keyword arguments for download_url_job, i.e. name and s3_key_path
+    :return: Download or import job, which returns the reference file FileStoreID
+    :rtype: JobFunctionWrappingJob
+    """
+    if not cache_dir:
+        return job.addChildJobFn(download_url_job, url, disk=disk, **kwargs)
+
+    fingerprint = url_fingerprint(url)
+    if fingerprint == url:
+        job.fileStore.logToMaster('Cannot determine the version of {}, so it will not be cached'.format(url))
+        return job.addChildJobFn(download_url_job, url, disk=disk, **kwargs)
+
+    cache_url = cache_location(cache_dir, fingerprint, url)
+    cached_size = url_size(cache_url)
+    if cached_size is not None:
+        job.fileStore.logToMaster('Using cached reference file {} for {}'.format(cache_url, url))
+        # The job store cannot read objects that are encrypted with a customer key
+        if kwargs.get('s3_key_path') and urlparse(cache_url).scheme == 's3':
+            return job.addChildJobFn(download_url_job, cache_url, disk=cached_size, **kwargs)
+        return job.addChildJobFn(import_reference_job, cache_url, cached_size, disk=0)
+
+    download = job.addChildJobFn(download_url_job, url, disk=disk, **kwargs)
+    download.addChildJobFn(save_reference_job,
+                           download.rv(),
+                           cache_url,
+                           s3_key_path=kwargs.get('s3_key_path'),
+                           disk=PromisedRequirement(lambda x: x.size, download.rv()))
+    return download
+
+
+@metered
+def import_reference_job(job, cache_url, size):
+    """
+    Imports a reference file from the reference cache into the job store. The job store copies the file
+    itself, so the job needs no disk space.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str cache_url: URL of the cached reference file from cache_location
+    :param int size: Size of the cached reference file in bytes
+    :return: Reference file FileStoreID
+    :rtype: toil.fileStore.FileID
+    """
+    job.fileStore.logToMaster('Importing reference file {}'.format(cache_url))
+    # importFile returns a plain job store ID, but disk requirements read the size of FileStoreIDs
+    return FileID(job.fileStore.importFile(cache_url), size)
+
+
+@metered
+def save_reference_job(job, file_id, cache_url, s3_key_path=None):
+    """
+    Saves a reference file to the reference cache
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str file_id: Reference file FileStoreID
+    :param str cache_url: URL of the cached reference file from cache_location
+    :param str s3_key_path: (OPTIONAL) Path to 32-byte key to be used for SSE-C encryption
+    """
+    job.fileStore.logToMaster('Saving reference file to {}'.format(cache_url))
+    parsed_url = urlparse(cache_url)
+    filename = os.path.basename(parsed_url.path)
+    if parsed_url.scheme == 's3':
+        work_dir = job.fileStore.getLocalTempDir()
+        path = job.fileStore.readGlobalFile(file_id, os.path.join(work_dir, filename))
+        s3am_upload(job=job, fpath=path, s3_dir=os.path.dirname(cache_url), s3_key_path=s3_key_path)
+    else:
+        cache_dir = os.path.dirname(parsed_url.path)
+        mkdir_p(cache_dir)
+        # Write to a temporary file and rename it, so other workflows never read a partial file
+        tmp_path = os.path.join(cache_dir, '.{}.{}'.format(filename, uuid.uuid4().hex))
+        with job.fileStore.readGlobalFileStream(file_id) as f_in, open(tmp_path, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.rename(tmp_path, parsed_url.path)
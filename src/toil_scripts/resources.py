@@ -0,0 +1,245 @@
+#!/usr/bin/env python2.7
+"""
+Resource estimates learned from previous workflow runs.
+
+A ResourceModel holds the metrics records written by toil_scripts.metrics for earlier runs and fits a
+linear regression of each stage's peak disk, memory and runtime against the stage's input size. Pipelines
+request disk and memory through ResourceModel.disk and ResourceModel.memory, which use the fitted estimate
+when the stage has enough history and otherwise fall back to the pipeline's built-in multiplier or memory
+profile.
+"""
+import json
+import os
+
+from toil.job import PromisedRequirement
+
+from toil_scripts.metrics import input_size
+
+
+def memory_used(record):
+    """
+    Returns the memory that a job used, which is the peak memory of its containers and the peak RSS of
+    the worker. Jobs that ran containers whose memory was not measured are left out.
+
+    >>> memory_used({'container_time': 10.0, 'peak_memory': 1000, 'peak_rss': 100})
+    1100
+    >>> memory_used({'container_time': None, 'peak_memory': None, 'peak_rss': 100})
+    100
+    >>> memory_used({'container_time': 10.0, 'peak_memory': None, 'peak_rss': 100}) is None
+    True
+
+    :param dict record: Metrics record
+    :return: Memory in bytes, or None if it was not measured
+    :rtype: int|None
+    """
+    if record.get('peak_rss') is None or (record.get('container_time') is not None and
+                                          record.get('peak_memory') is None):
+        return None
+    return (record.get('peak_memory') or 0) + record['peak_rss']
+
+
+# Maps each estimated resource to the function of a metrics record that it is fitted to
+RESOURCES = {'disk': lambda record: record.get('peak_disk'),
+             'memory': memory_used,
+             'runtime': lambda record: record.get('wall_time')}
+
+
+def fit_linear(points):
+    """
+    Fits y = intercept + slope * x by least squares and records the largest amount that any point lies
+    above the fitted line, so that estimates cover every observation.
+
+    >>> fit_linear([(1, 3), (2, 5), (3, 7)])
+    (1.0, 2.0, 0.0, 3)
+    >>> fit_linear([(4, 10), (4, 14)])
+    (12.0, 0.0, 2.0, 4)
+
+    :param list[tuple(int, float)] points: List of (x, y) observations
+    :return: Tuple of intercept, slope, maximum residual, and largest observed x
+    :rtype: tuple(float, float, float, int)
+    """
+    n = float(len(points))
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    cov_xy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    # Disk, memory and runtime do not shrink as inputs grow
+    slope = max(0.0, cov_xy / var_x) if var_x else 0.0
+    intercept = mean_y - slope * mean_x
+    max_residual = max(y - (intercept + slope * x) for x, y in points)
+    return intercept, slope, max_residual, max(x for x, _ in points)
+
+
+class Estimate(object):
+    """
+    Callable used by PromisedRequirement. Estimates a resource from the input size of the promised
+    arguments, or calls the fallback function if the stage has no fit or the inputs are much larger
+    than any that were observed.
+    """
+
+    def __init__(self, fit, fallback, headroom, max_extrapolation):
+        self.fit = fit
+        self.fallback = fallback
+        self.headroom = headroom
+        self.max_extrapolation = max_extrapolation
+
+    def __call__(self, *args):
+        estimate = self.predict(input_size(args))
+        return estimate if estimate else self.fallback(*args)
+
+    def predict(self, x):
+        """
+        :param int x: Input size in bytes
+        :return: Fitted estimate, or None if there is no fit for the input size
+        :rtype: int|None
+        """
+        if self.fit is None:
+            return None
+        intercept, slope, max_residual, max_x = self.fit
+        if x > self.max_extrapolation * max_x:
+            return None
+        return int(self.headroom * max(0, intercept + slope * x + max_residual))
+
+
+class ResourceModel(object):
+    """
+    Per-stage regressions of disk, memory and runtime against input size
+
+    >>> records = [{'stage': 'sort', 'input_bytes': x, 'peak_disk': 2 * x, 'wall_time': x / 10}
+    ...            for x in range(100, 600, 100)]
+    >>> model = ResourceModel(records, headroom=1.0)
+    >>> model.estimate('sort', 'disk', 1000)
+    2000
+    >>> model.estimate('sort', 'disk', 10000) is None
+    True
+    >>> Estimate(model.fits.get(('index', 'disk')), lambda bam: 3 * bam, 1.2, 2.0)(100)
+    300
+
+    Promised arguments that are not files, i.e. shard counts, do not change the input size
+
+    >>> class FileID(str):
+    ...     size = 500
+    >>> Estimate(model.fits[('sort', 'disk')], None, 1.0, 2.0)(FileID('bam'), 4)
+    1000
+    """
+
+    def __init__(self, records=None, min_samples=5, headroom=1.2, max_extrapolation=2.0, max_history=1000):
+        """
+        :param list[dict] records: Metrics records from toil_scripts.metrics
+        :param int min_samples: Number of records a stage needs before its fit is used
+        :param float headroom: Factor applied to estimates as a safety margin
+        :param float max_extrapolation: Estimates are only used for inputs up to this multiple of the largest
+            input observed for the stage
+        :param int max_history: Number of records kept for each stage
+        """
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.max_extrapolation = max_extrapolation
+        self.max_history = max_history
+        self.records = {}
+        self.fits = {}
+        self.update(records or [])
+
+    def update(self, records):
+        """
+        Adds metrics records and refits the stages they belong to
+
+        :param list[dict] records: Metrics records from toil_scripts.metrics
+        """
+        for record in records:
+            if record.get('input_bytes'):
+                self.records.setdefault(record['stage'], []).append(record)
+        for stage in set(record['stage'] for record in records):
+            if stage not in self.records:
+                continue
+            self.records[stage] = self.records[stage][-self.max_history:]
+            for resource, measured in RESOURCES.iteritems():
+                points = [(r['input_bytes'], measured(r)) for r in self.records[stage] if measured(r) is not None]
+                if len(points) >= self.min_samples:
+                    self.fits[(stage, resource)] = fit_linear(points)
+
+    def estimate(self, stage, resource, input_bytes):
+        """
+        Estimates a resource requirement
+
+        :param str stage: Stage name, see toil_scripts.metrics.job_stage
+        :param str resource: disk, memory or runtime
+        :param int input_bytes: Input size of the job, see toil_scripts.metrics.input_size
+        :return: Estimate, or None if the stage has no fit for the input size
+        :rtype: int|None
+        """
+        return Estimate(self.fits.get((stage, resource)), None, self.headroom, self.max_extrapolation).predict(input_bytes)
+
+    def disk(self, stage, fallback, *args):
+        """
+        Builds the disk requirement for a job. The estimate uses the input size of the promised
+        arguments, which is measured like the input size that metered jobs record, so the arguments
+        must include every file that the job receives. Other arguments, i.e. sizes, counts and flags
+        used by the fallback, do not count towards the input size.
+
+        :param str stage: Stage name, see toil_scripts.metrics.job_stage
+        :param function fallback: Function of the promised arguments used when the stage has no history
+        :param args: Promised arguments, i.e. FileStoreIDs or job.rv() promises
+        :return: Disk requirement
+        :rtype: PromisedRequirement
+        """
+        return PromisedRequirement(Estimate(self.fits.get((stage, 'disk')), fallback,
+                                            self.headroom, self.max_extrapolation), *args)
+
+    def memory(self, stage, fallback, *args):
+        """
+        Builds the memory requirement for a job. Like disk, the estimate uses the input size of the
+        promised arguments. Stages whose container memory was not measured use the fallback.
+
+        :param str stage: Stage name, see toil_scripts.metrics.job_stage
+        :param function fallback: Function of the promised arguments, e.g. a memory profile of the input sizes
+        :param args: Promised arguments, i.e. FileStoreIDs or job.rv() promises
+        :return: Memory requirement
+        :rtype: PromisedRequirement
+        """
+        return PromisedRequirement(Estimate(self.fits.get((stage, 'memory')), fallback,
+                                            self.headroom, self.max_extrapolation), *args)
+
+    def __getstate__(self):
+        # Jobs only need the fits, so the history is not pickled into the job graph
+        state = self.__dict__.copy()
+        state['records'] = {}
+        return state
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Loads a model saved with ResourceModel.save. A missing file gives an empty model.
+
+        :param str path: Path to the model file
+        :return: Resource model
+        :rtype: ResourceModel
+        """
+        records = []
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                for stage_records in json.load(f)['records'].itervalues():
+                    records.extend(stage_records)
+        return cls(records, **kwargs)
+
+    def save(self, path):
+        """
+        Saves the metrics history of the model
+
+        :param str path: Path to the model file
+        """
+        with open(path, 'w') as f:
+            json.dump({'records': self.records}, f)
+
+    def summary(self):
+        """
+        Describes each fit
+
+        :return: One line per stage and resource
+        :rtype: str
+        """
+        lines = []
+        for (stage, resource), (intercept, slope, max_residual, max_x) in sorted(self.fits.iteritems()):
+            lines.append('%s %s = %.3g + %.3g * input_bytes (+%.3g, n=%d)'
+                         % (stage, resource, intercept, slope, max_residual, len(self.records.get(stage, []))))
+        return '\n'.join(lines)
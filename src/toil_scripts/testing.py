@@ -0,0 +1,92 @@
+#!/usr/bin/env python2.7
+"""
+Helpers for tests that run pipeline jobs in a local Toil workflow.
+
+The workflow uses a file job store and the single machine batch system in a scratch directory. Tests
+whose jobs run containers put the fake docker of the benchmark first on the PATH, so the jobs run
+unchanged on synthetic inputs without a container runtime (see toil_scripts.benchmark.fake_docker).
+"""
+import gzip
+import os
+import shutil
+from contextlib import contextmanager
+
+from toil.job import Job
+
+from toil_scripts.benchmark.benchmark import write_fake_docker
+
+
+def run_workflow(work_dir, job_function, *args, **kwargs):
+    """
+    Runs a job function as the root job of a workflow. Results are best returned by writing them to local
+    paths from a job of the workflow, with export_file, since the root job's return value is not resolved.
+
+    :param str work_dir: Scratch directory for the job store and the work directories of the jobs
+    :param function job_function: Root job function
+    :param args: Arguments of the job function
+    :param kwargs: Keyword arguments of the job function
+    """
+    options = Job.Runner.getDefaultOptions(os.path.join(work_dir, 'jobstore'))
+    options.workDir = os.path.join(work_dir, 'tmp')
+    options.batchSystem = 'singleMachine'
+    options.logLevel = 'WARNING'
+    options.clean = 'always'
+    if not os.path.exists(options.workDir):
+        os.makedirs(options.workDir)
+    Job.Runner.startToil(Job.wrapJobFn(job_function, *args, **kwargs), options)
+
+
+def export_file(job, file_id, path):
+    """
+    Writes a file of the FileStore to a local path. A file that a job reads with readGlobalFile is deleted
+    when the job ends if the FileStore caches files, even if it was read to a path outside the job's work
+    directory.
+
+    :param JobFunctionWrappingJob job: passed automatically by Toil
+    :param str file_id: FileStoreID of the file
+    :param str path: Local path of the copy
+    """
+    job.fileStore.exportFile(file_id, 'file://' + os.path.abspath(path))
+
+
+def gzip_file(path):
+    """
+    Compresses a file with gzip. The pipelines and the fake docker read a gzip compressed VCF like one
+    that bgzip compressed.
+
+    :param str path: Path of the file
+    :return: Path of the compressed copy, which is path followed by .gz
+    :rtype: str
+    """
+    with open(path, 'rb') as f_in, gzip.open(path + '.gz', 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    return path + '.gz'
+
+
+@contextmanager
+def fake_docker(work_dir):
+    """
+    Puts the benchmark's fake docker first on the PATH of the workflows that are run in the context
+
+    :param str work_dir: Scratch directory for the docker executable and its call log
+    :return: Path of the call log, with one JSON record per docker run
+    :rtype: str
+    """
+    bin_dir = os.path.join(work_dir, 'bin')
+    if not os.path.exists(bin_dir):
+        os.makedirs(bin_dir)
+    write_fake_docker(bin_dir)
+    log = os.path.join(work_dir, 'docker.log')
+    env = {'PATH': bin_dir + os.pathsep + os.environ.get('PATH', ''),
+           'TOIL_SCRIPTS_FAKE_DOCKER_TIME_SCALE': '0',
+           'TOIL_SCRIPTS_FAKE_DOCKER_LOG': log}
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        yield log
+    finally:
+        for key, value in saved.iteritems():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
@@ -0,0 +1,197 @@
+#!/usr/bin/env python2.7
+import httplib
+import logging
+import os
+import urllib2
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+
+log = logging.getLogger(__name__)
+
+
+def url_size(url):
+    """
+    Returns the size of the file at a URL without downloading it
+
+    :param str url: URL (file://, s3://, http://, https://) or local path
+    :return: Size in bytes, or None if the file does not exist or the size cannot be determined
+    :rtype: int|None
+    """
+    metadata = _stat_url(url)
+    return metadata[0] if metadata else None
+
+
+def probe_url_sizes(urls, threads=16):
+    """
+    Looks up the sizes of input files concurrently before a workflow starts, so download and processing
+    jobs can be sized for each sample. Sizes that cannot be determined are None.
+
+    >>> import BaseHTTPServer, tempfile, threading
+    >>> class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    ...     def do_HEAD(self):
+    ...         self.send_response(200)
+    ...         self.send_header('Content-Length', '1000')
+    ...         self.end_headers()
+    ...     def log_message(self, *args):
+    ...         pass
+    >>> server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    >>> thread = threading.Thread(target=server.serve_forever)
+    >>> thread.start()
+    >>> http_url = 'http://127.0.0.1:%d/sample.bam' % server.server_port
+    >>> with tempfile.NamedTemporaryFile() as f:
+    ...     f.write('x' * 10)
+    ...     f.flush()
+    ...     sizes = probe_url_sizes([http_url, 'file://' + f.name, 'file:///missing.bam', None])
+    ...     sizes[http_url], sizes['file://' + f.name], sizes['file:///missing.bam']
+    (1000, 10, None)
+    >>> server.shutdown()
+    >>> server.server_close()
+
+    A server that cannot be reached gives an unknown size, and the URL is its own fingerprint
+
+    >>> url_size(http_url) is None, url_fingerprint(http_url) == http_url
+    (True, True)
+
+    :param list[str] urls: URLs (file://, s3://, http://, https://) or local paths. Empty values are skipped.
+    :param int threads: Maximum number of concurrent lookups
+    :return: Sizes in bytes {URL: size}
+    :rtype: dict
+    """
+    urls = sorted(set(url for url in urls if url))
+    if not urls:
+        return {}
+    pool = ThreadPool(min(threads, len(urls)))
+    try:
+        sizes = pool.map(_probe_url_size, urls)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(urls, sizes))
+
+
+def _probe_url_size(url):
+    """
+    Returns the size of the file at a URL, or None if the lookup fails
+
+    :param str url: URL or local path
+    :return: Size in bytes
+    :rtype: int|None
+    """
+    try:
+        return url_size(url)
+    # A failed lookup only means the job falls back to the configured disk size
+    except Exception as e:
+        log.warning('Could not determine the size of %s: %s', url, e)
+        return None
+
+
+def download_disk(url_sizes, url, default):
+    """
+    Returns the disk requirement for downloading a file: its probed size, or the default if the size
+    is unknown
+
+    >>> download_disk({'s3://bucket/sample.bam': 100}, 's3://bucket/sample.bam', '20G')
+    100
+    >>> download_disk({}, 's3://bucket/other.bam', '20G')
+    '20G'
+
+    :param dict url_sizes: Sizes in bytes {URL: size} from probe_url_sizes
+    :param str url: URL of the file
+    :param str|int default: Disk requirement used when the size is unknown
+    :return: Disk requirement
+    :rtype: str|int
+    """
+    size = (url_sizes or {}).get(url)
+    return size if size is not None else default
+
+
+def url_fingerprint(url):
+    """
+    Returns a string that identifies the content at a URL. The fingerprint uses the ETag for S3 and
+    HTTP URLs and the size and modification time for local files, so it changes whenever the file
+    is replaced. URLs that cannot be inspected are identified by the URL alone.
+
+    :param str url: URL (file://, s3://, http://, https://) or local path
+    :return: Fingerprint
+    :rtype: str
+    """
+    metadata = _stat_url(url)
+    if metadata is None:
+        return url
+    return '{}#{}:{}'.format(url, *metadata)
+
+
+def s3_connection():
+    """
+    Opens a boto S3 connection. Set TOIL_SCRIPTS_S3_ENDPOINT to the URL of an S3-compatible service,
+    i.e. http://localhost:9000, to use it instead of Amazon S3.
+
+    :return: S3 connection
+    :rtype: boto.s3.connection.S3Connection
+    """
+    from boto.s3.connection import OrdinaryCallingFormat, S3Connection
+    endpoint = os.environ.get('TOIL_SCRIPTS_S3_ENDPOINT')
+    if not endpoint:
+        return S3Connection()
+    parsed_endpoint = urlparse(endpoint)
+    return S3Connection(host=parsed_endpoint.hostname,
+                        port=parsed_endpoint.port,
+                        is_secure=parsed_endpoint.scheme == 'https',
+                        calling_format=OrdinaryCallingFormat())
+
+
+def _stat_url(url):
+    """
+    Looks up the size and a version tag for the file at a URL. Lookups that fail, i.e. because the
+    server cannot be reached or the credentials do not allow it, are logged and return None, so the
+    size is unknown and the file is not found in caches.
+
+    :param str url: URL (file://, s3://, http://, https://) or local path
+    :return: Tuple of size in bytes and version tag, or None if unavailable
+    :rtype: tuple(int, str)|None
+    """
+    parsed_url = urlparse(url)
+    if parsed_url.scheme in ('', 'file'):
+        try:
+            st = os.stat(parsed_url.path)
+        except OSError:
+            return None
+        return st.st_size, str(int(st.st_mtime))
+
+    elif parsed_url.scheme == 's3':
+        from boto.exception import BotoClientError, BotoServerError, NoAuthHandlerFound
+        try:
+            s3 = s3_connection()
+            try:
+                bucket = s3.get_bucket(parsed_url.netloc, validate=False)
+                # Listing does not require the SSE-C key that a HEAD request on an encrypted key needs
+                key_name = parsed_url.path.lstrip('/')
+                for key in bucket.list(prefix=key_name):
+                    if key.name == key_name:
+                        return key.size, key.etag.strip('"')
+                return None
+            finally:
+                s3.close()
+        # Missing credentials, a denied listing or a network error leave the file unversioned
+        except (BotoClientError, BotoServerError, NoAuthHandlerFound, IOError) as e:
+            log.warning('Could not look up %s: %s', url, e)
+            return None
+
+    elif parsed_url.scheme in ('http', 'https'):
+        request = urllib2.Request(url)
+        request.get_method = lambda: 'HEAD'
+        try:
+            response = urllib2.urlopen(request)
+            try:
+                headers = response.info()
+                size = headers.getheader('Content-Length')
+                tag = headers.getheader('ETag') or headers.getheader('Last-Modified') or ''
+            finally:
+                response.close()
+            return (int(size) if size is not None else None), tag.strip('"')
+        # URLError and HTTPError are IOErrors, and so are the socket errors of a failed connection
+        except (IOError, httplib.HTTPException, ValueError) as e:
+            log.warning('Could not look up %s: %s', url, e)
+            return None
+
+    return None